@@ -4,15 +4,31 @@ MQTT心率模擬器
 模擬多個用戶的心率數據並通過MQTT發送
 """
 
-import json
+import argparse
+import os
 import random
+import sys
 import time
 import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+import numpy as np
 import paho.mqtt.client as mqtt
 import logging
 
+# 共用工具模組位於 tool/ 目錄
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool"))
+from tick_scheduler import TickScheduler
+from publisher_pool import PublisherPool
+from heart_rate_history import HeartRateHistory
+from health_anomaly import METRICS, HealthAnomalyDetector, format_alert
+from metrics import REGISTRY, LogSampler, start_http_server, start_stats_line
+from state_file import PeriodicSnapshot, load_state
+from scenario import HEALTH_DEVICES, Scenario, compile_scenario
+from outbound_spool import DEFAULT_DRAIN_RATE, DEFAULT_MAX_AGE, OutboundSpool, SpoolDrainer, queued_by_client
+from rollup_store import DEFAULT_FLUSH_INTERVAL, RollupStore, start_flusher, start_query_server
+from payload_codec import CODEC_JSON, CODECS, TEXT, PayloadTemplate, Slot, TickClock, codec_available
+
 # 配置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -25,6 +41,8 @@ MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "health/data"
 MQTT_QOS = 1
+# 負載編碼（--codec），msgpack / cbor 需要對應套件，接收端按首字節自動識別
+PAYLOAD_CODEC = CODEC_JSON
 
 # 用戶配置
 USERS = [
@@ -45,10 +63,83 @@ HEART_RATE_RANGES = {
     "critical_high": 150
 }
 
+# 基礎心率範圍（與 send_heart_rate_data 首次建立歷史記錄時一致）
+BASE_HEART_RATE_MIN = 65
+BASE_HEART_RATE_MAX = 85
+
+# 異常值注入概率
+ANOMALY_PROBABILITY = 0.05
+
+# 每個用戶的默認上報頻率（每30秒一次）
+DEFAULT_UDR_HZ = 1 / 30
+
+# 每個用戶保存的歷史讀數數量
+HISTORY_WINDOW = 100
+
+# 狀態快照的默認寫入間隔（秒）
+STATE_INTERVAL = 30.0
+
+# 統計時逐個用戶輸出的人數上限，超過則只輸出彙總
+STATS_DETAIL_LIMIT = 20
+
+# 異常偵測的滑動窗口、連續異常次數與 z-score 閾值
+ALERT_WINDOW = 32
+ALERT_CONSECUTIVE = 3
+ALERT_Z_THRESHOLD = 3.0
+
 # 全局變量
 running = False
 client = None
-heart_rate_history = {}
+# 斷線期間的磁碟外發緩衝（--spool），None 表示斷線時丟棄
+spool = None
+# 讀數的多解析度彙總（--rollup），None 表示只保留最近 HISTORY_WINDOW 條
+rollup = None
+# 每位住民預編譯的心率訊息模板 (id, 是否帶 sos/fall) -> PayloadTemplate，與同一週期共用的時間字段
+health_templates: Dict = {}
+tick_clock = TickClock()
+heart_rate_history = HeartRateHistory(HISTORY_WINDOW)
+population = None
+
+def create_health_detector(window: int = ALERT_WINDOW, consecutive: int = ALERT_CONSECUTIVE,
+                           z_threshold: float = ALERT_Z_THRESHOLD,
+                           initial_users: int = 0) -> HealthAnomalyDetector:
+    """建立異常偵測器，心率範圍沿用 HEART_RATE_RANGES 的閾值"""
+    return HealthAnomalyDetector(
+        window, consecutive, z_threshold,
+        ranges={"hr": (HEART_RATE_RANGES["low_threshold"], HEART_RATE_RANGES["high_threshold"])},
+        initial_residents=initial_users
+    )
+
+health_detector = create_health_detector()
+
+# 指標（見 tool/metrics.py），熱路徑上只做計數與耗時觀測
+METRICS_PREFIX = "hr_sim_"
+PUBLISHED = REGISTRY.counter("hr_sim_published_total", "已發布的心率訊息數")
+PUBLISH_SECONDS = REGISTRY.histogram("hr_sim_publish_seconds", "單條訊息組裝與 publish 呼叫耗時（秒）")
+CONNECTIONS = REGISTRY.counter("hr_sim_connections_total", "成功連接 MQTT 代理的次數")
+RECONNECTS = REGISTRY.counter("hr_sim_reconnects_total", "重新連接 MQTT 代理的次數",
+                              function=lambda: max(0, CONNECTIONS.value() - 1))
+CONNECTED = REGISTRY.gauge("hr_sim_connected", "是否已連接 MQTT 代理")
+HEALTH_ALERTS = REGISTRY.counter("hr_sim_health_alerts_total", "健康異常告警事件數")
+OUTAGE_DROPPED = REGISTRY.counter("hr_sim_outage_dropped_total", "場景 Gateway 斷線期間未發送的訊息數")
+
+# 逐條訊息的日誌改為取樣的 debug 級別
+log_sampler = LogSampler()
+# 斷線寫入 spool 的提示每 100 個週期輸出一次
+spool_log_sampler = LogSampler(100)
+# 健康告警明細同樣取樣輸出在 debug 級別，warning 只輸出彙總：
+# 排程週期可短至數毫秒，彙總每 ALERT_SUMMARY_INTERVAL 秒最多一行
+alert_log_sampler = LogSampler()
+ALERT_SUMMARY_INTERVAL = 1.0
+# 上次彙總之後累計的告警事件數與各告警類型次數，由 flush_health_alerts 輸出後清零
+pending_alert_events = 0
+pending_alerts: Dict[str, int] = {}
+last_alert_summary = 0.0
+
+def count_publish_failure(rc: int, count: int = 1):
+    """按 result.rc 分別計數發布失敗"""
+    REGISTRY.counter("hr_sim_publish_failures_total", "發布失敗數（按返回碼）",
+                     labels={"rc": str(rc)}).inc(count)
 
 def setup_mqtt_client():
     """設置MQTT客戶端"""
@@ -56,15 +147,19 @@ def setup_mqtt_client():
     
     def on_connect(client, userdata, flags, rc):
         if rc == 0:
+            CONNECTIONS.inc()
+            CONNECTED.set(1)
             logger.info("成功連接到MQTT代理")
         else:
             logger.error(f"連接MQTT代理失敗，返回碼: {rc}")
     
     def on_disconnect(client, userdata, rc):
+        CONNECTED.set(0)
         logger.info("與MQTT代理斷開連接")
     
     def on_publish(client, userdata, mid):
-        logger.debug(f"消息已發布，消息ID: {mid}")
+        if logger.isEnabledFor(logging.DEBUG) and log_sampler():
+            logger.debug(f"消息已發布，消息ID: {mid}（每 {log_sampler.every} 條取樣）")
     
     client = mqtt.Client()
     client.on_connect = on_connect
@@ -133,6 +228,520 @@ def generate_heart_rate_data(user_id: str, base_heart_rate: Optional[int] = None
     
     return heart_rate
 
+def create_rng(seed: Optional[int] = None):
+    """
+    建立批量模擬使用的隨機數生成器
+
+    同一個 seed 會同時設置 random 模組，讓單用戶路徑也能重現
+
+    Args:
+        seed: 隨機種子，None 表示不固定
+
+    Returns:
+        numpy Generator
+    """
+    if seed is not None:
+        random.seed(seed)
+    return np.random.default_rng(seed)
+
+def build_population(count: int, gateway_count: int = 1, rng=None) -> Dict:
+    """
+    建立大規模模擬住民群體，並在 heart_rate_history 登記其基礎心率
+
+    Args:
+        count: 住民數量
+        gateway_count: 閘道數量，住民按順序平均分配
+        rng: numpy 隨機數生成器
+
+    Returns:
+        群體字典，包含用戶列表與其在歷史記錄中的列索引
+    """
+    if rng is None:
+        rng = create_rng()
+
+    width = max(3, len(str(count)))
+    users = [
+        {
+            "id": f"user{i + 1:0{width}d}",
+            "name": f"住民{i + 1:0{width}d}",
+            "gateway_id": f"gateway{i % gateway_count + 1:03d}"
+        }
+        for i in range(count)
+    ]
+
+    base_heart_rates = rng.integers(BASE_HEART_RATE_MIN, BASE_HEART_RATE_MAX + 1, size=count)
+    return {
+        "users": users,
+        "rows": heart_rate_history.ensure_users([u["id"] for u in users], base_heart_rates),
+        "alert_rows": health_detector.add_residents([u["id"] for u in users]),
+        "rng": rng
+    }
+
+def build_scenario_population(scenario: Scenario, rng=None, rows=None) -> Dict:
+    """
+    按編譯後的場景建立模擬群體，只包含有心率讀數的設備（300B）
+
+    Args:
+        scenario: compile_scenario 編譯的場景
+        rng: numpy 隨機數生成器，None 時以場景 seed 建立
+        rows: 只建立場景中的這些住民行（發送池分片），None 表示全部
+
+    Returns:
+        群體字典，另含 scenario、scenario_rows（每位住民在場景中的行）與場景開始時間（首個週期設置）
+    """
+    if rng is None:
+        rng = create_rng(scenario.seed)
+    if rows is None:
+        rows = scenario.rows_for_device(*HEALTH_DEVICES)
+    rows = np.asarray(rows, dtype=np.int64)
+
+    users = [
+        {
+            "id": scenario.resident_ids[row],
+            "name": scenario.resident_names[row],
+            "gateway_id": scenario.gateways[scenario.gateway[row]]["name"]
+        }
+        for row in rows.tolist()
+    ]
+    user_ids = [u["id"] for u in users]
+    return {
+        "users": users,
+        "rows": heart_rate_history.ensure_users(user_ids, scenario.base_heart_rate[rows]),
+        "alert_rows": health_detector.add_residents(user_ids),
+        "rng": rng,
+        "scenario": scenario,
+        "scenario_rows": rows,
+        "scenario_started": None
+    }
+
+def generate_scenario_batch(population: Dict, indices, base_heart_rates, now: datetime):
+    """
+    按場景生成一個週期的讀數：群組的異常概率與體溫範圍，疊加進行中事件的心率 / 體溫偏移
+
+    Returns:
+        (心率, 體溫, 所屬 Gateway 在線與否, SOS 標記, 跌倒標記)
+    """
+    scenario = population["scenario"]
+    timeline = scenario.timeline
+    if population["scenario_started"] is None:
+        population["scenario_started"] = time.monotonic()
+    for event, started in timeline.advance(time.monotonic() - population["scenario_started"]):
+        logger.info(f"場景事件{'開始' if started else '結束'}: {timeline.describe(event)}")
+
+    rows = population["scenario_rows"][indices]
+    rng = population["rng"]
+    heart_rates = generate_heart_rate_batch(base_heart_rates, rng, now,
+                                            scenario.anomaly_probability[rows])
+    heart_rates += np.rint(timeline.hr_offset[rows]).astype(np.int64)
+    np.clip(heart_rates, HEART_RATE_RANGES["critical_low"], HEART_RATE_RANGES["critical_high"],
+            out=heart_rates)
+    temperatures = rng.uniform(scenario.temp_low[rows], scenario.temp_high[rows]) + timeline.temp_offset[rows]
+    online = timeline.gateway_down[scenario.gateway[rows]] == 0
+    return heart_rates, temperatures, online, timeline.sos[rows] > 0, timeline.fall[rows] > 0
+
+def generate_heart_rate_batch(base_heart_rates, rng,
+                              current_time: Optional[datetime] = None,
+                              anomaly_probability=ANOMALY_PROBABILITY):
+    """
+    一次為所有住民生成一個週期的心率數據
+
+    與 generate_heart_rate_data 的分佈相同：日夜係數、隨機變化、
+    範圍限制及 5% 異常值注入，但整個群體只需一次 numpy 運算
+
+    Args:
+        base_heart_rates: 每位住民的基礎心率陣列
+        rng: numpy 隨機數生成器
+        current_time: 本週期時間，None 則取當前時間
+        anomaly_probability: 異常值注入概率，可為按住民排列的陣列
+
+    Returns:
+        與 base_heart_rates 等長的 int64 心率陣列
+    """
+    if current_time is None:
+        current_time = datetime.now()
+
+    base = np.asarray(base_heart_rates, dtype=np.float64)
+    count = base.shape[0]
+
+    # 根據時間模擬心率變化（白天較高，夜間較低）
+    if 6 <= current_time.hour <= 22:
+        time_factor = 1.0 + rng.uniform(-0.1, 0.2, size=count)
+    else:
+        time_factor = 0.8 + rng.uniform(-0.1, 0.1, size=count)
+
+    # 添加隨機變化，int() 截斷與標量路徑一致
+    variation = rng.uniform(-5, 5, size=count)
+    heart_rates = np.trunc(base * time_factor + variation).astype(np.int64)
+
+    np.clip(heart_rates,
+            HEART_RATE_RANGES["critical_low"],
+            HEART_RATE_RANGES["critical_high"],
+            out=heart_rates)
+
+    # 偶爾生成異常值，高低各半
+    anomaly = rng.random(count) < anomaly_probability
+    anomaly_count = int(anomaly.sum())
+    if anomaly_count:
+        high = rng.random(anomaly_count) < 0.5
+        high_values = rng.integers(
+            HEART_RATE_RANGES["high_threshold"] + 10,
+            HEART_RATE_RANGES["critical_high"] + 1,
+            size=anomaly_count
+        )
+        low_values = rng.integers(
+            HEART_RATE_RANGES["critical_low"],
+            HEART_RATE_RANGES["low_threshold"] - 10 + 1,
+            size=anomaly_count
+        )
+        heart_rates[anomaly] = np.where(high, high_values, low_values)
+
+    return heart_rates
+
+def send_heart_rate_batch(population: Dict, indices: Optional[List[int]] = None):
+    """
+    為模擬群體發送一個週期的心率數據
+
+    Args:
+        population: build_population 建立的群體
+        indices: 本次到期的住民索引，None 表示整個群體
+    """
+    try:
+        rng = population["rng"]
+        now = datetime.now()
+        if indices is None:
+            indices = np.arange(len(population["users"]))
+        else:
+            indices = np.asarray(indices, dtype=np.int64)
+        rows = population["rows"][indices]
+        online = sos = fall = None
+        if population.get("scenario") is not None:
+            heart_rates, temperatures, online, sos, fall = generate_scenario_batch(
+                population, indices, heart_rate_history.base_heart_rate[rows], now
+            )
+        else:
+            heart_rates = generate_heart_rate_batch(
+                heart_rate_history.base_heart_rate[rows], rng, now
+            )
+            temperatures = rng.uniform(36.0, 37.5, size=heart_rates.shape[0])
+
+        # 同一週期共用時間字段
+        clock = tick_clock.set(now.timestamp())
+        time_str = clock.local_time
+        timestamp = clock.timestamp_ms
+
+        # 更新歷史記錄
+        heart_rate_history.push_batch(
+            rows, heart_rates, timestamp,
+            (heart_rates < HEART_RATE_RANGES["low_threshold"]) |
+            (heart_rates > HEART_RATE_RANGES["high_threshold"])
+        )
+
+        # 讀數產生的當下即偵測異常
+        readings = np.full((len(indices), len(METRICS)), np.nan)
+        readings[:, METRICS.index("hr")] = heart_rates
+        readings[:, METRICS.index("skin temp")] = temperatures
+        report_health_alerts(
+            health_detector.update(population["alert_rows"][indices], readings, now.timestamp())
+        )
+        if rollup is not None:
+            if "rollup_rows" not in population:
+                population["rollup_rows"] = rollup.rows_for([u["id"] for u in population["users"]])
+            rollup.update(population["rollup_rows"][indices], readings, now.timestamp(), METRICS)
+
+        connected = client is not None and client.is_connected()
+        if not connected and spool is None:
+            logger.warning("MQTT客戶端未連接，無法發送數據")
+            return
+
+        # 場景中 Gateway 斷線的住民本週期不發送；SOS / 跌倒只在事件進行中附加字段
+        flags = None
+        if online is not None:
+            if not online.all():
+                OUTAGE_DROPPED.inc(int(np.count_nonzero(~online)))
+                indices, heart_rates, temperatures = indices[online], heart_rates[online], temperatures[online]
+                sos, fall = sos[online], fall[online]
+            if sos.any() or fall.any():
+                flags = [(int(s), int(f)) if s or f else None for s, f in zip(sos.tolist(), fall.tolist())]
+        if flags is None:
+            flags = [None] * len(indices)
+
+        payloads = batch_payloads(population["users"], indices.tolist(), heart_rates.tolist(),
+                                  temperatures.tolist(), flags, time_str, timestamp)
+        if not connected:
+            spool_messages(payloads)
+            return
+
+        sent = 0
+        failed: Dict[int, int] = {}
+        retry = []
+        observe = PUBLISH_SECONDS.observe
+        started = time.perf_counter()
+        for payload in payloads:
+            result = client.publish(MQTT_TOPIC, payload, MQTT_QOS)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                sent += 1
+            else:
+                failed[result.rc] = failed.get(result.rc, 0) + 1
+                # QoS ≥ 1 斷線時 paho 已排隊並會重發，不再寫入 spool
+                if spool is not None and not queued_by_client(result.rc, MQTT_QOS):
+                    retry.append(payload)
+            finished = time.perf_counter()
+            observe(finished - started)
+            started = finished
+
+        PUBLISHED.inc(sent)
+        for rc, count in failed.items():
+            count_publish_failure(rc, count)
+        if retry:
+            # 斷線競態等發送失敗的訊息寫入 spool，重新連接後補發
+            spool_messages(retry, "發送失敗")
+        if failed:
+            queued = sum(failed.values()) - len(retry) if spool is not None else 0
+            logger.error(f"批量發送心率數據: 成功 {sent}，失敗 {sum(failed.values())} "
+                         f"(返回碼 {failed}){'，已寫入 spool' if retry else ''}"
+                         f"{f'，{queued} 條已由 MQTT 客戶端排隊重發' if queued else ''}")
+        else:
+            logger.debug(f"批量發送心率數據: 成功 {sent}")
+
+    except Exception as e:
+        logger.error(f"批量發送心率數據時出錯: {e}")
+
+def health_template(user: Dict, flagged: bool = False) -> PayloadTemplate:
+    """
+    住民的心率訊息模板：id / name / gateway_id 預先編碼，
+    槽位依次為 heart_rate、temperature、time、timestamp（flagged 時另加 sos、fall）
+    """
+    key = (user["id"], flagged)
+    template = health_templates.get(key)
+    if template is None:
+        message = {
+            "type": "health",
+            "id": user["id"],
+            "name": user["name"],
+            "gateway_id": user["gateway_id"],
+            "heart_rate": Slot(),
+            "temperature": Slot(),
+            "time": Slot(TEXT),
+            "timestamp": Slot()
+        }
+        if flagged:
+            message["sos"] = Slot()
+            message["fall"] = Slot()
+        template = health_templates[key] = PayloadTemplate(message, PAYLOAD_CODEC)
+    return template
+
+def batch_payloads(users: List[Dict], indices: List[int], heart_rates: List[int],
+                   temperatures: List[float], flags: List, time_str: str, timestamp: int):
+    """逐條產生一個週期的心率訊息負載，flags 中非 None 的項為 (sos, fall)"""
+    for index, heart_rate, temperature, flag in zip(indices, heart_rates, temperatures, flags):
+        user = users[index]
+        if flag:
+            yield health_template(user, True).encode(heart_rate, temperature, time_str, timestamp, *flag)
+        else:
+            yield health_template(user).encode(heart_rate, temperature, time_str, timestamp)
+
+def spool_messages(payloads, reason: str = "MQTT客戶端未連接") -> int:
+    """斷線期間或發送失敗時把訊息寫入 spool，重新連接後由 SpoolDrainer 限速補發"""
+    count = 0
+    for payload in payloads:
+        spool.append(MQTT_TOPIC, payload, MQTT_QOS)
+        count += 1
+    if spool_log_sampler():
+        logger.warning(f"{reason}，已寫入 spool {count} 條，積壓 {len(spool)} 條 "
+                       f"({spool.size / 1024:.0f} KB)")
+    return count
+
+def open_spool(path: str, max_mb: float, max_age: float) -> OutboundSpool:
+    """開啟 spool 文件（恢復上次未補發的積壓）並登記 spool 指標"""
+    opened = OutboundSpool(path, int(max_mb * 1024 * 1024), max_age)
+    if opened.recovered:
+        logger.info(f"spool {path} 中有 {opened.recovered} 條未補發訊息，連接後補發")
+    REGISTRY.gauge("hr_sim_spool_depth", "spool 積壓訊息數", function=lambda: len(opened))
+    REGISTRY.gauge("hr_sim_spool_bytes", "spool 積壓字節數", function=lambda: opened.size)
+    for key, help_text in (("spooled", "寫入 spool 的訊息數"), ("drained", "自 spool 補發的訊息數"),
+                           ("dropped", "spool 超出大小上限丟棄的訊息數"),
+                           ("expired", "spool 中超過保留時間丟棄的訊息數")):
+        REGISTRY.counter(f"hr_sim_spool_{key}_total", help_text,
+                         function=lambda key=key: getattr(opened, key))
+    return opened
+
+def report_health_alerts(events: List[Dict]):
+    """累計告警事件，明細在 debug 級別取樣輸出；彙總由 flush_health_alerts 定期輸出"""
+    global pending_alert_events
+    if not events:
+        return
+    HEALTH_ALERTS.inc(len(events))
+    pending_alert_events += len(events)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for event in events:
+        for alert in event["alerts"]:
+            pending_alerts[alert] = pending_alerts.get(alert, 0) + 1
+        if debug and alert_log_sampler():
+            logger.debug(f"健康告警: {format_alert(event)}（每 {alert_log_sampler.every} 條取樣）")
+
+def flush_health_alerts(force: bool = False):
+    """
+    每個排程週期結束時呼叫：距上次彙總超過 ALERT_SUMMARY_INTERVAL 秒（或 force）時
+    把累計的告警輸出為一行，沒有告警時不輸出
+    """
+    global pending_alert_events, last_alert_summary
+    if not pending_alert_events:
+        return
+    now = time.monotonic()
+    if not force and now - last_alert_summary < ALERT_SUMMARY_INTERVAL:
+        return
+    logger.warning(f"健康告警: {pending_alert_events} 條 "
+                   f"({', '.join(f'{alert} {count}' for alert, count in sorted(pending_alerts.items()))})")
+    pending_alert_events = 0
+    pending_alerts.clear()
+    last_alert_summary = now
+
+def shard_population(population: Dict, workers: int, seed: Optional[int] = None,
+                     udr_hz: Optional[float] = DEFAULT_UDR_HZ) -> List[Dict]:
+    """
+    按閘道把群體分片到多個發送進程
+
+    同一閘道的住民總在同一分片，分片名稱即閘道身份
+
+    Args:
+        population: build_population 建立的群體
+        workers: 進程數量
+        seed: 隨機種子，每個分片使用 seed + 分片序號
+        udr_hz: 每個用戶的上報頻率，場景群體為 None 時使用場景中各住民的頻率
+
+    Returns:
+        分片描述列表
+    """
+    gateway_ids = sorted({user["gateway_id"] for user in population["users"]})
+    workers = max(1, min(workers, len(gateway_ids)))
+    assignment = {gateway_id: i % workers for i, gateway_id in enumerate(gateway_ids)}
+
+    shards = [{"gateways": [], "users": [], "base_heart_rate": [], "rows": []} for _ in range(workers)]
+    for gateway_id in gateway_ids:
+        shards[assignment[gateway_id]]["gateways"].append(gateway_id)
+    base_heart_rates = heart_rate_history.base_heart_rate[population["rows"]].tolist()
+    for index, (user, base) in enumerate(zip(population["users"], base_heart_rates)):
+        shard = shards[assignment[user["gateway_id"]]]
+        shard["users"].append(user)
+        shard["base_heart_rate"].append(base)
+        shard["rows"].append(index)
+
+    # 場景群體：各進程以同一 spec 重新編譯場景，按 scenario_rows 取自己的住民與上報頻率
+    scenario = population.get("scenario")
+    for index, shard in enumerate(shards):
+        rows = shard.pop("rows")
+        shard["name"] = "+".join(shard["gateways"])
+        shard["seed"] = None if seed is None else seed + index
+        shard["udr_hz"] = udr_hz
+        if scenario is not None:
+            shard["scenario_rows"] = population["scenario_rows"][rows].tolist()
+            if udr_hz is None:
+                shard["udr_hz"] = scenario.udr[shard["scenario_rows"]].tolist()
+    return shards
+
+def run_population_shard(shard: Dict, publisher, stop_event):
+    """
+    發送池工作進程任務：按排程為分片內住民發送心率數據
+
+    Args:
+        shard: shard_population 產生的分片
+        publisher: 工作進程自己的發送端
+        stop_event: 停止事件
+    """
+    global client, running, population, heart_rate_history, health_detector, MQTT_TOPIC, MQTT_QOS, spool
+    global PAYLOAD_CODEC
+
+    # 工作進程內以分片發送端取代全局客戶端
+    client = publisher
+    MQTT_TOPIC = shard.get("topic", MQTT_TOPIC)
+    MQTT_QOS = shard.get("qos", MQTT_QOS)
+    PAYLOAD_CODEC = shard.get("codec", PAYLOAD_CODEC)
+    running = True
+    state_file = shard.get("state_file")
+    heart_rate_history, restored = restore_history(
+        state_file, shard.get("history_window", HISTORY_WINDOW), len(shard["users"])
+    )
+    health_detector = create_health_detector(
+        shard.get("alert_window", ALERT_WINDOW),
+        shard.get("alert_consecutive", ALERT_CONSECUTIVE),
+        shard.get("alert_z", ALERT_Z_THRESHOLD),
+        len(shard["users"])
+    )
+    if shard.get("scenario"):
+        scenario = Scenario(shard["scenario"], shard["scenario_dir"])
+        population = build_scenario_population(scenario, create_rng(shard["seed"]),
+                                               shard["scenario_rows"])
+    else:
+        population = {
+            "users": shard["users"],
+            "rows": heart_rate_history.ensure_users(
+                [u["id"] for u in shard["users"]], shard["base_heart_rate"]
+            ),
+            "alert_rows": health_detector.add_residents([u["id"] for u in shard["users"]]),
+            "rng": create_rng(shard["seed"])
+        }
+    if restored and "rng" in restored:
+        population["rng"].bit_generator.state = restored["rng"]
+    snapshot = (PeriodicSnapshot(state_file, lambda: simulator_state(population),
+                                 shard.get("state_interval", STATE_INTERVAL))
+                if state_file else None)
+
+    drainer = None
+    if shard.get("spool"):
+        options = shard["spool"]
+        spool = open_spool(options["path"], options["max_mb"], options["max_age"])
+        drainer = SpoolDrainer(spool, publisher.publish, publisher.is_connected, options["rate"]).start()
+
+    scheduler = TickScheduler(
+        len(shard["users"]),
+        udr_hz=shard["udr_hz"],
+        jitter=shard.get("jitter", 0.0),
+        report_interval=shard.get("report_interval", 0),
+        seed=shard["seed"]
+    )
+    try:
+        for due in scheduler.ticks():
+            if stop_event.is_set():
+                break
+            send_heart_rate_batch(population, due)
+            flush_health_alerts()
+            if snapshot:
+                snapshot.maybe_save()
+    finally:
+        flush_health_alerts(force=True)
+        if snapshot:
+            snapshot.save()
+        if drainer:
+            drainer.stop()
+            spool.close()
+
+def simulator_state(population: Optional[Dict]):
+    """收集快照內容：心率歷史（基礎心率、最後讀數、環形緩衝）與隨機數生成器狀態"""
+    arrays, meta = heart_rate_history.state()
+    meta["saved_at"] = time.time()
+    if population is not None:
+        meta["rng"] = population["rng"].bit_generator.state
+    return arrays, meta
+
+def restore_history(state_file: Optional[str], history_window: int, initial_users: int = 1):
+    """
+    從快照恢復心率歷史，快照不存在時建立新的歷史
+
+    Returns:
+        (HeartRateHistory, 快照元數據或 None)
+    """
+    if not state_file or not os.path.exists(state_file):
+        return HeartRateHistory(history_window, initial_users=max(initial_users, 1)), None
+    started = time.perf_counter()
+    arrays, meta = load_state(state_file)
+    history = HeartRateHistory.from_state(arrays, meta)
+    if history.capacity != history_window:
+        logger.warning(f"快照的歷史窗口為 {history.capacity}，忽略 --history-window {history_window}")
+    saved_at = datetime.fromtimestamp(meta.get("saved_at", 0)).strftime("%Y-%m-%d %H:%M:%S")
+    logger.info(f"已從 {state_file} 恢復 {len(history)} 個用戶的狀態 (保存於 {saved_at}), "
+                f"耗時 {(time.perf_counter() - started) * 1000:.1f} ms")
+    return history, meta
+
 def send_heart_rate_data(user: Dict[str, str]):
     """
     為指定用戶發送心率數據
@@ -141,34 +750,28 @@ def send_heart_rate_data(user: Dict[str, str]):
         user: 用戶信息字典
     """
     try:
+        # 本條訊息的時間字段與歷史記錄共用一次取得的時間
+        clock = tick_clock.set()
+
         # 獲取或生成基礎心率
-        if user["id"] not in heart_rate_history:
-            heart_rate_history[user["id"]] = {
-                "base_heart_rate": random.randint(65, 85),
-                "last_heart_rate": None,
-                "readings": []
-            }
-        
-        user_history = heart_rate_history[user["id"]]
+        row = heart_rate_history.index_of(user["id"])
+        if row is None:
+            row = int(heart_rate_history.add_users(
+                [user["id"]], [random.randint(BASE_HEART_RATE_MIN, BASE_HEART_RATE_MAX)]
+            )[0])
         
         # 生成心率數據
         heart_rate = generate_heart_rate_data(
             user["id"], 
-            user_history["base_heart_rate"]
+            int(heart_rate_history.base_heart_rate[row])
         )
         
-        # 更新歷史記錄
-        user_history["last_heart_rate"] = heart_rate
-        user_history["readings"].append({
-            "heart_rate": heart_rate,
-            "timestamp": datetime.now().isoformat(),
-            "is_abnormal": heart_rate < HEART_RATE_RANGES["low_threshold"] or 
-                          heart_rate > HEART_RATE_RANGES["high_threshold"]
-        })
-        
-        # 保持最近100條記錄
-        if len(user_history["readings"]) > 100:
-            user_history["readings"] = user_history["readings"][-100:]
+        # 更新歷史記錄（環形緩衝區自動覆蓋最舊讀數）
+        heart_rate_history.push(
+            row, heart_rate, clock.timestamp_ms,
+            heart_rate < HEART_RATE_RANGES["low_threshold"] or 
+            heart_rate > HEART_RATE_RANGES["high_threshold"]
+        )
         
         # 構建MQTT消息
         message = {
@@ -178,17 +781,36 @@ def send_heart_rate_data(user: Dict[str, str]):
             "gateway_id": user["gateway_id"],
             "heart_rate": heart_rate,
             "temperature": random.uniform(36.0, 37.5),  # 同時發送溫度數據
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "timestamp": int(datetime.now().timestamp() * 1000)
+            "time": clock.local_time,
+            "timestamp": clock.timestamp_ms
         }
+        payload = health_template(user).encode(heart_rate, message["temperature"], clock.local_time,
+                                               clock.timestamp_ms)
         
-        # 發送MQTT消息
+        report_health_alerts(health_detector.process(message, message["timestamp"] / 1000))
+
+        # 發送MQTT消息，斷線時寫入 spool（如有）
         if client and client.is_connected():
-            result = client.publish(MQTT_TOPIC, json.dumps(message), MQTT_QOS)
+            started = time.perf_counter()
+            result = client.publish(MQTT_TOPIC, payload, MQTT_QOS)
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"發送心率數據: {user['name']} - {heart_rate} bpm")
+                PUBLISHED.inc()
+                if logger.isEnabledFor(logging.DEBUG) and log_sampler():
+                    logger.debug(f"發送心率數據: {user['name']} - {heart_rate} bpm"
+                                 f"（每 {log_sampler.every} 條取樣）")
             else:
-                logger.error(f"發送心率數據失敗: {result.rc}")
+                count_publish_failure(result.rc)
+                if queued_by_client(result.rc, MQTT_QOS):
+                    # QoS ≥ 1 斷線時 paho 已排隊並會重發，不再寫入 spool
+                    logger.error(f"發送心率數據失敗: {result.rc}，已由 MQTT 客戶端排隊重發")
+                else:
+                    logger.error(f"發送心率數據失敗: {result.rc}"
+                                 f"{'，已寫入 spool' if spool is not None else ''}")
+                    if spool is not None:
+                        spool_messages([payload], "發送失敗")
+        elif spool is not None:
+            spool_messages([payload])
         else:
             logger.warning("MQTT客戶端未連接，無法發送數據")
             
@@ -200,31 +822,243 @@ def print_statistics():
     while running:
         try:
             logger.info("=== 心率統計 ===")
-            for user_id, history in heart_rate_history.items():
-                if history["readings"]:
-                    recent_readings = [r["heart_rate"] for r in history["readings"][-10:]]
-                    avg_heart_rate = sum(recent_readings) / len(recent_readings)
-                    abnormal_count = sum(1 for r in history["readings"] if r["is_abnormal"])
-                    
-                    user_name = next((u["name"] for u in USERS if u["id"] == user_id), user_id)
-                    logger.info(f"{user_name}: 平均心率 {avg_heart_rate:.1f} bpm, "
-                              f"異常讀數 {abnormal_count}/{len(history['readings'])}")
+            user_count = len(heart_rate_history)
+            sizes = heart_rate_history.size[:user_count]
+            abnormal_counts = heart_rate_history.abnormal_count[:user_count]
+            recent_means = heart_rate_history.recent_mean()
+            
+            if user_count > STATS_DETAIL_LIMIT:
+                # 大規模群體只輸出彙總，統計直接讀取增量計數，不掃描讀數
+                active = sizes > 0
+                if active.any():
+                    logger.info(f"{int(active.sum())} 個用戶: 平均心率 "
+                              f"{recent_means[active].mean():.1f} bpm, "
+                              f"異常讀數 {int(abnormal_counts.sum())}/{int(sizes.sum())}")
+            else:
+                users = population["users"] if population is not None else USERS
+                for row, user_id in enumerate(heart_rate_history.user_ids):
+                    if sizes[row]:
+                        user_name = next((u["name"] for u in users if u["id"] == user_id), user_id)
+                        logger.info(f"{user_name}: 平均心率 {recent_means[row]:.1f} bpm, "
+                                  f"異常讀數 {abnormal_counts[row]}/{sizes[row]}")
             
             time.sleep(60)  # 每分鐘打印一次統計
         except Exception as e:
             logger.error(f"打印統計信息時出錯: {e}")
             time.sleep(60)
 
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="MQTT心率模擬器")
+    parser.add_argument("--users", type=int, default=0,
+                        help="批量模擬的住民數量，0 表示使用內建 USERS")
+    parser.add_argument("--gateways", type=int, default=1,
+                        help="批量模擬的閘道數量")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="隨機種子，用於重現模擬結果")
+    parser.add_argument("--udr", type=float, default=DEFAULT_UDR_HZ,
+                        help="每個用戶的上報頻率 (Hz)，默認每30秒一次")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="目標總發送速率 (msg/s)，設置後未指定 --udr 的頻率按此分配")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="每次發送的相位抖動，以週期比例表示")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+                        help="發送速率回報間隔（秒）")
+    parser.add_argument("--history-window", type=int, default=HISTORY_WINDOW,
+                        help="每個用戶保存的歷史讀數數量")
+    parser.add_argument("--alert-window", type=int, default=ALERT_WINDOW,
+                        help="異常偵測的滑動窗口讀數數量")
+    parser.add_argument("--alert-consecutive", type=int, default=ALERT_CONSECUTIVE,
+                        help="連續多少次超出範圍視為持續異常")
+    parser.add_argument("--alert-z", type=float, default=ALERT_Z_THRESHOLD,
+                        help="z-score 突變告警閾值")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="發送池進程數，按閘道分片，0 表示單進程")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="本地 HTTP /metrics 端口，0 表示不啟用")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="定期輸出精簡指標行的間隔（秒），0 表示不輸出")
+    parser.add_argument("--log-sample", type=int, default=1000,
+                        help="逐條訊息 debug 日誌的取樣間隔（每 N 條輸出一條）")
+    parser.add_argument("--debug", action="store_true", help="輸出 debug 級別日誌")
+    parser.add_argument("--state-file", default=None,
+                        help="狀態快照文件：啟動時恢復，運行中定期寫入，發送池模式下每個進程使用 <文件>.<序號>")
+    parser.add_argument("--state-interval", type=float, default=STATE_INTERVAL,
+                        help="狀態快照寫入間隔（秒）")
+    parser.add_argument("--spool", default=None,
+                        help="斷線期間寫入的 spool 文件，重新連接後限速補發，發送池模式下每個進程使用 <文件>.<序號>")
+    parser.add_argument("--spool-max-mb", type=float, default=64,
+                        help="spool 積壓上限 (MB)，超出時丟棄最舊的訊息")
+    parser.add_argument("--spool-max-age", type=float, default=DEFAULT_MAX_AGE,
+                        help="spool 訊息最長保留時間（秒），0 表示不限")
+    parser.add_argument("--spool-rate", type=float, default=DEFAULT_DRAIN_RATE,
+                        help="重新連接後的補發速率 (msg/s)")
+    parser.add_argument("--rollup", default=None, metavar="DIR",
+                        help="把產生的讀數彙總為 1 秒 / 1 分鐘 / 1 小時聚合並寫入目錄（不支援發送池模式）")
+    parser.add_argument("--rollup-port", type=int, default=0,
+                        help="在此端口提供彙總查詢 HTTP 接口 /query 與 /devices（0 表示不開啟）")
+    parser.add_argument("--codec", default=CODEC_JSON, choices=CODECS,
+                        help="負載編碼：json（默認）或 msgpack / cbor（需要對應套件，接收端 anchor_recieve 自動識別）")
+    parser.add_argument("--scenario", default=None,
+                        help="場景文件 (YAML/JSON) 或 test-data 目錄，取代內建 USERS 與 --users / --gateways / --udr")
+    parser.add_argument("--broker", default=None, help=f"MQTT代理地址，默認 {MQTT_BROKER} 或場景設置")
+    parser.add_argument("--port", type=int, default=None, help=f"MQTT代理端口，默認 {MQTT_PORT} 或場景設置")
+    return parser.parse_args()
+
+def run_publisher_pool(args, scenario: Optional[Scenario] = None):
+    """以多進程發送池運行模擬器"""
+    if scenario is not None:
+        pool_population = build_scenario_population(scenario, create_rng(args.seed))
+        udr_hz = None if args.udr == DEFAULT_UDR_HZ else args.udr
+        expected_rate = float(scenario.udr[pool_population["scenario_rows"]].sum()) \
+            if udr_hz is None else udr_hz * args.users
+        args.gateways = len(scenario.gateways)
+    elif args.users <= 0:
+        logger.error("發送池模式需要以 --users 或 --scenario 指定模擬住民")
+        return
+    else:
+        pool_population = build_population(args.users, args.gateways, create_rng(args.seed))
+        udr_hz = args.udr
+    if args.rate is not None:
+        udr_hz = args.rate / args.users
+    if udr_hz is not None:
+        expected_rate = udr_hz * args.users
+    shards = shard_population(pool_population, args.workers, args.seed, udr_hz)
+    for index, shard in enumerate(shards):
+        shard["topic"] = MQTT_TOPIC
+        shard["qos"] = MQTT_QOS
+        shard["codec"] = PAYLOAD_CODEC
+        if scenario is not None:
+            shard["scenario"] = scenario.spec
+            shard["scenario_dir"] = scenario.base_dir
+        shard["jitter"] = args.jitter
+        shard["report_interval"] = args.report_interval
+        shard["history_window"] = args.history_window
+        if args.state_file:
+            shard["state_file"] = f"{args.state_file}.{index}"
+            shard["state_interval"] = args.state_interval
+        if args.spool:
+            shard["spool"] = {"path": f"{args.spool}.{index}", "max_mb": args.spool_max_mb,
+                              "max_age": args.spool_max_age, "rate": args.spool_rate}
+        shard["alert_window"] = args.alert_window
+        shard["alert_consecutive"] = args.alert_consecutive
+        shard["alert_z"] = args.alert_z
+    
+    logger.info(f"發送池: {args.users} 個用戶, {args.gateways} 個閘道, "
+                f"{len(shards)} 個進程, 目標 {expected_rate:.1f} msg/s")
+    
+    pool = PublisherPool(
+        shards,
+        run_population_shard,
+        {
+            "broker": args.broker,
+            "port": args.port,
+            "client_prefix": "hr-sim"
+        },
+        report_interval=args.report_interval
+    )
+    register_pool_metrics(pool)
+    pool.run()
+
+def register_pool_metrics(pool: PublisherPool):
+    """發送池模式下指標取自工作進程回報的彙總統計"""
+    for key, help_text in (("sent", "已發布的心率訊息數"), ("failed", "發布失敗數"),
+                           ("acked", "已確認的訊息數"), ("reconnects", "重新連接 MQTT 代理的次數")):
+        REGISTRY.counter(f"hr_sim_pool_{key}_total", f"發送池 {help_text}",
+                         function=lambda key=key: pool.totals()[key])
+    REGISTRY.gauge("hr_sim_pool_connected", "發送池已連接的進程數",
+                   function=lambda: pool.totals()["connected"])
+
 def main():
     """主函數"""
-    global running
+    global running, population, heart_rate_history, health_detector, spool, rollup
+    global MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_QOS, PAYLOAD_CODEC
     
+    args = parse_args()
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    log_sampler.every = max(1, args.log_sample)
+    alert_log_sampler.every = log_sampler.every
     logger.info("啟動MQTT心率模擬器...")
+
+    # 場景文件取代內建用戶與代理設置，命令列參數優先
+    scenario = None
+    if args.scenario:
+        try:
+            scenario = compile_scenario(args.scenario)
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.error(f"載入場景 {args.scenario} 失敗: {e}")
+            return
+        logger.info(scenario.summary())
+        MQTT_BROKER = scenario.broker.get("host", MQTT_BROKER)
+        MQTT_PORT = int(scenario.broker.get("port", MQTT_PORT))
+        MQTT_TOPIC = scenario.broker.get("topic", MQTT_TOPIC)
+        MQTT_QOS = int(scenario.broker.get("qos", MQTT_QOS))
+        args.users = len(scenario.rows_for_device(*HEALTH_DEVICES))
+        if args.users <= 0:
+            logger.error("場景中沒有可模擬心率的設備 (300B)")
+            return
+        if args.seed is None:
+            args.seed = scenario.seed
+    if not codec_available(args.codec):
+        logger.error(f"{args.codec} 編碼需要安裝 {'msgpack' if args.codec == 'msgpack' else 'cbor2'}")
+        return
+    PAYLOAD_CODEC = args.codec
+    MQTT_BROKER = args.broker or MQTT_BROKER
+    MQTT_PORT = args.port or MQTT_PORT
+    args.broker, args.port = MQTT_BROKER, MQTT_PORT
+    health_detector = create_health_detector(args.alert_window, args.alert_consecutive,
+                                             args.alert_z, max(args.users, 1))
+    if args.workers > 0:
+        heart_rate_history = HeartRateHistory(args.history_window, initial_users=max(args.users, 1))
+        restored = None
+    else:
+        heart_rate_history, restored = restore_history(args.state_file, args.history_window, args.users)
+
+    metrics_stop = threading.Event()
+    if args.metrics_port:
+        start_http_server(REGISTRY, args.metrics_port)
+        logger.info(f"指標: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_interval > 0:
+        start_stats_line(REGISTRY, args.metrics_interval, metrics_stop,
+                         lambda text: logger.info(f"[指標] {text}"), METRICS_PREFIX)
+    
+    if args.workers > 0:
+        if args.rollup:
+            logger.warning("發送池模式不支援 --rollup，已忽略")
+        run_publisher_pool(args, scenario)
+        metrics_stop.set()
+        return
+    
+    if scenario is not None:
+        population = build_scenario_population(scenario, create_rng(args.seed))
+        if restored and "rng" in restored:
+            population["rng"].bit_generator.state = restored["rng"]
+    elif args.users > 0:
+        population = build_population(args.users, args.gateways, create_rng(args.seed))
+        if restored and "rng" in restored:
+            population["rng"].bit_generator.state = restored["rng"]
+    elif args.seed is not None:
+        random.seed(args.seed)
+    if args.rollup:
+        rollup = RollupStore(args.rollup)
+        start_flusher(rollup, DEFAULT_FLUSH_INTERVAL, metrics_stop)
+        logger.info(f"彙總存儲: {args.rollup} ({len(rollup)} 個設備)")
+        if args.rollup_port:
+            start_query_server(rollup, args.rollup_port)
+            logger.info(f"彙總查詢: http://127.0.0.1:{args.rollup_port}/query?device=...&field=hr&start=-1h")
+    snapshot = (PeriodicSnapshot(args.state_file, lambda: simulator_state(population),
+                                 args.state_interval)
+                if args.state_file else None)
     
     # 設置MQTT客戶端
     if not setup_mqtt_client():
         logger.error("無法連接到MQTT代理，退出程序")
         return
+    drainer = None
+    if args.spool:
+        spool = open_spool(args.spool, args.spool_max_mb, args.spool_max_age)
+        drainer = SpoolDrainer(spool, client.publish, client.is_connected, args.spool_rate).start()
     
     # 等待連接建立
     time.sleep(2)
@@ -235,19 +1069,36 @@ def main():
     stats_thread = threading.Thread(target=print_statistics, daemon=True)
     stats_thread.start()
     
-    logger.info(f"開始為 {len(USERS)} 個用戶模擬心率數據...")
+    user_count = len(population["users"]) if population is not None else len(USERS)
+    logger.info(f"開始為 {user_count} 個用戶模擬心率數據...")
+    
+    # 指定 --rate 而保留默認 --udr 時，頻率由目標速率平均分配；場景群體默認使用各住民自己的頻率
+    udr_hz = None if args.rate is not None and args.udr == DEFAULT_UDR_HZ else args.udr
+    if scenario is not None and args.udr == DEFAULT_UDR_HZ:
+        udr_hz = scenario.udr[population["scenario_rows"]].tolist()
+    scheduler = TickScheduler(
+        user_count,
+        udr_hz=udr_hz,
+        target_rate=args.rate,
+        jitter=args.jitter,
+        report_interval=args.report_interval,
+        seed=args.seed
+    )
+    logger.info(f"目標發送速率 {scheduler.expected_rate:.2f} msg/s")
     
     try:
-        while running:
-            # 為每個用戶發送心率數據
-            for user in USERS:
-                if not running:
-                    break
-                send_heart_rate_data(user)
-                time.sleep(1)  # 每個用戶之間間隔1秒
-            
-            # 等待下一輪發送（每30秒發送一輪）
-            time.sleep(25)  # 5個用戶 * 1秒 + 25秒 = 30秒總間隔
+        # 按排程發送到期用戶的心率數據
+        for due in scheduler.ticks():
+            if not running:
+                break
+            if population is not None:
+                send_heart_rate_batch(population, due)
+            else:
+                for index in due:
+                    send_heart_rate_data(USERS[index])
+            flush_health_alerts()
+            if snapshot:
+                snapshot.maybe_save()
             
     except KeyboardInterrupt:
         logger.info("收到中斷信號，正在停止模擬器...")
@@ -255,6 +1106,17 @@ def main():
         logger.error(f"模擬器運行時出錯: {e}")
     finally:
         running = False
+        flush_health_alerts(force=True)
+        metrics_stop.set()
+        if snapshot:
+            snapshot.save()
+            logger.info(f"狀態已保存到 {args.state_file}")
+        if rollup:
+            rollup.close()
+        if drainer:
+            drainer.stop()
+            spool.close()
+            logger.info(f"spool 剩餘 {len(spool)} 條未補發，下次啟動後補發")
         if client:
             client.loop_stop()
             client.disconnect()
@@ -0,0 +1,341 @@
+"""
+下行命令往返延遲探針
+按間隔向各 Anchor 發送 configChange 命令（Dwlink），把每條命令按 serial no 記入待確認表，
+收到同一 id、同一位置的 AncConf（或同一 id 的 TagConf）回報時配對，
+以對數分桶直方圖統計命令到確認的 p50/p95/p99 延遲，超時由時間輪批量清理；
+--fake-gateway 啟動本地假 Gateway 回送配置，可在沒有硬體時測試
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from anchor_trasmitt import (broker_config, build_gateway_shards, create_anchor_message,
+                             dwlink_topic, serial_counter)
+from async_publisher import AsyncPublisher
+from payload_codec import decode_payload
+from publisher_pool import create_client
+
+# 回報位置與命令位置的容差：命令坐標 = serial no / 1000，相鄰序列號相差 0.001，容差取其一半
+POSITION_TOLERANCE = 0.0005
+
+
+class LatencyHistogram:
+    """
+    HDR 風格的延遲直方圖
+
+    以相對精度 precision 做對數分桶，任何量級的百分位誤差都不超過該精度，
+    記錄為 O(1)，桶數只隨量級範圍對數增長
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.buckets: Dict[int, int] = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value_ms: float):
+        """記錄一個延遲值（毫秒）"""
+        # 以微秒為單位分桶，小於 1 微秒的值歸入第一桶
+        index = int(math.log(max(value_ms * 1000.0, 1.0)) / self._log_base)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms < self.min:
+            self.min = value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def percentile(self, percentile: float) -> float:
+        """估算百分位（毫秒，取所在桶上界且不超過最大值）"""
+        if not self.count:
+            return 0.0
+        threshold = self.count * percentile / 100.0
+        cumulative = 0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative >= threshold:
+                return min(math.exp((index + 1) * self._log_base) / 1000.0, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other: "LatencyHistogram"):
+        """合併另一個相同精度的直方圖"""
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+class TimeoutWheel:
+    """
+    超時時間輪
+
+    按 resolution 秒把截止時間分到環形槽位，插入 O(1)；槽位中的項目同時記下截止刻度，
+    advance() 只檢查已經走過的槽位，截止刻度未到的項目（advance 落後超過一圈時與新項目同槽）留在原槽位；
+    配對成功的項目由呼叫方從待確認表移除，到期時再檢查一次即可（惰性刪除）
+    """
+
+    def __init__(self, timeout: float, resolution: float = 0.1):
+        self.timeout = timeout
+        self.resolution = resolution
+        self.slots: List[List] = [[] for _ in range(int(math.ceil(timeout / resolution)) + 2)]
+        self._tick = None
+
+    def _slot_of(self, deadline: float) -> int:
+        return int(deadline / self.resolution)
+
+    def add(self, key, now: float):
+        """登記 key，截止時間為 now + timeout"""
+        tick = self._slot_of(now + self.timeout)
+        if self._tick is None:
+            self._tick = self._slot_of(now)
+        self.slots[tick % len(self.slots)].append((tick, key))
+
+    def advance(self, now: float) -> List:
+        """推進到 now，返回截止時間已過的 key"""
+        if self._tick is None:
+            return []
+        expired = []
+        current = self._slot_of(now)
+        # 落後超過一圈時每個槽位只需檢查一次
+        for tick in range(self._tick, min(current, self._tick + len(self.slots))):
+            slot = self.slots[tick % len(self.slots)]
+            if slot:
+                waiting = [entry for entry in slot if entry[0] >= current]
+                expired.extend(key for deadline, key in slot if deadline < current)
+                slot[:] = waiting
+        self._tick = max(self._tick, current)
+        return expired
+
+
+class PendingTable:
+    """
+    待確認命令表
+
+    以 (gateway id, 設備 id) 分組，每組按發送順序保存 (serial, 位置, 發送時間)；
+    回報到達時取同組中位置相符的最早一條，沒有位置的回報（TagConf）直接取最早一條
+    """
+
+    def __init__(self, timeout: float, resolution: float = 0.1):
+        self.groups: Dict[Tuple, collections.OrderedDict] = collections.defaultdict(
+            collections.OrderedDict)
+        self.wheel = TimeoutWheel(timeout, resolution)
+        self.histogram = LatencyHistogram()
+        self.sent = 0
+        self.matched = 0
+        self.timeouts = 0
+        self.unmatched = 0
+
+    def add(self, gateway_id: int, device_id: int, serial: int, position: Tuple, now: float):
+        """登記一條已發送的命令"""
+        self.groups[(gateway_id, device_id)][serial] = (position, now)
+        self.wheel.add((gateway_id, device_id, serial), now)
+        self.sent += 1
+
+    def match(self, message: Dict, now: float) -> Optional[float]:
+        """用回報訊息配對命令，成功時返回延遲（毫秒）"""
+        group = self.groups.get((message.get("gateway id"), message.get("id")))
+        if not group:
+            self.unmatched += 1
+            return None
+
+        position = message.get("position")
+        for serial, (sent_position, sent_at) in group.items():
+            if position is None or all(
+                    abs(position.get(axis, math.inf) - value) <= POSITION_TOLERANCE
+                    for axis, value in zip("xyz", sent_position)):
+                del group[serial]
+                latency_ms = (now - sent_at) * 1000.0
+                self.histogram.record(latency_ms)
+                self.matched += 1
+                return latency_ms
+        self.unmatched += 1
+        return None
+
+    def expire(self, now: float) -> int:
+        """清理已超時的命令，返回本次超時數量"""
+        count = 0
+        for gateway_id, device_id, serial in self.wheel.advance(now):
+            group = self.groups.get((gateway_id, device_id))
+            if group is not None and group.pop(serial, None) is not None:
+                count += 1
+        self.timeouts += count
+        return count
+
+    def outstanding(self) -> int:
+        return sum(len(group) for group in self.groups.values())
+
+    def summary(self) -> str:
+        histogram = self.histogram
+        return (f"已發送 {self.sent}, 已確認 {self.matched}, 超時 {self.timeouts}, "
+                f"待確認 {self.outstanding()}, 未配對回報 {self.unmatched}, "
+                f"延遲 avg {histogram.mean():.1f} ms / p50 {histogram.percentile(50):.1f} ms / "
+                f"p95 {histogram.percentile(95):.1f} ms / p99 {histogram.percentile(99):.1f} ms / "
+                f"max {histogram.max:.1f} ms")
+
+
+def config_echo(command: Dict) -> Dict:
+    """按 configChange 命令組裝 Gateway 回送的 AncConf 配置訊息"""
+    position = command.get("position", {})
+    return {
+        "content": "config",
+        "gateway id": command["gateway id"],
+        "region id": 0,
+        "organiz id": 0,
+        "node": command.get("node", "ANCHOR"),
+        "name": command["name"],
+        "id": command["id"],
+        "id(Hex)": f"0x{command['id']:04X}",
+        "fw update": command.get("fw update", 0),
+        "led": command.get("led", 1),
+        "ble": command.get("ble", 1),
+        "initiator": command.get("initiator", 0),
+        "position": {axis: position.get(axis, 0.0) for axis in "xyz"}
+    }
+
+
+async def run_fake_gateway(config: Dict, delay: float) -> AsyncPublisher:
+    """本地假 Gateway：訂閱所有 Dwlink，延遲 delay 秒後在同一 Gateway 的 AncConf 主題回送配置"""
+    echo = AsyncPublisher(create_client(config, f"fake-gateway-{int(time.time())}"), window=10000)
+    loop = asyncio.get_running_loop()
+
+    def on_message(client, userdata, msg):
+        if not msg.topic.endswith("_Dwlink"):
+            return
+        try:
+            command = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if command.get("content") != "configChange":
+            return
+        topic = msg.topic[:-len("_Dwlink")] + "_AncConf"
+        payload = json.dumps(config_echo(command), ensure_ascii=False)
+        loop.call_later(delay, client.publish, topic, payload, 0)
+
+    echo.client.on_message = on_message
+    await echo.connect(config["broker"], config["port"])
+    echo.client.subscribe("UWB/+", qos=0)
+    return echo
+
+
+async def run_probe(args):
+    """發送命令並配對回報，定期輸出延遲統計"""
+    config = broker_config(args)
+    echo = None
+    if args.fake_gateway:
+        echo = await run_fake_gateway(config, args.echo_delay)
+        print(f"假 Gateway 已啟動，回送延遲 {args.echo_delay * 1000:.0f} ms")
+
+    table = PendingTable(args.timeout)
+    probe = AsyncPublisher(create_client(config, f"ack-probe-{int(time.time())}"), window=args.window)
+
+    def on_message(client, userdata, msg):
+        now = time.monotonic()
+        try:
+            message = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if message.get("content") == "config":
+            table.match(message, now)
+
+    probe.client.on_message = on_message
+    await probe.connect(config["broker"], config["port"])
+
+    shard = build_gateway_shards(args.gateways, args.anchors, 1, args.interval)[0]
+    for gw in shard["gateways"]:
+        for suffix in ("AncConf", "TagConf"):
+            probe.client.subscribe(dwlink_topic(gw["gateway_id"]).replace("Dwlink", suffix), qos=0)
+    print(f"往返探針: {args.gateways} 個 Gateway x {args.anchors} 個 Anchor, 每 {args.interval} 秒, "
+          f"超時 {args.timeout} 秒, 代理 {config['broker']}:{config['port']}")
+    # 等訂閱生效再開始計時
+    await asyncio.sleep(0.5)
+
+    async def drive_anchor(gateway_id, anchor):
+        serial = serial_counter
+        topic = dwlink_topic(gateway_id)
+        next_due = time.monotonic()
+        sent = 0
+        while not args.count or sent < args.count:
+            message = create_anchor_message(gateway_id, anchor, serial)
+            position = tuple(message["position"][axis] for axis in "xyz")
+            await probe.submit(topic, json.dumps(message, ensure_ascii=False), args.qos)
+            # 取得視窗名額並發出後才記時，等待名額的時間不計入往返延遲；
+            # 回調都在事件迴圈內執行，submit 返回到登記之間不會有回覆被處理
+            table.add(gateway_id, anchor["id"], serial, position, time.monotonic())
+            serial += 1
+            sent += 1
+            next_due += args.interval
+            await asyncio.sleep(max(0.0, next_due - time.monotonic()))
+
+    async def tick():
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(table.wheel.resolution)
+            now = time.monotonic()
+            table.expire(now)
+            if now - last_report >= args.report_interval:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {table.summary()}")
+                last_report = now
+
+    ticker = asyncio.ensure_future(tick())
+    try:
+        await asyncio.gather(*(drive_anchor(gw["gateway_id"], anchor)
+                               for gw in shard["gateways"] for anchor in gw["anchors"]))
+        # 等待最後一批回報或超時
+        deadline = time.monotonic() + args.timeout + table.wheel.resolution * 2
+        while table.outstanding() and time.monotonic() < deadline:
+            await asyncio.sleep(table.wheel.resolution)
+        table.expire(time.monotonic() + args.timeout)
+    finally:
+        ticker.cancel()
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {table.summary()}")
+        await probe.disconnect()
+        if echo:
+            await echo.disconnect()
+        await asyncio.sleep(0.1)
+    return table
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="下行命令往返延遲探針")
+    parser.add_argument("--gateways", type=int, default=1, help="Gateway 數量")
+    parser.add_argument("--anchors", type=int, default=1, help="每個 Gateway 的 Anchor 數量")
+    parser.add_argument("--interval", type=float, default=1.0, help="每個 Anchor 的命令間隔（秒）")
+    parser.add_argument("--count", type=int, default=0, help="每個 Anchor 發送的命令數，0 表示持續發送")
+    parser.add_argument("--timeout", type=float, default=5.0, help="等待確認的超時（秒）")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2), help="命令發布 QoS")
+    parser.add_argument("--window", type=int, default=100, help="在途（未確認）命令上限")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="統計輸出間隔（秒）")
+    parser.add_argument("--local", action="store_true",
+                        help="連接本地 mosquitto (localhost:1883, 無 TLS)")
+    parser.add_argument("--fake-gateway", action="store_true",
+                        help="啟動本地假 Gateway 回送配置（代替硬體）")
+    parser.add_argument("--echo-delay", type=float, default=0.05, help="假 Gateway 回送延遲（秒）")
+    return parser.parse_args()
+
+
+def main():
+    """主程式"""
+    args = parse_args()
+    try:
+        asyncio.run(run_probe(args))
+    except KeyboardInterrupt:
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式被用戶中斷")
+
+
+if __name__ == "__main__":
+    main()
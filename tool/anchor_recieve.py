@@ -1,7 +1,34 @@
+import argparse
+import contextlib
+import io
+import itertools
 import json
+import os
 import ssl
+import sys
+import threading
+import time
 import paho.mqtt.client as mqtt
 from datetime import datetime
+from types import SimpleNamespace
+
+from device_state import DeviceStateStore
+from geofence import format_event, load_geofence
+from health_anomaly import HealthAnomalyDetector, format_alert, health_values, resident_key
+from message_sink import create_sink
+from metrics import REGISTRY, start_http_server, start_stats_line
+from payload_codec import decode_binary, is_binary_payload
+from rollup_store import DEFAULT_FLUSH_INTERVAL, RollupStore, start_flusher, start_query_server
+from work_queue import POLICIES, POLICY_BLOCK, BoundedWorkQueue
+
+# 可用時使用 orjson 直接解析 bytes，否則退回標準庫
+try:
+    import orjson
+    _loads = orjson.loads
+    DECODER_NAME = "orjson"
+except ImportError:
+    _loads = json.loads
+    DECODER_NAME = "json"
 
 # 雲端 MQTT 配置
 MQTT_BROKER = "067ec32ef1344d3bb20c4e53abdde99a.s1.eu.hivemq.cloud"
@@ -12,20 +39,42 @@ MQTT_TOPIC_MESSAGE = "UWB/GW16B8_Message"  # 訊息主題
 MQTT_USERNAME = "testweb1"
 MQTT_PASSWORD = "Aa000000"
 
+# 默認只監聽 GW16B8 的三個主題
+DEFAULT_SUBSCRIPTIONS = [MQTT_TOPIC_CONFIG, MQTT_TOPIC_TAGCONF, MQTT_TOPIC_MESSAGE]
+
+# 所有 Gateway 模式：MQTT 萬用字元必須佔滿整個層級（"UWB/+_AncConf" 不是合法的過濾器），
+# 因此訂閱 UWB/+ 後由分派表按主題後綴篩選
+ALL_GATEWAYS_SUBSCRIPTIONS = ["UWB/+"]
+
+# 全域 Gateway 主題，不帶 GWxxxx 前綴
+GATEWAY_TOPIC = "UWB/UWB_Gateway"
+
+# 指標（見 metrics.py），熱路徑上只做計數與耗時觀測
+METRICS_PREFIX = "uwb_receiver_"
+RECEIVED = REGISTRY.counter("uwb_receiver_messages_total", "收到並處理的訊息數")
+ERRORS = REGISTRY.counter("uwb_receiver_errors_total", "解析或處理失敗的訊息數")
+DECODE_SECONDS = REGISTRY.histogram("uwb_receiver_decode_seconds", "JSON 解析耗時（秒）")
+HANDLER_SECONDS = REGISTRY.histogram("uwb_receiver_handler_seconds", "解析後處理與輸出耗時（秒）")
+CONNECTIONS = REGISTRY.counter("uwb_receiver_connections_total", "成功連接 MQTT Broker 的次數")
+RECONNECTS = REGISTRY.counter("uwb_receiver_reconnects_total", "重新連接 MQTT Broker 的次數",
+                              function=lambda: max(0, CONNECTIONS.value() - 1))
+CONNECTED = REGISTRY.gauge("uwb_receiver_connected", "是否已連接 MQTT Broker")
+# 高吞吐路徑每多少條訊息取樣一次耗時
+TIMING_SAMPLE_EVERY = 16
+_timing_ticks = itertools.count()
+
 def on_connect(client, userdata, flags, rc):
     """MQTT 連接回調函數"""
     if rc == 0:
+        CONNECTIONS.inc()
+        CONNECTED.set(1)
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 成功連接到 MQTT Broker")
 
-        # 訂閱三個主題
-        client.subscribe(MQTT_TOPIC_CONFIG)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已訂閱主題: {MQTT_TOPIC_CONFIG}")
-
-        client.subscribe(MQTT_TOPIC_TAGCONF)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已訂閱主題: {MQTT_TOPIC_TAGCONF}")
-
-        client.subscribe(MQTT_TOPIC_MESSAGE)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已訂閱主題: {MQTT_TOPIC_MESSAGE}")
+        # 訂閱主題
+        subscriptions = (userdata or {}).get("subscriptions") or DEFAULT_SUBSCRIPTIONS
+        for topic in subscriptions:
+            client.subscribe(topic)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已訂閱主題: {topic}")
     else:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 連接失敗，返回碼: {rc}")
 
@@ -99,19 +148,108 @@ def handle_status_message(message, topic):
     print(f"  5V 電源狀態: {message.get('5V plugged', 'N/A')}")
     print(f"  序列號: {message.get('serial no', 'N/A')}")
 
+def handle_location_message(message, topic):
+    """處理 Tag 位置訊息"""
+    print(f"\n{'='*60}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到 UWB Tag 位置訊息")
+    print(f"主題: {topic}")
+    print(f"{'='*60}")
+
+    print("位置訊息內容:")
+    print(f"  Gateway ID: {message.get('gateway id', 'N/A')}")
+    print(f"  設備 ID: {message.get('id', 'N/A')}")
+    position = message.get('position', {})
+    print(f"  位置坐標: ({position.get('x', 'N/A')}, {position.get('y', 'N/A')}, "
+          f"{position.get('z', 'N/A')}), 品質: {position.get('quality', 'N/A')}")
+    print(f"  序列號: {message.get('serial no', 'N/A')}")
+
+def handle_health_message(message, topic):
+    """處理健康訊息（300B、diaper DV1、motion info 等）"""
+    print(f"\n{'='*60}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到健康訊息")
+    print(f"主題: {topic}")
+    print(f"{'='*60}")
+
+    print("健康訊息內容:")
+    print(f"  內容類型: {message.get('content', 'N/A')}")
+    print(f"  Gateway ID: {message.get('gateway id', 'N/A')}")
+    print(f"  設備: {message.get('id', message.get('MAC', 'N/A'))}")
+    print(f"  電量: {message.get('battery level', 'N/A')}")
+    print(f"  序列號: {message.get('serial no', 'N/A')}")
+
+def handle_gateway_message(message, topic):
+    """處理 Gateway 狀態訊息"""
+    print(f"\n{'='*60}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到 Gateway 狀態訊息")
+    print(f"主題: {topic}")
+    print(f"{'='*60}")
+
+    print("Gateway 狀態訊息內容:")
+    print(f"  Gateway ID: {message.get('gateway id', 'N/A')}")
+    print(f"  名稱: {message.get('name', 'N/A')}")
+    print(f"  韌體版本: {message.get('fw ver', 'N/A')}")
+    print(f"  UWB Joined: {message.get('UWB Joined', 'N/A')}")
+    print(f"  最後同步: {message.get('last sync', 'N/A')}")
+
+# 訊息分派表：(主題後綴, content) -> 處理函數，content 為 None 表示該後綴的默認處理
+MESSAGE_HANDLERS = {
+    ("AncConf", None): handle_anchor_config_message,
+    ("TagConf", None): handle_tag_config_message,
+    ("Message", None): handle_status_message,
+    ("Loca", None): handle_location_message,
+    ("Health", None): handle_health_message,
+    ("Gateway", None): handle_gateway_message,
+}
+
+# 主題 -> (Gateway 前綴, 主題後綴) 快取，每個主題字串只拆分一次
+_topic_cache = {}
+
+def register_handler(suffix, handler, content=None):
+    """註冊或替換分派表中的處理函數"""
+    MESSAGE_HANDLERS[(suffix, content)] = handler
+
+def resolve_topic(topic):
+    """
+    拆分主題為 (Gateway 前綴, 主題後綴)
+
+    例如 UWB/GW16B8_Loca -> ("GW16B8", "Loca")，UWB/UWB_Gateway -> (None, "Gateway")
+    """
+    resolved = _topic_cache.get(topic)
+    if resolved is None:
+        if topic == GATEWAY_TOPIC:
+            resolved = (None, "Gateway")
+        else:
+            name = topic.rpartition('/')[2]
+            prefix, _, suffix = name.rpartition('_')
+            resolved = (prefix or None, suffix)
+        _topic_cache[topic] = resolved
+    return resolved
+
+def find_handler(topic, message):
+    """按主題後綴與 content 查找處理函數，找不到返回 None"""
+    suffix = resolve_topic(topic)[1]
+    handler = MESSAGE_HANDLERS.get((suffix, message.get('content')))
+    if handler is None:
+        handler = MESSAGE_HANDLERS.get((suffix, None))
+    return handler
+
 def on_message(client, userdata, msg):
     """MQTT 訊息接收回調函數"""
+    RECEIVED.inc()
     try:
-        # 解析 JSON 訊息
-        message = json.loads(msg.payload.decode('utf-8'))
-
-        # 根據主題判斷訊息類型並處理
-        if msg.topic == MQTT_TOPIC_CONFIG:
-            handle_anchor_config_message(message, msg.topic)
-        elif msg.topic == MQTT_TOPIC_TAGCONF:
-            handle_tag_config_message(message, msg.topic)
-        elif msg.topic == MQTT_TOPIC_MESSAGE:
-            handle_status_message(message, msg.topic)
+        # 解析 JSON 訊息（msgpack / CBOR 負載按首字節識別）
+        started = time.perf_counter()
+        if is_binary_payload(msg.payload):
+            message = decode_binary(msg.payload)
+        else:
+            message = json.loads(msg.payload.decode('utf-8'))
+        decoded = time.perf_counter()
+        DECODE_SECONDS.observe(decoded - started)
+
+        # 根據主題後綴與內容類型分派處理
+        handler = find_handler(msg.topic, message)
+        if handler:
+            handler(message, msg.topic)
         else:
             print(f"\n{'='*60}")
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到未知主題訊息")
@@ -122,35 +260,432 @@ def on_message(client, userdata, msg):
         print(f"\n原始 JSON:")
         print(json.dumps(message, indent=2, ensure_ascii=False))
         print(f"{'='*60}\n")
+        HANDLER_SECONDS.observe(time.perf_counter() - decoded)
 
     except json.JSONDecodeError as e:
+        ERRORS.inc()
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] JSON 解析錯誤: {e}")
         print(f"主題: {msg.topic}")
         print(f"原始訊息: {msg.payload.decode('utf-8')}")
     except Exception as e:
+        ERRORS.inc()
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 處理訊息時發生錯誤: {e}")
 
+def decode_payload(payload):
+    """直接從 bytes 解析 JSON，不先解碼為字串；首字節不低於 0x80 的負載按 msgpack / CBOR 解析"""
+    if payload[:1] >= b"\x80":
+        return decode_binary(payload)
+    return _loads(payload)
+
+class CompactRecordWriter:
+    """
+    高吞吐模式的單行記錄輸出
+
+    每條訊息寫一行: 接收時間(epoch ms)\t主題\tcontent\t設備\tserial no，
+    按時間間隔批量 flush，避免逐條寫終端
+    """
+
+    def __init__(self, stream, flush_interval=1.0):
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.errors = 0
+        self._last_flush = time.monotonic()
+        # 佇列模式下多個工作執行緒共用同一輸出
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _record_line(recv_ts, topic, message):
+        """單行記錄的固定欄位（不含換行）"""
+        device = message.get('id')
+        if device is None:
+            device = message.get('MAC', message.get('name', ''))
+        return (f"{int(recv_ts * 1000)}\t{topic}\t{message.get('content', '')}\t"
+                f"{device}\t{message.get('serial no', '')}")
+
+    def _emit(self, line):
+        """寫入一條記錄，距上次 flush 超過間隔時 flush"""
+        with self._lock:
+            self.stream.write(line)
+            self.count += 1
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self.stream.flush()
+                self._last_flush = now
+
+    def write(self, recv_ts, topic, message):
+        self._emit(self._record_line(recv_ts, topic, message) + "\n")
+
+    def write_change(self, recv_ts, topic, message, changes):
+        """變化模式：在單行記錄後附加變化欄位 JSON"""
+        self._emit(f"{self._record_line(recv_ts, topic, message)}\t"
+                   f"{json.dumps(changes, ensure_ascii=False, separators=(',', ':'))}\n")
+
+    def write_alert(self, recv_ts, topic, event):
+        """健康告警事件：以 ALERT 標記單獨一行"""
+        with self._lock:
+            self.stream.write(f"{int(recv_ts * 1000)}\t{topic}\tALERT\t{format_alert(event)}\n")
+            self.count += 1
+
+    def write_zone_event(self, recv_ts, topic, event):
+        """區域事件：以 ZONE 標記單獨一行"""
+        with self._lock:
+            self.stream.write(f"{int(recv_ts * 1000)}\t{topic}\tZONE\t{format_event(event)}\n")
+            self.count += 1
+
+    def write_error(self, recv_ts, topic, error):
+        with self._lock:
+            self.stream.write(f"{int(recv_ts * 1000)}\t{topic}\tERROR\t{error}\n")
+            self.errors += 1
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+def handle_fast(userdata, topic, payload, recv_ts):
+    """
+    高吞吐路徑：解析 bytes 並輸出單行記錄，分派表未登記的主題後綴（如 Dwlink）直接略過
+
+    userdata 含狀態表 store 時只輸出有變化的訊息，重複與無變化的訊息直接丟棄；
+    含批量寫入器 sink 時每條訊息同時持久化；
+    含異常偵測器 detector 時 Health 訊息即時偵測並輸出告警行；
+    含電子圍欄 geofence 時 Loca 訊息更新 Tag 所在區域並輸出進入/離開/停留事件行；
+    含彙總存儲 rollup 時 Health / Loca 讀數累加進 1 秒 / 1 分鐘 / 1 小時聚合；
+    解析與處理耗時每 TIMING_SAMPLE_EVERY 條取樣一次，避免計時本身佔用熱路徑
+    """
+    suffix = resolve_topic(topic)[1]
+    if (suffix, None) not in MESSAGE_HANDLERS:
+        return
+    RECEIVED.inc()
+    writer = userdata["writer"]
+    try:
+        if next(_timing_ticks) % TIMING_SAMPLE_EVERY:
+            handle_decoded(userdata, writer, topic, suffix, decode_payload(payload), payload, recv_ts)
+        else:
+            started = time.perf_counter()
+            message = decode_payload(payload)
+            decoded = time.perf_counter()
+            handle_decoded(userdata, writer, topic, suffix, message, payload, recv_ts)
+            DECODE_SECONDS.observe(decoded - started)
+            HANDLER_SECONDS.observe(time.perf_counter() - decoded)
+    except Exception as e:
+        ERRORS.inc()
+        writer.write_error(recv_ts, topic, e)
+
+def handle_decoded(userdata, writer, topic, suffix, message, payload, recv_ts):
+    """高吞吐路徑中解析之後的處理：持久化、異常偵測與輸出"""
+    sink = userdata.get("sink")
+    if sink is not None:
+        sink.add(topic, message, recv_ts, payload)
+    detector = userdata.get("detector")
+    if detector is not None and suffix == "Health":
+        health_batch = userdata.get("health_batch")
+        if health_batch is not None:
+            # 佇列模式整批取出時留到批末一次偵測
+            health_batch.append((topic, message, recv_ts))
+        else:
+            for event in detector.process(message, recv_ts):
+                writer.write_alert(recv_ts, topic, event)
+    geofence = userdata.get("geofence")
+    if geofence is not None and suffix == "Loca":
+        for event in geofence.process(message, recv_ts):
+            writer.write_zone_event(recv_ts, topic, event)
+    rollup = userdata.get("rollup")
+    if rollup is not None and suffix in ("Health", "Loca"):
+        rollup.process(message, recv_ts)
+    store = userdata.get("store")
+    if store is None:
+        writer.write(recv_ts, topic, message)
+        return
+    event = store.update(topic, message, recv_ts)
+    if event is not None:
+        writer.write_change(recv_ts, topic, message, event["changes"])
+
+def handle_fast_batch(userdata, items):
+    """
+    佇列模式一次取出的多條訊息：逐條走高吞吐路徑，
+    其中 Health 訊息的異常偵測在批末以一次向量化的 detector.update 處理，而不是逐條呼叫 process
+    """
+    detector = userdata.get("detector")
+    if detector is None:
+        for topic, payload, recv_ts in items:
+            handle_fast(userdata, topic, payload, recv_ts)
+        return
+    health_batch = []
+    batch_userdata = dict(userdata, health_batch=health_batch)
+    for topic, payload, recv_ts in items:
+        handle_fast(batch_userdata, topic, payload, recv_ts)
+    if health_batch:
+        detect_health_batch(detector, userdata["writer"], health_batch)
+
+def detect_health_batch(detector, writer, health_batch):
+    """批量偵測 [(topic, message, recv_ts)]，告警行使用觸發讀數的接收時間與住民所在主題"""
+    keys, values, stamps, topics = [], [], [], {}
+    for topic, message, recv_ts in health_batch:
+        readings = health_values(message)
+        key = resident_key(message)
+        if readings is None or key is None:
+            continue
+        keys.append(key)
+        values.append(readings)
+        stamps.append(recv_ts)
+        topics[key] = topic
+    if not keys:
+        return
+    try:
+        events = detector.update(detector.rows_for(keys), values, stamps)
+    except Exception as e:
+        ERRORS.inc()
+        writer.write_error(stamps[-1], health_batch[-1][0], e)
+        return
+    for event in events:
+        writer.write_alert(event["timestamp"], topics[event["resident"]], event)
+
+def on_message_fast(client, userdata, msg):
+    """高吞吐模式的訊息回調：直接解析 bytes 並輸出單行記錄"""
+    handle_fast(userdata, msg.topic, msg.payload, time.time())
+
+def on_message_enqueue(client, userdata, msg):
+    """佇列模式的訊息回調：網路執行緒只負責入隊，不做解析與輸出"""
+    userdata["queue"].put(msg.topic, msg.payload, time.time())
+
+def create_work_queue(args, userdata):
+    """按命令列參數建立工作佇列，處理函數沿用高吞吐或原始輸出路徑"""
+    batch_handler = None
+    if userdata["writer"]:
+        def handler(topic, payload, recv_ts):
+            handle_fast(userdata, topic, payload, recv_ts)
+
+        # 啟用異常偵測時整批取出，Health 訊息批量偵測
+        if userdata.get("detector") is not None:
+            def batch_handler(items):
+                handle_fast_batch(userdata, items)
+    else:
+        def handler(topic, payload, recv_ts):
+            on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+
+    return BoundedWorkQueue(handler, workers=args.workers, maxsize=args.queue_size,
+                            policy=args.policy, batch_handler=batch_handler)
+
+def write_state_snapshot(store, path):
+    """把所有設備當前狀態原子寫入 JSON 文件（先寫臨時文件再替換）"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"generated_at": time.time(), "devices": store.snapshot()},
+                  f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+def run_state_snapshots(store, path, interval, stop_event):
+    """定期寫出設備狀態快照，並輸出狀態表統計"""
+    while not stop_event.wait(interval):
+        try:
+            write_state_snapshot(store, path)
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 寫入狀態快照失敗: {e}",
+                  file=sys.stderr)
+        stats = store.stats()
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 狀態表: {stats['devices']} 個設備, "
+              f"收到 {stats['received']}, 輸出變化 {stats['emitted']}, 重複 {stats['duplicates']}, "
+              f"無變化 {stats['unchanged']}", file=sys.stderr)
+
+def report_queue_stats(work_queue, interval, stop_event):
+    """定期輸出佇列深度與丟棄計數"""
+    while not stop_event.wait(interval):
+        stats = work_queue.stats()
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 佇列: 深度 {stats['depth']} "
+              f"(最大 {stats['max_depth']}), 已處理 {stats['processed']}/{stats['enqueued']}, "
+              f"丟棄 {stats['dropped']}, 錯誤 {stats['errors']}", file=sys.stderr)
+
+def load_benchmark_messages(path):
+    """讀取抓包文件，轉為 paho 訊息形式 (topic, payload bytes)"""
+    from replay_capture import iter_capture
+
+    return [SimpleNamespace(topic=record["topic"],
+                            payload=json.dumps(record["message"], ensure_ascii=False).encode('utf-8'))
+            for record in iter_capture(path)]
+
+def run_benchmark(path, repeat):
+    """比較原始輸出路徑與高吞吐路徑的處理速率 (msgs/s)"""
+    messages = load_benchmark_messages(path) * repeat
+    print(f"基準測試: {len(messages)} 條訊息 (抓包 {path} x {repeat}), 解析器: {DECODER_NAME}")
+
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for msg in messages:
+                on_message(None, None, msg)
+            legacy_elapsed = time.perf_counter() - start
+
+        writer = CompactRecordWriter(io.TextIOWrapper(open(os.devnull, 'wb'), encoding='utf-8'))
+        userdata = {"writer": writer}
+        start = time.perf_counter()
+        for msg in messages:
+            on_message_fast(None, userdata, msg)
+        writer.flush()
+        fast_elapsed = time.perf_counter() - start
+
+        store = DeviceStateStore()
+        userdata = {"writer": writer, "store": store}
+        start = time.perf_counter()
+        for msg in messages:
+            on_message_fast(None, userdata, msg)
+        writer.flush()
+        changes_elapsed = time.perf_counter() - start
+
+    legacy_rate = len(messages) / legacy_elapsed
+    fast_rate = len(messages) / fast_elapsed
+    changes_rate = len(messages) / changes_elapsed
+    stats = store.stats()
+    print(f"  原始路徑: {legacy_rate:,.0f} msgs/s")
+    print(f"  高吞吐路徑: {fast_rate:,.0f} msgs/s ({fast_rate / legacy_rate:.1f}x)")
+    print(f"  變化模式: {changes_rate:,.0f} msgs/s ({changes_rate / legacy_rate:.1f}x), "
+          f"輸出 {stats['emitted']} / {stats['received']} 條, 重複 {stats['duplicates']}")
+
 def on_disconnect(client, userdata, rc):
     """MQTT 斷線回調函數"""
+    CONNECTED.set(0)
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 與 MQTT Broker 斷線，返回碼: {rc}")
 
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="UWB 雲端 MQTT 多主題訊息監聽程式")
+    parser.add_argument("--fast", action="store_true",
+                        help="高吞吐模式：直接解析 bytes，每條訊息只輸出一行記錄")
+    parser.add_argument("--output", default=None,
+                        help="高吞吐模式的記錄輸出文件，默認為標準輸出")
+    parser.add_argument("--benchmark", nargs="?", metavar="CAPTURE",
+                        const=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                           "..", "test-data", "mqtt_messages.json"),
+                        help="以抓包文件比較原始路徑與高吞吐路徑的處理速率")
+    parser.add_argument("--repeat", type=int, default=100, help="基準測試重複抓包次數")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="工作執行緒數，大於 0 時網路回調只入隊，由工作執行緒處理")
+    parser.add_argument("--queue-size", type=int, default=10000, help="工作佇列總容量")
+    parser.add_argument("--policy", choices=POLICIES, default=POLICY_BLOCK,
+                        help="佇列已滿時的背壓策略")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="佇列統計輸出間隔（秒）")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="本地 HTTP /metrics 端口，0 表示不啟用")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="定期輸出精簡指標行的間隔（秒），0 表示不輸出")
+    parser.add_argument("--all-gateways", action="store_true",
+                        help="以萬用字元訂閱所有 Gateway 的 UWB 主題")
+    parser.add_argument("--changes-only", action="store_true",
+                        help="按設備保存最新狀態，只輸出有變化的訊息並丟棄重複 serial no（隱含 --fast）")
+    parser.add_argument("--health-alerts", action="store_true",
+                        help="對 Health 訊息做滑動窗口異常偵測並輸出告警行（隱含 --fast）")
+    parser.add_argument("--geofence", nargs="?", const="", default=None, metavar="ZONES",
+                        help="對 Loca 訊息做電子圍欄判斷並輸出區域事件行，可指定區域文件 (YAML/JSON)，"
+                             "默認以樓層邊界作為區域（隱含 --fast）")
+    parser.add_argument("--rollup", default=None, metavar="DIR",
+                        help="把 Health / Loca 讀數彙總為 1 秒 / 1 分鐘 / 1 小時聚合並寫入目錄（隱含 --fast）")
+    parser.add_argument("--rollup-port", type=int, default=0,
+                        help="在此端口提供彙總查詢 HTTP 接口 /query 與 /devices（0 表示不開啟）")
+    parser.add_argument("--rollup-flush", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="彙總關閉到期時間桶並寫出段文件的間隔（秒）")
+    parser.add_argument("--snapshot-file", default=None,
+                        help="定期寫出所有設備當前狀態的 JSON 文件（需 --changes-only）")
+    parser.add_argument("--snapshot-interval", type=float, default=10.0,
+                        help="狀態快照寫出間隔（秒）")
+    parser.add_argument("--sqlite", default=None,
+                        help="把訊息批量寫入 SQLite 數據庫（WAL 模式，隱含 --fast）")
+    parser.add_argument("--parquet", default=None,
+                        help="把訊息批量寫入 Parquet 文件目錄（需要 pyarrow，隱含 --fast）")
+    parser.add_argument("--batch-size", type=int, default=1000, help="持久化每批最大行數")
+    parser.add_argument("--batch-interval", type=float, default=1.0,
+                        help="持久化最長等待時間（秒）")
+    return parser.parse_args()
+
 def main():
     """主程式"""
+    args = parse_args()
+    if args.benchmark:
+        run_benchmark(args.benchmark, args.repeat)
+        return
+
     print("UWB 雲端 MQTT 多主題訊息監聽程式")
     print(f"雲端 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
     print(f"用戶名: {MQTT_USERNAME}")
-    print(f"監聽主題 1: {MQTT_TOPIC_CONFIG} (Anchor 配置)")
-    print(f"監聽主題 2: {MQTT_TOPIC_TAGCONF} (Tag 配置)")
-    print(f"監聽主題 3: {MQTT_TOPIC_MESSAGE} (狀態訊息)")
+    if args.all_gateways:
+        print(f"監聽主題: {', '.join(ALL_GATEWAYS_SUBSCRIPTIONS)} (所有 Gateway)")
+    else:
+        print(f"監聽主題 1: {MQTT_TOPIC_CONFIG} (Anchor 配置)")
+        print(f"監聽主題 2: {MQTT_TOPIC_TAGCONF} (Tag 配置)")
+        print(f"監聽主題 3: {MQTT_TOPIC_MESSAGE} (狀態訊息)")
     print("使用 SSL/TLS 加密連接")
     print("按 Ctrl+C 退出程式\n")
 
+    writer = None
+    store = None
+    stop_event = threading.Event()
+    sink = create_sink(args.sqlite, args.parquet, args.batch_size, args.batch_interval)
+    if sink:
+        print(f"持久化: {', '.join(backend.name for backend in sink.backends)}, "
+              f"每批最多 {args.batch_size} 行 / {args.batch_interval} 秒")
+    if (args.fast or args.changes_only or args.health_alerts or args.geofence is not None or sink
+            or args.rollup):
+        stream = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+        writer = CompactRecordWriter(stream)
+        print(f"高吞吐模式: 每條訊息輸出一行記錄 ({DECODER_NAME})")
+    if args.changes_only:
+        store = DeviceStateStore()
+        print("變化模式: 只輸出設備狀態變化")
+        if args.snapshot_file:
+            threading.Thread(target=run_state_snapshots,
+                             args=(store, args.snapshot_file, args.snapshot_interval, stop_event),
+                             daemon=True).start()
+    detector = None
+    if args.health_alerts:
+        detector = HealthAnomalyDetector()
+        print("異常偵測: Health 訊息越過正常範圍、連續異常與 z-score 突變時輸出 ALERT 行")
+    geofence = None
+    if args.geofence is not None:
+        geofence = load_geofence(args.geofence or None)
+        print(f"電子圍欄: {len(geofence.zones)} 個區域, {len(geofence.gateway_floors)} 個 Gateway 已對應樓層")
+        REGISTRY.counter("uwb_receiver_zone_events_total", "電子圍欄產生的區域事件數",
+                         function=lambda: geofence.events)
+    rollup = None
+    if args.rollup:
+        rollup = RollupStore(args.rollup)
+        start_flusher(rollup, args.rollup_flush, stop_event)
+        print(f"彙總存儲: {args.rollup} ({len(rollup)} 個設備), 每 {args.rollup_flush:g} 秒寫出")
+        if args.rollup_port:
+            start_query_server(rollup, args.rollup_port)
+            print(f"彙總查詢: http://127.0.0.1:{args.rollup_port}/query?device=...&field=hr&start=-1h")
+    userdata = {"writer": writer, "store": store, "sink": sink, "detector": detector, "geofence": geofence,
+                "rollup": rollup}
+
+    work_queue = None
+    if args.workers > 0:
+        work_queue = create_work_queue(args, userdata)
+        work_queue.start()
+        threading.Thread(target=report_queue_stats,
+                         args=(work_queue, args.stats_interval, stop_event),
+                         daemon=True).start()
+        print(f"佇列模式: {args.workers} 個工作執行緒, 容量 {args.queue_size}, 策略 {args.policy}")
+        REGISTRY.gauge("uwb_receiver_queue_depth", "工作佇列當前深度", function=work_queue.depth)
+        REGISTRY.counter("uwb_receiver_queue_dropped_total", "工作佇列丟棄的訊息數",
+                         function=lambda: work_queue.stats()["dropped"])
+
+    if args.metrics_port:
+        start_http_server(REGISTRY, args.metrics_port)
+        print(f"指標: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_interval > 0:
+        start_stats_line(REGISTRY, args.metrics_interval, stop_event, prefix=METRICS_PREFIX)
+
     # 創建 MQTT 客戶端
-    client = mqtt.Client()
+    subscriptions = ALL_GATEWAYS_SUBSCRIPTIONS if args.all_gateways else DEFAULT_SUBSCRIPTIONS
+    userdata["queue"] = work_queue
+    userdata["subscriptions"] = subscriptions
+    client = mqtt.Client(userdata=userdata)
 
     # 設置回調函數
     client.on_connect = on_connect
-    client.on_message = on_message
+    if work_queue:
+        client.on_message = on_message_enqueue
+    else:
+        client.on_message = on_message_fast if writer else on_message
     client.on_disconnect = on_disconnect
 
     try:
@@ -174,6 +709,21 @@ def main():
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 發生錯誤: {e}")
     finally:
         client.disconnect()
+        stop_event.set()
+        if work_queue:
+            work_queue.stop()
+        if writer:
+            writer.flush()
+        if store and args.snapshot_file:
+            write_state_snapshot(store, args.snapshot_file)
+        if rollup:
+            rollup.close()
+        if sink:
+            sink.close()
+            stats = sink.stats()
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已持久化 {stats['rows']} 行 "
+                  f"({stats['batches']} 批), 寫入錯誤 {stats['errors']}, "
+                  f"未寫入 {stats['pending']} 行, 丟棄 {stats['failed']} 行")
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式結束")
 
 if __name__ == "__main__":
@@ -1,9 +1,23 @@
-import json
+import argparse
+import asyncio
+import logging
+import math
 import ssl
+import os
 import paho.mqtt.client as mqtt
 from datetime import datetime
 import time
 
+import numpy as np
+
+from async_publisher import AsyncPublisher
+from outbound_spool import DEFAULT_DRAIN_RATE, DEFAULT_MAX_AGE, OutboundSpool, SpoolDrainer
+from payload_codec import CODEC_JSON, CODECS, PayloadTemplate, Slot, codec_available
+from publisher_pool import PublisherPool, create_client, format_stats, latency_percentile
+from scenario import compile_scenario
+from state_file import PeriodicSnapshot, load_state
+from tick_scheduler import TickScheduler
+
 # 雲端 MQTT 配置
 MQTT_BROKER = "067ec32ef1344d3bb20c4e53abdde99a.s1.eu.hivemq.cloud"
 MQTT_PORT = 8883  # SSL/TLS 端口
@@ -12,9 +26,27 @@ MQTT_TOPIC = "UWB/GW16B8_Dwlink"  # 發送主題
 MQTT_USERNAME = "testweb1"
 MQTT_PASSWORD = "Aa000000"
 
+# 默認 Gateway 與 Anchor
+DEFAULT_GATEWAY_ID = 4192540344
+DEFAULT_ANCHOR = {"name": "0x8E97", "id": 36503}
+
+# 本地 mosquitto（見專案根目錄 mosquitto.conf，允許匿名連接）
+LOCAL_BROKER = "localhost"
+LOCAL_PORT = 1883
+
 # 全域變數用於追蹤序列號
 serial_counter = 1240
 
+# 序列號快照的默認寫入間隔（秒）
+STATE_INTERVAL = 10.0
+
+# 斷線期間的磁碟外發緩衝（--spool），None 表示斷線時丟棄
+spool = None
+
+# 負載編碼（--codec）與每個 (Gateway, Anchor) 預編譯的配置訊息模板
+PAYLOAD_CODEC = CODEC_JSON
+anchor_templates = {}
+
 def on_connect(client, userdata, flags, rc):
     """MQTT 連接回調函數"""
     if rc == 0:
@@ -31,19 +63,42 @@ def on_disconnect(client, userdata, rc):
     """MQTT 斷線回調函數"""
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 與 MQTT Broker 斷線，返回碼: {rc}")
 
-def create_anchor_message():
-    """創建 Anchor 配置訊息"""
+def dwlink_topic(gateway_id):
+    """根據 Gateway ID 推導下行主題，例如 4192540344 (0xF9E516B8) -> UWB/GW16B8_Dwlink"""
+    return f"UWB/GW{gateway_id & 0xFFFF:04X}_Dwlink"
+
+def create_anchor_message(gateway_id=DEFAULT_GATEWAY_ID, anchor=None, serial=None):
+    """
+    創建 Anchor 配置訊息
+
+    serial 為 None 時使用並遞增全域 serial_counter；
+    指定 serial 時由呼叫方自行維護序列號（例如每個 Anchor 獨立計數）
+    """
     global serial_counter
 
+    if anchor is None:
+        anchor = DEFAULT_ANCHOR
+    if serial is not None:
+        return build_anchor_message(gateway_id, anchor, serial)
+
+    message = build_anchor_message(gateway_id, anchor, serial_counter)
+
+    # 序列號遞增
+    serial_counter += 1
+
+    return message
+
+def build_anchor_message(gateway_id, anchor, serial):
+    """按指定序列號組裝 Anchor 配置訊息"""
     # 計算坐標值 (序列號/1000)
-    coordinate_value = serial_counter / 1000.0
+    coordinate_value = serial / 1000.0
 
-    message = {
+    return {
         "content": "configChange",
-        "gateway id": 4192540344,
+        "gateway id": gateway_id,
         "node": "ANCHOR",
-        "name": "0x8E97",
-        "id": 36503,
+        "name": anchor["name"],
+        "id": anchor["id"],
         "fw update": 0,
         "led": 1,
         "ble": 1,
@@ -53,25 +108,52 @@ def create_anchor_message():
             "y": coordinate_value,
             "z": coordinate_value
         },
-        "serial no": serial_counter
+        "serial no": serial
     }
 
-    # 序列號遞增
-    serial_counter += 1
+def anchor_template(gateway_id, anchor):
+    """Anchor 配置訊息模板，槽位依次為 position 的 x / y / z 與 serial no"""
+    key = (gateway_id, anchor["id"], anchor["name"])
+    template = anchor_templates.get(key)
+    if template is None:
+        message = build_anchor_message(gateway_id, anchor, 0)
+        message["position"] = {"x": Slot(), "y": Slot(), "z": Slot()}
+        message["serial no"] = Slot()
+        template = anchor_templates[key] = PayloadTemplate(message, PAYLOAD_CODEC)
+    return template
+
+def encode_anchor_message(gateway_id, anchor, serial):
+    """按指定序列號直接編碼 Anchor 配置訊息，與 build_anchor_message 的內容相同"""
+    coordinate_value = serial / 1000.0
+    return anchor_template(gateway_id, anchor).encode(coordinate_value, coordinate_value, coordinate_value, serial)
+
+def create_anchor_payload(gateway_id=DEFAULT_GATEWAY_ID, anchor=None, serial=None):
+    """create_anchor_message 的編碼版本：不建立字典，直接返回負載 bytes"""
+    global serial_counter
 
-    return message
+    if anchor is None:
+        anchor = DEFAULT_ANCHOR
+    if serial is None:
+        serial = serial_counter
+        serial_counter += 1
+    return encode_anchor_message(gateway_id, anchor, serial)
 
-def send_message(client):
+def send_message(client, gateway_id=DEFAULT_GATEWAY_ID, anchor=None):
     """發送訊息到 MQTT"""
     try:
-        # 創建訊息
-        message = create_anchor_message()
+        # 創建訊息（字典用於輸出，發送的負載由模板編碼）
+        message = create_anchor_message(gateway_id, anchor)
+        payload = encode_anchor_message(gateway_id, anchor or DEFAULT_ANCHOR, message["serial no"])
 
-        # 轉換為 JSON 字符串
-        json_message = json.dumps(message, ensure_ascii=False)
+        # 斷線時寫入 spool，重新連接後限速補發
+        if spool is not None and not client.is_connected():
+            spool.append(MQTT_TOPIC, payload)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 未連接，序列號 {message['serial no']} "
+                  f"已寫入 spool，積壓 {len(spool)} 條")
+            return
 
         # 發送訊息
-        result = client.publish(MQTT_TOPIC, json_message)
+        result = client.publish(MQTT_TOPIC, payload)
 
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
             print(f"\n{'='*60}")
@@ -104,15 +186,394 @@ def send_message(client):
             print(f"  序列號: {message['serial no']}, 坐標: ({position['x']}, {position['y']}, {position['z']})")
             print(f"{'='*60}\n")
 
+        elif spool is not None:
+            # 斷線競態等發送失敗同樣寫入 spool，不丟棄
+            spool.append(MQTT_TOPIC, payload)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 發送失敗，錯誤碼: {result.rc}，"
+                  f"序列號 {message['serial no']} 已寫入 spool，積壓 {len(spool)} 條")
         else:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 發送失敗，錯誤碼: {result.rc}")
 
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 發送訊息時發生錯誤: {e}")
 
+def open_spool(path, max_mb, max_age):
+    """開啟 spool 文件，上次未補發的積壓在連接後補發"""
+    opened = OutboundSpool(path, int(max_mb * 1024 * 1024), max_age)
+    if opened.recovered:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] spool {path} 中有 {opened.recovered} 條未補發訊息，連接後補發")
+    return opened
+
+def transmitter_state(serials=None, gateway_serials=None):
+    """收集快照內容：全域序列號、（asyncio 模式）每個 Anchor 與（發送池模式）每個 Gateway 的序列號"""
+    keys = list(serials) if serials else []
+    gateways = list(gateway_serials) if gateway_serials else []
+    arrays = {
+        "serial_counter": np.array([serial_counter], dtype=np.int64),
+        "gateway_ids": np.array([key[0] for key in keys], dtype=np.int64),
+        "anchor_ids": np.array([key[1] for key in keys], dtype=np.int64),
+        "serials": np.array([serials[key] for key in keys], dtype=np.int64),
+        "serial_gateways": np.array(gateways, dtype=np.int64),
+        "gateway_serials": np.array([gateway_serials[key] for key in gateways], dtype=np.int64),
+    }
+    return arrays, {"saved_at": time.time()}
+
+def serials_ahead(state_interval, interval, messages=1):
+    """
+    定期快照最多落後的序列號數：每 interval 秒發出 messages 條，
+    快照每 state_interval 秒在發送週期之間寫入一次，最多再晚一個週期
+    """
+    return int(math.ceil((state_interval / interval + 1) * messages))
+
+def restore_serials(state_file, serials=None, gateway_serials=None, ahead=0):
+    """
+    從快照恢復序列號，讓重啟後的 serial no 接續上次而不是回到初始值
+
+    serials 為 (gateway_id, anchor_id) -> 序列號 的字典時一併恢復其中的 Anchor，
+    gateway_serials 為 gateway_id -> 序列號 的字典時一併恢復其中的 Gateway，
+    快照中沒有的 Anchor / Gateway 從恢復後的全域序列號開始。
+
+    快照不是正常結束時寫入的（進程崩潰或被強制終止）時，快照之後發出的序列號已經丟失，
+    每個計數器向前跳過 ahead 條（整數，或以 serials / gateway_serials 的鍵為索引的字典），
+    寧可留下空缺也不重複發送已用過的序列號
+    """
+    global serial_counter
+
+    if not state_file or not os.path.exists(state_file):
+        return False
+    arrays, meta = load_state(state_file, mmap_mode=None)
+    if meta.get("final"):
+        ahead = 0
+    if isinstance(ahead, dict):
+        skip = ahead.get
+        global_skip = max(ahead.values(), default=0)
+    else:
+        skip = lambda key: ahead
+        global_skip = ahead
+    serial_counter = int(arrays["serial_counter"][0]) + global_skip
+    if serials is not None:
+        for key in serials:
+            serials[key] = serial_counter
+        for gateway_id, anchor_id, serial in zip(arrays["gateway_ids"].tolist(),
+                                                 arrays["anchor_ids"].tolist(),
+                                                 arrays["serials"].tolist()):
+            if (gateway_id, anchor_id) in serials:
+                serials[(gateway_id, anchor_id)] = serial + skip((gateway_id, anchor_id))
+    if gateway_serials is not None:
+        for key in gateway_serials:
+            gateway_serials[key] = serial_counter
+        if "serial_gateways" in arrays:
+            for gateway_id, serial in zip(arrays["serial_gateways"].tolist(),
+                                          arrays["gateway_serials"].tolist()):
+                if gateway_id in gateway_serials:
+                    gateway_serials[gateway_id] = serial + skip(gateway_id)
+    saved_at = datetime.fromtimestamp(meta.get("saved_at", 0)).strftime('%Y-%m-%d %H:%M:%S')
+    skipped = f"，快照非正常結束時保存，序列號最多跳過 {global_skip}" if global_skip else ""
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已從 {state_file} 恢復序列號 "
+          f"{serial_counter} (保存於 {saved_at}){skipped}")
+    return True
+
+def build_gateway_shards(gateway_count, anchors_per_gateway, workers, interval, gateways=None):
+    """
+    建立發送池分片，每個分片代表一個或多個 Gateway
+
+    Gateway ID 從 DEFAULT_GATEWAY_ID 開始遞增，Anchor ID 從 DEFAULT_ANCHOR 開始遞增；
+    指定 gateways（場景中的 Gateway 與 Anchor）時改用其拓撲
+    """
+    if gateways is None:
+        gateways = []
+        for g in range(gateway_count):
+            anchors = []
+            for a in range(anchors_per_gateway):
+                anchor_id = (DEFAULT_ANCHOR["id"] + g * anchors_per_gateway + a) & 0xFFFF
+                anchors.append({"name": f"0x{anchor_id:04X}", "id": anchor_id})
+            gateways.append({"gateway_id": DEFAULT_GATEWAY_ID + g, "anchors": anchors})
+
+    workers = max(1, min(workers, len(gateways)))
+    shards = [{"gateways": [], "interval": interval} for _ in range(workers)]
+    for g, gateway in enumerate(gateways):
+        anchors = [{"name": anchor["name"], "id": anchor["id"]} for anchor in gateway["anchors"]]
+        shards[g % workers]["gateways"].append({"gateway_id": gateway["gateway_id"], "anchors": anchors})
+
+    for shard in shards:
+        shard["name"] = "+".join(f"GW{gw['gateway_id'] & 0xFFFF:04X}" for gw in shard["gateways"])
+    return shards
+
+def load_scenario_gateways(args):
+    """
+    載入 --scenario 中有 Anchor 的 Gateway，並以場景的代理設置（如有）作為 args.scenario_broker
+
+    未指定場景時返回 None
+    """
+    args.scenario_broker = None
+    if not args.scenario:
+        return None
+    scenario = compile_scenario(args.scenario)
+    gateways = [gateway for gateway in scenario.gateways if gateway["anchors"]]
+    if not gateways:
+        raise ValueError(f"場景 {scenario.name} 中沒有帶 Anchor 的 Gateway")
+    args.scenario_broker = scenario.broker or None
+    args.gateways = len(gateways)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {scenario.summary()}")
+    return gateways
+
+def run_gateway_shard(shard, publisher, stop_event):
+    """
+    發送池工作進程任務：按間隔為分片內每個 Anchor 發送配置訊息
+
+    每個 Gateway 獨立維護 serial no（同一 Gateway 的 Anchor 共用），
+    一個分片模擬多個 Gateway 時各自的序列號仍然連續
+    """
+    global PAYLOAD_CODEC
+    PAYLOAD_CODEC = shard.get("codec", PAYLOAD_CODEC)
+    targets = [(dwlink_topic(gw["gateway_id"]), gw["gateway_id"], anchor)
+               for gw in shard["gateways"] for anchor in gw["anchors"]]
+    gateway_serials = {gw["gateway_id"]: serial_counter for gw in shard["gateways"]}
+    state_file = shard.get("state_file")
+    state_interval = shard.get("state_interval", STATE_INTERVAL)
+    restore_serials(state_file, gateway_serials=gateway_serials,
+                    ahead={gw["gateway_id"]: serials_ahead(state_interval, shard["interval"], len(gw["anchors"]))
+                           for gw in shard["gateways"]})
+    snapshot = (PeriodicSnapshot(state_file, lambda: transmitter_state(gateway_serials=gateway_serials),
+                                 state_interval)
+                if state_file else None)
+
+    shard_spool, drainer = None, None
+    if shard.get("spool"):
+        options = shard["spool"]
+        shard_spool = open_spool(options["path"], options["max_mb"], options["max_age"])
+        drainer = SpoolDrainer(shard_spool, publisher.publish, publisher.is_connected, options["rate"]).start()
+
+    scheduler = TickScheduler(len(targets), udr_hz=1.0 / shard["interval"],
+                              report_interval=0)
+    try:
+        for due in scheduler.ticks():
+            if stop_event.is_set():
+                break
+            connected = shard_spool is None or publisher.is_connected()
+            for index in due:
+                topic, gateway_id, anchor = targets[index]
+                payload = encode_anchor_message(gateway_id, anchor, gateway_serials[gateway_id])
+                gateway_serials[gateway_id] += 1
+                if connected:
+                    result = publisher.publish(topic, payload)
+                    if result.rc == mqtt.MQTT_ERR_SUCCESS or shard_spool is None:
+                        continue
+                # 斷線或發送失敗（如斷線競態下的 MQTT_ERR_NO_CONN）時寫入 spool
+                shard_spool.append(topic, payload)
+            if snapshot:
+                snapshot.maybe_save()
+    finally:
+        if drainer:
+            drainer.stop()
+            shard_spool.close()
+        if snapshot:
+            snapshot.save(final=True)
+
+def run_publisher_pool(args):
+    """以多進程發送池運行，每個進程使用獨立連接模擬不同 Gateway"""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # 場景可指定代理，先載入場景再決定連接配置
+    gateways = load_scenario_gateways(args)
+    config = broker_config(args)
+    config["client_prefix"] = "anchor-tx"
+
+    shards = build_gateway_shards(args.gateways, args.anchors, args.workers, args.interval, gateways)
+    if args.state_file:
+        for index, shard in enumerate(shards):
+            shard["state_file"] = f"{args.state_file}.{index}"
+            shard["state_interval"] = args.state_interval
+    if args.spool:
+        for index, shard in enumerate(shards):
+            shard["spool"] = {"path": f"{args.spool}.{index}", "max_mb": args.spool_max_mb,
+                              "max_age": args.spool_max_age, "rate": args.spool_rate}
+    for shard in shards:
+        shard["codec"] = PAYLOAD_CODEC
+    anchor_count = sum(len(gw["anchors"]) for shard in shards for gw in shard["gateways"])
+    print(f"發送池模式: {args.gateways} 個 Gateway, {anchor_count} 個 Anchor, "
+          f"{len(shards)} 個進程, 代理 {config['broker']}:{config['port']}")
+
+    PublisherPool(shards, run_gateway_shard, config,
+                  report_interval=args.report_interval).run()
+
+def broker_config(args):
+    """按命令列參數返回連接配置（本地 mosquitto、場景中的代理或雲端 TLS）"""
+    if args.local:
+        return {"broker": LOCAL_BROKER, "port": LOCAL_PORT}
+    broker = getattr(args, "scenario_broker", None)
+    if broker:
+        return {"broker": broker.get("host", LOCAL_BROKER), "port": int(broker.get("port", LOCAL_PORT)),
+                "tls": bool(broker.get("tls", False)),
+                "username": broker.get("username"), "password": broker.get("password")}
+    return {"broker": MQTT_BROKER, "port": MQTT_PORT, "tls": True,
+            "username": MQTT_USERNAME, "password": MQTT_PASSWORD}
+
+async def run_anchor_async(publisher, topic, gateway_id, anchor, serials, args, track):
+    """單個 Anchor 的發送協程：突發模式連續提交 burst 條，否則按間隔發送；確認 Future 交給 track 登記"""
+    key = (gateway_id, anchor["id"])
+    count = 0
+    next_due = time.monotonic()
+    while not args.burst or count < args.burst:
+        payload = encode_anchor_message(gateway_id, anchor, serials[key])
+        serials[key] += 1
+        track(await publisher.submit(topic, payload, args.qos))
+        count += 1
+        if not args.burst:
+            next_due += args.interval
+            await asyncio.sleep(max(0.0, next_due - time.monotonic()))
+
+def confirmation_tracker():
+    """
+    返回 (在途確認集合, 登記函數)：Future 完成時經回調從集合移除（O(1)，不再逐週期重建列表），
+    失敗的確認輸出錯誤；同一錯誤只在第 1 次與每第 100 次輸出，斷線期間不會逐條刷屏
+    """
+    pending = set()
+    failures = {}
+
+    def done(future):
+        pending.discard(future)
+        if future.cancelled() or future.exception() is None:
+            return
+        error = str(future.exception())
+        failures[error] = count = failures.get(error, 0) + 1
+        if count == 1 or count % 100 == 0:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 確認失敗: {error}（第 {count} 次）")
+
+    def track(future):
+        pending.add(future)
+        future.add_done_callback(done)
+
+    return pending, track
+
+async def save_state_periodically(snapshot, interval):
+    """asyncio 模式下定期寫入序列號快照（在事件迴圈內執行，與發送協程不會交錯）"""
+    while True:
+        await asyncio.sleep(interval)
+        snapshot.save()
+
+async def report_async_stats(publisher, started_at, interval):
+    """定期輸出發送統計"""
+    while True:
+        await asyncio.sleep(interval)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+              f"{format_stats(publisher.snapshot(), time.monotonic() - started_at)}, "
+              f"在途 {publisher.in_flight}")
+
+async def run_async_transmitter(args):
+    """單事件迴圈驅動所有 Anchor，每個 Anchor 獨立維護序列號"""
+    gateways = load_scenario_gateways(args)
+    config = broker_config(args)
+    publisher = AsyncPublisher(create_client(config, f"anchor-tx-async-{int(time.time())}"),
+                               window=args.window)
+    await publisher.connect(config["broker"], config["port"])
+
+    shard = build_gateway_shards(args.gateways, args.anchors, 1, args.interval, gateways)[0]
+    serials = {(gw["gateway_id"], anchor["id"]): serial_counter
+               for gw in shard["gateways"] for anchor in gw["anchors"]}
+    # 突發模式每個 Anchor 最多發出 burst 條
+    restore_serials(args.state_file, serials,
+                    ahead=args.burst or serials_ahead(args.state_interval, args.interval))
+    snapshot = (PeriodicSnapshot(args.state_file, lambda: transmitter_state(serials), args.state_interval)
+                if args.state_file else None)
+    mode = f"突發 {args.burst} 條/Anchor" if args.burst else f"每 {args.interval} 秒"
+    print(f"asyncio 模式: {args.gateways} 個 Gateway, {len(serials)} 個 Anchor, {mode}, "
+          f"QoS {args.qos}, 在途視窗 {args.window}, 代理 {config['broker']}:{config['port']}")
+
+    started_at = time.monotonic()
+    confirmations, track = confirmation_tracker()
+    reporter = asyncio.ensure_future(report_async_stats(publisher, started_at, args.report_interval))
+    saver = asyncio.ensure_future(save_state_periodically(snapshot, args.state_interval)) if snapshot else None
+    try:
+        await asyncio.gather(*(
+            run_anchor_async(publisher, dwlink_topic(gw["gateway_id"]), gw["gateway_id"], anchor,
+                             serials, args, track)
+            for gw in shard["gateways"] for anchor in gw["anchors"]))
+        await asyncio.gather(*confirmations, return_exceptions=True)
+    finally:
+        reporter.cancel()
+        if snapshot:
+            saver.cancel()
+            snapshot.save(final=True)
+        elapsed = time.monotonic() - started_at
+        stats = publisher.snapshot()
+        await publisher.disconnect()
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {format_stats(stats, elapsed)}")
+        print(f"確認延遲 p50 {latency_percentile(stats, 50):.0f} ms / "
+              f"p95 {latency_percentile(stats, 95):.0f} ms / "
+              f"p99 {latency_percentile(stats, 99):.0f} ms, 最大在途 {stats['max_in_flight']}")
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="UWB Anchor 配置訊息發送程式")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="發送池進程數，0 表示單連接模式")
+    parser.add_argument("--gateways", type=int, default=1, help="發送池模擬的 Gateway 數量")
+    parser.add_argument("--anchors", type=int, default=1, help="每個 Gateway 的 Anchor 數量")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="每個 Anchor 的發送間隔（秒）")
+    parser.add_argument("--local", action="store_true",
+                        help="連接本地 mosquitto (localhost:1883, 無 TLS)")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+                        help="發送池統計回報間隔（秒）")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="以單個 asyncio 事件迴圈驅動所有 Anchor")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2), help="asyncio 模式發布 QoS")
+    parser.add_argument("--window", type=int, default=100,
+                        help="asyncio 模式在途（未確認）訊息上限")
+    parser.add_argument("--burst", type=int, default=0,
+                        help="asyncio 模式每個 Anchor 連續發送的訊息數，0 表示按間隔持續發送")
+    parser.add_argument("--scenario", default=None,
+                        help="場景文件 (YAML/JSON) 或 test-data 目錄，以其中的 Gateway 與 Anchor 取代 --gateways / --anchors")
+    parser.add_argument("--state-file", default=None,
+                        help="序列號快照文件：啟動時恢復，運行中定期寫入，發送池模式下每個進程使用 <文件>.<序號>")
+    parser.add_argument("--state-interval", type=float, default=STATE_INTERVAL,
+                        help="序列號快照寫入間隔（秒）")
+    parser.add_argument("--spool", default=None,
+                        help="斷線期間寫入的 spool 文件，重新連接後限速補發，發送池模式下每個進程使用 <文件>.<序號>"
+                             "（asyncio 模式不使用，其在途窗口已限制積壓）")
+    parser.add_argument("--spool-max-mb", type=float, default=64,
+                        help="spool 積壓上限 (MB)，超出時丟棄最舊的訊息")
+    parser.add_argument("--spool-max-age", type=float, default=DEFAULT_MAX_AGE,
+                        help="spool 訊息最長保留時間（秒），0 表示不限")
+    parser.add_argument("--spool-rate", type=float, default=DEFAULT_DRAIN_RATE,
+                        help="重新連接後的補發速率 (msg/s)")
+    parser.add_argument("--codec", default=CODEC_JSON, choices=CODECS,
+                        help="負載編碼：json（默認）或 msgpack / cbor（需要對應套件，接收端 anchor_recieve 自動識別）")
+    return parser.parse_args()
+
 def main():
     """主程式"""
-    global serial_counter
+    global serial_counter, MQTT_TOPIC, spool, PAYLOAD_CODEC
+
+    args = parse_args()
+    if not codec_available(args.codec):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {args.codec} 編碼需要安裝 "
+              f"{'msgpack' if args.codec == 'msgpack' else 'cbor2'}")
+        return
+    PAYLOAD_CODEC = args.codec
+    if args.use_async:
+        try:
+            asyncio.run(run_async_transmitter(args))
+        except KeyboardInterrupt:
+            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式被用戶中斷")
+        return
+    if args.workers > 0:
+        run_publisher_pool(args)
+        return
+
+    # 單連接模式只發送場景中第一個 Gateway 的第一個 Anchor（連接設置不變）
+    gateway_id, anchor = DEFAULT_GATEWAY_ID, DEFAULT_ANCHOR
+    if args.scenario:
+        gateway = load_scenario_gateways(args)[0]
+        gateway_id, anchor = gateway["gateway_id"], gateway["anchors"][0]
+        MQTT_TOPIC = dwlink_topic(gateway_id)
+
+    # 單連接模式每秒發送一條
+    restore_serials(args.state_file, ahead=serials_ahead(args.state_interval, 1.0))
+    snapshot = (PeriodicSnapshot(args.state_file, transmitter_state, args.state_interval)
+                if args.state_file else None)
 
     print("UWB 雲端 MQTT 自動循環發送程式")
     print(f"雲端 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
@@ -125,6 +586,7 @@ def main():
 
     # 創建 MQTT 客戶端
     client = mqtt.Client()
+    drainer = None
 
     # 設置回調函數
     client.on_connect = on_connect
@@ -149,13 +611,19 @@ def main():
         # 等待連接建立
         time.sleep(2)
 
+        if args.spool:
+            spool = open_spool(args.spool, args.spool_max_mb, args.spool_max_age)
+            drainer = SpoolDrainer(spool, client.publish, client.is_connected, args.spool_rate).start()
+
         print("開始自動發送訊息...")
 
         # 自動循環發送
         while True:
             try:
                 # 發送訊息
-                send_message(client)
+                send_message(client, gateway_id, anchor)
+                if snapshot:
+                    snapshot.maybe_save()
 
                 # 等待1秒
                 time.sleep(1)
@@ -170,7 +638,14 @@ def main():
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 發生錯誤: {e}")
     finally:
+        if drainer:
+            drainer.stop()
+            spool.close()
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] spool 剩餘 {len(spool)} 條未補發，下次啟動後補發")
         client.disconnect()
+        if snapshot:
+            snapshot.save(final=True)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 序列號已保存到 {args.state_file}")
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式結束")
         print(f"最後發送的序列號: {serial_counter - 1}")
 
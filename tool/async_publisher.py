@@ -0,0 +1,171 @@
+"""
+asyncio MQTT 發送端
+把 paho Client 的 socket 交給 asyncio 事件迴圈驅動（不另開網路執行緒），
+以在途視窗限制尚未確認的發布數量，每次發布返回可等待的確認 Future，
+並統計 publish -> PUBACK/PUBCOMP 的延遲
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+import paho.mqtt.client as mqtt
+
+from publisher_pool import new_stats, record_latency
+
+
+class AsyncPublisher:
+    """
+    單事件迴圈的 MQTT 發送端
+
+    所有 paho 回調都在事件迴圈執行緒內觸發，因此不需要額外的鎖；
+    submit() 在取得在途視窗名額後發出訊息並立即返回確認 Future，
+    呼叫方可連續提交以形成管線，再統一等待確認
+    """
+
+    def __init__(self, client: mqtt.Client, window: int = 100):
+        """
+        Args:
+            client: 未連接的 paho Client（可用 publisher_pool.create_client 建立）
+            window: 同時在途（已發出未確認）的訊息上限
+        """
+        if window <= 0:
+            raise ValueError("window 必須大於 0")
+        self.client = client
+        self.window = window
+        self.stats = new_stats()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending: Dict[int, tuple] = {}
+        self._connected: Optional[asyncio.Future] = None
+        self._misc_task: Optional[asyncio.Task] = None
+
+        # paho 自身的在途上限與視窗一致，佇列不設限，流量由視窗控制
+        client.max_inflight_messages_set(window)
+        client.max_queued_messages_set(0)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # ---- socket 與事件迴圈的銜接 ----
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        if self._misc_task:
+            self._misc_task.cancel()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """處理 keepalive 與重傳計時"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    # ---- paho 回調 ----
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if self._connected and not self._connected.done():
+            if rc == 0:
+                self._connected.set_result(True)
+            else:
+                self._connected.set_exception(ConnectionError(f"連接失敗，返回碼: {rc}"))
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.stats["connected"] = False
+        if rc != 0:
+            self.stats["reconnects"] += 1
+        # 斷線後不再有確認，讓所有等待方收到錯誤並歸還視窗名額
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"與 MQTT 代理斷開連接，返回碼: {rc}"))
+            self._release()
+        self.stats["failed"] += len(pending)
+
+    def _on_publish(self, client, userdata, mid, *args):
+        entry = self._pending.pop(mid, None)
+        if entry is None:
+            return
+        future, sent_at = entry
+        latency_ms = (time.perf_counter() - sent_at) * 1000.0
+        record_latency(self.stats, latency_ms)
+        self._release()
+        if not future.done():
+            future.set_result(latency_ms)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    # ---- 公開介面 ----
+
+    async def connect(self, host: str, port: int, keepalive: int = 60):
+        """連接代理並等待 CONNACK"""
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.window)
+        self._connected = self._loop.create_future()
+        self.client.connect(host, port, keepalive)
+        await self._connected
+        self.stats["connected"] = True
+
+    async def submit(self, topic: str, payload, qos: int = 1, retain: bool = False) -> asyncio.Future:
+        """
+        等待在途視窗名額後發出訊息
+
+        Returns:
+            確認 Future，結果為 publish 到確認的延遲（毫秒）；
+            QoS 0 在訊息寫入 socket 後即視為確認
+        """
+        await self._slots.acquire()
+        future = self._loop.create_future()
+        sent_at = time.perf_counter()
+        result = self.client.publish(topic, payload, qos, retain)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._slots.release()
+            self.stats["failed"] += 1
+            future.set_exception(ConnectionError(f"發送失敗，錯誤碼: {result.rc}"))
+            return future
+
+        self.stats["sent"] += 1
+        self._pending[result.mid] = (future, sent_at)
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+        return future
+
+    async def publish(self, topic: str, payload, qos: int = 1, retain: bool = False) -> float:
+        """發布並等待確認，返回延遲（毫秒）"""
+        return await (await self.submit(topic, payload, qos, retain))
+
+    async def drain(self):
+        """等待所有在途訊息確認（或失敗）"""
+        futures = [future for future, _ in self._pending.values()]
+        if futures:
+            await asyncio.gather(*futures, return_exceptions=True)
+
+    async def disconnect(self):
+        """等待在途訊息後斷開連接"""
+        await self.drain()
+        self.client.disconnect()
+
+    def snapshot(self) -> Dict:
+        """複製當前統計"""
+        snapshot = dict(self.stats)
+        snapshot["latency_buckets"] = list(self.stats["latency_buckets"])
+        snapshot["in_flight"] = self.in_flight
+        snapshot["max_in_flight"] = self.max_in_flight
+        return snapshot
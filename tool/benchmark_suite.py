@@ -0,0 +1,571 @@
+"""
+Python MQTT 工具基準測試套件
+以固定種子與抓包文件重現測量以下項目的速率（每秒操作數）：
+訊息產生（generate_heart_rate_data / generate_heart_rate_batch / create_anchor_message / create_anchor_payload）、
+抓包中每種訊息形狀（主題後綴 + content）的 JSON 編碼與解析、
+預編譯模板的 JSON / msgpack / CBOR 編碼（後兩者需已安裝）、
+接收端 on_message 原始路徑與高吞吐路徑的分派、
+抓包 location 訊息的電子圍欄更新（示例區域文件）、
+彙總存儲的批量寫入與 1 天範圍查詢、
+離線分析的逐行統計與分塊結果合併、
+以及經過本地代理的端到端 發布 -> 接收 吞吐量
+
+結果寫成 JSON，可指定上一次的結果作為基準，速率下降超過閾值時返回非零退出碼
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_CAPTURE = os.path.join(ROOT_DIR, "test-data", "mqtt_messages.json")
+MOSQUITTO_CONF = os.path.join(ROOT_DIR, "mosquitto.conf")
+ZONES_FILE = os.path.join(ROOT_DIR, "tool", "scenarios", "zones.yaml")
+
+# 模擬器位於專案根目錄
+sys.path.insert(0, ROOT_DIR)
+
+import anchor_recieve
+import anchor_trasmitt
+import mqtt_heart_rate_simulator as simulator
+from geofence import load_geofence
+from capture_analyzer import CaptureStats
+from payload_codec import CODEC_JSON, PayloadTemplate, available_codecs, decode_payload, sample_shapes
+from replay_capture import iter_capture
+from rollup_store import RollupStore
+
+# 可選的 orjson 編解碼對比
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 每個測量項目的輪數與每輪最短時間（秒），取最佳輪的速率
+DEFAULT_ROUNDS = 5
+DEFAULT_MIN_TIME = 0.2
+# 默認回歸閾值：速率低於基準的 (1 - 閾值) 視為回歸
+DEFAULT_THRESHOLD = 0.15
+# 項目名稱前綴 -> 所屬項目組，用於判斷基準中的項目是否因 --only / --skip-e2e 而未執行
+RESULT_GROUPS = {"generate": "generation", "template": "codec", "json": "json", "orjson": "json",
+                 "dispatch": "dispatch", "geofence": "geofence", "rollup": "rollup", "capture": "capture",
+                 "e2e": "e2e"}
+# 本地 mosquitto 配置中不適用於臨時實例的指令（Windows 路徑的日誌與持久化）
+MOSQUITTO_SKIP_DIRECTIVES = ("listener", "protocol", "log_dest", "persistence",
+                             "persistence_location", "autosave_interval")
+
+
+def log(text: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {text}")
+
+
+def measure(func: Callable[[], int], rounds: int = DEFAULT_ROUNDS,
+            min_time: float = DEFAULT_MIN_TIME) -> Dict:
+    """
+    重複執行 func（返回本次完成的操作數）直到每輪至少 min_time 秒，共 rounds 輪
+
+    Returns:
+        {"rate": 最佳輪速率, "median": 中位數速率, "ops": 總操作數}
+    """
+    rates = []
+    total_ops = 0
+    for _ in range(rounds):
+        ops = 0
+        start = time.perf_counter()
+        while True:
+            ops += func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        rates.append(ops / elapsed)
+        total_ops += ops
+    return {"rate": max(rates), "median": statistics.median(rates), "ops": total_ops}
+
+
+# ---- 訊息產生 ----
+
+def bench_generation(rounds: int, min_time: float) -> Dict[str, Dict]:
+    random.seed(0)
+    results = {}
+
+    def heart_rate():
+        for i in range(1000):
+            simulator.generate_heart_rate_data("user001", 75)
+        return 1000
+    results["generate.heart_rate_data"] = measure(heart_rate, rounds, min_time)
+
+    rng = np.random.default_rng(0)
+    base_heart_rates = rng.integers(simulator.BASE_HEART_RATE_MIN,
+                                    simulator.BASE_HEART_RATE_MAX + 1, size=10000)
+    now = datetime(2026, 1, 1, 12, 0, 0)
+
+    def heart_rate_batch():
+        simulator.generate_heart_rate_batch(base_heart_rates, rng, now)
+        return len(base_heart_rates)
+    results["generate.heart_rate_batch"] = measure(heart_rate_batch, rounds, min_time)
+
+    def anchor_message():
+        for serial in range(1000):
+            anchor_trasmitt.create_anchor_message(serial=serial)
+        return 1000
+    results["generate.anchor_message"] = measure(anchor_message, rounds, min_time)
+
+    def anchor_payload():
+        for serial in range(1000):
+            anchor_trasmitt.create_anchor_payload(serial=serial)
+        return 1000
+    results["generate.anchor_payload"] = measure(anchor_payload, rounds, min_time)
+    return results
+
+
+def bench_codec(rounds: int, min_time: float) -> Dict[str, Dict]:
+    """各訊息形狀的預編譯模板編碼，以及已安裝時的 msgpack / CBOR 模板編碼與解析"""
+    results = {}
+    for shape, (template, values) in sample_shapes().items():
+        for codec in available_codecs():
+            compiled = PayloadTemplate(template, codec)
+            payload = compiled.encode(*values)
+
+            def encode(compiled=compiled):
+                for _ in range(1000):
+                    compiled.encode(*values)
+                return 1000
+            results[f"template.{codec}.encode[{shape}]"] = measure(encode, rounds, min_time)
+            if codec != CODEC_JSON:
+                def decode(payload=payload):
+                    for _ in range(1000):
+                        decode_payload(payload)
+                    return 1000
+                results[f"template.{codec}.decode[{shape}]"] = measure(decode, rounds, min_time)
+    return results
+
+
+# ---- JSON 編解碼 ----
+
+def payload_shapes(path: str) -> Dict[str, Dict]:
+    """抓包中每種訊息形狀（主題後綴/content）的第一條訊息"""
+    shapes = {}
+    for record in iter_capture(path):
+        suffix = anchor_recieve.resolve_topic(record["topic"])[1]
+        shape = f"{suffix}/{record['message'].get('content', '')}"
+        shapes.setdefault(shape, record["message"])
+    return shapes
+
+
+def bench_json(path: str, rounds: int, min_time: float) -> Dict[str, Dict]:
+    results = {}
+    for shape, message in sorted(payload_shapes(path).items()):
+        text = json.dumps(message, ensure_ascii=False)
+        payload = text.encode("utf-8")
+
+        def encode():
+            for _ in range(1000):
+                json.dumps(message, ensure_ascii=False).encode("utf-8")
+            return 1000
+
+        def decode():
+            for _ in range(1000):
+                json.loads(payload.decode("utf-8"))
+            return 1000
+        results[f"json.encode[{shape}]"] = measure(encode, rounds, min_time)
+        results[f"json.decode[{shape}]"] = measure(decode, rounds, min_time)
+
+        if orjson is not None:
+            def orjson_encode():
+                for _ in range(1000):
+                    orjson.dumps(message)
+                return 1000
+
+            def orjson_decode():
+                for _ in range(1000):
+                    orjson.loads(payload)
+                return 1000
+            results[f"orjson.encode[{shape}]"] = measure(orjson_encode, rounds, min_time)
+            results[f"orjson.decode[{shape}]"] = measure(orjson_decode, rounds, min_time)
+    return results
+
+
+# ---- 接收端分派 ----
+
+def bench_dispatch(path: str, rounds: int, min_time: float) -> Dict[str, Dict]:
+    messages = anchor_recieve.load_benchmark_messages(path)
+    results = {}
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        def legacy():
+            with contextlib.redirect_stdout(devnull):
+                for msg in messages:
+                    anchor_recieve.on_message(None, None, msg)
+            return len(messages)
+        results["dispatch.on_message"] = measure(legacy, rounds, min_time)
+
+        writer = anchor_recieve.CompactRecordWriter(
+            io.TextIOWrapper(open(os.devnull, "wb"), encoding="utf-8"))
+        userdata = {"writer": writer}
+
+        def fast():
+            for msg in messages:
+                anchor_recieve.on_message_fast(None, userdata, msg)
+            return len(messages)
+        results["dispatch.on_message_fast"] = measure(fast, rounds, min_time)
+        writer.flush()
+    return results
+
+
+# ---- 電子圍欄 ----
+
+def bench_geofence(path: str, rounds: int, min_time: float, tags: int = 100) -> Dict[str, Dict]:
+    """抓包中的 location 訊息複製為 tags 個 Tag（固定偏移），按時間順序更新示例區域文件的引擎"""
+    from replay_capture import parse_timestamp
+
+    rng = np.random.default_rng(0)
+    offsets = rng.normal(0.0, 0.5, (tags, 2)).round(2).tolist()
+    messages = []
+    for record in iter_capture(path):
+        message = record["message"]
+        if message.get("content") != "location":
+            continue
+        stamp = parse_timestamp(record["timestamp"])
+        position = message["position"]
+        for tag, (dx, dy) in enumerate(offsets):
+            copy = dict(message, id=message["id"] + tag)
+            copy["position"] = dict(position, x=position["x"] + dx, y=position["y"] + dy)
+            messages.append((copy, stamp))
+    if not messages:
+        raise ValueError("抓包中沒有 location 訊息")
+
+    results = {}
+    engine = load_geofence(ZONES_FILE)
+    grid = engine.grids[0]
+    points = [(message["position"]["x"], message["position"]["y"]) for message, _ in messages]
+
+    def classify():
+        for x, y in points:
+            grid.classify_point(x, y)
+        return len(points)
+    results["geofence.classify_point"] = measure(classify, rounds, min_time)
+
+    span = messages[-1][1] - messages[0][1] + 1.0
+    loops = [0]
+
+    def process():
+        shift = loops[0] * span
+        loops[0] += 1
+        for message, stamp in messages:
+            engine.process(message, stamp + shift)
+        return len(messages)
+    results["geofence.process"] = measure(process, rounds, min_time)
+    return results
+
+
+def bench_rollup(rounds: int, min_time: float, devices: int = 500) -> Dict[str, Dict]:
+    """devices 個設備每秒一條 hr / SpO2 / skin temp 讀數寫入臨時目錄的彙總存儲，再按 1 天範圍查詢"""
+    rng = np.random.default_rng(0)
+    fields = ("hr", "SpO2", "skin temp")
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        store = RollupStore(directory, initial_devices=devices)
+        rows = store.rows_for([f"R{i:05d}" for i in range(devices)])
+        values = rng.normal([75, 97, 36.6], [6, 1.2, 0.3], (devices, len(fields)))
+        clock = [float(int(time.time() // 86400 - 1) * 86400)]
+
+        def update():
+            for _ in range(60):
+                store.update(rows, values, clock[0], fields)
+                clock[0] += 1
+            store.flush()
+            return 60 * devices * len(fields)
+        results["rollup.update"] = measure(update, rounds, min_time)
+
+        keys = [f"R{i:05d}" for i in range(0, devices, 7)]
+
+        def query():
+            end = clock[0]
+            for key in keys:
+                store.query(key, "hr", end - 86400, end)
+            return len(keys)
+        results["rollup.query_1d"] = measure(query, rounds, min_time)
+        store.close()
+    return results
+
+
+# ---- 離線分析 ----
+
+def bench_capture(path: str, rounds: int, min_time: float, gateways: int = 20) -> Dict[str, Dict]:
+    """抓包記錄按 gateways 個 Gateway id 編成 NDJSON 行，測量逐行統計，以及與進程池相同的分塊結果反序列化 + 合併"""
+    lines = []
+    for record in iter_capture(path):
+        for k in range(gateways):
+            message = dict(record["message"])
+            if isinstance(message.get("gateway id"), int):
+                message["gateway id"] += k
+            lines.append(json.dumps(dict(record, message=message), ensure_ascii=False).encode("utf-8"))
+    results = {}
+
+    def add_line():
+        stats = CaptureStats()
+        for line in lines:
+            stats.add_line(line)
+        return len(lines)
+    results["capture.add_line"] = measure(add_line, rounds, min_time)
+
+    parts = []
+    for offset in range(0, len(lines), 500):
+        part = CaptureStats()
+        for line in lines[offset:offset + 500]:
+            part.add_line(line)
+        parts.append(pickle.dumps(part.compact()))
+
+    def merge():
+        total = CaptureStats()
+        for part in parts:
+            total.merge(pickle.loads(part))
+        return len(parts)
+    results["capture.merge"] = measure(merge, rounds, min_time)
+    return results
+
+
+# ---- 端到端 ----
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_mosquitto(conf_path: str = MOSQUITTO_CONF):
+    """
+    以專案 mosquitto.conf 為基礎啟動臨時 mosquitto，產出 (host, port)
+
+    保留連接數、封包大小與匿名設定，監聽改為空閒端口，
+    日誌與持久化（原配置為 Windows 路徑）改為臨時目錄
+    """
+    binary = shutil.which("mosquitto")
+    if binary is None:
+        raise RuntimeError("找不到 mosquitto 可執行文件")
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        lines = [f"listener {port} 127.0.0.1", "protocol mqtt",
+                 f"log_dest file {os.path.join(directory, 'mosquitto.log')}",
+                 "persistence false"]
+        with open(conf_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and line.split()[0] not in MOSQUITTO_SKIP_DIRECTIVES:
+                    lines.append(line)
+        conf = os.path.join(directory, "mosquitto.conf")
+        with open(conf, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        process = subprocess.Popen([binary, "-c", conf], stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), 0.2):
+                    break
+                time.sleep(0.05)
+            else:
+                raise RuntimeError("mosquitto 未能在 5 秒內啟動")
+            yield "127.0.0.1", port
+        finally:
+            process.terminate()
+            process.wait(5)
+
+
+def run_end_to_end(host: str, port: int, path: str, count: int, qos: int,
+                   timeout: float = 60.0) -> Dict:
+    """發布抓包訊息 count 條並等待訂閱端全部收到，返回 msg/s"""
+    records = [(record["topic"], json.dumps(record["message"], ensure_ascii=False).encode("utf-8"))
+               for record in iter_capture(path)]
+    received = 0
+    done = threading.Event()
+    subscribed = threading.Event()
+
+    def on_message(client, userdata, msg):
+        nonlocal received
+        received += 1
+        if received >= count:
+            done.set()
+
+    subscriber = mqtt.Client(client_id=f"bench-sub-{os.getpid()}")
+    subscriber.on_message = on_message
+    subscriber.on_subscribe = lambda *args: subscribed.set()
+    subscriber.connect(host, port)
+    subscriber.subscribe("UWB/#", qos)
+    subscriber.loop_start()
+
+    publisher = mqtt.Client(client_id=f"bench-pub-{os.getpid()}")
+    publisher.max_inflight_messages_set(1000)
+    publisher.max_queued_messages_set(0)
+    publisher.connect(host, port)
+    publisher.loop_start()
+    try:
+        if not subscribed.wait(5):
+            raise RuntimeError("訂閱逾時")
+        start = time.perf_counter()
+        for i in range(count):
+            topic, payload = records[i % len(records)]
+            publisher.publish(topic, payload, qos)
+        done.wait(timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        publisher.loop_stop()
+        publisher.disconnect()
+        subscriber.loop_stop()
+        subscriber.disconnect()
+    return {"rate": received / elapsed, "median": received / elapsed, "ops": received,
+            "lost": count - received}
+
+
+def bench_end_to_end(path: str, broker: Optional[str], count: int) -> Dict[str, Dict]:
+    results = {}
+
+    def run(host, port):
+        for qos in (0, 1):
+            results[f"e2e.publish_receive[qos{qos}]"] = run_end_to_end(host, port, path, count, qos)
+
+    if broker:
+        host, _, port = broker.partition(":")
+        run(host, int(port or 1883))
+    else:
+        with local_mosquitto() as (host, port):
+            run(host, port)
+    return results
+
+
+# ---- 結果與回歸檢查 ----
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float,
+            not_run: Sequence[str] = ()) -> Tuple[List[str], List[str]]:
+    """
+    對比基準，返回 (回歸, 略過)：速率低於基準 (1 - threshold) 的項目與基準中有、本次沒有結果的項目算作回歸，
+    屬於 not_run 中項目組（本次未要求執行）的缺失項目列為略過
+    """
+    regressions = []
+    skipped = []
+    for name, previous in baseline.items():
+        if not previous or not previous.get("rate"):
+            continue
+        result = results.get(name)
+        if result is None:
+            if RESULT_GROUPS.get(name.split(".", 1)[0].split("[", 1)[0]) in not_run:
+                skipped.append(f"{name}: 未執行")
+            else:
+                regressions.append(f"{name}: 本次沒有結果，基準 {previous['rate']:,.0f}/s")
+            continue
+        ratio = result["rate"] / previous["rate"]
+        result["baseline"] = previous["rate"]
+        result["ratio"] = round(ratio, 3)
+        if ratio < 1.0 - threshold:
+            regressions.append(f"{name}: {result['rate']:,.0f}/s, 基準 {previous['rate']:,.0f}/s "
+                               f"({(ratio - 1) * 100:+.1f}%)")
+    return regressions, skipped
+
+
+def run_suite(args) -> int:
+    rounds = 2 if args.quick else args.rounds
+    min_time = 0.05 if args.quick else args.min_time
+    groups = [
+        ("generation", lambda: bench_generation(rounds, min_time)),
+        ("json", lambda: bench_json(args.capture, rounds, min_time)),
+        ("codec", lambda: bench_codec(rounds, min_time)),
+        ("dispatch", lambda: bench_dispatch(args.capture, rounds, min_time)),
+        ("geofence", lambda: bench_geofence(args.capture, rounds, min_time)),
+        ("rollup", lambda: bench_rollup(rounds, min_time)),
+        ("capture", lambda: bench_capture(args.capture, rounds, min_time)),
+        ("e2e", lambda: bench_end_to_end(args.capture, args.broker, args.e2e_count)),
+    ]
+    results: Dict[str, Dict] = {}
+    skipped = {}
+    not_run = []
+    for name, runner in groups:
+        if (args.only and name not in args.only) or (name == "e2e" and args.skip_e2e):
+            not_run.append(name)
+            continue
+        log(f"測量 {name} ...")
+        try:
+            results.update(runner())
+        except Exception as e:
+            skipped[name] = str(e)
+            log(f"略過 {name}: {e}")
+
+    regressions, not_compared = [], []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions, not_compared = compare(results, json.load(f)["results"], args.threshold, not_run)
+
+    width = max((len(name) for name in results), default=0)
+    for name, result in results.items():
+        line = f"  {name:<{width}}  {result['rate']:>14,.0f}/s  (中位數 {result['median']:,.0f}/s)"
+        if "ratio" in result:
+            line += f"  {(result['ratio'] - 1) * 100:+.1f}%"
+        print(line)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "decoder": anchor_recieve.DECODER_NAME,
+        "capture": os.path.relpath(args.capture, ROOT_DIR),
+        "rounds": rounds,
+        "min_time": min_time,
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        log(f"結果已寫入 {args.output}")
+
+    if not_compared:
+        log(f"基準中 {len(not_compared)} 項本次未執行，未對比:")
+        for line in not_compared:
+            print(f"  {line}")
+    if regressions:
+        log(f"{len(regressions)} 項速率低於基準超過 {args.threshold:.0%} 或本次沒有結果:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="Python MQTT 工具基準測試套件")
+    parser.add_argument("--capture", default=DEFAULT_CAPTURE, help="抓包文件路徑")
+    parser.add_argument("--output", default=None, help="結果 JSON 輸出路徑")
+    parser.add_argument("--baseline", default=None, help="作為基準的上一次結果 JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="回歸閾值，速率低於基準的此比例時返回非零退出碼")
+    parser.add_argument("--only", nargs="+", choices=["generation", "json", "codec", "dispatch", "geofence", "rollup", "capture", "e2e"],
+                        help="只執行指定的項目組")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="每個項目的輪數")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="每輪最短時間（秒）")
+    parser.add_argument("--quick", action="store_true", help="快速模式：減少輪數與每輪時間")
+    parser.add_argument("--broker", default=None, metavar="HOST[:PORT]",
+                        help="端到端測試使用已運行的代理，默認以 mosquitto.conf 啟動臨時 mosquitto")
+    parser.add_argument("--e2e-count", type=int, default=20000, help="端到端測試的訊息數量")
+    parser.add_argument("--skip-e2e", action="store_true", help="略過端到端測試")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(run_suite(parse_args()))
@@ -0,0 +1,856 @@
+"""
+MQTT 抓包離線分析工具
+把 NDJSON 抓包按換行對齊切成字節範圍分塊，交給進程池並行解析，一次掃描得到每個 Gateway / 設備的統計：
+- 訊息速率，Tag 定位速率與 TagConf 宣告的 nominal / stationary udr(hz) 對比
+- serial no（每個 Gateway 所有訊息共用）與 mssg idx（尿布感測器）的缺號（丟包）與重複投遞
+- 設備時間（time / current，或模擬器的 epoch 毫秒 timestamp）與接收時間 timestamp 的偏差
+- 定位 position.quality 分佈
+
+每個分塊產生可合併的部分結果：序號按接收順序在回退處（重啟/回繞）切成多段，每段以有序不相交區間加重複次數表示，
+偏差以計數 / 均值 / 二階中心矩表示，quality 以固定分桶表示；父進程按完成順序合併，結果與分塊方式無關。
+頂層 JSON 陣列（如 test-data/mqtt_messages.json）無法按字節切分，以單進程增量解析，
+可先用 --to-ndjson 轉換（同時可按虛擬 Gateway / 循環放大並模擬丟包與重複，用於基準測試）
+"""
+
+import argparse
+import calendar
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from replay_capture import DEFAULT_CAPTURE, GatewayRewriter, gateway_prefix, iter_capture, parse_timestamp
+
+# 可用時使用 orjson 直接解析 bytes，否則退回標準庫
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(record):
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# 默認分塊大小（MB）；小文件按進程數細分，保證每個進程都有多個分塊
+DEFAULT_CHUNK_MB = 64
+MIN_CHUNK_SIZE = 1024 * 1024
+CHUNKS_PER_WORKER = 4
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+# 序號回退或前向跳躍超過此值視為設備重啟或計數器回繞，不計入丟包或重複；
+# 同一閾值決定重啟判定，計數器在重啟前低於此值時重啟後的序號仍會被算作重複
+DEFAULT_MAX_GAP = 500
+# quality 分桶：0-9, 10-19, ..., 90-99, 100 以上
+QUALITY_BINS = 11
+QUALITY_LABELS = [f"{low}-{low + 9}" for low in range(0, 100, 10)] + ["100"]
+# 自動推斷時區時的取整單位（秒）
+CLOCK_OFFSET_STEP = 900
+# 時間字串解析快取的上限，超過時清空
+CLOCK_CACHE_LIMIT = 100000
+
+_receive_cache: Dict[str, float] = {}
+_device_cache: Dict[str, float] = {}
+
+
+def receive_time(value) -> Optional[float]:
+    """抓包記錄的接收時間（ISO 字串，如 2026-02-27T16:37:00.169Z，或 epoch 數字）轉為 epoch 秒"""
+    if isinstance(value, str):
+        second = value[:19]
+        rest = value[19:]
+        if rest.endswith("Z") and (len(rest) == 1 or rest[0] == "."):
+            base = _receive_cache.get(second)
+            if base is None:
+                try:
+                    base = calendar.timegm(time.strptime(second, "%Y-%m-%dT%H:%M:%S"))
+                except ValueError:
+                    return None
+                if len(_receive_cache) >= CLOCK_CACHE_LIMIT:
+                    _receive_cache.clear()
+                _receive_cache[second] = base
+            return base + float(rest[:-1]) if len(rest) > 2 else base
+        try:
+            return parse_timestamp(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)):
+        return value / 1000.0 if value > 1e11 else float(value)
+    return None
+
+
+def device_clock(value: str) -> Optional[float]:
+    """
+    Gateway 本地時間字串（2026-059 00:36:58.80，或模擬器的 2026-02-28 00:36:58）
+    按 UTC 解讀為 epoch 秒，實際時區在彙總時由偏差推斷
+    """
+    if value[8:9] == " ":
+        second, fmt = value[:17], "%Y-%j %H:%M:%S"
+    else:
+        second, fmt = value[:19], "%Y-%m-%d %H:%M:%S"
+    base = _device_cache.get(second)
+    if base is None:
+        try:
+            base = calendar.timegm(time.strptime(second, fmt))
+        except ValueError:
+            return None
+        if len(_device_cache) >= CLOCK_CACHE_LIMIT:
+            _device_cache.clear()
+        _device_cache[second] = base
+    rest = value[len(second):]
+    if rest:
+        try:
+            return base + float(rest)
+        except ValueError:
+            return None
+    return base
+
+
+def merge_runs(run_lists: List[List[List[int]]]) -> Tuple[List[List[int]], int]:
+    """合併多組有序不相交區間，返回 (合併後的區間, 重疊的序號數)"""
+    merged = []
+    overlap = 0
+    for start, end in sorted(run for runs in run_lists for run in runs):
+        if merged and start <= merged[-1][1] + 1:
+            last = merged[-1]
+            if start <= last[1]:
+                overlap += min(end, last[1]) - start + 1
+            if end > last[1]:
+                last[1] = end
+        else:
+            merged.append([start, end])
+    return merged, overlap
+
+
+class SequenceEpoch:
+    """計數器的一段連續生命週期：首個序號、最大序號、首尾接收時間，以及序號的區間集合與重複次數"""
+
+    def __init__(self, value: int, received: float):
+        self.first = self.high = value
+        self.first_time = self.last_time = received
+        self.runs: List[List[int]] = []
+        self.duplicates = 0
+        self.pending = array("q", [value])
+
+    def compact(self):
+        if not self.pending:
+            return
+        values = sorted(self.pending)
+        self.pending = array("q")
+        runs = []
+        start = end = values[0]
+        duplicates = 0
+        for value in values[1:]:
+            if value == end:
+                duplicates += 1
+            elif value == end + 1:
+                end = value
+            else:
+                runs.append([start, end])
+                start = end = value
+        runs.append([start, end])
+        self.runs, overlap = merge_runs([self.runs, runs])
+        self.duplicates += duplicates + overlap
+
+
+class SequenceStats:
+    """
+    序號的可合併摘要
+
+    按接收順序把序號流切成多個 epoch：序號比當前 epoch 的最大值回退超過 max_gap 時
+    （Gateway 重啟或計數器回繞）開始新的 epoch。每個 epoch 內以有序不相交區間 [start, end]
+    加重複次數表示，因此重啟後的第二輪既不會被算成重複，其中的丟包也不會被第一輪的序號掩蓋。
+    分塊之間只拼接 epoch 列表，summary() 時才按接收時間排序，
+    以同樣的規則把跨分塊邊界的 epoch 接回一起，結果與分塊方式及合併順序無關
+    """
+
+    def __init__(self, max_gap: int = DEFAULT_MAX_GAP):
+        self.max_gap = max_gap
+        self.epochs: List[SequenceEpoch] = []
+        self.current: Optional[SequenceEpoch] = None
+
+    def add(self, value: int, received: float):
+        epoch = self.current
+        if epoch is None or value < epoch.high - self.max_gap:
+            self.current = SequenceEpoch(value, received)
+            self.epochs.append(self.current)
+            return
+        epoch.pending.append(value)
+        if value > epoch.high:
+            epoch.high = value
+        if received > epoch.last_time:
+            epoch.last_time = received
+
+    def compact(self):
+        for epoch in self.epochs:
+            epoch.compact()
+
+    def merge(self, other: "SequenceStats"):
+        other.compact()
+        self.epochs.extend(other.epochs)
+        self.current = None
+
+    def _lifetimes(self) -> List[List[SequenceEpoch]]:
+        """按接收時間把 epoch 分組，每組為計數器的一段生命週期"""
+        groups = []
+        high = None
+        for epoch in sorted(self.epochs, key=lambda item: (item.first_time, item.last_time)):
+            if groups and epoch.first >= high - self.max_gap:
+                groups[-1].append(epoch)
+                high = max(high, epoch.high)
+            else:
+                groups.append([epoch])
+                high = epoch.high
+        return groups
+
+    def summary(self) -> Optional[Dict]:
+        """
+        每段生命週期內缺口不超過 max_gap 的計為丟包，更大的前向跳躍計為重啟/回繞；
+        生命週期之間的序號回退同樣計為重啟/回繞
+        """
+        self.compact()
+        if not self.epochs:
+            return None
+        lifetimes = self._lifetimes()
+        unique = duplicates = missing = gaps = largest = 0
+        resets = len(lifetimes) - 1
+        for group in lifetimes:
+            runs, overlap = merge_runs([epoch.runs for epoch in group])
+            duplicates += overlap + sum(epoch.duplicates for epoch in group)
+            unique += sum(end - start + 1 for start, end in runs)
+            for (_, previous_end), (start, _) in zip(runs, runs[1:]):
+                gap = start - previous_end - 1
+                if gap > self.max_gap:
+                    resets += 1
+                    continue
+                missing += gap
+                gaps += 1
+                largest = max(largest, gap)
+        return {
+            "first": lifetimes[0][0].first,
+            "last": max(epoch.high for epoch in lifetimes[-1]),
+            "unique": unique,
+            "duplicates": duplicates,
+            "missing": missing,
+            "loss": missing / (unique + missing),
+            "gaps": gaps,
+            "max_gap": largest,
+            "resets": resets
+        }
+
+
+class MomentStats:
+    """計數 / 均值 / 二階中心矩 / 最小 / 最大值，按 Chan 等人的並行公式合併，大偏移量下仍數值穩定"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: "MomentStats"):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def summary(self, shift: float = 0.0) -> Optional[Dict]:
+        """各統計量減去 shift（標準差不受影響）"""
+        if not self.count:
+            return None
+        return {
+            "count": self.count,
+            "mean": round(self.mean - shift, 3),
+            "std": round(math.sqrt(self.m2 / self.count), 3),
+            "min": round(self.minimum - shift, 3),
+            "max": round(self.maximum - shift, 3)
+        }
+
+
+class StreamStats:
+    """單個 Gateway 或設備的訊息流統計，所有欄位均可合併"""
+
+    def __init__(self, max_gap: int = DEFAULT_MAX_GAP):
+        self.count = 0
+        self.first = math.inf
+        self.last = -math.inf
+        self.contents: Dict[str, int] = {}
+        self.sequence = SequenceStats(max_gap)
+        # 本地時間字串（按 UTC 解讀）與 epoch 時間戳分開累計，前者在彙總時扣除時區
+        self.local_skew = MomentStats()
+        self.epoch_skew = MomentStats()
+        self.quality = [0] * QUALITY_BINS
+        self.quality_total = 0.0
+        self.locations = 0
+        self.location_first = math.inf
+        self.location_last = -math.inf
+        self.nominal_udr = None
+        self.stationary_udr = None
+        self.config_time = -math.inf
+
+    def merge(self, other: "StreamStats"):
+        self.count += other.count
+        self.first = min(self.first, other.first)
+        self.last = max(self.last, other.last)
+        for content, count in other.contents.items():
+            self.contents[content] = self.contents.get(content, 0) + count
+        self.sequence.merge(other.sequence)
+        self.local_skew.merge(other.local_skew)
+        self.epoch_skew.merge(other.epoch_skew)
+        self.quality = [a + b for a, b in zip(self.quality, other.quality)]
+        self.quality_total += other.quality_total
+        self.locations += other.locations
+        self.location_first = min(self.location_first, other.location_first)
+        self.location_last = max(self.location_last, other.location_last)
+        # 宣告的 udr 取接收時間最晚的 TagConf
+        if other.config_time > self.config_time:
+            self.nominal_udr = other.nominal_udr
+            self.stationary_udr = other.stationary_udr
+            self.config_time = other.config_time
+
+    def rate(self) -> Optional[float]:
+        span = self.last - self.first
+        return (self.count - 1) / span if self.count > 1 and span > 0 else None
+
+    def location_rate(self) -> Optional[float]:
+        span = self.location_last - self.location_first
+        return (self.locations - 1) / span if self.locations > 1 and span > 0 else None
+
+    def quality_summary(self) -> Optional[Dict]:
+        count = sum(self.quality)
+        if not count:
+            return None
+        return {
+            "count": count,
+            "mean": round(self.quality_total / count, 2),
+            "histogram": {label: value for label, value in zip(QUALITY_LABELS, self.quality) if value}
+        }
+
+
+def device_key(message: Dict) -> Optional[Tuple[str, object]]:
+    """訊息所屬設備：(TAG / ANCHOR, id)、(BLE, MAC) 或模擬器的 (USER, id)；Gateway 自身的訊息返回 None"""
+    node = message.get("node")
+    if node == "GW":
+        return None
+    if node and "id" in message:
+        return node, message["id"]
+    mac = message.get("MAC")
+    if mac is not None:
+        return "BLE", mac
+    if "id" in message:
+        return "USER", message["id"]
+    return None
+
+
+class CaptureStats:
+    """整個抓包（或一個分塊）的統計：Gateway -> StreamStats 與 (Gateway, 設備類型, 設備 id) -> StreamStats"""
+
+    def __init__(self, max_gap: int = DEFAULT_MAX_GAP):
+        self.max_gap = max_gap
+        self.records = 0
+        self.errors = 0
+        self.bytes = 0
+        self.unattributed = 0
+        self.gateways: Dict[object, StreamStats] = {}
+        self.devices: Dict[tuple, StreamStats] = {}
+
+    def _stream(self, table: Dict, key) -> StreamStats:
+        stream = table.get(key)
+        if stream is None:
+            stream = table[key] = StreamStats(self.max_gap)
+        return stream
+
+    def add_line(self, line: bytes):
+        """解析一行 NDJSON（容許每行一條記錄的 JSON 陣列的括號與逗號）"""
+        line = line.strip(b" \t\r,[]")
+        if not line:
+            return
+        try:
+            record = _loads(line)
+        except ValueError:
+            self.records += 1
+            self.errors += 1
+            return
+        self.add(record)
+
+    def add(self, record: Dict):
+        self.records += 1
+        message = record.get("message") if isinstance(record, dict) else None
+        if not isinstance(message, dict):
+            self.errors += 1
+            return
+        gateway_id = message.get("gateway id", message.get("gateway_id"))
+        if gateway_id is None:
+            self.unattributed += 1
+            return
+        received = receive_time(record.get("timestamp"))
+        if received is None:
+            self.errors += 1
+            return
+
+        content = message.get("content") or message.get("type") or "?"
+        streams = [self._stream(self.gateways, gateway_id)]
+        device = device_key(message)
+        if device is not None:
+            streams.append(self._stream(self.devices, (gateway_id, *device)))
+
+        local_skew = epoch_skew = None
+        stamp = message.get("timestamp")
+        if isinstance(stamp, (int, float)) and stamp > 1e11:
+            epoch_skew = stamp / 1000.0 - received
+        else:
+            clock = message.get("time") or message.get("current")
+            if isinstance(clock, str):
+                local = device_clock(clock)
+                if local is not None:
+                    local_skew = local - received
+
+        quality = None
+        if content == "location":
+            position = message.get("position")
+            if isinstance(position, dict):
+                quality = position.get("quality")
+                if not isinstance(quality, (int, float)):
+                    quality = None
+
+        for stream in streams:
+            stream.count += 1
+            if received < stream.first:
+                stream.first = received
+            if received > stream.last:
+                stream.last = received
+            stream.contents[content] = stream.contents.get(content, 0) + 1
+            if local_skew is not None:
+                stream.local_skew.add(local_skew)
+            elif epoch_skew is not None:
+                stream.epoch_skew.add(epoch_skew)
+            if quality is not None:
+                stream.quality[min(max(int(quality) // 10, 0), QUALITY_BINS - 1)] += 1
+                stream.quality_total += quality
+
+        gateway = streams[0]
+        serial = message.get("serial no")
+        if isinstance(serial, int):
+            gateway.sequence.add(serial, received)
+        if device is None:
+            return
+        stream = streams[1]
+        index = message.get("mssg idx")
+        if isinstance(index, int):
+            stream.sequence.add(index, received)
+        if content == "location":
+            stream.locations += 1
+            if received < stream.location_first:
+                stream.location_first = received
+            if received > stream.location_last:
+                stream.location_last = received
+        elif "nominal udr(hz)" in message and received >= stream.config_time:
+            stream.nominal_udr = message.get("nominal udr(hz)")
+            stream.stationary_udr = message.get("stationary udr(hz)")
+            stream.config_time = received
+
+    def compact(self):
+        """把各序號的原始值壓縮為區間，分塊結果送回父進程前呼叫"""
+        for table in (self.gateways, self.devices):
+            for stream in table.values():
+                stream.sequence.compact()
+        return self
+
+    def merge(self, other: "CaptureStats"):
+        self.records += other.records
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.unattributed += other.unattributed
+        for table, parts in ((self.gateways, other.gateways), (self.devices, other.devices)):
+            for key, part in parts.items():
+                stream = table.get(key)
+                if stream is None:
+                    table[key] = part
+                else:
+                    stream.merge(part)
+        return self
+
+
+def capture_format(path: str) -> str:
+    """返回 "ndjson"（每行一條記錄，可按字節切分）或 "array"（多行排版的 JSON 陣列）"""
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024).lstrip()
+    if not head.startswith(b"["):
+        return "ndjson"
+    first_line = head[1:].lstrip().split(b"\n", 1)[0].strip(b" \t\r,[]")
+    try:
+        return "ndjson" if isinstance(_loads(first_line), dict) else "array"
+    except ValueError:
+        return "array"
+
+
+def split_ranges(path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """把文件切成約 chunk_size 字節的範圍，每個範圍都從行首開始"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        position = chunk_size
+        while position < size:
+            f.seek(position)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            bounds.append(position)
+            position += chunk_size
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def analyze_range(task: Tuple[str, int, int, int]) -> CaptureStats:
+    """工作進程：解析文件 [start, end) 範圍內的行"""
+    path, start, end, max_gap = task
+    stats = CaptureStats(max_gap)
+    add_line = stats.add_line
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        tail = b""
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            lines = (tail + block).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                add_line(line)
+        if tail:
+            add_line(tail)
+    stats.bytes = end - start
+    return stats.compact()
+
+
+def analyze(path: str, workers: int = 1, chunk_mb: float = DEFAULT_CHUNK_MB,
+            max_gap: int = DEFAULT_MAX_GAP, report_interval: float = 5.0) -> CaptureStats:
+    """
+    分析抓包文件
+
+    NDJSON 按字節範圍分塊，workers > 1 時以進程池並行解析並按完成順序合併；
+    多行排版的 JSON 陣列以單進程增量解析；序號回退超過 max_gap 視為重啟/回繞
+    """
+    size = os.path.getsize(path)
+    if capture_format(path) == "array":
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 抓包為多行 JSON 陣列，以單進程解析"
+              f"（可先用 --to-ndjson 轉換以並行分析）")
+        stats = CaptureStats(max_gap)
+        for record in iter_capture(path):
+            stats.add(record)
+        stats.bytes = size
+        return stats.compact()
+
+    workers = max(1, workers)
+    chunk_size = max(MIN_CHUNK_SIZE, min(int(chunk_mb * 1024 * 1024),
+                                         -(-size // (workers * CHUNKS_PER_WORKER))))
+    tasks = [(path, start, end, max_gap) for start, end in split_ranges(path, chunk_size)]
+    total = CaptureStats(max_gap)
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = mp.Pool(min(workers, len(tasks)))
+        results = pool.imap_unordered(analyze_range, tasks)
+    else:
+        results = map(analyze_range, tasks)
+
+    started = time.perf_counter()
+    last_report = started
+    try:
+        for done, part in enumerate(results, 1):
+            total.merge(part)
+            now = time.perf_counter()
+            if report_interval and now - last_report >= report_interval:
+                last_report = now
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已分析 {done}/{len(tasks)} 塊, "
+                      f"{total.bytes / 1e6:.0f} MB, {total.records / (now - started):.0f} 條/秒")
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    return total
+
+
+def clock_offset(stream: StreamStats, offset_hours: Optional[float]) -> Optional[float]:
+    """Gateway 本地時間相對 UTC 的偏移（秒）：指定時直接使用，否則按平均偏差取整到 15 分鐘"""
+    if offset_hours is not None:
+        return offset_hours * 3600.0
+    if not stream.local_skew.count:
+        return None
+    return round(stream.local_skew.mean / CLOCK_OFFSET_STEP) * CLOCK_OFFSET_STEP
+
+
+def _skew(stream: StreamStats, offset: Optional[float]) -> Optional[Dict]:
+    if stream.epoch_skew.count:
+        return stream.epoch_skew.summary()
+    if stream.local_skew.count and offset is not None:
+        return stream.local_skew.summary(offset)
+    return None
+
+
+def _ratio(value: Optional[float], reference) -> Optional[float]:
+    if value is None or not isinstance(reference, (int, float)) or reference <= 0:
+        return None
+    return round(value / reference, 3)
+
+
+def _round(value: Optional[float], digits: int = 4) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+
+def build_report(stats: CaptureStats, offset_hours: Optional[float] = None) -> Dict:
+    """把合併後的統計整理為可 JSON 序列化的報告"""
+    gateways = []
+    offsets = {}
+    for gateway_id, stream in sorted(stats.gateways.items(), key=lambda item: str(item[0])):
+        offset = offsets[gateway_id] = clock_offset(stream, offset_hours)
+        gateways.append({
+            "gateway id": gateway_id,
+            "prefix": gateway_prefix(gateway_id) if isinstance(gateway_id, int) else None,
+            "messages": stream.count,
+            "duration": round(stream.last - stream.first, 3),
+            "rate_hz": _round(stream.rate()),
+            "contents": dict(sorted(stream.contents.items(), key=lambda item: -item[1])),
+            "serial no": stream.sequence.summary(),
+            "clock_offset_hours": None if offset is None else offset / 3600.0,
+            "skew": _skew(stream, offset),
+            "quality": stream.quality_summary()
+        })
+
+    devices = []
+    for (gateway_id, kind, device_id), stream in stats.devices.items():
+        location_rate = stream.location_rate()
+        devices.append({
+            "gateway id": gateway_id,
+            "kind": kind,
+            "id": device_id,
+            "messages": stream.count,
+            "rate_hz": _round(stream.rate()),
+            "locations": stream.locations,
+            "location_rate_hz": _round(location_rate),
+            "nominal_udr": stream.nominal_udr,
+            "stationary_udr": stream.stationary_udr,
+            "udr_ratio": _ratio(location_rate, stream.nominal_udr),
+            "mssg idx": stream.sequence.summary(),
+            "skew": _skew(stream, offsets.get(gateway_id)),
+            "quality": stream.quality_summary()
+        })
+    # 丟包最多、定位速率相對宣告值最低的設備排在前面
+    devices.sort(key=lambda item: (-(item["mssg idx"] or {}).get("missing", 0),
+                                   item["udr_ratio"] if item["udr_ratio"] is not None else math.inf,
+                                   str(item["gateway id"]), item["kind"], str(item["id"])))
+    return {
+        "records": stats.records,
+        "errors": stats.errors,
+        "unattributed": stats.unattributed,
+        "bytes": stats.bytes,
+        "gateways": gateways,
+        "devices": devices
+    }
+
+
+def _sequence_text(name: str, sequence: Optional[Dict]) -> str:
+    if not sequence:
+        return f"{name}: 無"
+    return (f"{name}: {sequence['first']}-{sequence['last']}, 缺號 {sequence['missing']} "
+            f"({sequence['loss'] * 100:.2f}%), 重複 {sequence['duplicates']}, "
+            f"缺口 {sequence['gaps']} (最大 {sequence['max_gap']}), 重啟/回繞 {sequence['resets']}")
+
+
+def _skew_text(skew: Optional[Dict]) -> str:
+    if not skew:
+        return "時間偏差: 無"
+    return (f"時間偏差(設備-接收): 均值 {skew['mean']:+.3f} s, 標準差 {skew['std']:.3f} s, "
+            f"範圍 [{skew['min']:+.3f}, {skew['max']:+.3f}] ({skew['count']} 條)")
+
+
+def _quality_text(quality: Optional[Dict]) -> str:
+    histogram = " ".join(f"{label}:{count}" for label, count in quality["histogram"].items())
+    return f"quality: 均值 {quality['mean']} ({quality['count']} 條) | {histogram}"
+
+
+def format_report(report: Dict, top: int = 20) -> List[str]:
+    """報告的文字摘要"""
+    lines = [f"記錄 {report['records']} 條, 解析錯誤 {report['errors']}, 無 Gateway 歸屬 {report['unattributed']}, "
+             f"{report['bytes'] / 1e6:.1f} MB"]
+    for gateway in report["gateways"]:
+        name = gateway["prefix"] or gateway["gateway id"]
+        rate = gateway["rate_hz"]
+        lines.append(f"Gateway {name} ({gateway['gateway id']}): {gateway['messages']} 條, "
+                     f"{gateway['duration'] / 60:.1f} 分鐘, {rate if rate is not None else '-'} msg/s")
+        lines.append("  " + _sequence_text("serial no", gateway["serial no"]))
+        if gateway["clock_offset_hours"] is not None:
+            lines.append(f"  本地時區 UTC{gateway['clock_offset_hours']:+g}, " + _skew_text(gateway["skew"]))
+        else:
+            lines.append("  " + _skew_text(gateway["skew"]))
+        if gateway["quality"]:
+            lines.append("  " + _quality_text(gateway["quality"]))
+        lines.append("  訊息類型: " + ", ".join(f"{content} {count}"
+                                            for content, count in gateway["contents"].items()))
+
+    devices = report["devices"]
+    if devices:
+        lines.append(f"設備 {len(devices)} 個" + (f"（列出前 {top} 個）" if len(devices) > top else "") + ":")
+    for device in devices[:top]:
+        parts = [f"{device['messages']} 條"]
+        if device["locations"]:
+            rate = device["location_rate_hz"]
+            text = f"定位 {device['locations']} 條 {rate if rate is not None else '-'} Hz"
+            if device["nominal_udr"] is not None:
+                text += f" / nominal {device['nominal_udr']} Hz"
+                if device["udr_ratio"] is not None:
+                    text += f" ({device['udr_ratio'] * 100:.0f}%)"
+                text += f", stationary {device['stationary_udr']} Hz"
+            parts.append(text)
+        elif device["rate_hz"] is not None:
+            parts.append(f"{device['rate_hz']} msg/s")
+        if device["mssg idx"]:
+            parts.append(_sequence_text("mssg idx", device["mssg idx"]))
+        if device["skew"]:
+            parts.append(f"偏差 {device['skew']['mean']:+.3f} s")
+        if device["quality"]:
+            parts.append(f"quality 均值 {device['quality']['mean']}")
+        lines.append(f"  {device['kind']} {device['id']} @ {device['gateway id']}: " + ", ".join(parts))
+    return lines
+
+
+def _shift_local(value: str, shift: timedelta) -> str:
+    moment = datetime.strptime(value, "%Y-%j %H:%M:%S.%f") + shift
+    return f"{moment:%Y-%j %H:%M:%S}.{moment.microsecond // 10000:02d}"
+
+
+def iter_amplified(path: str, gateways: int = 1, loops: int = 1, drop: float = 0.0,
+                   duplicate: float = 0.0, seed: Optional[int] = None) -> Iterator[Dict]:
+    """
+    把抓包放大為 gateways 個虛擬 Gateway x loops 輪的記錄流
+
+    每輪的接收時間、設備時間、serial no 與 mssg idx 按抓包跨度順延，保證序號連續；
+    drop / duplicate 為每條記錄被丟棄 / 重複輸出的機率，用於驗證丟包與重複統計
+    """
+    records = list(iter_capture(path))
+    if not records:
+        return
+    stamps = [parse_timestamp(record["timestamp"]) for record in records]
+    span = max(stamps) - min(stamps) + 1.0
+    serials = [record["message"]["serial no"] for record in records
+               if isinstance(record["message"].get("serial no"), int)]
+    serial_span = max(serials) - min(serials) + 1 if serials else 0
+    indexes = [record["message"]["mssg idx"] for record in records
+               if isinstance(record["message"].get("mssg idx"), int)]
+    index_span = max(indexes) - min(indexes) + 1 if indexes else 0
+    rng = random.Random(seed)
+    rewriter = GatewayRewriter()
+
+    for loop in range(loops):
+        shift = timedelta(seconds=loop * span)
+        for record, stamp in zip(records, stamps):
+            received = datetime.fromtimestamp(stamp + loop * span, timezone.utc)
+            received_text = f"{received:%Y-%m-%dT%H:%M:%S}.{received.microsecond // 1000:03d}Z"
+            for k in range(gateways):
+                if drop and rng.random() < drop:
+                    continue
+                topic, message = rewriter.rewrite(record["topic"], record["message"], k, loop * serial_span)
+                if message is record["message"]:
+                    message = dict(message)
+                if loop:
+                    if isinstance(message.get("mssg idx"), int):
+                        message["mssg idx"] += loop * index_span
+                    for field in ("time", "current"):
+                        if isinstance(message.get(field), str) and message[field][8:9] == " ":
+                            message[field] = _shift_local(message[field], shift)
+                copy = {"topic": topic, "message": message, "timestamp": received_text}
+                yield copy
+                if duplicate and rng.random() < duplicate:
+                    yield copy
+
+
+def write_ndjson(source: str, output: str, **options) -> int:
+    """把抓包（可放大）寫成 NDJSON，返回記錄數"""
+    count = 0
+    with open(output, "wb") as f:
+        for record in iter_amplified(source, **options):
+            f.write(_dumps(record))
+            f.write(b"\n")
+            count += 1
+    return count
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="MQTT 抓包離線分析工具")
+    parser.add_argument("capture", nargs="?", default=DEFAULT_CAPTURE, help="抓包文件路徑（NDJSON 或 JSON 陣列）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解析進程數")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_MB, help="每個分塊的大小上限（MB）")
+    parser.add_argument("--device-utc-offset", type=float, default=None, metavar="HOURS",
+                        help="Gateway 本地時間的時區（小時），默認按偏差自動推斷")
+    parser.add_argument("--max-gap", type=int, default=DEFAULT_MAX_GAP,
+                        help="序號回退或前向跳躍超過此值視為重啟/回繞，不計入丟包或重複")
+    parser.add_argument("--top", type=int, default=20, help="文字摘要中列出的設備數")
+    parser.add_argument("--output", default=None, help="完整報告輸出為 JSON 文件")
+    parser.add_argument("--to-ndjson", default=None, metavar="FILE",
+                        help="把抓包轉換為 NDJSON 後退出（可配合下列放大參數）")
+    parser.add_argument("--gateways", type=int, default=1, help="轉換時的虛擬 Gateway 數量")
+    parser.add_argument("--loops", type=int, default=1, help="轉換時的循環次數")
+    parser.add_argument("--drop", type=float, default=0.0, help="轉換時每條記錄被丟棄的機率")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="轉換時每條記錄被重複的機率")
+    parser.add_argument("--seed", type=int, default=None, help="轉換時的隨機種子")
+    return parser.parse_args()
+
+
+def main():
+    """主程式"""
+    args = parse_args()
+    if args.to_ndjson:
+        started = time.perf_counter()
+        count = write_ndjson(args.capture, args.to_ndjson, gateways=args.gateways, loops=args.loops,
+                             drop=args.drop, duplicate=args.duplicate, seed=args.seed)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 已寫入 {args.to_ndjson}: {count} 條, "
+              f"{os.path.getsize(args.to_ndjson) / 1e6:.1f} MB, 耗時 {time.perf_counter() - started:.1f} 秒")
+        return
+
+    print("MQTT 抓包離線分析工具")
+    print(f"抓包文件: {args.capture}, 進程數: {args.workers}")
+    try:
+        started = time.perf_counter()
+        stats = analyze(args.capture, args.workers, args.chunk_mb, args.max_gap)
+        elapsed = time.perf_counter() - started
+        report = build_report(stats, args.device_utc_offset)
+        report["elapsed"] = round(elapsed, 3)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 分析完成: {stats.records} 條記錄, "
+              f"耗時 {elapsed:.2f} 秒 ({stats.records / elapsed if elapsed else 0:.0f} 條/秒, "
+              f"{stats.bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s)")
+        for line in format_report(report, args.top):
+            print(line)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"報告已寫入 {args.output}")
+    except KeyboardInterrupt:
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式被用戶中斷")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+設備最新狀態表
+以 (gateway id, node, id) 為鍵保存每個設備各類訊息的最新欄位，
+計算欄位級差異，只把真正變化的內容交給下游；重複的 serial no 直接丟棄
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 每條訊息都會變、但不代表設備狀態變化的欄位，不參與差異比較
+VOLATILE_FIELDS = frozenset({
+    "serial no", "time", "current", "sf number", "last sync", "mssg idx", "stamp(sec)",
+})
+
+# 組成設備鍵的欄位，不重複存入狀態
+KEY_FIELDS = frozenset({"gateway id", "node", "id", "content"})
+
+# 每個設備保留的最近 serial no 數量，用於識別重複投遞
+RECENT_SERIALS = 8
+
+
+def device_key(message: Dict) -> Tuple:
+    """
+    設備鍵 (gateway id, node, id)
+
+    沒有 id 的設備（diaper DV1、300B 等）以 MAC 或 name 代替，沒有 node 的以 content 代替
+    """
+    device_id = message.get("id")
+    if device_id is None:
+        device_id = message.get("MAC", message.get("name"))
+    node = message.get("node")
+    if node is None:
+        node = message.get("content")
+    return message.get("gateway id"), node, device_id
+
+
+def flatten_fields(message: Dict, prefix: str = "") -> Dict:
+    """把巢狀欄位展平，例如 position.x"""
+    fields = {}
+    for key, value in message.items():
+        if not prefix and key in KEY_FIELDS:
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            fields.update(flatten_fields(value, f"{name}."))
+        else:
+            fields[name] = value
+    return fields
+
+
+class DeviceRecord:
+    """單個設備的最新狀態"""
+
+    __slots__ = ("key", "states", "serials", "first_seen", "last_seen",
+                 "messages", "changes", "duplicates")
+
+    def __init__(self, key: Tuple, now: float):
+        self.key = key
+        # content -> 展平後的最新欄位
+        self.states: Dict[str, Dict] = {}
+        self.serials: List[int] = []
+        self.first_seen = now
+        self.last_seen = now
+        self.messages = 0
+        self.changes = 0
+        self.duplicates = 0
+
+    def seen_serial(self, serial) -> bool:
+        """記錄 serial no，已見過時返回 True"""
+        if serial is None:
+            return False
+        serials = self.serials
+        if serial in serials:
+            return True
+        serials.append(serial)
+        if len(serials) > RECENT_SERIALS:
+            del serials[0]
+        return False
+
+
+class DeviceStateStore:
+    """
+    設備最新狀態表
+
+    update() 返回變化事件（新設備、欄位變化）或 None（重複或無變化），
+    snapshot() 提供所有設備當前狀態供儀表板使用
+    """
+
+    def __init__(self, volatile_fields: Iterable[str] = VOLATILE_FIELDS):
+        self.volatile_fields = frozenset(volatile_fields)
+        self.records: Dict[Tuple, DeviceRecord] = {}
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.emitted = 0
+        self.duplicates = 0
+        self.unchanged = 0
+
+    def update(self, topic: str, message: Dict, recv_ts: Optional[float] = None) -> Optional[Dict]:
+        """
+        用一條訊息更新設備狀態
+
+        Returns:
+            變化事件 {"topic", "key", "content", "serial no", "recv_ts", "new", "changes"}，
+            changes 為 {欄位: 新值}；重複或沒有變化時返回 None
+        """
+        if recv_ts is None:
+            recv_ts = time.time()
+        key = device_key(message)
+        content = message.get("content")
+        serial = message.get("serial no")
+        fields = flatten_fields(message)
+
+        with self._lock:
+            self.received += 1
+            record = self.records.get(key)
+            is_new = record is None
+            if is_new:
+                record = DeviceRecord(key, recv_ts)
+                self.records[key] = record
+
+            record.messages += 1
+            record.last_seen = recv_ts
+            if record.seen_serial(serial):
+                record.duplicates += 1
+                self.duplicates += 1
+                return None
+
+            previous = record.states.get(content)
+            if previous is None:
+                changes = {name: value for name, value in fields.items()
+                           if name not in self.volatile_fields}
+                record.states[content] = fields
+                is_new_content = True
+            else:
+                changes = {}
+                volatile = self.volatile_fields
+                for name, value in fields.items():
+                    if name not in volatile and previous.get(name) != value:
+                        changes[name] = value
+                previous.update(fields)
+                is_new_content = False
+
+            if not changes and not is_new_content:
+                self.unchanged += 1
+                return None
+
+            record.changes += 1
+            self.emitted += 1
+
+        return {
+            "topic": topic,
+            "key": key,
+            "content": content,
+            "serial no": serial,
+            "recv_ts": recv_ts,
+            "new": is_new or is_new_content,
+            "changes": changes
+        }
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        """單個設備的當前狀態"""
+        with self._lock:
+            record = self.records.get(key)
+            return self._describe(record) if record else None
+
+    @staticmethod
+    def _describe(record: DeviceRecord) -> Dict:
+        gateway_id, node, device_id = record.key
+        return {
+            "gateway id": gateway_id,
+            "node": node,
+            "id": device_id,
+            "first_seen": record.first_seen,
+            "last_seen": record.last_seen,
+            "messages": record.messages,
+            "changes": record.changes,
+            "duplicates": record.duplicates,
+            "state": {content: dict(fields) for content, fields in record.states.items()}
+        }
+
+    def snapshot(self) -> List[Dict]:
+        """所有設備當前狀態的快照"""
+        with self._lock:
+            return [self._describe(record) for record in self.records.values()]
+
+    def stats(self) -> Dict:
+        """狀態表統計"""
+        with self._lock:
+            return {
+                "devices": len(self.records),
+                "received": self.received,
+                "emitted": self.emitted,
+                "duplicates": self.duplicates,
+                "unchanged": self.unchanged
+            }
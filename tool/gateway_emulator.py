@@ -0,0 +1,845 @@
+"""
+本地 UWB Gateway 模擬器
+按 N 個 Gateway × M 個 Anchor × K 個 Tag（另加尿布與 300B 手環）產生完整主題組合：
+Loca (location)、Message (heartbeat / 5V status)、AncConf / TagConf (config)、
+Health (diaper DV1 / 300B / motion info step) 與 UWB/UWB_Gateway (gateway topic)，
+訊息格式依 UWB_structured_spec_v2.md 與 test-data/mqtt_messages.json；
+Tag 位置由向量化運動模型 tag_motion.TagMotionModel 推進，
+每個 Tag 按自己的 nominal udr(hz) / stationary udr(hz) 上報，
+並回應 Dwlink 的 configChange（Ack + 更新後的配置）。
+每條訊息流的固定字段預編譯為模板（payload_codec），發送時只填入變化的字段，可選 msgpack / CBOR 編碼。
+多進程發送池下每個進程負責一部分 Gateway
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from payload_codec import (CODEC_JSON, CODECS, TEXT, PayloadTemplate, Slot, TickClock, codec_available,
+                           decode_payload, encoder_for)
+from publisher_pool import PublisherPool, new_stats
+from replay_capture import gateway_prefix
+from scenario import DEVICE_TYPES, Scenario, compile_scenario
+from tag_motion import (DEFAULT_DATA_DIR, FloorGeometry, TagMotionModel, default_floor,
+                        load_floors, synthetic_floor)
+from tick_scheduler import TickScheduler
+
+# 可用時使用 orjson 編碼，否則退回標準庫
+try:
+    import orjson
+
+    def _dumps(message):
+        return orjson.dumps(message)
+except ImportError:
+    def _dumps(message):
+        return json.dumps(message, ensure_ascii=False)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATEWAY_ID = 4192540344
+FIRST_ANCHOR_ID = 16912
+FIRST_TAG_ID = 11143
+GATEWAY_TOPIC = "UWB/UWB_Gateway"
+
+# 各類週期性訊息的默認間隔（秒），取自抓包中的實際頻率與 gateway topic 的更新時間設定
+DEFAULT_INTERVALS = {
+    "gateway heartbeat": 30.0,
+    "gateway topic": 60.0,
+    "anchor heartbeat": 30.0,
+    "anchor config": 30.0,
+    "tag config": 30.0,
+    "5V status": 300.0,
+    "motion info step": 60.0,
+    "diaper DV1": 20.0,
+    "300B": 20.0,
+}
+
+# Tag 默認上報頻率（與抓包中的 TagConf 一致）
+DEFAULT_NOMINAL_UDR = 0.2
+DEFAULT_STATIONARY_UDR = 0.1
+
+# 未載入樓層時 Anchor 的隨機佈置範圍（米）
+AREA_HALF_SIZE = 5.0
+# 運動模型推進間隔（秒）與步幅（米）
+MOTION_TICK = 0.1
+STRIDE_LENGTH = 0.6
+
+
+def gateway_time(now: float) -> str:
+    """Gateway 時間格式，例如 2026-059 00:36:58.80"""
+    moment = datetime.fromtimestamp(now)
+    return f"{moment:%Y-%j %H:%M:%S}.{moment.microsecond // 10000:02d}"
+
+
+def valid_udr(value) -> bool:
+    """上報頻率須為大於 0 的有限數值"""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value) and value > 0)
+
+
+def build_gateways(count: int, anchors: int, tags: int, diapers: int = 1, watches: int = 1,
+                   nominal_udr: float = DEFAULT_NOMINAL_UDR,
+                   stationary_udr: float = DEFAULT_STATIONARY_UDR,
+                   seed: Optional[int] = None) -> List[Dict]:
+    """
+    建立 Gateway 拓撲
+
+    Gateway ID 從 DEFAULT_GATEWAY_ID 遞增，Anchor / Tag ID 全局唯一；
+    nominal_udr 為 0 以下時每個 Tag 從常見頻率中隨機選取
+    """
+    rng = random.Random(seed)
+    gateways = []
+    for g in range(count):
+        gateway_id = DEFAULT_GATEWAY_ID + g
+        gateway = {
+            "gateway_id": gateway_id,
+            "prefix": gateway_prefix(gateway_id),
+            "name": f"Gw{gateway_id:08X}_{g % 100}",
+            "anchors": [],
+            "tags": [],
+            "diapers": [],
+            "watches": [],
+        }
+        for a in range(anchors):
+            anchor_id = (FIRST_ANCHOR_ID + g * anchors + a) & 0xFFFF
+            gateway["anchors"].append({
+                "id": anchor_id,
+                "name": f"DW{anchor_id:04X}",
+                "fw update": 0,
+                "led": 1,
+                "ble": 1,
+                "initiator": 1 if a == 0 else 0,
+                "position": {"x": round(rng.uniform(-AREA_HALF_SIZE, AREA_HALF_SIZE), 2),
+                             "y": round(rng.uniform(-AREA_HALF_SIZE, AREA_HALF_SIZE), 2),
+                             "z": round(rng.uniform(1.0, 2.5), 2)},
+            })
+        for t in range(tags):
+            tag_id = (FIRST_TAG_ID + g * tags + t) & 0xFFFF
+            udr = nominal_udr if nominal_udr > 0 else rng.choice((0.1, 0.2, 0.5, 1.0, 2.0))
+            gateway["tags"].append({
+                "id": tag_id,
+                "name": f"DW{tag_id:04X}",
+                "fw update": 0,
+                "led": 0,
+                "ble": 1,
+                "location engine": 1,
+                "responsive mode(0=On,1=Off)": 1,
+                "stationary detect": 1,
+                "nominal udr(hz)": udr,
+                "stationary udr(hz)": min(stationary_udr, udr),
+            })
+        for d in range(diapers):
+            suffix = f"{g & 0xFF:02X}{d >> 8 & 0xFF:02X}{d & 0xFF:02X}"
+            gateway["diapers"].append({
+                "MAC": f"C5:C6:E3:{suffix[0:2]}:{suffix[2:4]}:{suffix[4:6]}",
+                "name": f"DV1_{suffix}",
+            })
+        for w in range(watches):
+            gateway["watches"].append({
+                "MAC": f"E0:0E:08:{g & 0xFF:02X}:{w >> 8 & 0xFF:02X}:{w & 0xFF:02X}",
+            })
+        gateways.append(gateway)
+    return gateways
+
+
+def scenario_gateways(scenario: Scenario, stationary_udr: float = DEFAULT_STATIONARY_UDR) -> List[Dict]:
+    """
+    按場景建立 Gateway 拓撲：Anchor 取自場景，Tag（含 pedo）、尿布與 300B 手環取自場景住民，
+    設備識別沿用場景的 device_uid，Tag 的 nominal udr(hz) 為住民的上報頻率
+    """
+    gateways = []
+    for g, source in enumerate(scenario.gateways):
+        gateway = {
+            "gateway_id": source["gateway_id"],
+            "prefix": source["prefix"],
+            "name": source["name"],
+            "anchors": [],
+            "tags": [],
+            "diapers": [],
+            "watches": [],
+        }
+        for a, anchor in enumerate(source["anchors"]):
+            position = anchor.get("position") or {"x": 0.0, "y": 0.0, "z": 2.0}
+            gateway["anchors"].append({
+                "id": anchor["id"],
+                "name": anchor["name"],
+                "fw update": 0,
+                "led": 1,
+                "ble": 1,
+                "initiator": 1 if a == 0 else 0,
+                "position": {axis: round(float(position[axis]), 2) for axis in "xyz"},
+            })
+        for row in np.flatnonzero(scenario.gateway == g).tolist():
+            device = DEVICE_TYPES[scenario.device[row]]
+            identity = scenario.device_uids[row].split(":", 1)[1]
+            if device in ("tag", "pedo"):
+                tag_id = int(identity)
+                udr = float(scenario.udr[row])
+                gateway["tags"].append({
+                    "id": tag_id,
+                    "name": f"DW{tag_id:04X}",
+                    "fw update": 0,
+                    "led": 0,
+                    "ble": 1,
+                    "location engine": 1,
+                    "responsive mode(0=On,1=Off)": 1,
+                    "stationary detect": 1,
+                    "nominal udr(hz)": udr,
+                    "stationary udr(hz)": min(stationary_udr, udr),
+                })
+            elif device == "diaper DV1":
+                gateway["diapers"].append({"MAC": identity, "name": f"DV1_{identity[-8:].replace(':', '')}"})
+            else:
+                gateway["watches"].append({"MAC": identity})
+        gateways.append(gateway)
+    return gateways
+
+
+class GatewayEmulator:
+    """
+    一組 Gateway 的訊息產生器
+
+    每條週期性訊息流（某設備的某類訊息）對應排程器中的一個索引，
+    build() 按索引產生 (主題, 訊息)，encode() 以預編譯模板直接產生 (主題, 負載)，
+    handle_command() 處理 Dwlink 命令並返回回覆
+    """
+
+    def __init__(self, gateways: List[Dict], intervals: Optional[Dict] = None,
+                 seed: Optional[int] = None, floors: Optional[List[FloorGeometry]] = None,
+                 codec: str = CODEC_JSON):
+        """
+        Args:
+            gateways: build_gateways() 產生的拓撲
+            intervals: 覆蓋 DEFAULT_INTERVALS 的訊息間隔
+            seed: 隨機種子
+            floors: 樓層幾何，Gateway 依序輪流分配樓層並使用其 Anchor 坐標；
+                    None 時以每個 Gateway 自己的 Anchor 外接矩形作為樓層
+            codec: 負載編碼（payload_codec.CODECS），默認 JSON
+        """
+        self.gateways = gateways
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.rng = random.Random(seed)
+        self.scheduler: Optional[TickScheduler] = None
+        self.codec = codec
+        # 未預編譯的訊息（命令回覆）使用的通用編碼
+        self.dumps = _dumps if codec == CODEC_JSON else encoder_for(codec)
+        self.clock = TickClock()
+
+        # (類型, Gateway 索引, 設備索引) 與對應頻率
+        self.streams: List[Tuple[str, int, int]] = []
+        self.rates: List[float] = []
+        # 每個 Gateway 的 serial no 在所有訊息類型間共用遞增
+        self.serials = [self.rng.randrange(1, 1000) for _ in gateways]
+        self.started = time.time()
+
+        # Tag 在運動模型中的列、定位訊息流索引與 sf number
+        self.tag_rows: Dict[Tuple[int, int], int] = {}
+        self.tag_keys: List[Tuple[int, int]] = []
+        self.tag_streams: Dict[Tuple[int, int], int] = {}
+        self.tag_sf: List[int] = []
+        self.tag_last: List[Optional[float]] = []
+        # (Gateway ID, 設備 ID) -> (Gateway 索引, 類型, 設備索引)，用於處理命令
+        self.devices: Dict[Tuple[int, int], Tuple[int, str, int]] = {}
+
+        for g, gateway in enumerate(gateways):
+            self._add_stream("gateway heartbeat", g, 0)
+            self._add_stream("gateway topic", g, 0)
+            for a, anchor in enumerate(gateway["anchors"]):
+                self.devices[(gateway["gateway_id"], anchor["id"])] = (g, "anchor", a)
+                self._add_stream("anchor heartbeat", g, a)
+                self._add_stream("anchor config", g, a)
+                self._add_stream("5V status", g, a)
+            for t, tag in enumerate(gateway["tags"]):
+                self.devices[(gateway["gateway_id"], tag["id"])] = (g, "tag", t)
+                self.tag_rows[(g, t)] = len(self.tag_keys)
+                self.tag_keys.append((g, t))
+                self.tag_streams[(g, t)] = len(self.streams)
+                self.tag_sf.append(self.rng.randrange(0, 4096))
+                self.tag_last.append(None)
+                self._add_stream("location", g, t, tag["nominal udr(hz)"])
+                self._add_stream("tag config", g, t)
+                self._add_stream("motion info step", g, t)
+            for d in range(len(gateway["diapers"])):
+                self._add_stream("diaper DV1", g, d)
+            for w in range(len(gateway["watches"])):
+                self._add_stream("300B", g, w)
+
+        self.motion = TagMotionModel(self._gateway_floors(floors),
+                                     [g for g, _ in self.tag_keys], seed, time.monotonic())
+        self._refresh_motion()
+        for g, t in self.tag_keys:
+            self.rates[self.tag_streams[(g, t)]] = self._tag_rate(g, t)
+
+        # 類型 -> (模板, 數值)
+        self.shapes = {
+            "location": (self._location_template, self._location_values),
+            "gateway heartbeat": (self._gateway_heartbeat_template, self._gateway_heartbeat_values),
+            "gateway topic": (self._gateway_topic_template, self._gateway_topic_values),
+            "anchor heartbeat": (self._anchor_heartbeat_template, self._constant_values),
+            "anchor config": (self._anchor_config_template, self._constant_values),
+            "tag config": (self._tag_config_template, self._constant_values),
+            "5V status": (self._power_status_template, self._power_status_values),
+            "motion info step": (self._motion_step_template, self._motion_step_values),
+            "diaper DV1": (self._diaper_template, self._diaper_values),
+            "300B": (self._watch_template, self._watch_values),
+        }
+        self._templates: List[Optional[Tuple[str, PayloadTemplate]]] = [None] * len(self.streams)
+
+    def _gateway_floors(self, floors: Optional[List[FloorGeometry]]) -> List[FloorGeometry]:
+        """每個 Gateway 的樓層；使用載入的樓層時 Anchor 坐標改為樓層內的 Anchor"""
+        result = []
+        for g, gateway in enumerate(self.gateways):
+            anchors = gateway["anchors"]
+            if floors:
+                floor = floors[g % len(floors)]
+                for a, anchor in enumerate(anchors):
+                    x, y, z = floor.anchors[a % len(floor.anchors)]
+                    anchor["position"] = {"x": round(float(x), 2), "y": round(float(y), 2),
+                                          "z": round(float(z), 2)}
+            elif anchors:
+                floor = default_floor([[a["position"][axis] for axis in "xyz"] for a in anchors],
+                                      gateway["prefix"])
+            else:
+                floor = synthetic_floor(gateway["prefix"], 2 * AREA_HALF_SIZE, 2 * AREA_HALF_SIZE)
+            result.append(floor)
+        return result
+
+    def _refresh_motion(self):
+        """把運動模型的位置與品質轉為 Python 列表，供逐條組裝訊息時讀取"""
+        self._positions = np.round(self.motion.position, 2).tolist()
+        self._quality = self.motion.quality().tolist()
+
+    def advance(self, now: float):
+        """以單調時鐘推進運動模型（每 MOTION_TICK 秒最多一次），並切換狀態改變的 Tag 的頻率"""
+        if now - self.motion.last_step < MOTION_TICK:
+            return
+        for row in self.motion.step(now):
+            g, t = self.tag_keys[row]
+            self._update_tag_rate(g, t)
+        self._refresh_motion()
+
+    def _add_stream(self, kind: str, g: int, index: int, rate: Optional[float] = None):
+        self.streams.append((kind, g, index))
+        self.rates.append(rate if rate is not None else 1.0 / self.intervals[kind])
+
+    def _tag_rate(self, g: int, t: int) -> float:
+        tag = self.gateways[g]["tags"][t]
+        if tag["stationary detect"] and not self.motion.moving[self.tag_rows[(g, t)]]:
+            return tag["stationary udr(hz)"]
+        return tag["nominal udr(hz)"]
+
+    def _update_tag_rate(self, g: int, t: int):
+        if self.scheduler is not None:
+            self.scheduler.set_rate(self.tag_streams[(g, t)], self._tag_rate(g, t))
+
+    def _next_serial(self, g: int) -> int:
+        self.serials[g] += 1
+        return self.serials[g]
+
+    def _header(self, g: int, content: str) -> Dict:
+        return {
+            "content": content,
+            "gateway id": self.gateways[g]["gateway_id"],
+            "region id": 0,
+            "organiz id": 0,
+        }
+
+    def _topic(self, g: int, suffix: str) -> str:
+        return f"UWB/{self.gateways[g]['prefix']}_{suffix}"
+
+    def _time(self, now: float) -> str:
+        """同一週期的訊息共用已格式化的 Gateway 時間"""
+        return self.clock.set(now).gateway_time
+
+    # ---- 各類訊息 ----
+    # 每類訊息分為模板（每個設備固定的字段，變化的字段以 Slot 佔位）與數值（按槽位順序返回變化的字段）
+
+    def _location_template(self, g: int, t: int):
+        tag = self.gateways[g]["tags"][t]
+        message = self._header(g, "location")
+        message.update({
+            "node": "TAG",
+            "id": tag["id"],
+            "id(Hex)": f"0x{tag['id']:04X}",
+            "position": {"x": Slot(), "y": Slot(), "z": Slot(), "quality": Slot()},
+            "time": Slot(TEXT),
+            "sf number": Slot(),
+            "serial no": Slot(),
+        })
+        return self._topic(g, "Loca"), message
+
+    def _location_values(self, g: int, t: int, now: float):
+        row = self.tag_rows[(g, t)]
+        last = self.tag_last[row]
+        self.tag_last[row] = now
+        # superframe 計數按經過時間推進
+        self.tag_sf[row] = (self.tag_sf[row] + max(1, int((now - last) * 10) if last else 1)) % 4096
+        x, y, z = self._positions[row]
+        return x, y, z, self._quality[row], self._time(now), self.tag_sf[row], self._next_serial(g)
+
+    def _gateway_heartbeat_template(self, g: int, index: int):
+        gateway = self.gateways[g]
+        message = self._header(g, "heartbeat")
+        message.update({
+            "node": "GW",
+            "name": gateway["name"],
+            "fw ver": "0.82838s",
+            "fw serial": 0,
+            "UWB HW Com OK": "yes",
+            "UWB Joined": "yes",
+            "UWB Network ID": 24015,
+            "connected AP": "Emulator",
+            "anchor cfg stack": 0,
+            "current": Slot(TEXT),
+        })
+        return self._topic(g, "Message"), message
+
+    def _gateway_heartbeat_values(self, g: int, index: int, now: float):
+        return (self._time(now),)
+
+    def _gateway_topic_template(self, g: int, index: int):
+        gateway = self.gateways[g]
+        prefix = f"UWB/{gateway['prefix']}"
+        message = self._header(g, "gateway topic")
+        message.update({
+            "name": gateway["name"],
+            "fw ver": "0.82838s",
+            "fw serial": 0,
+            "UWB HW Com OK": "yes",
+            "UWB Joined": "yes",
+            "UWB Network ID": 24015,
+            "connected AP": "Emulator",
+            "Wifi tx power(dBm)": 13,
+            "set Wifi max tx power(dBm)": 13.75,
+            "ble scan time": 5,
+            "ble scan pause time": 20,
+            "300B update time": int(self.intervals["300B"]),
+            "diaper DV1 update time": int(self.intervals["diaper DV1"]),
+            "battery voltage": 0.284,
+            "5V plugged": "yes",
+            "uwb tx power changed": "no",
+            "uwb tx power": {"boost norm(5.0~30.5dB)": 6.5, "boost 500(5.0~30.5dB)": 9,
+                             "boost 250(5.0~30.5dB)": 11.5, "boost 125(5.0~30.5dB)": 14},
+            "tx power configChange every anchor": "no",
+            "tx power configChange every tag": "no",
+            "tag config pub": "yes",
+            "QoS": 0,
+            "pub topic": {"anchor config": f"{prefix}_AncConf", "tag config": f"{prefix}_TagConf",
+                          "location": f"{prefix}_Loca", "message": f"{prefix}_Message",
+                          "ack from node": f"{prefix}_Ack", "health": f"{prefix}_Health"},
+            "sub topic": {"downlink": f"{prefix}_Dwlink"},
+            "discard IOT data time(0.1s)": 30,
+            "discarded IOT data": 0,
+            "total discarded data": 0,
+            "1st sync": gateway_time(self.started),
+            "last sync": Slot(TEXT),
+            "current": Slot(TEXT),
+        })
+        return GATEWAY_TOPIC, message
+
+    def _gateway_topic_values(self, g: int, index: int, now: float):
+        current = self._time(now)
+        return current, current
+
+    def _anchor_fields(self, g: int, a: int) -> Dict:
+        anchor = self.gateways[g]["anchors"][a]
+        return {
+            "node": "ANCHOR",
+            "name": anchor["name"],
+            "id": anchor["id"],
+            "id(Hex)": f"0x{anchor['id']:04X}",
+            "fw update": anchor["fw update"],
+            "led": anchor["led"],
+            "ble": anchor["ble"],
+            "initiator": anchor["initiator"],
+            "position": dict(anchor["position"]),
+        }
+
+    def _anchor_heartbeat_template(self, g: int, a: int):
+        message = self._header(g, "heartbeat")
+        message.update(self._anchor_fields(g, a))
+        return self._topic(g, "Message"), message
+
+    def _anchor_config_template(self, g: int, a: int):
+        message = self._header(g, "config")
+        message.update(self._anchor_fields(g, a))
+        return self._topic(g, "AncConf"), message
+
+    def _tag_config_template(self, g: int, t: int):
+        tag = self.gateways[g]["tags"][t]
+        message = self._header(g, "config")
+        message.update({
+            "node": "TAG",
+            "name": tag["name"],
+            "id": tag["id"],
+            "id(Hex)": f"0x{tag['id']:04X}",
+        })
+        for key in ("fw update", "led", "ble", "location engine", "responsive mode(0=On,1=Off)",
+                    "stationary detect", "nominal udr(hz)", "stationary udr(hz)"):
+            message[key] = tag[key]
+        return self._topic(g, "TagConf"), message
+
+    def _constant_values(self, g: int, index: int, now: float):
+        """配置與 Anchor 心跳只在收到 configChange 後改變（模板隨之重建）"""
+        return ()
+
+    def _power_status_template(self, g: int, a: int):
+        message = self._header(g, "5V status")
+        message.update({
+            "node": "ANCHOR",
+            "id": self.gateways[g]["anchors"][a]["id"],
+            "5V plugged": Slot(TEXT),
+            "serial no": Slot(),
+        })
+        return self._topic(g, "Message"), message
+
+    def _power_status_values(self, g: int, a: int, now: float):
+        return "yes" if self.rng.random() < 0.9 else "no", self._next_serial(g)
+
+    def _motion_step_template(self, g: int, t: int):
+        tag = self.gateways[g]["tags"][t]
+        message = self._header(g, "motion info step")
+        message.update({
+            "node": "TAG",
+            "id": tag["id"],
+            "id(Hex)": f"0x{tag['id']:04X}",
+            "step": Slot(),
+            "distance(m)": Slot(),
+            "calorie(Kcal)": Slot(),
+            "serial no": Slot(),
+        })
+        return self._topic(g, "Health"), message
+
+    def _motion_step_values(self, g: int, t: int, now: float):
+        distance = float(self.motion.distance[self.tag_rows[(g, t)]])
+        steps = int(distance / STRIDE_LENGTH)
+        return steps, int(distance), int(steps * 0.04), self._next_serial(g)
+
+    def _diaper_template(self, g: int, d: int):
+        diaper = self.gateways[g]["diapers"][d]
+        message = self._header(g, "diaper DV1")
+        message.update({
+            "MAC": diaper["MAC"],
+            "name": diaper["name"],
+            "fw ver": 2.01,
+            "temp": Slot(),
+            "humi": Slot(),
+            "button": 0,
+            "mssg idx": Slot(),
+            "ack": 0,
+            "battery level": Slot(),
+            "serial no": Slot(),
+        })
+        return self._topic(g, "Health"), message
+
+    def _diaper_values(self, g: int, d: int, now: float):
+        diaper = self.gateways[g]["diapers"][d]
+        diaper["mssg idx"] = diaper.get("mssg idx", self.rng.randrange(0, 30000)) + 1
+        rng = self.rng
+        return (round(rng.uniform(23.0, 34.0), 2), round(rng.uniform(40.0, 95.0), 2), diaper["mssg idx"],
+                rng.randint(60, 100), self._next_serial(g))
+
+    def _watch_template(self, g: int, w: int):
+        watch = self.gateways[g]["watches"][w]
+        message = self._header(g, "300B")
+        message.update({
+            "MAC": watch["MAC"],
+            "SOS": 0,
+            "hr": Slot(),
+            "SpO2": Slot(),
+            "bp syst": Slot(),
+            "bp diast": Slot(),
+            "skin temp": Slot(),
+            "room temp": Slot(),
+            "steps": Slot(),
+            "sleep time": "22:46",
+            "wake time": "7:13",
+            "light sleep (min)": 297,
+            "deep sleep (min)": 38,
+            "move": Slot(),
+            "wear": 1,
+            "battery level": Slot(),
+            "serial no": Slot(),
+        })
+        return self._topic(g, "Health"), message
+
+    def _watch_values(self, g: int, w: int, now: float):
+        watch = self.gateways[g]["watches"][w]
+        rng = self.rng
+        watch["steps"] = watch.get("steps", 0) + rng.randint(0, 30)
+        return (rng.randint(60, 100), rng.randint(93, 99), rng.randint(110, 140), rng.randint(70, 90),
+                round(rng.uniform(32.0, 35.0), 1), round(rng.uniform(22.0, 27.0), 1), watch["steps"],
+                rng.randint(0, 40), rng.randint(60, 100), self._next_serial(g))
+
+    def _compiled(self, index: int) -> Tuple[str, PayloadTemplate]:
+        """第 index 條訊息流的主題與預編譯模板（首次使用時建立）"""
+        compiled = self._templates[index]
+        if compiled is None:
+            kind, g, device = self.streams[index]
+            topic, template = self.shapes[kind][0](g, device)
+            compiled = self._templates[index] = (topic, PayloadTemplate(template, self.codec))
+        return compiled
+
+    def build(self, index: int, now: float) -> Tuple[str, Dict]:
+        """產生第 index 條訊息流的一條訊息（字典）"""
+        kind, g, device = self.streams[index]
+        topic, template = self._compiled(index)
+        return topic, template.fill(*self.shapes[kind][1](g, device, now))
+
+    def encode(self, index: int, now: float) -> Tuple[str, bytes]:
+        """產生第 index 條訊息流的一條訊息並直接編碼為負載，不建立字典"""
+        kind, g, device = self.streams[index]
+        topic, template = self._compiled(index)
+        return topic, template.encode(*self.shapes[kind][1](g, device, now))
+
+    # ---- 下行命令 ----
+
+    def dwlink_topics(self) -> List[str]:
+        """本組 Gateway 訂閱的下行主題"""
+        return [self._topic(g, "Dwlink") for g in range(len(self.gateways))]
+
+    def handle_command(self, command: Dict) -> List[Tuple[str, Dict]]:
+        """
+        處理 configChange 命令，返回需要發布的回覆
+
+        命中已知設備時更新其配置並回覆 Ack 與新配置，否則回覆 fail
+        """
+        if command.get("content") != "configChange":
+            return []
+        key = (command.get("gateway id"), command.get("id"))
+        target = self.devices.get(key)
+        if target is None:
+            for g, gateway in enumerate(self.gateways):
+                if gateway["gateway_id"] == key[0]:
+                    return [(self._topic(g, "Ack"), self._ack(g, command, "fail from gateway"))]
+            return []
+
+        g, node, index = target
+        if node == "anchor":
+            anchor = self.gateways[g]["anchors"][index]
+            for field in ("fw update", "led", "ble", "initiator"):
+                if field in command:
+                    anchor[field] = command[field]
+            if isinstance(command.get("position"), dict):
+                anchor["position"] = {axis: command["position"].get(axis, anchor["position"][axis])
+                                      for axis in "xyz"}
+            config = self._anchor_config_template(g, index)
+        else:
+            tag = self.gateways[g]["tags"][index]
+            for field in ("nominal udr(hz)", "stationary udr(hz)"):
+                if field in command and not valid_udr(command[field]):
+                    # 本方法在 paho 網路執行緒內執行，無效頻率須在此拒絕，不能讓 set_rate 拋出
+                    logger.warning(f"拒絕 configChange: Gateway {key[0]} Tag {key[1]} "
+                                   f"的 {field} 無效 ({command[field]!r})")
+                    return [(self._topic(g, "Ack"), self._ack(g, command, "fail from gateway"))]
+            for field in ("fw update", "led", "ble", "location engine",
+                          "responsive mode(0=On,1=Off)", "stationary detect",
+                          "nominal udr(hz)", "stationary udr(hz)"):
+                if field in command:
+                    tag[field] = command[field]
+            self._update_tag_rate(g, index)
+            config = self._tag_config_template(g, index)
+        # 配置已改變，模板在下次使用時按新配置重建
+        self._templates = [None] * len(self.streams)
+        return [(self._topic(g, "Ack"), self._ack(g, command, "ack from gateway")), config]
+
+    def _ack(self, g: int, command: Dict, content: str) -> Dict:
+        return {
+            "content": content,
+            "gateway id": self.gateways[g]["gateway_id"],
+            "command": command.get("content"),
+            "node": command.get("node"),
+            "id": command.get("id"),
+            "serial no": command.get("serial no"),
+        }
+
+
+def attach_dwlink(emulator: GatewayEmulator, publisher, qos: int = 0):
+    """在發送端的連接上訂閱 Dwlink，並在網路執行緒內回覆命令"""
+    client = publisher.client
+    topics = emulator.dwlink_topics()
+    previous_on_connect = client.on_connect
+
+    def on_connect(client, userdata, flags, rc):
+        if previous_on_connect:
+            previous_on_connect(client, userdata, flags, rc)
+        if rc == 0:
+            client.subscribe([(topic, 0) for topic in topics])
+
+    def on_message(client, userdata, msg):
+        try:
+            command = decode_payload(msg.payload)
+        except ValueError:
+            return
+        for topic, message in emulator.handle_command(command):
+            publisher.publish(topic, emulator.dumps(message), qos)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    if client.is_connected():
+        client.subscribe([(topic, 0) for topic in topics])
+
+
+def run_emulator_shard(shard: Dict, publisher, stop_event):
+    """發送池工作進程任務：按排程產生分片內所有 Gateway 的訊息"""
+    floors = load_floors(shard["data_dir"]) if shard.get("data_dir") else None
+    emulator = GatewayEmulator(shard["gateways"], shard.get("intervals"), shard.get("seed"), floors,
+                               shard.get("codec", CODEC_JSON))
+    scheduler = TickScheduler(len(emulator.streams), udr_hz=emulator.rates,
+                              jitter=shard.get("jitter", 0.1),
+                              report_interval=shard.get("report_interval", 0),
+                              seed=shard.get("seed"))
+    emulator.scheduler = scheduler
+    qos = shard.get("qos", 0)
+    if hasattr(publisher, "client"):
+        attach_dwlink(emulator, publisher, qos)
+
+    encode = emulator.encode
+    publish = publisher.publish
+    for due in scheduler.ticks():
+        if stop_event.is_set():
+            break
+        emulator.advance(time.monotonic())
+        now = time.time()
+        for index in due:
+            topic, payload = encode(index, now)
+            publish(topic, payload, qos)
+
+
+def build_shards(gateways: List[Dict], workers: int, args) -> List[Dict]:
+    """把 Gateway 輪流分配給各工作進程"""
+    workers = max(1, min(workers, len(gateways)))
+    shards = [{"gateways": [], "seed": None if args.seed is None else args.seed + i,
+               "jitter": args.jitter, "report_interval": args.report_interval, "qos": args.qos,
+               "data_dir": args.floors, "codec": args.codec}
+              for i in range(workers)]
+    for index, gateway in enumerate(gateways):
+        shards[index % workers]["gateways"].append(gateway)
+    for shard in shards:
+        shard["name"] = "+".join(gw["prefix"] for gw in shard["gateways"][:4])
+        if len(shard["gateways"]) > 4:
+            shard["name"] += f"+{len(shard['gateways']) - 4}"
+    return shards
+
+
+class CountingPublisher:
+    """不連接代理的發送端，只統計條數與位元組數（--dry-run）"""
+
+    def __init__(self):
+        self.stats = new_stats()
+        self.bytes = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.stats["sent"] += 1
+        self.bytes += len(payload)
+
+
+def run_dry(gateways: List[Dict], args):
+    """在本進程內以最快速度產生訊息，測量產生能力"""
+    floors = load_floors(args.floors) if args.floors else None
+    emulator = GatewayEmulator(gateways, seed=args.seed, floors=floors, codec=args.codec)
+    publisher = CountingPublisher()
+    count = len(emulator.streams)
+    rates = emulator.rates
+    expected = sum(rates)
+    print(f"模擬 {len(gateways)} 個 Gateway, {count} 條訊息流, 標稱 {expected:.1f} msg/s")
+
+    stop = threading.Event()
+    timer = threading.Timer(args.duration or 5.0, stop.set)
+    timer.start()
+    start = time.perf_counter()
+    now = time.time()
+    index = 0
+    while not stop.is_set():
+        emulator.advance(time.monotonic())
+        for _ in range(1000):
+            topic, payload = emulator.encode(index, now)
+            publisher.publish(topic, payload)
+            index = (index + 1) % count
+    elapsed = time.perf_counter() - start
+    sent = publisher.stats["sent"]
+    print(f"產生 {sent} 條訊息, {elapsed:.2f} 秒, {sent / elapsed:,.0f} msg/s, "
+          f"平均 {publisher.bytes / sent:.0f} bytes/msg")
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="本地 UWB Gateway 模擬器")
+    parser.add_argument("--gateways", type=int, default=1, help="Gateway 數量")
+    parser.add_argument("--anchors", type=int, default=4, help="每個 Gateway 的 Anchor 數量")
+    parser.add_argument("--tags", type=int, default=1, help="每個 Gateway 的 Tag 數量")
+    parser.add_argument("--diapers", type=int, default=1, help="每個 Gateway 的尿布感測器數量")
+    parser.add_argument("--watches", type=int, default=1, help="每個 Gateway 的 300B 手環數量")
+    parser.add_argument("--tag-udr", type=float, default=DEFAULT_NOMINAL_UDR,
+                        help="Tag nominal udr(hz)，0 表示每個 Tag 隨機選取")
+    parser.add_argument("--stationary-udr", type=float, default=DEFAULT_STATIONARY_UDR,
+                        help="Tag stationary udr(hz)")
+    parser.add_argument("--floors", nargs="?", const=DEFAULT_DATA_DIR, default=None, metavar="DIR",
+                        help="從目錄載入 floors.json / anchors.json / gateways.json 作為樓層幾何"
+                             "（默認 test-data）")
+    parser.add_argument("--scenario", default=None,
+                        help="場景文件 (YAML/JSON) 或 test-data 目錄，以其中的 Gateway、Anchor 與設備取代上面的數量參數")
+    parser.add_argument("--workers", type=int, default=1, help="發送進程數")
+    parser.add_argument("--jitter", type=float, default=0.1, help="發送時間抖動（週期比例）")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2), help="發布 QoS")
+    parser.add_argument("--broker", default="localhost", help="MQTT 代理地址")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT 代理端口")
+    parser.add_argument("--tls", action="store_true", help="使用 SSL/TLS 連接")
+    parser.add_argument("--username", default=None, help="MQTT 用戶名")
+    parser.add_argument("--password", default=None, help="MQTT 密碼")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="統計回報間隔（秒）")
+    parser.add_argument("--duration", type=float, default=None, help="運行時間（秒），默認一直運行")
+    parser.add_argument("--codec", default=CODEC_JSON, choices=CODECS,
+                        help="負載編碼：json（默認）或 msgpack / cbor（需要對應套件，接收端 anchor_recieve 自動識別）")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="不連接代理，以最快速度產生訊息並報告產生速率")
+    return parser.parse_args()
+
+
+def main():
+    """主程式"""
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.scenario:
+        scenario = compile_scenario(args.scenario)
+        logger.info(scenario.summary())
+        gateways = scenario_gateways(scenario, args.stationary_udr)
+        args.gateways = len(gateways)
+        if args.seed is None:
+            args.seed = scenario.seed
+    else:
+        gateways = build_gateways(args.gateways, args.anchors, args.tags, args.diapers, args.watches,
+                                  args.tag_udr, args.stationary_udr, args.seed)
+
+    if not codec_available(args.codec):
+        logger.error(f"{args.codec} 編碼需要安裝 {'msgpack' if args.codec == 'msgpack' else 'cbor2'}")
+        return
+
+    if args.dry_run:
+        run_dry(gateways, args)
+        return
+
+    shards = build_shards(gateways, args.workers, args)
+    config = {"broker": args.broker, "port": args.port, "tls": args.tls,
+              "username": args.username, "password": args.password,
+              "client_prefix": "gw-emu"}
+    logger.info(f"Gateway 模擬器: {args.gateways} 個 Gateway, "
+                f"{sum(len(gw['anchors']) for gw in gateways)} 個 Anchor, "
+                f"{sum(len(gw['tags']) for gw in gateways)} 個 Tag, "
+                f"{len(shards)} 個進程, 代理 {args.broker}:{args.port}")
+    PublisherPool(shards, run_emulator_shard, config,
+                  report_interval=args.report_interval).run(args.duration)
+
+
+if __name__ == "__main__":
+    main()
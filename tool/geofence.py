@@ -0,0 +1,607 @@
+"""
+即時區域佔用與電子圍欄
+消費 UWB/+_Loca 的 TAG location 訊息（x / y / z + quality），
+按 Gateway 所屬樓層把位置歸入區域（房間、浴室、走廊、整個樓層），
+維護每個 Tag 的當前區域並產生 enter / exit / dwell 事件
+
+每個樓層在啟動時把區域多邊形一次性編入均勻網格：
+完全落在某區域內（或所有區域外）的單元直接保存結果，
+被多邊形邊穿過的單元保存少量候選區域，查詢時只對候選做射線法判斷，
+因此每次分類的平均成本為 O(1)，與區域數量無關；區域重疊時面積小的優先（如房間內的浴室）
+
+抖動抑制（hysteresis）：
+  - 位置仍在當前區域邊界約 hysteresis 米的帶狀範圍內（以網格單元為粒度）時保持當前區域
+  - 新區域需連續 confirm 次分類一致才切換
+  - quality 低於 min_quality 的位置不參與判斷
+
+區域文件格式（YAML / JSON，也可作為場景文件中的 zones 段落）：
+
+    data_dir: ../../test-data        # floors.json / gateways.json / anchors.json，默認為專案 test-data
+    cell_size: 0.25                  # 網格單元（米）
+    dwell: 10m                       # 區域默認停留告警時間，0 表示不告警
+    floors:
+      - floor: floor_1763482987693   # floors.json 中的 id 或名稱
+        floor_zone: true             # 另加覆蓋整個樓層的區域，離開時即「離開樓層」（默認 true）
+        zones:
+          - {name: 101房, rect: [-3.0, -4.8, 0.0, -1.5]}
+          - {name: 101浴室, polygon: [[-3.0, -4.8], [-1.8, -4.8], [-1.8, -3.4], [-3.0, -3.4]], dwell: 20m}
+    gateways: {4192540345: floor_1763482987693}   # 額外的 Gateway -> 樓層對應
+
+樓層邊界取自 tag_motion.load_floors（與 Gateway 模擬器的 Tag 活動範圍一致），
+floors.json 沒有區域多邊形，未提供區域文件時每個樓層以其邊界作為唯一區域
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from replay_capture import iter_capture, parse_timestamp
+from scenario import load_scenario, parse_seconds
+from tag_motion import DEFAULT_DATA_DIR, load_floors
+
+DEFAULT_CAPTURE = os.path.join(DEFAULT_DATA_DIR, "mqtt_messages.json")
+
+# 網格單元（米）、邊界帶寬（米）、切換所需的連續一致次數
+DEFAULT_CELL_SIZE = 0.25
+DEFAULT_HYSTERESIS = 0.5
+DEFAULT_CONFIRM = 2
+# 區域默認停留告警時間（秒）
+DEFAULT_DWELL = 600.0
+
+# 不在任何區域內
+OUTSIDE = -1
+
+# 標記邊界單元時的容差（米）：邊恰好落在網格線上時兩側單元都列為候選，寧多勿漏
+EDGE_TOLERANCE = 1e-6
+
+# 事件類型
+EVENT_ENTER = "enter"
+EVENT_EXIT = "exit"
+EVENT_DWELL = "dwell"
+
+
+class Zone:
+    """單個區域：多邊形頂點 (N, 2)、所屬樓層與停留告警時間（0 表示不告警）"""
+
+    def __init__(self, name: str, polygon, floor: str, dwell: float = DEFAULT_DWELL):
+        self.name = name
+        self.polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"區域 {name} 的多邊形至少需要 3 個頂點")
+        self.floor = floor
+        self.dwell = dwell
+        self.vertices = [tuple(point) for point in self.polygon.tolist()]
+        x, y = self.polygon[:, 0], self.polygon[:, 1]
+        self.area = abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))) / 2.0
+        self.bounds = (x.min(), y.min(), x.max(), y.max())
+
+
+def rect_polygon(bounds: Sequence[float]) -> List[Tuple[float, float]]:
+    xmin, ymin, xmax, ymax = (float(value) for value in bounds)
+    return [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+
+
+def point_in_polygon(x: float, y: float, vertices: Sequence[Tuple[float, float]]) -> bool:
+    """射線法判斷單點是否在多邊形內"""
+    inside = False
+    x1, y1 = vertices[-1]
+    for x2, y2 in vertices:
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def points_in_polygon(xs: np.ndarray, ys: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """射線法的向量化版本，逐條邊處理全部點"""
+    inside = np.zeros(xs.shape, dtype=bool)
+    x1, y1 = polygon[-1]
+    for x2, y2 in polygon:
+        if y1 != y2:
+            crosses = (y1 > ys) != (y2 > ys)
+            inside ^= crosses & (xs < (x2 - x1) * (ys - y1) / (y2 - y1) + x1)
+        x1, y1 = x2, y2
+    return inside
+
+
+class ZoneGrid:
+    """
+    單個樓層的均勻網格索引
+
+    answer 為每個單元的分類結果（邊界單元為候選都不命中時的結果），
+    _candidates 只保存被多邊形邊穿過的單元 -> 需精確判斷的區域（按優先順序）；
+    _bands 為各區域邊界帶內的單元集合，用於抖動抑制
+    """
+
+    def __init__(self, floor: str, zones: Sequence[Zone], zone_ids: Sequence[int],
+                 cell_size: float = DEFAULT_CELL_SIZE, hysteresis: float = DEFAULT_HYSTERESIS):
+        """
+        Args:
+            floor: 樓層名稱
+            zones: 樓層內的區域
+            zone_ids: 各區域在引擎中的全域編號
+            cell_size: 網格單元（米）
+            hysteresis: 邊界帶寬（米），0 表示不保持
+        """
+        self.floor = floor
+        self.cell_size = cell_size
+        self.inv_cell = 1.0 / cell_size
+        if zones:
+            self.xmin = min(zone.bounds[0] for zone in zones)
+            self.ymin = min(zone.bounds[1] for zone in zones)
+            xmax = max(zone.bounds[2] for zone in zones)
+            ymax = max(zone.bounds[3] for zone in zones)
+        else:
+            self.xmin = self.ymin = xmax = ymax = 0.0
+        self.nx = max(1, int(math.ceil((xmax - self.xmin) * self.inv_cell)))
+        self.ny = max(1, int(math.ceil((ymax - self.ymin) * self.inv_cell)))
+
+        self._vertices = {zone_id: zone.vertices for zone, zone_id in zip(zones, zone_ids)}
+        self._build(zones, zone_ids, hysteresis)
+
+    def _edge_cells(self, polygon: np.ndarray) -> np.ndarray:
+        """被多邊形邊穿過（含接觸）的單元：邊的外接單元範圍內，四個角不全在邊所在直線同一側"""
+        mask = np.zeros((self.ny, self.nx), dtype=bool)
+        cell = self.cell_size
+        tolerance = EDGE_TOLERANCE
+        x1, y1 = polygon[-1]
+        for x2, y2 in polygon:
+            c0 = max(int(math.floor((min(x1, x2) - tolerance - self.xmin) * self.inv_cell)), 0)
+            c1 = min(int(math.floor((max(x1, x2) + tolerance - self.xmin) * self.inv_cell)), self.nx - 1)
+            r0 = max(int(math.floor((min(y1, y2) - tolerance - self.ymin) * self.inv_cell)), 0)
+            r1 = min(int(math.floor((max(y1, y2) + tolerance - self.ymin) * self.inv_cell)), self.ny - 1)
+            if c0 <= c1 and r0 <= r1:
+                cols = np.arange(c0, c1 + 1)
+                rows = np.arange(r0, r1 + 1)
+                left = self.xmin + cols * cell
+                bottom = self.ymin + rows * cell
+                dx, dy = x2 - x1, y2 - y1
+                sides = [dx * (b[:, None] - y1) - dy * (l[None, :] - x1)
+                         for l in (left, left + cell) for b in (bottom, bottom + cell)]
+                sides = np.stack(sides)
+                slack = tolerance * math.hypot(dx, dy)
+                mask[r0:r1 + 1, c0:c1 + 1] |= (sides.min(axis=0) <= slack) & (sides.max(axis=0) >= -slack)
+            x1, y1 = x2, y2
+        return mask
+
+    @staticmethod
+    def _dilate(mask: np.ndarray, steps: int) -> np.ndarray:
+        for _ in range(steps):
+            grown = mask.copy()
+            grown[1:, :] |= mask[:-1, :]
+            grown[:-1, :] |= mask[1:, :]
+            grown[:, 1:] |= grown[:, :-1].copy()
+            grown[:, :-1] |= grown[:, 1:].copy()
+            mask = grown
+        return mask
+
+    def _build(self, zones: Sequence[Zone], zone_ids: Sequence[int], hysteresis: float):
+        # 單元角點格（ny + 1, nx + 1）
+        xs = self.xmin + np.arange(self.nx + 1) * self.cell_size
+        ys = self.ymin + np.arange(self.ny + 1) * self.cell_size
+        corner_x, corner_y = np.meshgrid(xs, ys)
+
+        answer = np.full((self.ny, self.nx), OUTSIDE, dtype=np.int32)
+        resolved = np.zeros((self.ny, self.nx), dtype=bool)
+        candidates: Dict[int, List[int]] = {}
+        self._bands: Dict[int, frozenset] = {}
+        band_steps = max(0, int(math.ceil(hysteresis * self.inv_cell)) - 1)
+
+        # 按面積從小到大處理，小區域優先
+        for zone, zone_id in sorted(zip(zones, zone_ids), key=lambda item: item[0].area):
+            corners = points_in_polygon(corner_x, corner_y, zone.polygon)
+            all_inside = corners[:-1, :-1] & corners[1:, :-1] & corners[:-1, 1:] & corners[1:, 1:]
+            edges = self._edge_cells(zone.polygon)
+            for cell in np.flatnonzero(edges & ~resolved).tolist():
+                candidates.setdefault(cell, []).append(zone_id)
+            full = all_inside & ~edges & ~resolved
+            answer[full] = zone_id
+            resolved |= full
+            if hysteresis > 0:
+                self._bands[zone_id] = frozenset(np.flatnonzero(self._dilate(edges, band_steps)).tolist())
+
+        self.answer = answer.ravel()
+        self.has_candidates = np.zeros(self.nx * self.ny, dtype=bool)
+        self.has_candidates[list(candidates)] = True
+        self._answer = self.answer.tolist()
+        self._candidates = {cell: tuple(zone_ids) for cell, zone_ids in candidates.items()}
+
+    def _resolve(self, cell: int, x: float, y: float) -> int:
+        for zone_id in self._candidates[cell]:
+            if point_in_polygon(x, y, self._vertices[zone_id]):
+                return zone_id
+        return self._answer[cell]
+
+    def classify_point(self, x: float, y: float) -> Tuple[int, int]:
+        """返回 (區域編號, 單元編號)，網格外為 (OUTSIDE, -1)"""
+        fx = (x - self.xmin) * self.inv_cell
+        fy = (y - self.ymin) * self.inv_cell
+        if fx < 0 or fy < 0 or fx >= self.nx or fy >= self.ny:
+            return OUTSIDE, -1
+        cell = int(fy) * self.nx + int(fx)
+        if cell in self._candidates:
+            return self._resolve(cell, x, y), cell
+        return self._answer[cell], cell
+
+    def classify(self, xs, ys) -> np.ndarray:
+        """批量分類：網格查表向量化，只有落在邊界單元的點逐點精確判斷"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        fx = np.floor((xs - self.xmin) * self.inv_cell)
+        fy = np.floor((ys - self.ymin) * self.inv_cell)
+        inside = (fx >= 0) & (fy >= 0) & (fx < self.nx) & (fy < self.ny)
+        cells = np.where(inside, fy * self.nx + fx, 0).astype(np.int64)
+        result = np.where(inside, self.answer[cells], OUTSIDE)
+        for index in np.flatnonzero(inside & self.has_candidates[cells]).tolist():
+            result[index] = self._resolve(int(cells[index]), float(xs[index]), float(ys[index]))
+        return result
+
+    def in_band(self, zone_id: int, cell: int) -> bool:
+        band = self._bands.get(zone_id)
+        return band is not None and cell in band
+
+    def stats(self) -> Dict:
+        return {"cells": self.nx * self.ny, "boundary_cells": len(self._candidates),
+                "zones": len(self._vertices)}
+
+
+class GeofenceEngine:
+    """
+    多 Tag 電子圍欄
+
+    每個 Tag 保存當前區域、待確認區域與連續次數、進入時間與是否已發出停留事件，
+    以按 Tag 排列的列表保存（單條更新只做少量列表索引）；
+    佇列模式下多個工作執行緒可共用同一引擎
+    """
+
+    def __init__(self, zones: Sequence[Zone], grids: Sequence[ZoneGrid], gateway_floors: Dict[int, int],
+                 confirm: int = DEFAULT_CONFIRM, min_quality: float = 0,
+                 on_event: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            zones: 所有區域（按全域編號排列）
+            grids: 各樓層的網格索引
+            gateway_floors: Gateway ID -> grids 中的樓層索引
+            confirm: 切換區域所需的連續一致次數
+            min_quality: 低於此定位品質的位置忽略
+            on_event: 每個事件的回調
+        """
+        self.zones = list(zones)
+        self.grids = list(grids)
+        self.gateway_floors = dict(gateway_floors)
+        # 只有一個樓層時，未登記的 Gateway 也歸入該樓層
+        self.default_floor = 0 if len(self.grids) == 1 else None
+        self.confirm = max(1, confirm)
+        self.min_quality = min_quality
+        self.on_event = on_event
+
+        self.tag_ids: List = []
+        self._index: Dict = {}
+        self._zone: List[int] = []
+        self._pending: List[int] = []
+        self._pending_count: List[int] = []
+        self._entered: List[float] = []
+        self._dwelled: List[bool] = []
+        self._occupancy = [0] * len(self.zones)
+        self._dwell = [zone.dwell for zone in self.zones]
+
+        self.updates = 0
+        self.events = 0
+        self.low_quality = 0
+        self.unmapped = 0
+        self._lock = threading.Lock()
+
+    def _row(self, key) -> int:
+        row = self._index.get(key)
+        if row is None:
+            row = len(self.tag_ids)
+            self._index[key] = row
+            self.tag_ids.append(key)
+            self._zone.append(OUTSIDE)
+            self._pending.append(OUTSIDE)
+            self._pending_count.append(0)
+            self._entered.append(0.0)
+            self._dwelled.append(False)
+        return row
+
+    def _event(self, kind: str, key, zone_id: int, timestamp: float, x: float, y: float, **extra) -> Dict:
+        zone = self.zones[zone_id]
+        event = {"tag": key, "event": kind, "zone": zone.name, "floor": zone.floor,
+                 "timestamp": timestamp, "x": x, "y": y}
+        event.update(extra)
+        self.events += 1
+        if self.on_event is not None:
+            self.on_event(event)
+        return event
+
+    def update(self, key, floor: int, x: float, y: float, timestamp: float) -> List[Dict]:
+        """以一個位置更新 Tag，返回產生的事件"""
+        grid = self.grids[floor]
+        zone_id, cell = grid.classify_point(x, y)
+        row = self._row(key)
+        current = self._zone[row]
+        self.updates += 1
+
+        # 仍在當前區域的邊界帶內時保持當前區域
+        if zone_id != current and current != OUTSIDE and grid.in_band(current, cell):
+            zone_id = current
+
+        events = []
+        if zone_id == current:
+            self._pending_count[row] = 0
+            dwell = self._dwell[current] if current != OUTSIDE else 0
+            if dwell and not self._dwelled[row] and timestamp - self._entered[row] >= dwell:
+                self._dwelled[row] = True
+                events.append(self._event(EVENT_DWELL, key, current, timestamp, x, y,
+                                          duration=round(timestamp - self._entered[row], 3)))
+            return events
+
+        if zone_id == self._pending[row]:
+            self._pending_count[row] += 1
+        else:
+            self._pending[row] = zone_id
+            self._pending_count[row] = 1
+        if self._pending_count[row] < self.confirm:
+            return events
+
+        if current != OUTSIDE:
+            self._occupancy[current] -= 1
+            events.append(self._event(EVENT_EXIT, key, current, timestamp, x, y,
+                                      duration=round(max(timestamp - self._entered[row], 0.0), 3),
+                                      to=self.zones[zone_id].name if zone_id != OUTSIDE else None))
+        if zone_id != OUTSIDE:
+            self._occupancy[zone_id] += 1
+            events.append(self._event(EVENT_ENTER, key, zone_id, timestamp, x, y,
+                                      **{"from": self.zones[current].name if current != OUTSIDE else None}))
+        self._zone[row] = zone_id
+        self._entered[row] = timestamp
+        self._dwelled[row] = False
+        self._pending[row] = OUTSIDE
+        self._pending_count[row] = 0
+        return events
+
+    # ---- 訊息介面 ----
+
+    def _process(self, message: Dict, recv_ts: float) -> List[Dict]:
+        if message.get("content") != "location" or message.get("node", "TAG") != "TAG":
+            return []
+        position = message.get("position")
+        key = message.get("id")
+        if not position or key is None:
+            return []
+        floor = self.gateway_floors.get(message.get("gateway id"), self.default_floor)
+        if floor is None:
+            self.unmapped += 1
+            return []
+        if self.min_quality and position.get("quality", 100) < self.min_quality:
+            self.low_quality += 1
+            return []
+        try:
+            x = float(position["x"])
+            y = float(position["y"])
+        except (KeyError, TypeError, ValueError):
+            return []
+        return self.update(key, floor, x, y, recv_ts)
+
+    def process(self, message: Dict, recv_ts: Optional[float] = None) -> List[Dict]:
+        """處理單條 location 訊息，其他訊息返回空列表"""
+        if recv_ts is None:
+            recv_ts = time.time()
+        with self._lock:
+            return self._process(message, recv_ts)
+
+    def process_batch(self, messages: Sequence[Dict], recv_ts: Optional[float] = None) -> List[Dict]:
+        """處理一批 location 訊息（如接收端一次取出的佇列內容）"""
+        if recv_ts is None:
+            recv_ts = time.time()
+        events = []
+        with self._lock:
+            for message in messages:
+                events.extend(self._process(message, recv_ts))
+        return events
+
+    # ---- 查詢 ----
+
+    def current_zone(self, key) -> Optional[str]:
+        """Tag 當前所在區域，未見過或不在任何區域時返回 None"""
+        row = self._index.get(key)
+        if row is None or self._zone[row] == OUTSIDE:
+            return None
+        return self.zones[self._zone[row]].name
+
+    def occupancy(self) -> Dict[str, int]:
+        """各區域當前 Tag 數量（樓層/區域 -> 數量）"""
+        return {f"{zone.floor}/{zone.name}": count for zone, count in zip(self.zones, self._occupancy)}
+
+    def stats(self) -> Dict:
+        return {"tags": len(self.tag_ids), "updates": self.updates, "events": self.events,
+                "low_quality": self.low_quality, "unmapped": self.unmapped}
+
+
+def format_event(event: Dict) -> str:
+    """區域事件的單行文字"""
+    text = f"{event['tag']} {event['event']} {event['floor']}/{event['zone']} ({event['x']:g}, {event['y']:g})"
+    if event["event"] == EVENT_EXIT:
+        text += f" 停留 {event['duration']:g}s -> {event.get('to') or '區域外'}"
+    elif event["event"] == EVENT_DWELL:
+        text += f" 已停留 {event['duration']:g}s"
+    elif event.get("from"):
+        text += f" <- {event['from']}"
+    return text
+
+
+def _read_json(data_dir: str, name: str) -> List[Dict]:
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_geofence(path: Optional[str] = None, data_dir: str = DEFAULT_DATA_DIR,
+                  confirm: Optional[int] = None, min_quality: Optional[float] = None,
+                  on_event: Optional[Callable[[Dict], None]] = None) -> GeofenceEngine:
+    """
+    按區域文件（或場景文件的 zones 段落）建立引擎，path 為空時每個樓層以其邊界作為唯一區域
+
+    confirm / min_quality 為 None 時取文件中的設置或默認值
+    """
+    spec: Dict = {}
+    base_dir = os.getcwd()
+    if path:
+        spec = load_scenario(path)
+        if isinstance(spec.get("zones"), dict):
+            spec = spec["zones"]
+        base_dir = os.path.dirname(os.path.abspath(path))
+    if spec.get("data_dir"):
+        data_dir = os.path.join(base_dir, spec["data_dir"])
+
+    cell_size = float(spec.get("cell_size", DEFAULT_CELL_SIZE))
+    hysteresis = float(spec.get("hysteresis", DEFAULT_HYSTERESIS))
+    default_dwell = parse_seconds(spec.get("dwell", DEFAULT_DWELL))
+    geometries = load_floors(data_dir)
+    floor_specs = spec.get("floors") or [{"floor": geometry.floor_id} for geometry in geometries]
+
+    zones: List[Zone] = []
+    grids: List[ZoneGrid] = []
+    floor_index: Dict[str, int] = {}
+    for entry in floor_specs:
+        key = str(entry["floor"])
+        geometry = next((g for g in geometries
+                         if key in (g.floor_id, g.name) or g.name.startswith(f"{key}(")), None)
+        if geometry is None and "bounds" not in entry:
+            raise ValueError(f"找不到樓層 {key}，請在 floors.json 中登記或為其指定 bounds")
+        name = geometry.name if geometry is not None else key
+        bounds = entry.get("bounds", geometry.bounds if geometry is not None else None)
+
+        floor_zones = []
+        for zone in entry.get("zones", []):
+            polygon = rect_polygon(zone["rect"]) if "rect" in zone else zone["polygon"]
+            floor_zones.append(Zone(zone["name"], polygon, name,
+                                    parse_seconds(zone.get("dwell", default_dwell))))
+        if entry.get("floor_zone", True):
+            floor_zones.append(Zone(name, rect_polygon(bounds), name,
+                                    parse_seconds(entry.get("floor_dwell", 0))))
+        zone_ids = list(range(len(zones), len(zones) + len(floor_zones)))
+        zones.extend(floor_zones)
+        floor_index[key] = len(grids)
+        if geometry is not None and geometry.floor_id:
+            floor_index[geometry.floor_id] = len(grids)
+        grids.append(ZoneGrid(name, floor_zones, zone_ids, float(entry.get("cell_size", cell_size)),
+                              hysteresis))
+
+    gateway_floors = {}
+    for gateway in _read_json(data_dir, "gateways.json"):
+        if gateway.get("cloud_gateway_id") is not None and gateway.get("floorId") in floor_index:
+            gateway_floors[int(gateway["cloud_gateway_id"])] = floor_index[gateway["floorId"]]
+    for gateway_id, floor in (spec.get("gateways") or {}).items():
+        if str(floor) not in floor_index:
+            raise ValueError(f"Gateway {gateway_id} 對應的樓層 {floor} 不在區域文件中")
+        gateway_floors[int(gateway_id)] = floor_index[str(floor)]
+
+    return GeofenceEngine(zones, grids, gateway_floors,
+                          confirm=int(spec.get("confirm", DEFAULT_CONFIRM)) if confirm is None else confirm,
+                          min_quality=float(spec.get("min_quality", 0)) if min_quality is None else min_quality,
+                          on_event=on_event)
+
+
+def describe(engine: GeofenceEngine) -> str:
+    parts = []
+    for grid in engine.grids:
+        stats = grid.stats()
+        parts.append(f"{grid.floor}: {stats['zones']} 個區域, 網格 {grid.nx}x{grid.ny} "
+                     f"(邊界單元 {stats['boundary_cells']})")
+    return "; ".join(parts)
+
+
+def run_benchmark(capture: str, zones_path: Optional[str], tags: int, updates: int,
+                  seed: Optional[int] = None):
+    """
+    以抓包中的 location 訊息測量更新速率 (updates/s)
+
+    抓包只有少量 Tag，因此把每條 location 訊息複製為 tags 個 Tag（各自加固定偏移與定位抖動），
+    按時間順序重放，直到累計 updates 次更新
+    """
+    records = [record for record in iter_capture(capture)
+               if record["message"].get("content") == "location"]
+    if not records:
+        raise ValueError(f"{capture} 中沒有 location 訊息")
+    rng = np.random.default_rng(seed)
+    offsets = rng.normal(0.0, 0.5, (tags, 2))
+    messages = []
+    stamps = []
+    for record in records:
+        message = record["message"]
+        position = message["position"]
+        jitter = rng.normal(0.0, 0.1, (tags, 2))
+        xs = (position["x"] + offsets[:, 0] + jitter[:, 0]).round(2).tolist()
+        ys = (position["y"] + offsets[:, 1] + jitter[:, 1]).round(2).tolist()
+        stamp = parse_timestamp(record["timestamp"])
+        for tag in range(tags):
+            copy = dict(message, id=message["id"] + tag)
+            copy["position"] = dict(position, x=xs[tag], y=ys[tag])
+            messages.append(copy)
+            stamps.append(stamp)
+    span = stamps[-1] - stamps[0] + 1.0
+
+    kinds: Dict[str, int] = {}
+
+    def count_event(event):
+        kinds[event["event"]] = kinds.get(event["event"], 0) + 1
+
+    engine = load_geofence(zones_path, on_event=count_event)
+    print(f"基準測試: 抓包 {len(records)} 條 location x {tags} 個 Tag, 共 {updates} 次更新")
+    print(f"  {describe(engine)}")
+
+    count = 0
+    loop = 0
+    start = time.perf_counter()
+    while count < updates:
+        shift = loop * span
+        for message, stamp in zip(messages, stamps):
+            engine.process(message, stamp + shift)
+        count += len(messages)
+        loop += 1
+    elapsed = time.perf_counter() - start
+    stats = engine.stats()
+    print(f"  逐條訊息: {count / elapsed:,.0f} updates/s, 事件 {stats['events']} "
+          f"({', '.join(f'{kind} {number}' for kind, number in sorted(kinds.items()))}), "
+          f"當前在區域內 {sum(engine.occupancy().values())} / {stats['tags']} 個 Tag")
+
+    floor = engine.default_floor if engine.default_floor is not None else 0
+    grid = engine.grids[floor]
+    xs = np.array([message["position"]["x"] for message in messages])
+    ys = np.array([message["position"]["y"] for message in messages])
+    start = time.perf_counter()
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        grid.classify_point(x, y)
+    elapsed = time.perf_counter() - start
+    print(f"  單點分類: {len(xs) / elapsed:,.0f} points/s")
+    start = time.perf_counter()
+    grid.classify(xs, ys)
+    elapsed = time.perf_counter() - start
+    print(f"  陣列分類: {len(xs) / elapsed:,.0f} points/s")
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="電子圍欄基準測試")
+    parser.add_argument("--zones", default=None, help="區域文件 (YAML/JSON)，默認以樓層邊界作為區域")
+    parser.add_argument("--capture", default=DEFAULT_CAPTURE, help="抓包文件路徑")
+    parser.add_argument("--tags", type=int, default=1000, help="每條 location 訊息複製的 Tag 數量")
+    parser.add_argument("--updates", type=int, default=1000000, help="更新次數")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 開始基準測試")
+    run_benchmark(args.capture, args.zones, args.tags, args.updates, args.seed)
@@ -0,0 +1,423 @@
+"""
+串流健康異常偵測
+消費健康訊息（300B 手環的 hr / SpO2 / bp syst / bp diast / skin temp，
+以及模擬器 health/data 的 heart_rate / temperature），
+以按住民 × 指標排列的預分配陣列維護滑動窗口的平均、方差、最小與最大值（每次更新 O(1)），
+並在讀數到達的當下產生告警事件：越過正常範圍、連續 N 次偏高/偏低、z-score 突變
+"""
+
+import argparse
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 偵測的指標（陣列中的列順序）
+METRICS = ("hr", "SpO2", "bp syst", "bp diast", "skin temp")
+# 其他來源的欄位名 -> 指標
+FIELD_ALIASES = {"heart_rate": "hr", "temperature": "skin temp"}
+
+# 正常範圍（與前端 healthStore 的 NORMAL_RANGES 一致）
+NORMAL_RANGES = {
+    "hr": (60, 100),
+    "SpO2": (95, 100),
+    "bp syst": (90, 140),
+    "bp diast": (60, 90),
+    "skin temp": (36.0, 37.5),
+}
+
+# 告警類型
+ALERT_HIGH = "high"
+ALERT_LOW = "low"
+ALERT_NORMAL = "normal"
+ALERT_SUSTAINED_HIGH = "sustained_high"
+ALERT_SUSTAINED_LOW = "sustained_low"
+ALERT_SPIKE = "spike"
+
+# 標準差低於此值時不計算 z-score
+MIN_STD = 1e-6
+
+_FIELDS = {name: column for column, name in enumerate(METRICS)}
+_FIELDS.update({alias: _FIELDS[name] for alias, name in FIELD_ALIASES.items()})
+
+
+def resident_key(message: Dict):
+    """健康訊息所屬住民的鍵：300B 手環為 MAC，模擬器訊息為 id"""
+    key = message.get("MAC")
+    if key is None:
+        key = message.get("id")
+    return key
+
+
+def health_values(message: Dict) -> Optional[List[float]]:
+    """按 METRICS 順序取出讀數，缺少的指標為 NaN；不含任何指標時返回 None"""
+    values = [np.nan] * len(METRICS)
+    found = False
+    for field, column in _FIELDS.items():
+        value = message.get(field)
+        if value is None:
+            continue
+        try:
+            values[column] = float(value)
+            found = True
+        except (TypeError, ValueError):
+            continue
+    return values if found else None
+
+
+class HealthAnomalyDetector:
+    """
+    多住民滑動窗口異常偵測器
+
+    每個 住民 × 指標 為一個單元，保存最近 window 條讀數的環形緩衝、
+    窗口總和與平方和（平均、方差）以及按 window 分塊的前綴/後綴極值
+    （van Herk / Gil-Werman 方法：窗口最小值 = 上一塊的後綴最小值 與 本塊的前綴最小值 取小），
+    後綴極值在每塊寫滿時計算一次，因此每條讀數的攤銷成本為 O(1)；
+    update() 以向量化方式一次處理一批讀數，只為觸發告警的讀數建立事件；
+    佇列模式下多個工作執行緒可共用同一偵測器
+    """
+
+    def __init__(self, window: int = 32, consecutive: int = 3, z_threshold: float = 3.0,
+                 min_samples: int = 10, ranges: Optional[Dict] = None, initial_residents: int = 0,
+                 on_alert: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            window: 每個指標的滑動窗口讀數數量
+            consecutive: 連續多少次超出範圍視為持續異常
+            z_threshold: z-score 突變閾值（相對於窗口內已有讀數）
+            min_samples: 計算 z-score 所需的最少讀數
+            ranges: 覆蓋 NORMAL_RANGES 的 {指標: (下限, 上限)}
+            initial_residents: 預先分配的住民列數
+            on_alert: 每個告警事件的回調
+        """
+        if window <= 1:
+            raise ValueError("window 必須大於 1")
+        self.window = window
+        self.consecutive = consecutive
+        self.z_threshold = z_threshold
+        self.min_samples = max(2, min(min_samples, window))
+        self.on_alert = on_alert
+
+        limits = dict(NORMAL_RANGES)
+        limits.update(ranges or {})
+        self.low = np.array([limits[name][0] for name in METRICS], dtype=np.float64)
+        self.high = np.array([limits[name][1] for name in METRICS], dtype=np.float64)
+
+        self.resident_ids: List = []
+        self._index: Dict = {}
+        self.readings = 0
+        self.alerts = 0
+        self._lock = threading.Lock()
+        self._allocate(max(initial_residents, 1))
+
+    def _allocate(self, rows: int):
+        """分配（或擴充到）rows 個住民的儲存空間，陣列按單元 row * 指標數 + 指標 展平"""
+        cells = rows * len(METRICS)
+        window = self.window
+        arrays = {
+            "ring": np.zeros((cells, window)),
+            "suffix_min": np.full((cells, window), np.inf),
+            "suffix_max": np.full((cells, window), -np.inf),
+            "prefix_min": np.full(cells, np.inf),
+            "prefix_max": np.full(cells, -np.inf),
+            "window_min": np.full(cells, np.nan),
+            "window_max": np.full(cells, np.nan),
+            "total": np.zeros(cells),
+            "total_sq": np.zeros(cells),
+            "count": np.zeros(cells, dtype=np.int64),
+            "run": np.zeros(cells, dtype=np.int32),        # 正數為連續偏高次數，負數為連續偏低
+            "level": np.zeros(cells, dtype=np.int8),       # 上一條讀數: 1 偏高 / -1 偏低 / 0 正常
+            "last_ts": np.zeros(cells),
+        }
+        used = len(self.resident_ids) * len(METRICS)
+        for name, array in arrays.items():
+            if used:
+                array[:used] = getattr(self, name)[:used]
+            setattr(self, name, array)
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self.resident_ids)
+
+    def add_residents(self, keys: Sequence) -> np.ndarray:
+        """登記新住民，返回其所在列"""
+        with self._lock:
+            return self._add_residents(keys)
+
+    def _add_residents(self, keys: Sequence) -> np.ndarray:
+        start = len(self.resident_ids)
+        end = start + len(keys)
+        if end > self._rows:
+            rows = self._rows
+            while rows < end:
+                rows *= 2
+            self._allocate(rows)
+        for offset, key in enumerate(keys):
+            self._index[key] = start + offset
+        self.resident_ids.extend(keys)
+        return np.arange(start, end, dtype=np.int64)
+
+    def rows_for(self, keys: Sequence) -> np.ndarray:
+        """返回住民所在列，未登記的住民自動登記"""
+        index = self._index
+        with self._lock:
+            missing = [key for key in dict.fromkeys(keys) if key not in index]
+            if missing:
+                self._add_residents(missing)
+            return np.fromiter((index[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    # ---- 更新 ----
+
+    def update(self, rows, values, timestamp=None) -> List[Dict]:
+        """
+        處理一批讀數
+
+        Args:
+            rows: 住民列索引，長度 n
+            values: (n, len(METRICS)) 讀數，NaN 表示該條讀數不含此指標
+            timestamp: 讀數時間（epoch 秒），標量或長度 n 的陣列，默認為當前時間
+
+        Returns:
+            本批觸發的告警事件
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(rows), len(METRICS))
+        if timestamp is None:
+            timestamp = time.time()
+        timestamps = np.broadcast_to(np.asarray(timestamp, dtype=np.float64), rows.shape)
+
+        present_row, metric = np.nonzero(~np.isnan(values))
+        cells = rows[present_row] * len(METRICS) + metric
+        readings = values[present_row, metric]
+        stamps = timestamps[present_row]
+
+        events: List[Dict] = []
+        with self._lock:
+            self.readings += len(cells)
+            # 同一單元在一批中出現多次時分輪處理，保持讀數順序
+            while len(cells):
+                unique, first = np.unique(cells, return_index=True)
+                if len(unique) == len(cells):
+                    self._update_cells(cells, readings, stamps, events)
+                    break
+                first.sort()
+                self._update_cells(cells[first], readings[first], stamps[first], events)
+                rest = np.ones(len(cells), dtype=bool)
+                rest[first] = False
+                cells, readings, stamps = cells[rest], readings[rest], stamps[rest]
+        if self.on_alert:
+            for event in events:
+                self.on_alert(event)
+        return events
+
+    def _update_cells(self, cells: np.ndarray, values: np.ndarray, stamps: np.ndarray,
+                      events: List[Dict]):
+        """以向量化運算更新互不重複的單元"""
+        window = self.window
+        count = self.count[cells]
+        position = count % window
+        filled = np.minimum(count, window)
+
+        # z-score 相對於加入本讀數之前的窗口
+        total = self.total[cells]
+        total_sq = self.total_sq[cells]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / filled
+            std = np.sqrt(np.maximum(total_sq / filled - mean * mean, 0.0))
+            z = np.where((filled >= self.min_samples) & (std > MIN_STD), (values - mean) / std, 0.0)
+
+        # 窗口總和：寫滿後扣除被覆蓋的讀數
+        evicted = np.where(count >= window, self.ring[cells, position], 0.0)
+        self.total[cells] = total + values - evicted
+        self.total_sq[cells] = total_sq + values * values - evicted * evicted
+        self.ring[cells, position] = values
+
+        # 極值：本塊前綴 與 上一塊 position + 1 起的後綴
+        block_start = position == 0
+        prefix_min = np.where(block_start, values, np.minimum(self.prefix_min[cells], values))
+        prefix_max = np.where(block_start, values, np.maximum(self.prefix_max[cells], values))
+        self.prefix_min[cells] = prefix_min
+        self.prefix_max[cells] = prefix_max
+        following = np.minimum(position + 1, window - 1)
+        has_suffix = position + 1 < window
+        self.window_min[cells] = np.where(
+            has_suffix, np.minimum(prefix_min, self.suffix_min[cells, following]), prefix_min)
+        self.window_max[cells] = np.where(
+            has_suffix, np.maximum(prefix_max, self.suffix_max[cells, following]), prefix_max)
+        self.count[cells] = count + 1
+        self.last_ts[cells] = stamps
+
+        # 塊寫滿：計算後綴極值，並以整塊重算總和消除浮點累積誤差
+        completed = cells[position == window - 1]
+        if len(completed):
+            block = self.ring[completed]
+            self.suffix_min[completed] = np.minimum.accumulate(block[:, ::-1], axis=1)[:, ::-1]
+            self.suffix_max[completed] = np.maximum.accumulate(block[:, ::-1], axis=1)[:, ::-1]
+            self.total[completed] = block.sum(axis=1)
+            self.total_sq[completed] = (block * block).sum(axis=1)
+
+        # 範圍與連續異常
+        metric = cells % len(METRICS)
+        level = np.where(values > self.high[metric], 1, np.where(values < self.low[metric], -1, 0))
+        level = level.astype(np.int8)
+        previous_level = self.level[cells]
+        run = self.run[cells]
+        run = np.where(level == 0, 0, np.where(np.sign(run) == level, run + level, level))
+        self.run[cells] = run
+        self.level[cells] = level
+
+        crossed = level != previous_level
+        sustained = np.abs(run) == self.consecutive
+        spike = np.abs(z) >= self.z_threshold
+        triggered = np.flatnonzero(crossed | sustained | spike)
+        if not len(triggered):
+            return
+        self._emit(cells, values, stamps, z, level, crossed, sustained, spike, triggered, events)
+
+    def _emit(self, cells, values, stamps, z, level, crossed, sustained, spike, triggered, events):
+        """為觸發告警的讀數建立事件"""
+        count = len(METRICS)
+        for i in triggered.tolist():
+            cell = int(cells[i])
+            alerts = []
+            if crossed[i]:
+                alerts.append({1: ALERT_HIGH, -1: ALERT_LOW, 0: ALERT_NORMAL}[int(level[i])])
+            if sustained[i]:
+                alerts.append(ALERT_SUSTAINED_HIGH if level[i] > 0 else ALERT_SUSTAINED_LOW)
+            if spike[i]:
+                alerts.append(ALERT_SPIKE)
+            event = {
+                "resident": self.resident_ids[cell // count],
+                "metric": METRICS[cell % count],
+                "alerts": alerts,
+                "value": float(values[i]),
+                "timestamp": float(stamps[i]),
+                "z": round(float(z[i]), 2),
+                "consecutive": abs(int(self.run[cell])),
+            }
+            event.update(self._cell_stats(cell))
+            events.append(event)
+            self.alerts += 1
+
+    # ---- 訊息介面 ----
+
+    def process(self, message: Dict, recv_ts: Optional[float] = None) -> List[Dict]:
+        """處理單條健康訊息，不含健康指標的訊息返回空列表"""
+        values = health_values(message)
+        key = resident_key(message)
+        if values is None or key is None:
+            return []
+        return self.update(self.rows_for([key]), [values], recv_ts)
+
+    def process_batch(self, messages: Sequence[Dict], recv_ts: Optional[float] = None) -> List[Dict]:
+        """處理一批健康訊息（如接收端一次取出的佇列內容）"""
+        keys = []
+        values = []
+        for message in messages:
+            readings = health_values(message)
+            key = resident_key(message)
+            if readings is not None and key is not None:
+                keys.append(key)
+                values.append(readings)
+        if not keys:
+            return []
+        return self.update(self.rows_for(keys), values, recv_ts)
+
+    # ---- 查詢 ----
+
+    def _cell_stats(self, cell: int) -> Dict:
+        filled = min(int(self.count[cell]), self.window)
+        if not filled:
+            return {"count": 0}
+        mean = self.total[cell] / filled
+        variance = max(self.total_sq[cell] / filled - mean * mean, 0.0)
+        return {
+            "count": filled,
+            "mean": round(float(mean), 2),
+            "std": round(float(np.sqrt(variance)), 2),
+            "min": float(self.window_min[cell]),
+            "max": float(self.window_max[cell]),
+        }
+
+    def window_stats(self, key) -> Optional[Dict[str, Dict]]:
+        """住民各指標的窗口統計，未登記時返回 None"""
+        row = self._index.get(key)
+        if row is None:
+            return None
+        base = row * len(METRICS)
+        with self._lock:
+            return {name: self._cell_stats(base + column) for column, name in enumerate(METRICS)}
+
+    def stats(self) -> Dict:
+        return {"residents": len(self.resident_ids), "readings": self.readings, "alerts": self.alerts}
+
+
+def format_alert(event: Dict) -> str:
+    """告警事件的單行文字"""
+    return (f"{event['resident']} {event['metric']}={event['value']:g} "
+            f"[{', '.join(event['alerts'])}] 窗口平均 {event.get('mean', 'N/A')} "
+            f"z={event['z']} 連續 {event['consecutive']}")
+
+
+def run_benchmark(residents: int, readings: int, batch_size: int, seed: Optional[int] = None):
+    """以合成的 300B 訊息測量偵測速率 (readings/s)"""
+    rng = np.random.default_rng(seed)
+    keys = [f"E0:0E:08:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}"
+            for i in range(residents)]
+    means = np.array([75, 97, 120, 78, 36.6])
+    spreads = np.array([6, 1.2, 8, 5, 0.3])
+    samples = rng.normal(means, spreads, (readings, len(METRICS)))
+    # 約 2% 的讀數注入異常
+    anomalies = rng.random(readings) < 0.02
+    samples[anomalies] += spreads * rng.choice([-6, 6], (int(anomalies.sum()), len(METRICS)))
+    samples = np.round(samples, 1)
+    rows = np.arange(readings) % residents
+
+    print(f"基準測試: {residents} 個住民, {readings} 條讀數, 每批 {batch_size} 條")
+    detector = HealthAnomalyDetector(initial_residents=residents)
+    detector.add_residents(keys)
+    start = time.perf_counter()
+    alerts = 0
+    for offset in range(0, readings, batch_size):
+        alerts += len(detector.update(rows[offset:offset + batch_size],
+                                      samples[offset:offset + batch_size], 0.0))
+    elapsed = time.perf_counter() - start
+    print(f"  陣列輸入: {readings / elapsed:,.0f} readings/s "
+          f"({len(METRICS) * readings / elapsed:,.0f} 指標值/s), 告警 {alerts}")
+
+    messages = [dict(zip(METRICS, sample), MAC=keys[row], content="300B")
+                for row, sample in zip(rows.tolist(), samples.tolist())]
+    detector = HealthAnomalyDetector(initial_residents=residents)
+    start = time.perf_counter()
+    alerts = 0
+    for offset in range(0, readings, batch_size):
+        alerts += len(detector.process_batch(messages[offset:offset + batch_size], 0.0))
+    elapsed = time.perf_counter() - start
+    print(f"  訊息輸入: {readings / elapsed:,.0f} readings/s "
+          f"({len(METRICS) * readings / elapsed:,.0f} 指標值/s), 告警 {alerts}")
+
+    detector = HealthAnomalyDetector(initial_residents=residents)
+    count = min(readings, 20000)
+    start = time.perf_counter()
+    for message in messages[:count]:
+        detector.process(message, 0.0)
+    elapsed = time.perf_counter() - start
+    print(f"  逐條訊息: {count / elapsed:,.0f} readings/s")
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="串流健康異常偵測基準測試")
+    parser.add_argument("--residents", type=int, default=10000, help="住民數量")
+    parser.add_argument("--readings", type=int, default=1000000, help="讀數數量")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批讀數數量")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 開始基準測試")
+    run_benchmark(args.residents, args.readings, args.batch_size, args.seed)
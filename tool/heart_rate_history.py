@@ -0,0 +1,201 @@
+"""
+心率歷史環形緩衝區
+以按用戶排列的固定容量陣列保存最近 N 條讀數（心率、epoch 毫秒時間戳、
+按位壓縮的異常標記），並以 O(1) 增量維護窗口總和、近期總和與異常計數
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# 快照保存的陣列
+STATE_ARRAYS = ("values", "timestamps", "flags", "write_pos", "size", "window_sum",
+                "recent_sum", "abnormal_count", "base_heart_rate", "last_heart_rate")
+
+
+class HeartRateHistory:
+    """
+    多用戶心率環形緩衝區
+
+    每個用戶佔一列，寫入位置與已存數量按列記錄；
+    覆蓋舊讀數時同步扣除其對總和與異常計數的貢獻，
+    因此統計查詢不需要重新掃描歷史
+    """
+
+    def __init__(self, capacity: int = 100, recent: int = 10, initial_users: int = 0):
+        """
+        Args:
+            capacity: 每個用戶保存的讀數數量
+            recent: 近期平均使用的讀數數量（不超過 capacity）
+            initial_users: 預先分配的用戶列數
+        """
+        if capacity <= 0:
+            raise ValueError("capacity 必須大於 0")
+        self.capacity = capacity
+        self.recent = max(1, min(recent, capacity))
+        self.user_ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._allocate(max(initial_users, 1))
+
+    def _allocate(self, rows: int):
+        """分配（或擴充到）rows 列的儲存空間"""
+        capacity = self.capacity
+        flag_bytes = (capacity + 7) // 8
+        arrays = {
+            "values": np.zeros((rows, capacity), dtype=np.int16),
+            "timestamps": np.zeros((rows, capacity), dtype=np.int64),
+            "flags": np.zeros((rows, flag_bytes), dtype=np.uint8),
+            "write_pos": np.zeros(rows, dtype=np.int32),
+            "size": np.zeros(rows, dtype=np.int32),
+            "window_sum": np.zeros(rows, dtype=np.int64),
+            "recent_sum": np.zeros(rows, dtype=np.int64),
+            "abnormal_count": np.zeros(rows, dtype=np.int32),
+            "base_heart_rate": np.zeros(rows, dtype=np.int16),
+            "last_heart_rate": np.zeros(rows, dtype=np.int16),
+        }
+        used = len(self.user_ids)
+        for name, array in arrays.items():
+            if used:
+                array[:used] = getattr(self, name)[:used]
+            setattr(self, name, array)
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def index_of(self, user_id: str) -> Optional[int]:
+        """返回用戶所在列，未登記時返回 None"""
+        return self._index.get(user_id)
+
+    def add_users(self, user_ids: Sequence[str], base_heart_rates) -> np.ndarray:
+        """
+        登記新用戶及其基礎心率
+
+        Returns:
+            新用戶所在列的索引陣列
+        """
+        start = len(self.user_ids)
+        end = start + len(user_ids)
+        if end > self._rows:
+            rows = self._rows
+            while rows < end:
+                rows *= 2
+            self._allocate(rows)
+
+        for offset, user_id in enumerate(user_ids):
+            if user_id in self._index:
+                raise ValueError(f"用戶 {user_id} 已登記")
+            self._index[user_id] = start + offset
+        self.user_ids.extend(user_ids)
+        self.base_heart_rate[start:end] = base_heart_rates
+        return np.arange(start, end)
+
+    def ensure_users(self, user_ids: Sequence[str], base_heart_rates) -> np.ndarray:
+        """
+        返回用戶所在列，未登記的用戶以對應的基礎心率登記
+
+        從快照恢復後沿用已保存的基礎心率與歷史讀數
+        """
+        base_heart_rates = np.asarray(base_heart_rates)
+        rows = np.fromiter((self._index.get(user_id, -1) for user_id in user_ids),
+                           dtype=np.int64, count=len(user_ids))
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            rows[missing] = self.add_users([user_ids[i] for i in missing.tolist()],
+                                           base_heart_rates[missing])
+        return rows
+
+    def state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """返回已登記用戶的陣列與元數據，供 state_file.save_state 寫入快照"""
+        used = len(self.user_ids)
+        arrays = {name: getattr(self, name)[:used] for name in STATE_ARRAYS}
+        meta = {"capacity": self.capacity, "recent": self.recent, "user_ids": self.user_ids}
+        return arrays, meta
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict) -> "HeartRateHistory":
+        """由快照恢復，陣列可以是 np.memmap（在首次擴充前直接使用映射）"""
+        history = cls(meta["capacity"], meta["recent"])
+        user_ids = list(meta["user_ids"])
+        if not user_ids:
+            return history
+        for name in STATE_ARRAYS:
+            setattr(history, name, arrays[name])
+        history.user_ids = user_ids
+        history._index = {user_id: row for row, user_id in enumerate(user_ids)}
+        history._rows = len(user_ids)
+        return history
+
+    def push(self, index: int, heart_rate: int, timestamp_ms: int, abnormal: bool):
+        """寫入單個用戶的一條讀數"""
+        self.push_batch(np.array([index]), np.array([heart_rate]),
+                        timestamp_ms, np.array([abnormal]))
+
+    def push_batch(self, indices, heart_rates, timestamp_ms, abnormal):
+        """
+        批量寫入讀數，indices 在同一批內不可重複
+
+        Args:
+            indices: 用戶列索引陣列
+            heart_rates: 與 indices 對應的心率
+            timestamp_ms: epoch 毫秒時間戳，可為單一值或陣列
+            abnormal: 與 indices 對應的異常標記
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.asarray(heart_rates, dtype=np.int64)
+        flags_in = np.asarray(abnormal, dtype=np.uint8)
+        capacity = self.capacity
+
+        pos = self.write_pos[indices].astype(np.int64)
+        size = self.size[indices]
+        full = size >= capacity
+
+        # 扣除被覆蓋讀數的貢獻
+        overwritten = self.values[indices, pos].astype(np.int64)
+        self.window_sum[indices] += values - np.where(full, overwritten, 0)
+
+        recent_pos = (pos - self.recent) % capacity
+        leaving = self.values[indices, recent_pos].astype(np.int64)
+        self.recent_sum[indices] += values - np.where(size >= self.recent, leaving, 0)
+
+        byte = pos >> 3
+        bit = (pos & 7).astype(np.uint8)
+        packed = self.flags[indices, byte]
+        old_flag = (packed >> bit) & 1
+        self.abnormal_count[indices] += (flags_in.astype(np.int64) -
+                                         np.where(full, old_flag, 0).astype(np.int64))
+        self.flags[indices, byte] = (packed & ~(np.uint8(1) << bit)) | (flags_in << bit)
+
+        self.values[indices, pos] = values
+        self.timestamps[indices, pos] = timestamp_ms
+        self.write_pos[indices] = (pos + 1) % capacity
+        self.size[indices] = np.minimum(size + 1, capacity)
+        self.last_heart_rate[indices] = values
+
+    def recent_mean(self, indices=None) -> np.ndarray:
+        """最近 recent 條讀數的平均心率，沒有讀數時為 nan"""
+        if indices is None:
+            indices = slice(0, len(self.user_ids))
+        count = np.minimum(self.size[indices], self.recent)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.recent_sum[indices] / count
+
+    def window_mean(self, indices=None) -> np.ndarray:
+        """整個窗口的平均心率，沒有讀數時為 nan"""
+        if indices is None:
+            indices = slice(0, len(self.user_ids))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.window_sum[indices] / self.size[indices]
+
+    def readings(self, index: int) -> Dict[str, np.ndarray]:
+        """按時間順序（舊到新）返回單個用戶的窗口讀數"""
+        size = int(self.size[index])
+        start = (int(self.write_pos[index]) - size) % self.capacity
+        order = (start + np.arange(size)) % self.capacity
+        flags = np.unpackbits(self.flags[index], bitorder="little")[:self.capacity]
+        return {
+            "heart_rate": self.values[index, order],
+            "timestamp": self.timestamps[index, order],
+            "is_abnormal": flags[order].astype(bool)
+        }
@@ -0,0 +1,388 @@
+"""
+接收訊息的批量持久化
+把解析後的訊息按主題分類（location / health / config / heartbeat / message），
+在記憶體中累積成按數量或時間界定的批次，再以批量插入寫入後端：
+SQLite（WAL 模式、executemany）與可選的 Parquet 列式文件（按行數或時間輪換）
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Sequence
+
+from device_state import device_key
+
+# 可選的列式輸出依賴
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 主題後綴 -> 表名，Message 主題按 content 再區分心跳與其他訊息
+TOPIC_TABLES = {
+    "Loca": "location",
+    "Health": "health",
+    "TagConf": "config",
+    "AncConf": "config",
+    "Message": "message",
+    "Gateway": "message",
+}
+HEARTBEAT_CONTENT = "heartbeat"
+
+COMMON_COLUMNS = (
+    ("ts", "INTEGER"),          # 接收時間 epoch 毫秒
+    ("gateway_id", "INTEGER"),
+    ("node", "TEXT"),
+    ("device_id", "TEXT"),      # id，沒有 id 的設備為 MAC 或 name
+    ("content", "TEXT"),
+    ("serial_no", "INTEGER"),
+    ("topic", "TEXT"),
+    ("payload", "TEXT"),        # 完整訊息 JSON
+)
+
+# 各表在公共欄位之後的專用欄位
+TABLE_COLUMNS = {
+    "location": COMMON_COLUMNS + (("x", "REAL"), ("y", "REAL"), ("z", "REAL"),
+                                  ("quality", "INTEGER")),
+    "health": COMMON_COLUMNS + (("battery_level", "INTEGER"),),
+    "config": COMMON_COLUMNS,
+    "heartbeat": COMMON_COLUMNS,
+    "message": COMMON_COLUMNS,
+}
+
+
+def table_for(topic: str, message: Dict) -> Optional[str]:
+    """按主題後綴與 content 決定寫入的表，不持久化的主題（如 Dwlink）返回 None"""
+    suffix = topic.rsplit("_", 1)[-1]
+    table = TOPIC_TABLES.get(suffix)
+    if table == "message" and message.get("content") == HEARTBEAT_CONTENT:
+        return "heartbeat"
+    return table
+
+
+def to_row(table: str, topic: str, message: Dict, recv_ts: float, payload=None) -> tuple:
+    """
+    把訊息轉為對應表的一行
+
+    payload 為收到的原始 JSON（bytes 或 str）時直接保存，省去重新編碼；
+    msgpack / CBOR 負載（首字節不低於 0x80）轉存為 JSON
+    """
+    if isinstance(payload, bytes):
+        payload = None if payload[:1] >= b"\x80" else payload.decode('utf-8', 'replace')
+    if payload is None:
+        payload = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+    gateway_id, node, device_id = device_key(message)
+    serial = message.get("serial no")
+    row = (
+        int(recv_ts * 1000),
+        gateway_id if isinstance(gateway_id, int) else None,
+        node,
+        None if device_id is None else str(device_id),
+        message.get("content"),
+        serial if isinstance(serial, int) else None,
+        topic,
+        payload,
+    )
+    if table == "location":
+        position = message.get("position") or {}
+        row += (position.get("x"), position.get("y"), position.get("z"), position.get("quality"))
+    elif table == "health":
+        row += (message.get("battery level"),)
+    return row
+
+
+class SQLiteSink:
+    """
+    SQLite 後端
+
+    每個表一條預先組好的 INSERT 語句，一個批次在單個事務內以 executemany 寫入；
+    WAL 模式下讀取方（如儀表板查詢）不會阻塞寫入
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.statements: Dict[str, str] = {}
+        for table, columns in TABLE_COLUMNS.items():
+            definition = ", ".join(f'"{name}" {kind}' for name, kind in columns)
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({definition})')
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS "{table}_device_ts" '
+                                    f'ON "{table}" (device_id, ts)')
+            self.statements[table] = (f'INSERT INTO "{table}" VALUES '
+                                      f'({", ".join("?" * len(columns))})')
+        self.connection.commit()
+
+    def write(self, batches: Dict[str, List[tuple]]):
+        with self.connection:
+            for table, rows in batches.items():
+                self.connection.executemany(self.statements[table], rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class ParquetSink:
+    """
+    Parquet 後端（需要 pyarrow）
+
+    每個表一個目錄，持續寫入同一文件的多個 row group，
+    達到 rotate_rows 行或 rotate_seconds 秒後關閉並開始新文件
+    """
+
+    name = "parquet"
+
+    def __init__(self, directory: str, rotate_rows: int = 1000000, rotate_seconds: float = 3600.0):
+        if pa is None:
+            raise RuntimeError("Parquet 輸出需要安裝 pyarrow")
+        self.directory = directory
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+        self.schemas = {table: pa.schema([(name, self._arrow_type(kind)) for name, kind in columns])
+                        for table, columns in TABLE_COLUMNS.items()}
+        # 表名 -> (writer, 已寫行數, 開啟時間)
+        self.writers: Dict[str, list] = {}
+
+    @staticmethod
+    def _arrow_type(kind: str):
+        return {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}[kind]
+
+    def _writer(self, table: str):
+        current = self.writers.get(table)
+        now = time.monotonic()
+        if current and (current[1] >= self.rotate_rows or now - current[2] >= self.rotate_seconds):
+            current[0].close()
+            current = None
+        if current is None:
+            folder = os.path.join(self.directory, table)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{table}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.parquet")
+            current = [pq.ParquetWriter(path, self.schemas[table]), 0, now]
+            self.writers[table] = current
+        return current
+
+    def write(self, batches: Dict[str, List[tuple]]):
+        for table, rows in batches.items():
+            schema = self.schemas[table]
+            columns = list(zip(*rows))
+            batch = pa.table([pa.array(column, type=field.type)
+                              for column, field in zip(columns, schema)], schema=schema)
+            current = self._writer(table)
+            current[0].write_table(batch)
+            current[1] += len(rows)
+
+    def close(self):
+        for writer, _, _ in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+class BatchingSink:
+    """
+    批量寫入器
+
+    add() 只把行放入按表分組的記憶體緩衝；緩衝達到 max_rows 行，
+    或距上次寫入超過 max_delay 秒（由後台執行緒檢查）時整批交給所有後端。
+    後端寫入失敗的批次保留，下次 flush 時按原順序只重試失敗的後端；
+    保留的行數超過 max_pending_rows 時丟棄最舊的批次並計入 failed
+    """
+
+    def __init__(self, backends: Sequence, max_rows: int = 1000, max_delay: float = 1.0,
+                 max_pending_rows: Optional[int] = None):
+        self.backends = list(backends)
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending_rows = max_pending_rows if max_pending_rows is not None else 10 * max_rows
+        self._buffer: Dict[str, List[tuple]] = {}
+        self._buffered = 0
+        self._lock = threading.Lock()
+        # 後端寫入在單獨的鎖內進行，避免阻塞 add()
+        self._write_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        # 待寫入的批次：(按表分組的行, 行數, 尚未接受該批的後端)，只在 _write_lock 內存取
+        self._pending: Deque[tuple] = deque()
+        self._pending_rows = 0
+
+        self.rows = 0
+        self.batches = 0
+        self.skipped = 0
+        self.errors = 0
+        self.failed = 0
+
+    def start(self):
+        """啟動按時間 flush 的後台執行緒"""
+        self._thread = threading.Thread(target=self._run, name="sink-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(min(self.max_delay, 0.5)):
+            if time.monotonic() - self._last_flush >= self.max_delay:
+                self.flush()
+
+    def add(self, topic: str, message: Dict, recv_ts: float, payload=None):
+        """加入一條訊息（可附帶原始 payload），不持久化的主題直接略過"""
+        table = table_for(topic, message)
+        if table is None:
+            # add() 由多個佇列工作執行緒呼叫，計數同樣在鎖內累加
+            with self._lock:
+                self.skipped += 1
+            return
+        row = to_row(table, topic, message, recv_ts, payload)
+        with self._lock:
+            rows = self._buffer.get(table)
+            if rows is None:
+                rows = self._buffer[table] = []
+            rows.append(row)
+            self._buffered += 1
+            full = self._buffered >= self.max_rows
+        if full:
+            self.flush()
+
+    def flush(self):
+        """把當前緩衝寫入所有後端，並重試之前寫入失敗的批次"""
+        with self._write_lock:
+            with self._lock:
+                batches = self._buffer
+                count = self._buffered
+                self._buffer = {}
+                self._buffered = 0
+                self._last_flush = time.monotonic()
+            if count:
+                self._pending.append((batches, count, self.backends))
+                self._pending_rows += count
+            if not self._pending:
+                return
+
+            written = written_batches = errors = 0
+            # 本次已失敗的後端不再寫入後續批次，保持每個後端的寫入順序
+            failing = set()
+            pending = deque()
+            for batches, count, backends in self._pending:
+                remaining = []
+                for backend in backends:
+                    if backend in failing:
+                        remaining.append(backend)
+                        continue
+                    try:
+                        backend.write(batches)
+                    except Exception as e:
+                        errors += 1
+                        failing.add(backend)
+                        remaining.append(backend)
+                        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                              f"寫入 {backend.name} 失敗: {e}，{count} 行保留待重試")
+                if remaining:
+                    pending.append((batches, count, remaining))
+                else:
+                    written += count
+                    written_batches += 1
+
+            pending_rows = sum(entry[1] for entry in pending)
+            dropped = 0
+            while pending and pending_rows > self.max_pending_rows:
+                pending_rows -= pending[0][1]
+                dropped += pending.popleft()[1]
+            if dropped:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                      f"待重試超過 {self.max_pending_rows} 行，丟棄最舊的 {dropped} 行")
+            self._pending = pending
+            with self._lock:
+                self._pending_rows = pending_rows
+                self.rows += written
+                self.batches += written_batches
+                self.errors += errors
+                self.failed += dropped
+
+    def close(self):
+        """停止後台執行緒，寫出剩餘緩衝並關閉後端"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        for backend in self.backends:
+            backend.close()
+
+    def stats(self) -> Dict:
+        """rows / batches 只計所有後端都已接受的行；pending 為待重試行數，failed 為超出上限丟棄的行數"""
+        with self._lock:
+            return {"rows": self.rows, "batches": self.batches, "skipped": self.skipped,
+                    "errors": self.errors, "failed": self.failed, "pending": self._pending_rows,
+                    "buffered": self._buffered}
+
+
+def create_sink(sqlite_path: Optional[str] = None, parquet_dir: Optional[str] = None,
+                max_rows: int = 1000, max_delay: float = 1.0) -> Optional[BatchingSink]:
+    """按配置建立批量寫入器，沒有任何後端時返回 None"""
+    backends = []
+    if sqlite_path:
+        backends.append(SQLiteSink(sqlite_path))
+    if parquet_dir:
+        backends.append(ParquetSink(parquet_dir))
+    if not backends:
+        return None
+    return BatchingSink(backends, max_rows, max_delay).start()
+
+
+def run_benchmark(path: str, repeat: int, batch_size: int, directory: str):
+    """以抓包文件測量各後端的寫入速率 (rows/s)"""
+    from replay_capture import iter_capture
+
+    # 與接收端相同，每條訊息附帶收到的原始 payload
+    records = [(record["topic"], record["message"],
+                json.dumps(record["message"], ensure_ascii=False).encode('utf-8'))
+               for record in iter_capture(path)] * repeat
+    print(f"基準測試: {len(records)} 條訊息 (抓包 {path} x {repeat}), 批次 {batch_size} 行")
+    os.makedirs(directory, exist_ok=True)
+
+    backends = [("sqlite", lambda: SQLiteSink(os.path.join(directory, "bench.db")))]
+    if pa is not None:
+        backends.append(("parquet", lambda: ParquetSink(os.path.join(directory, "parquet"))))
+    else:
+        print("  parquet: 未安裝 pyarrow，略過")
+
+    for name, factory in backends:
+        sink = BatchingSink([factory()], max_rows=batch_size, max_delay=3600.0)
+        now = time.time()
+        start = time.perf_counter()
+        for topic, message, payload in records:
+            sink.add(topic, message, now, payload)
+        sink.close()
+        elapsed = time.perf_counter() - start
+        print(f"  {name}: {sink.rows / elapsed:,.0f} rows/s "
+              f"({sink.rows} 行, {sink.batches} 批, 略過 {sink.skipped})")
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="接收訊息批量持久化基準測試")
+    parser.add_argument("capture", nargs="?",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             "..", "test-data", "mqtt_messages.json"),
+                        help="抓包文件路徑")
+    parser.add_argument("--repeat", type=int, default=100, help="重複抓包次數")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批行數")
+    parser.add_argument("--directory", default=None, help="基準測試輸出目錄，默認使用臨時目錄")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.directory:
+        run_benchmark(args.capture, args.repeat, args.batch_size, args.directory)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run_benchmark(args.capture, args.repeat, args.batch_size, directory)
@@ -0,0 +1,336 @@
+"""
+輕量指標登記表
+提供計數器、量表與固定分桶直方圖，供心率模擬器與接收端在熱路徑上記錄：
+發布數量與失敗（按 result.rc）、解析與處理耗時、佇列深度、重連次數等
+
+計數器與直方圖按執行緒分格累加（每個執行緒只寫自己的格子，讀取時求和），
+熱路徑上不取鎖；指標以 Prometheus 文字格式經本地 HTTP /metrics 輸出，
+也可定期輸出一行精簡統計
+"""
+
+import bisect
+import logging
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默認耗時分桶（秒）：10us ~ 1s
+DEFAULT_LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                           0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# 取樣日誌默認每多少次輸出一次
+DEFAULT_LOG_SAMPLE_EVERY = 1000
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _ThreadCells:
+    """按執行緒分配的累加格子，格子建立時登記一次，之後只由所屬執行緒寫入"""
+
+    def __init__(self, size: int):
+        self._size = size
+        self.local = threading.local()
+        self._cells: List[List] = []
+        self._lock = threading.Lock()
+
+    def cell(self) -> List:
+        cell = getattr(self.local, "cell", None)
+        if cell is None:
+            cell = [0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+            self.local.cell = cell
+        return cell
+
+    def totals(self) -> List:
+        with self._lock:
+            cells = list(self._cells)
+        totals = [0] * self._size
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class Counter:
+    """單調遞增計數器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str = "", labels: Tuple = (),
+                 function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.function = function
+        self._cells = _ThreadCells(1)
+        self._local = self._cells.local
+
+    def inc(self, amount: float = 1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            self._cells.cell()[0] += amount
+
+    def value(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._cells.totals()[0]
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.labels)} {self.value()}"]
+
+
+class Gauge:
+    """量表：直接設置當前值，或在讀取時呼叫 function 取值（如佇列深度）"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str = "", labels: Tuple = (),
+                 function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.labels)} {self.value()}"]
+
+
+class Histogram:
+    """固定分桶直方圖，格子內為各桶計數，最後一格為觀測值總和"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str = "", labels: Tuple = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.bounds = tuple(sorted(buckets))
+        self._cells = _ThreadCells(len(self.bounds) + 2)
+        self._local = self._cells.local
+
+    def observe(self, value: float):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cells.cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def totals(self) -> Tuple[List[int], float]:
+        """返回 (各桶計數（含 +Inf 桶）, 總和)"""
+        totals = self._cells.totals()
+        return totals[:-1], totals[-1]
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        """以分桶上界估計分位數，落在 +Inf 桶時返回最大分桶上界"""
+        if counts is None:
+            counts = self.totals()[0]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        target = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def render(self) -> List[str]:
+        counts, total = self.totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            labels = _label_text(self.labels, 'le="%g"' % bound)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        cumulative += counts[-1]
+        labels = _label_text(self.labels, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels)} {total}")
+        lines.append(f"{self.name}_count{_label_text(self.labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    指標登記表
+
+    以 (名稱, 標籤) 為鍵，重複取得同一指標返回同一物件；
+    建議在模組載入或啟動時取得指標並保存引用，熱路徑上只呼叫 inc / set / observe
+    """
+
+    def __init__(self):
+        self._metrics: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str, labels: Optional[Dict], **kwargs):
+        label_items = tuple(sorted((labels or {}).items()))
+        key = (name, label_items)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, help_text, label_items, **kwargs)
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str = "", labels: Optional[Dict] = None,
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        return self._get(Counter, name, help_text, labels, function=function)
+
+    def gauge(self, name: str, help_text: str = "", labels: Optional[Dict] = None,
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._get(Gauge, name, help_text, labels, function=function)
+
+    def histogram(self, name: str, help_text: str = "", labels: Optional[Dict] = None,
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def metrics(self) -> List:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Prometheus 文字格式"""
+        lines = []
+        described = set()
+        for metric in sorted(self.metrics(), key=lambda m: (m.name, m.labels)):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.debug(f"讀取指標 {metric.name} 失敗: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class StatsLine:
+    """精簡統計行：計數器顯示總數與區間速率，直方圖顯示區間次數與 p50/p99，量表顯示當前值"""
+
+    def __init__(self, registry: MetricsRegistry, prefix: str = ""):
+        self.registry = registry
+        self.prefix = prefix
+        self._last: Dict[Tuple, object] = {}
+        self._last_time = time.monotonic()
+
+    def format(self) -> str:
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-9)
+        self._last_time = now
+        parts = []
+        for metric in sorted(self.registry.metrics(), key=lambda m: (m.name, m.labels)):
+            name = metric.name[len(self.prefix):] if metric.name.startswith(self.prefix) else metric.name
+            if metric.labels:
+                name += "[" + ",".join(value for _, value in metric.labels) + "]"
+            key = (metric.name, metric.labels)
+            try:
+                if metric.kind == "counter":
+                    value = metric.value()
+                    rate = (value - self._last.get(key, 0)) / elapsed
+                    self._last[key] = value
+                    parts.append(f"{name}={value:g} ({rate:.1f}/s)")
+                elif metric.kind == "gauge":
+                    parts.append(f"{name}={metric.value():g}")
+                else:
+                    counts, _ = metric.totals()
+                    previous = self._last.get(key) or [0] * len(counts)
+                    self._last[key] = counts
+                    delta = [current - old for current, old in zip(counts, previous)]
+                    if sum(delta):
+                        parts.append(f"{name} n={sum(delta)} p50={metric.quantile(0.5, delta) * 1e6:.0f}us "
+                                     f"p99={metric.quantile(0.99, delta) * 1e6:.0f}us")
+            except Exception as e:
+                logger.debug(f"讀取指標 {metric.name} 失敗: {e}")
+        return ", ".join(parts)
+
+
+def run_stats_line(registry: MetricsRegistry, interval: float, stop_event: threading.Event,
+                   emit: Optional[Callable[[str], None]] = None, prefix: str = ""):
+    """每 interval 秒輸出一行精簡統計，emit 默認為帶時間戳的 print"""
+    if emit is None:
+        def emit(text):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [指標] {text}")
+    line = StatsLine(registry, prefix)
+    while not stop_event.wait(interval):
+        text = line.format()
+        if text:
+            emit(text)
+
+
+def start_stats_line(registry: MetricsRegistry, interval: float, stop_event: threading.Event,
+                     emit: Optional[Callable[[str], None]] = None, prefix: str = "") -> threading.Thread:
+    """在後台執行緒啟動 run_stats_line"""
+    thread = threading.Thread(target=run_stats_line, args=(registry, interval, stop_event, emit, prefix),
+                              name="metrics-stats", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_http_server(registry: MetricsRegistry, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """在後台執行緒啟動 HTTP 服務，GET /metrics 返回 Prometheus 文字格式"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class LogSampler:
+    """
+    取樣日誌：每 every 次呼叫返回一次 True
+
+    用於把逐條訊息的日誌改為取樣輸出，計數在多執行緒下偶有偏差不影響用途
+    """
+
+    def __init__(self, every: int = DEFAULT_LOG_SAMPLE_EVERY):
+        self.every = max(1, every)
+        self._count = 0
+
+    def __call__(self) -> bool:
+        self._count += 1
+        return self._count % self.every == 1 or self.every == 1
+
+
+# 進程內共用的默認登記表
+REGISTRY = MetricsRegistry()
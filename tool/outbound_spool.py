@@ -0,0 +1,374 @@
+"""
+磁碟外發緩衝（spool）
+與代理斷線期間把待發訊息追加寫入 spool 文件，而不是丟棄或堆積在 paho 的記憶體佇列中；
+重新連接後由背景執行緒按限定速率分批補發，模擬真實 Gateway 斷線恢復後的補傳行為。
+
+文件格式：
+    <path>         16 字節文件頭（標記 + 代號）+ 逐條追加的記錄
+                   記錄 = crc32 | 內容長度 | 時間戳 | 主題長度 | QoS | 主題 | 內容
+    <path>.offset  已補發位置：(代號, 讀取偏移)，每批補發完成後寫入
+
+讀取以 mmap 映射文件，不把積壓的訊息載入記憶體；啟動時從已保存的讀取偏移掃描記錄，
+CRC 不符或不完整的尾部記錄（寫入時崩潰）截掉。
+超出 max_bytes 時丟棄最舊的記錄，超過 max_age 秒的記錄補發時跳過；
+已越過的部分超過 max_bytes 的一半與未補發部分時，把未補發部分複製到新文件並原子替換（代號遞增），
+文件大小因此不超過約 2 倍 max_bytes；
+偏移文件的代號與數據文件不一致時表示替換後尚未寫入偏移，從新文件開頭讀取。
+補發為至少一次：一批已交給發送端但偏移尚未寫入時崩潰，重啟後該批會再發送一次
+
+QoS ≥ 1 的訊息在未連接時 paho 仍會放入自身佇列（返回 MQTT_ERR_NO_CONN）並於重新連接後重發，
+這類失敗不可再寫入 spool，否則重新連接後同一訊息會送出兩次；判斷見 queued_by_client()
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SCPSPL01"
+FILE_HEADER = struct.Struct("<8sQ")
+OFFSET_RECORD = struct.Struct("<QQ")
+# crc32, 內容長度, 時間戳, 主題長度, QoS
+RECORD_HEADER = struct.Struct("<IIdHB")
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 超出上限時一次丟棄到上限的這個比例，避免每次追加都重新映射並逐條丟棄
+TRIM_TARGET = 0.9
+DEFAULT_MAX_AGE = 3600.0
+# 默認補發速率（msg/s）與每批條數
+DEFAULT_DRAIN_RATE = 200.0
+DEFAULT_DRAIN_BATCH = 50
+# paho.mqtt.client.MQTT_ERR_NO_CONN，本模組不依賴 paho
+MQTT_ERR_NO_CONN = 4
+
+
+def queued_by_client(rc: int, qos: int) -> bool:
+    """發布返回 rc 時訊息是否已由 paho 排隊、重新連接後自行重發（QoS ≥ 1 且未連接）"""
+    return qos > 0 and rc == MQTT_ERR_NO_CONN
+
+
+class OutboundSpool:
+    """
+    追加寫入、mmap 讀取的外發緩衝
+
+    append() 可由任意執行緒呼叫；read_batch() / commit() 由單個補發執行緒呼叫，
+    一批讀出後到 commit 之前不會壓縮文件，讀出的偏移保持有效
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE, sync: bool = False):
+        """
+        Args:
+            path: spool 文件路徑
+            max_bytes: 積壓上限（字節），超出時丟棄最舊的記錄
+            max_age: 記錄最長保留時間（秒），0 表示不限
+            sync: 每次追加後 fsync（斷電也不丟失，但寫入較慢）
+        """
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sync = sync
+
+        self.spooled = 0
+        self.drained = 0
+        self.dropped = 0
+        self.expired = 0
+        self.recovered = 0
+
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._in_flight = False
+        self._scanned: List[Tuple[int, bool]] = []
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # ---- 文件 ----
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < FILE_HEADER.size:
+            with open(self.path, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, 0))
+        self._file = open(self.path, "r+b")
+        magic, self.generation = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError(f"{self.path} 不是 spool 文件")
+
+        head = FILE_HEADER.size
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path, "rb") as f:
+                data = f.read(OFFSET_RECORD.size)
+            if len(data) == OFFSET_RECORD.size:
+                generation, saved_head = OFFSET_RECORD.unpack(data)
+                if generation == self.generation:
+                    head = saved_head
+        self._offset_file = open(self.offset_path, "r+b" if os.path.exists(self.offset_path) else "w+b")
+
+        size = os.fstat(self._file.fileno()).st_size
+        self.head = min(max(head, FILE_HEADER.size), size)
+        self.tail, self.count = self._scan(self.head, size)
+        if self.tail < size:
+            logger.warning(f"{self.path} 尾部 {size - self.tail} 字節不完整，已截掉")
+            self._map.close()
+            self._map = None
+            self._file.truncate(self.tail)
+        self.recovered = self.count
+        self._file.seek(self.tail)
+        self._write_offset()
+
+    def _mapped(self, size: int) -> Optional[mmap.mmap]:
+        """返回至少覆蓋 size 字節的只讀映射，文件增長後重新映射"""
+        if self._map is None or len(self._map) < size:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.flush()
+            if size:
+                self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _record_at(self, view, offset: int, end: int):
+        """解析 offset 處的記錄，不完整或校驗失敗返回 None"""
+        if offset + RECORD_HEADER.size > end:
+            return None
+        crc, length, timestamp, topic_length, qos = RECORD_HEADER.unpack_from(view, offset)
+        record_end = offset + RECORD_HEADER.size + topic_length + length
+        if record_end > end or zlib.crc32(view[offset + 4:record_end]) != crc:
+            return None
+        return record_end, timestamp, topic_length, qos
+
+    def _scan(self, offset: int, size: int) -> Tuple[int, int]:
+        """從 offset 掃描有效記錄，返回 (有效結尾, 記錄數)"""
+        view = self._mapped(size)
+        count = 0
+        while True:
+            record = self._record_at(view, offset, size)
+            if record is None:
+                return offset, count
+            offset = record[0]
+            count += 1
+
+    def _write_offset(self):
+        # 16 字節寫在文件開頭，不會跨越扇區
+        self._offset_file.seek(0)
+        self._offset_file.write(OFFSET_RECORD.pack(self.generation, self.head))
+        self._offset_file.flush()
+        if self.sync:
+            os.fsync(self._offset_file.fileno())
+
+    def _compact(self):
+        """把未補發的記錄複製到新文件並原子替換，代號遞增"""
+        view = self._mapped(self.tail)
+        temp_path = f"{self.path}.tmp-{os.getpid()}"
+        generation = self.generation + 1
+        with open(temp_path, "wb") as f:
+            f.write(FILE_HEADER.pack(MAGIC, generation))
+            if self.tail > self.head:
+                f.write(view[self.head:self.tail])
+            f.flush()
+            os.fsync(f.fileno())
+        # Windows 上被映射的文件無法替換，先關閉映射
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "r+b")
+        self.generation = generation
+        self.tail = FILE_HEADER.size + self.tail - self.head
+        self.head = FILE_HEADER.size
+        self._file.seek(self.tail)
+        self._write_offset()
+
+    def _maybe_compact(self):
+        if self._in_flight:
+            return
+        if self.head == self.tail and self.head > FILE_HEADER.size:
+            self._compact()
+        elif self.head - FILE_HEADER.size > max(self.max_bytes // 2, self.tail - self.head):
+            self._compact()
+
+    # ---- 寫入 ----
+
+    def append(self, topic: str, payload, qos: int = 0, timestamp: Optional[float] = None):
+        """追加一條待發訊息，超出 max_bytes 時先丟棄最舊的記錄"""
+        topic_bytes = topic.encode("utf-8")
+        body = payload.encode("utf-8") if isinstance(payload, str) else bytes(payload)
+        fields = RECORD_HEADER.pack(0, len(body), time.time() if timestamp is None else timestamp,
+                                    len(topic_bytes), qos)[4:]
+        crc = zlib.crc32(body, zlib.crc32(topic_bytes, zlib.crc32(fields)))
+        record = struct.pack("<I", crc) + fields + topic_bytes + body
+        with self._lock:
+            self._trim(len(record))
+            self._file.write(record)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self.tail += len(record)
+            self.count += 1
+            self.spooled += 1
+
+    def _trim(self, needed: int):
+        """超出上限時丟棄最舊的記錄，直到積壓降到上限的 TRIM_TARGET（正在補發的一批不丟棄）"""
+        if self.tail - self.head + needed <= self.max_bytes or self._in_flight:
+            return
+        view = self._mapped(self.tail)
+        target = int(self.max_bytes * TRIM_TARGET)
+        while self.count and self.tail - self.head + needed > target:
+            record = self._record_at(view, self.head, self.tail)
+            if record is None:
+                break
+            self.head = record[0]
+            self.count -= 1
+            self.dropped += 1
+        self._write_offset()
+        self._maybe_compact()
+
+    # ---- 補發 ----
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def size(self) -> int:
+        """積壓字節數"""
+        return self.tail - self.head
+
+    def read_batch(self, limit: int) -> List[Tuple[str, bytes, int]]:
+        """
+        讀出最多 limit 條待發記錄（超過 max_age 的記錄跳過），發送後以 commit() 確認
+
+        Returns:
+            [(主題, 內容, QoS)]
+        """
+        batch = []
+        # 本批掃描過的記錄：(結尾偏移, 是否過期)
+        scanned = []
+        with self._lock:
+            view = self._mapped(self.tail)
+            offset = self.head
+            oldest = time.time() - self.max_age if self.max_age > 0 else None
+            while len(batch) < limit and offset < self.tail:
+                record = self._record_at(view, offset, self.tail)
+                if record is None:
+                    break
+                record_end, timestamp, topic_length, qos = record
+                expired = oldest is not None and timestamp < oldest
+                if not expired:
+                    start = offset + RECORD_HEADER.size
+                    batch.append((bytes(view[start:start + topic_length]).decode("utf-8"),
+                                  bytes(view[start + topic_length:record_end]), qos))
+                scanned.append((record_end, expired))
+                offset = record_end
+            self._scanned = scanned
+            self._in_flight = True
+        return batch
+
+    def commit(self, sent: int):
+        """確認上一批中前 sent 條已交給發送端；全部發出時連同批末的過期記錄一起越過"""
+        with self._lock:
+            remaining = sent
+            consumed = 0
+            for record_end, expired in self._scanned:
+                if not expired:
+                    if not remaining:
+                        break
+                    remaining -= 1
+                    self.drained += 1
+                else:
+                    self.expired += 1
+                self.head = record_end
+                consumed += 1
+            self.count -= consumed
+            self._scanned = []
+            self._in_flight = False
+            if consumed:
+                self._write_offset()
+            self._maybe_compact()
+
+    def stats(self) -> dict:
+        return {"depth": self.count, "bytes": self.size, "spooled": self.spooled,
+                "drained": self.drained, "dropped": self.dropped, "expired": self.expired,
+                "recovered": self.recovered}
+
+    def close(self):
+        with self._lock:
+            self._write_offset()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._offset_file.close()
+
+
+class SpoolDrainer:
+    """
+    背景補發執行緒
+
+    連接正常且 spool 有積壓時，每 batch / rate 秒發出一批（最多 batch 條），
+    平均速率不超過 rate；發送失敗（返回碼非 0）時停止本批，未發出的記錄留待下次；
+    QoS ≥ 1 的記錄在斷線時已由 paho 排隊重發，視為已發出並確認，不再留在 spool
+    """
+
+    def __init__(self, spool: OutboundSpool, publish: Callable, is_connected: Callable[[], bool],
+                 rate: float = DEFAULT_DRAIN_RATE, batch: int = DEFAULT_DRAIN_BATCH,
+                 name: str = "spool-drain"):
+        self.spool = spool
+        self.publish = publish
+        self.is_connected = is_connected
+        self.rate = rate
+        self.batch = max(1, batch)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> "SpoolDrainer":
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def drain_once(self) -> int:
+        """補發一批，返回發出的條數"""
+        records = self.spool.read_batch(self.batch)
+        sent = 0
+        try:
+            for topic, payload, qos in records:
+                result = self.publish(topic, payload, qos)
+                rc = getattr(result, "rc", 0)
+                if rc != 0:
+                    if queued_by_client(rc, qos):
+                        sent += 1
+                    break
+                sent += 1
+        finally:
+            self.spool.commit(sent)
+        return sent
+
+    def _run(self):
+        interval = self.batch / self.rate if self.rate > 0 else 0.0
+        was_draining = False
+        while not self.stop_event.wait(interval if was_draining else 0.2):
+            if not len(self.spool) or not self.is_connected():
+                if was_draining and not len(self.spool):
+                    logger.info(f"spool 補發完成: 共補發 {self.spool.drained} 條, "
+                                f"丟棄 {self.spool.dropped} 條, 過期 {self.spool.expired} 條")
+                was_draining = False
+                continue
+            if not was_draining:
+                logger.info(f"開始補發 spool 積壓 {len(self.spool)} 條 ({self.spool.size / 1024:.0f} KB), "
+                            f"限速 {self.rate:.0f} msg/s")
+                was_draining = True
+            try:
+                self.drain_once()
+            except Exception as e:
+                logger.error(f"spool 補發出錯: {e}")
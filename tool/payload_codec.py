@@ -0,0 +1,455 @@
+"""
+訊息負載編碼
+把每種訊息形狀預先編譯為模板：JSON 的固定字段在編譯時序列化一次，
+每條訊息只把變化的字段（槽位 Slot）填入預先格式化的緩衝區，不再逐條建立字典與走通用 json.dumps；
+msgpack / CBOR 由為模板生成的函數以字面量建立訊息字典，再整個交給編碼器一次編碼；
+同一週期的時間字段由 TickClock 只格式化一次。
+
+默認輸出緊湊 JSON（與現有接收端、前端兼容）；可選 msgpack / CBOR 二進制編碼（需要 msgpack / cbor2），
+接收端按首字節自動識別：JSON 物件以 "{" 開頭，msgpack map 為 0x80-0x8f / 0xde / 0xdf，CBOR map 為 0xa0-0xbf
+"""
+
+import argparse
+import json
+import math
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 可選的二進制編碼
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+CODEC_CBOR = "cbor"
+CODECS = (CODEC_JSON, CODEC_MSGPACK, CODEC_CBOR)
+
+# 槽位類型：數值（int / float / bool，NumPy 標量自動轉換；JSON 編碼時拒絕 NaN / inf 與其他類型）、
+# 無需轉義的字串（時間、固定格式的標識，str 或 bytes）、任意 JSON 值
+NUMBER = "number"
+TEXT = "text"
+VALUE = "value"
+
+_SENTINEL = "\x00slot{}\x00"
+
+
+class Slot:
+    """模板中的變化字段"""
+
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str = NUMBER):
+        if kind not in (NUMBER, TEXT, VALUE):
+            raise ValueError(f"未知槽位類型 {kind}")
+        self.kind = kind
+
+
+def codec_available(name: str) -> bool:
+    return name == CODEC_JSON or (name == CODEC_MSGPACK and msgpack is not None) or \
+        (name == CODEC_CBOR and cbor2 is not None)
+
+
+def available_codecs() -> List[str]:
+    return [name for name in CODECS if codec_available(name)]
+
+
+def encoder_for(codec: str) -> Callable[[object], bytes]:
+    """通用編碼函數（未預編譯的訊息形狀使用）"""
+    if codec == CODEC_JSON:
+        return lambda message: json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if not codec_available(codec):
+        raise RuntimeError(f"{codec} 編碼需要安裝 {'msgpack' if codec == CODEC_MSGPACK else 'cbor2'}")
+    if codec == CODEC_MSGPACK:
+        return msgpack.Packer().pack
+    return cbor2.dumps
+
+
+def is_binary_payload(payload) -> bool:
+    """msgpack / CBOR 負載的首字節不低於 0x80，JSON 物件為 ASCII"""
+    return isinstance(payload, (bytes, bytearray, memoryview)) and len(payload) > 0 and payload[0] >= 0x80
+
+
+def decode_binary(payload):
+    """按首字節解析 msgpack 或 CBOR 負載"""
+    first = payload[0]
+    if 0xa0 <= first <= 0xbf:
+        if cbor2 is None:
+            raise ValueError("收到 CBOR 負載，但未安裝 cbor2")
+        return cbor2.loads(payload)
+    if msgpack is None:
+        raise ValueError("收到 msgpack 負載，但未安裝 msgpack")
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+def decode_payload(payload, loads: Callable = json.loads):
+    """解析任意編碼的負載，JSON 由 loads 處理"""
+    if is_binary_payload(payload):
+        return decode_binary(payload)
+    return loads(payload)
+
+
+def _call(convert, value):
+    return convert(value)
+
+
+def _text_bytes(value) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def _json_bytes(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+class _Literal:
+    """repr 為指定文字的對象，讓 bool 經 %a 輸出 JSON 的 true / false"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+_TRUE = _Literal("true")
+_FALSE = _Literal("false")
+
+
+def _json_number(value):
+    """
+    JSON 數值槽位：int 與有限 float 原樣交給 %a；bool 轉為 true / false；
+    int / float 子類與 NumPy 標量先轉為 Python 數值（否則 repr 會是 np.float64(1.5) 之類的非法 JSON）
+    """
+    kind = type(value)
+    if kind is int:
+        return value
+    if kind is float:
+        # inf - inf 與 nan - nan 均為 nan
+        if value - value == 0.0:
+            return value
+        raise ValueError(f"JSON 不支援非有限數值 {value}")
+    if kind is bool:
+        return _TRUE if value else _FALSE
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return _json_number(float(value))
+    item = getattr(value, "item", None)
+    if item is not None:
+        return _json_number(item())
+    raise TypeError(f"數值槽位不支援 {kind.__name__} 類型的值 {value!r}")
+
+
+class PayloadTemplate:
+    """
+    預編譯的訊息模板
+
+    template 為訊息字典，其中變化的字段以 Slot 佔位（可在嵌套字典內），
+    encode(*values) 按槽位在字典中的先後順序（深度優先）填入數值並返回 bytes；
+    fill(*values) 返回填好的新字典，供需要字典的呼叫方（例如異常偵測、回覆命令）使用
+    """
+
+    def __init__(self, template: Dict, codec: str = CODEC_JSON):
+        self.codec = codec
+        self.template = template
+        self.kinds: List[str] = []
+        marked = self._mark(template)
+        if codec == CODEC_JSON:
+            self._compile_json(marked)
+        else:
+            self._compile_binary(encoder_for(codec))
+
+    def _mark(self, value):
+        """深拷貝模板，槽位替換為唯一的標記字串"""
+        if isinstance(value, Slot):
+            self.kinds.append(value.kind)
+            return _SENTINEL.format(len(self.kinds) - 1)
+        if isinstance(value, dict):
+            return {key: self._mark(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._mark(item) for item in value]
+        return value
+
+    def _compile_json(self, marked: Dict):
+        # 固定部分轉為 bytes 的 % 格式：數值經 _json_number 校驗後以 %a（即 repr），字串槽位以 %s 填入 UTF-8 位元組
+        text = json.dumps(marked, ensure_ascii=False, separators=(",", ":")).replace("%", "%%")
+        for index, kind in enumerate(self.kinds):
+            placeholder = json.dumps(_SENTINEL.format(index))
+            text = text.replace(placeholder, "%a" if kind == NUMBER else ('"%s"' if kind == TEXT else "%s"), 1)
+        self._format = text.encode("utf-8")
+        self._converters = [_json_number if kind == NUMBER else (_text_bytes if kind == TEXT else _json_bytes)
+                            for kind in self.kinds]
+        self._constant = None if self.kinds else self._format.replace(b"%%", b"%")
+        self.encode = self._encode_json
+
+    def _encode_json(self, *values) -> bytes:
+        if self._constant is not None:
+            return self._constant
+        if len(values) != len(self._converters):
+            raise TypeError(f"模板有 {len(self._converters)} 個槽位，收到 {len(values)} 個值")
+        return self._format % tuple(map(_call, self._converters, values))
+
+    def _compile_binary(self, encode: Callable[[object], bytes]):
+        # 逐槽位編碼再拼接固定片段要多次呼叫編碼器，比一次編碼整個字典還慢；
+        # 二進制編碼改為以生成的字面量函數建立訊息字典，再一次交給 msgpack / cbor2 編碼
+        self._message = _message_builder(self.template)
+        self._value_encoder = encode
+        self._constant = None if self.kinds else encode(self.template)
+        self.encode = self._encode_binary
+
+    def _encode_binary(self, *values) -> bytes:
+        if self._constant is not None:
+            return self._constant
+        if len(values) != len(self.kinds):
+            raise TypeError(f"模板有 {len(self.kinds)} 個槽位，收到 {len(values)} 個值")
+        try:
+            return self._value_encoder(self._message(*values))
+        except Exception:
+            # NumPy 標量等編碼器不支援的數值先轉為 Python 數值（與 JSON 路徑相同），只在失敗時付出轉換的開銷
+            return self._value_encoder(self._message(*(_python_number(value) if kind == NUMBER else value
+                                                       for kind, value in zip(self.kinds, values))))
+
+    def fill(self, *values) -> Dict:
+        iterator = iter(values)
+
+        def build(value):
+            if isinstance(value, Slot):
+                return next(iterator)
+            if isinstance(value, dict):
+                return {key: build(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [build(item) for item in value]
+            return value
+        return build(self.template)
+
+
+def _message_builder(template: Dict) -> Callable[..., Dict]:
+    """
+    為模板生成建立訊息字典的函數，參數依次為各槽位的值；
+    含槽位的字典 / 列表生成為字面量，字串、整數、有限浮點數等固定值以 repr 寫入代碼（字典鍵全為常量時
+    CPython 一次建立整個字典），其他固定值經閉包變量引用
+    """
+    constants = []
+    names = []
+
+    def constant(value):
+        if value is None or type(value) in (str, int, bool) or (type(value) is float and math.isfinite(value)):
+            return repr(value)
+        constants.append(value)
+        return f"c{len(constants) - 1}"
+
+    def expression(value):
+        if isinstance(value, Slot):
+            names.append(f"v{len(names)}")
+            return names[-1]
+        if isinstance(value, dict) and _slot_count(value):
+            return "{" + ", ".join(f"{constant(key)}: {expression(item)}" for key, item in value.items()) + "}"
+        if isinstance(value, list) and _slot_count(value):
+            return "[" + ", ".join(expression(item) for item in value) + "]"
+        return constant(value)
+
+    body = expression(template)
+    namespace = {}
+    exec(f"def bind({', '.join(f'c{index}' for index in range(len(constants)))}):\n"
+         f"    def message({', '.join(names)}):\n"
+         f"        return {body}\n"
+         f"    return message", namespace)
+    return namespace["bind"](*constants)
+
+
+def _slot_count(value) -> int:
+    if isinstance(value, Slot):
+        return 1
+    if isinstance(value, dict):
+        return sum(_slot_count(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(_slot_count(item) for item in value)
+    return 0
+
+
+def _python_number(value):
+    """NumPy 標量與 int / float 子類轉為 Python 數值，其他值原樣返回"""
+    kind = type(value)
+    if kind is int or kind is float or kind is bool:
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    item = getattr(value, "item", None)
+    return item() if item is not None else value
+
+
+class TickClock:
+    """
+    每個發送週期共用的時間字段
+
+    set(now) 在每個週期開始時呼叫一次，之後直接讀取屬性；整秒部分不變時沿用已格式化的日期時間：
+    timestamp_ms（epoch 毫秒）、local_time（模擬器格式 2026-02-28 00:36:58）、
+    gateway_time（Gateway 格式 2026-059 00:36:58.80）
+    """
+
+    def __init__(self):
+        self.now = None
+        self.timestamp_ms = 0
+        self.local_time = ""
+        self.gateway_time = ""
+        self._second = None
+        self._gateway_second = ""
+
+    def set(self, now: Optional[float] = None) -> "TickClock":
+        now = time.time() if now is None else now
+        if now == self.now:
+            return self
+        self.now = now
+        self.timestamp_ms = int(now * 1000)
+        moment = datetime.fromtimestamp(now)
+        second = int(now)
+        if second != self._second:
+            self._second = second
+            self.local_time = f"{moment:%Y-%m-%d %H:%M:%S}"
+            self._gateway_second = f"{moment:%Y-%j %H:%M:%S}"
+        self.gateway_time = f"{self._gateway_second}.{moment.microsecond // 10000:02d}"
+        return self
+
+
+# ---- 基準測試 ----
+
+def sample_shapes() -> Dict[str, Tuple[Dict, Tuple]]:
+    """各訊息形狀的模板與一組示例數值（字段與抓包 / 模擬器一致）"""
+    header = {"gateway id": 4192540344, "region id": 0, "organiz id": 0}
+    return {
+        "health": ({"type": "health", "id": "user001", "name": "住民01", "gateway_id": "gateway001",
+                    "heart_rate": Slot(), "temperature": Slot(), "time": Slot(TEXT), "timestamp": Slot()},
+                   (72, 36.84123456789, "2026-10-16 23:59:58", 1792195198000)),
+        "location": (dict({"content": "location"}, **header, **{
+                         "node": "TAG", "id": 11143, "id(Hex)": "0x2B87",
+                         "position": {"x": Slot(), "y": Slot(), "z": Slot(), "quality": Slot()},
+                         "time": Slot(TEXT), "sf number": Slot(), "serial no": Slot()}),
+                     (3.41, 7.02, 1.2, 87, "2026-289 23:59:58.80", 1234, 5678)),
+        "anchor config": (dict({"content": "config"}, **header, **{
+                              "node": "ANCHOR", "name": "DW4C0F", "id": 19471, "id(Hex)": "0x4C0F",
+                              "fw update": 0, "led": 1, "ble": 1, "initiator": 0,
+                              "position": {"x": 0.0, "y": 6.28, "z": 2.4}}), ()),
+        "tag config": (dict({"content": "config"}, **header, **{
+                           "node": "TAG", "name": "DW2B87", "id": 11143, "id(Hex)": "0x2B87",
+                           "fw update": 0, "led": 1, "ble": 1, "location engine": 1,
+                           "responsive mode(0=On,1=Off)": 0, "stationary detect": 1,
+                           "nominal udr(hz)": 0.2, "stationary udr(hz)": 0.1}), ()),
+        "heartbeat": (dict({"content": "heartbeat"}, **header, **{
+                          "node": "GW", "name": "GW16B8", "fw ver": "0.82838s", "fw serial": 0,
+                          "UWB HW Com OK": "yes", "UWB Joined": "yes", "UWB Network ID": 24015,
+                          "connected AP": "Emulator", "anchor cfg stack": 0, "current": Slot(TEXT)}),
+                      ("2026-289 23:59:58.80",)),
+        "300B": (dict({"content": "300B"}, **header, **{
+                     "MAC": "E0:0E:08:36:93:F8", "SOS": 0, "hr": Slot(), "SpO2": Slot(), "bp syst": Slot(),
+                     "bp diast": Slot(), "skin temp": Slot(), "room temp": Slot(), "steps": Slot(),
+                     "sleep time": "22:46", "wake time": "7:13", "light sleep (min)": 297,
+                     "deep sleep (min)": 38, "move": Slot(), "wear": 1, "battery level": Slot(),
+                     "serial no": Slot()}),
+                 (78, 97, 128, 81, 33.6, 24.2, 1520, 12, 88, 5679)),
+        "diaper DV1": (dict({"content": "diaper DV1"}, **header, **{
+                           "MAC": "E0:0E:08:4B:1C:02", "name": "DV1_3301", "fw ver": 2.01, "temp": Slot(),
+                           "humi": Slot(), "button": 0, "mssg idx": Slot(), "ack": 0, "battery level": Slot(),
+                           "serial no": Slot()}),
+                       (28.37, 61.52, 20311, 76, 5680)),
+        "configChange": ({"content": "configChange", "gateway id": 4192540344, "node": "ANCHOR",
+                          "name": "0x8E97", "id": 36503, "fw update": 0, "led": 1, "ble": 1, "initiator": 0,
+                          "position": {"x": Slot(), "y": Slot(), "z": Slot()}, "serial no": Slot()},
+                         (1.24, 1.24, 1.24, 1240)),
+    }
+
+
+def _time_per_call(func: Callable[[], object], min_time: float) -> float:
+    """重複呼叫至少 min_time 秒，返回每次呼叫的納秒數（取三輪中最快的一輪）"""
+    best = None
+    for _ in range(3):
+        loops = 0
+        started = time.perf_counter()
+        while True:
+            for _ in range(200):
+                func()
+            loops += 200
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        per_call = elapsed / loops * 1e9
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+def run_benchmark(min_time: float = 0.2) -> Dict[str, Dict[str, Dict]]:
+    """
+    每種訊息形狀比較：現有做法（json.dumps，及可用時的 orjson）、
+    預編譯 JSON 模板，以及可用時的 msgpack / CBOR（字典編碼與模板）；
+    返回 形狀 -> 方式 -> {"bytes": 每條位元組數, "ns": 每條編碼納秒數}
+    """
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    results = {}
+    for shape, (template, values) in sample_shapes().items():
+        compiled = {codec: PayloadTemplate(template, codec) for codec in available_codecs()}
+        json_template = compiled[CODEC_JSON]
+        reference = json_template.fill(*values)
+        # 現有做法只計序列化已建立的字典，不含逐條建立字典與 datetime.now() 的開銷（保守估計）
+        variants = {
+            "json.dumps": lambda: json.dumps(reference, ensure_ascii=False),
+            "template json": lambda t=json_template: t.encode(*values),
+        }
+        if orjson is not None:
+            variants["orjson"] = lambda: orjson.dumps(reference)
+        for codec in (CODEC_MSGPACK, CODEC_CBOR):
+            if codec in compiled:
+                encode = encoder_for(codec)
+                variants[codec] = lambda e=encode: e(reference)
+                variants[f"template {codec}"] = lambda t=compiled[codec]: t.encode(*values)
+
+        results[shape] = {}
+        for name, func in variants.items():
+            payload = func()
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            decoded = decode_payload(payload)
+            if decoded != reference:
+                raise AssertionError(f"{shape} / {name} 解碼結果與原訊息不一致")
+            results[shape][name] = {"bytes": len(payload), "ns": _time_per_call(func, min_time)}
+    return results
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="訊息負載編碼基準測試 (bytes/msg 與 ns/msg)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每個項目每輪最短時間（秒）")
+    parser.add_argument("--output", default=None, help="把結果寫成 JSON 文件")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 可用編碼: {', '.join(available_codecs())}")
+    results = run_benchmark(args.min_time)
+    for shape, variants in results.items():
+        baseline = variants["json.dumps"]
+        print(f"{shape}:")
+        for name, result in variants.items():
+            print(f"  {name:<18} {result['bytes']:>5} bytes/msg  {result['ns']:>8,.0f} ns/msg  "
+                  f"({baseline['ns'] / result['ns']:.1f}x)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
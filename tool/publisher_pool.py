@@ -0,0 +1,324 @@
+"""
+多進程 MQTT 發送池
+把設備分片到 N 個工作進程，每個進程使用獨立的 MQTT 連接與閘道身份，
+並把發送成功/失敗數與發布延遲統計彙總回父進程
+"""
+
+import logging
+import multiprocessing as mp
+import queue
+import ssl
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# 發布延遲直方圖邊界（毫秒），最後一格收集超出部分
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def new_stats() -> Dict:
+    """建立空的發送統計"""
+    return {
+        "sent": 0,
+        "failed": 0,
+        "acked": 0,
+        "latency_sum_ms": 0.0,
+        "latency_max_ms": 0.0,
+        "latency_buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        "connected": False,
+        "reconnects": 0
+    }
+
+
+def merge_stats(total: Dict, part: Dict) -> Dict:
+    """把 part 的計數累加到 total 並返回 total"""
+    total["sent"] += part["sent"]
+    total["failed"] += part["failed"]
+    total["acked"] += part["acked"]
+    total["latency_sum_ms"] += part["latency_sum_ms"]
+    total["latency_max_ms"] = max(total["latency_max_ms"], part["latency_max_ms"])
+    total["latency_buckets"] = [a + b for a, b in
+                                zip(total["latency_buckets"], part["latency_buckets"])]
+    total["reconnects"] += part["reconnects"]
+    return total
+
+
+def record_latency(stats: Dict, latency_ms: float):
+    """把一次確認延遲計入統計"""
+    stats["acked"] += 1
+    stats["latency_sum_ms"] += latency_ms
+    if latency_ms > stats["latency_max_ms"]:
+        stats["latency_max_ms"] = latency_ms
+    for index, edge in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= edge:
+            stats["latency_buckets"][index] += 1
+            break
+    else:
+        stats["latency_buckets"][-1] += 1
+
+
+def latency_percentile(stats: Dict, percentile: float) -> float:
+    """以直方圖估算延遲百分位（毫秒，取所在區間上界）"""
+    count = sum(stats["latency_buckets"])
+    if count == 0:
+        return 0.0
+    threshold = count * percentile / 100.0
+    cumulative = 0
+    for index, bucket in enumerate(stats["latency_buckets"]):
+        cumulative += bucket
+        if cumulative >= threshold:
+            if index < len(LATENCY_BUCKETS_MS):
+                return min(float(LATENCY_BUCKETS_MS[index]), stats["latency_max_ms"])
+            return stats["latency_max_ms"]
+    return stats["latency_max_ms"]
+
+
+def format_stats(stats: Dict, elapsed: float) -> str:
+    """格式化統計為單行文字"""
+    rate = stats["sent"] / elapsed if elapsed > 0 else 0.0
+    avg = stats["latency_sum_ms"] / stats["acked"] if stats["acked"] else 0.0
+    return (f"已發送 {stats['sent']} ({rate:.1f} msg/s), 失敗 {stats['failed']}, "
+            f"已確認 {stats['acked']}, 延遲 avg {avg:.1f} ms / "
+            f"p50 {latency_percentile(stats, 50):.0f} ms / "
+            f"p99 {latency_percentile(stats, 99):.0f} ms / max {stats['latency_max_ms']:.1f} ms")
+
+
+class ShardPublisher:
+    """
+    工作進程內的發送端
+
+    提供與 paho Client 相同的 publish()/is_connected() 介面，
+    可直接替換現有腳本中的全局 client，同時統計發布延遲
+    """
+
+    def __init__(self, client: mqtt.Client):
+        self.client = client
+        self.stats = new_stats()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, float] = {}
+        self._early: Dict[int, float] = {}
+
+        client.on_publish = self._on_publish
+
+    def _on_publish(self, client, userdata, mid, *args):
+        now = time.perf_counter()
+        with self._lock:
+            sent_at = self._pending.pop(mid, None)
+            if sent_at is None:
+                # on_publish 可能早於 publish() 返回，先記下確認時間
+                self._early[mid] = now
+                return
+            record_latency(self.stats, (now - sent_at) * 1000.0)
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        """發布訊息並記錄發送時間"""
+        sent_at = time.perf_counter()
+        # 不可持鎖呼叫 publish：paho 在持有內部鎖時觸發 on_publish
+        result = self.client.publish(topic, payload, qos, retain)
+        with self._lock:
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.stats["sent"] += 1
+                acked_at = self._early.pop(result.mid, None)
+                if acked_at is None:
+                    self._pending[result.mid] = sent_at
+                else:
+                    record_latency(self.stats, (acked_at - sent_at) * 1000.0)
+            else:
+                self.stats["failed"] += 1
+        return result
+
+    def record_reconnect(self):
+        """記錄一次意外斷線；在 paho 網路執行緒呼叫，與 publish() 共用統計鎖"""
+        with self._lock:
+            self.stats["reconnects"] += 1
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def snapshot(self) -> Dict:
+        """複製當前統計"""
+        with self._lock:
+            snapshot = dict(self.stats)
+            snapshot["latency_buckets"] = list(self.stats["latency_buckets"])
+            snapshot["connected"] = self.client.is_connected()
+        return snapshot
+
+
+def create_client(config: Dict, client_id: str) -> mqtt.Client:
+    """按配置建立 MQTT 客戶端（未連接）"""
+    client = mqtt.Client(client_id=client_id)
+    if config.get("tls"):
+        client.tls_set(ca_certs=None, certfile=None, keyfile=None,
+                       cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS,
+                       ciphers=None)
+    if config.get("username"):
+        client.username_pw_set(config["username"], config.get("password"))
+    # 放寬 paho 默認的在途訊息上限，避免 QoS1 在高速率下被限流
+    client.max_inflight_messages_set(config.get("max_inflight", 1000))
+    client.max_queued_messages_set(config.get("max_queued", 0))
+    return client
+
+
+def _worker_main(index: int, shard: Dict, target: Callable, config: Dict,
+                 stats_queue, stop_event, report_interval: float):
+    """工作進程入口：建立連接、執行分片任務並定期回報統計"""
+    logging.basicConfig(
+        level=config.get("log_level", logging.INFO),
+        format=f'%(asctime)s - %(levelname)s - [worker {index}] %(message)s'
+    )
+    name = shard.get("name", str(index))
+    client = create_client(config, f"{config.get('client_prefix', 'sim')}-{name}")
+    publisher = ShardPublisher(client)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            logger.info(f"分片 {name} 已連接到 MQTT 代理")
+        else:
+            logger.error(f"分片 {name} 連接失敗，返回碼: {rc}")
+
+    def on_disconnect(client, userdata, rc):
+        if rc != 0:
+            publisher.record_reconnect()
+        logger.info(f"分片 {name} 與 MQTT 代理斷開連接")
+
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+
+    try:
+        client.connect(config["broker"], config["port"], config.get("keepalive", 60))
+    except Exception as e:
+        logger.error(f"分片 {name} 連接MQTT代理時出錯: {e}")
+        stats_queue.put((index, publisher.snapshot(), True))
+        return
+    client.loop_start()
+
+    # 週期性回報統計
+    def report():
+        while not stop_event.wait(report_interval):
+            stats_queue.put((index, publisher.snapshot(), False))
+
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+
+    try:
+        target(shard, publisher, stop_event)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"分片 {name} 執行時出錯: {e}")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        stats_queue.put((index, publisher.snapshot(), True))
+
+
+class PublisherPool:
+    """
+    多進程發送池
+
+    target 必須是模組頂層函數（可被 pickle），簽名為
+    target(shard, publisher, stop_event)，在工作進程內執行，
+    publisher 為 ShardPublisher，stop_event 設置後應儘快返回
+    """
+
+    def __init__(self, shards: List[Dict], target: Callable, config: Dict,
+                 report_interval: float = 10.0):
+        """
+        Args:
+            shards: 每個工作進程的分片描述，需包含 name
+            target: 工作進程執行的分片任務
+            config: 連接配置 (broker, port, tls, username, password, client_prefix)
+            report_interval: 統計回報間隔（秒）
+        """
+        self.shards = shards
+        self.target = target
+        self.config = config
+        self.report_interval = report_interval
+        self.stop_event = mp.Event()
+        self.stats_queue = mp.Queue()
+        self.processes: List[mp.Process] = []
+        self.worker_stats: Dict[int, Dict] = {}
+        self.started_at = 0.0
+
+    def start(self):
+        """啟動所有工作進程"""
+        self.started_at = time.monotonic()
+        for index, shard in enumerate(self.shards):
+            process = mp.Process(
+                target=_worker_main,
+                args=(index, shard, self.target, self.config, self.stats_queue,
+                      self.stop_event, self.report_interval),
+                name=f"publisher-{shard.get('name', index)}",
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        logger.info(f"已啟動 {len(self.processes)} 個發送進程")
+
+    def stop(self):
+        """通知所有工作進程停止"""
+        self.stop_event.set()
+
+    def totals(self) -> Dict:
+        """彙總所有工作進程的最新統計"""
+        total = new_stats()
+        for stats in self.worker_stats.values():
+            merge_stats(total, stats)
+        total["connected"] = sum(1 for s in self.worker_stats.values() if s["connected"])
+        return total
+
+    def _drain(self, timeout: float) -> int:
+        """接收工作進程回報，返回本次收到的結束通知數"""
+        finished = 0
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                index, stats, done = self.stats_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self.worker_stats[index] = stats
+            if done:
+                finished += 1
+        return finished
+
+    def run(self, duration: Optional[float] = None) -> Dict:
+        """
+        在前台運行直到中斷、所有進程結束或達到 duration
+
+        Returns:
+            彙總統計
+        """
+        if not self.processes:
+            self.start()
+        finished = 0
+        try:
+            while finished < len(self.processes):
+                finished += self._drain(self.report_interval)
+                elapsed = time.monotonic() - self.started_at
+                total = self.totals()
+                logger.info(f"[發送池 {total['connected']}/{len(self.processes)} 已連接] "
+                            f"{format_stats(total, elapsed)}")
+                if duration is not None and elapsed >= duration:
+                    break
+        except KeyboardInterrupt:
+            logger.info("收到中斷信號，正在停止發送池...")
+        finally:
+            self.stop()
+            deadline = time.monotonic() + 10
+            while finished < len(self.processes) and time.monotonic() < deadline:
+                finished += self._drain(1.0)
+            for process in self.processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+
+        total = self.totals()
+        logger.info(f"發送池已停止: {format_stats(total, time.monotonic() - self.started_at)}")
+        return total
@@ -0,0 +1,288 @@
+"""
+MQTT 抓包重放工具
+以增量方式解析 test-data/mqtt_messages.json 這類抓包文件（JSON 陣列或每行一條的 NDJSON），
+按原始時間間隔（可加速）把每條訊息重新發布到原主題；
+支援循環重放，並可改寫 gateway id / 主題前綴 / serial no，把一份抓包放大成多 Gateway 負載
+"""
+
+import argparse
+import json
+import os
+import ssl
+import time
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+import paho.mqtt.client as mqtt
+
+DEFAULT_CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..", "test-data", "mqtt_messages.json")
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_capture(path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    增量解析抓包文件，逐條產出 {"topic", "message", "timestamp"} 記錄
+
+    同時支援頂層 JSON 陣列與 NDJSON，任何時刻只在記憶體保留一個讀取塊
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            # 跳過空白、陣列括號與分隔逗號
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                pos += 1
+
+            if pos >= len(buffer):
+                if eof:
+                    return
+                buffer = f.read(chunk_size)
+                pos = 0
+                eof = not buffer
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 記錄跨越讀取塊邊界：保留未解析部分並補讀
+                more = f.read(chunk_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+
+            pos = end
+            yield record
+
+
+def parse_timestamp(value: str) -> float:
+    """把 ISO 時間戳（如 2026-02-27T16:37:00.169Z）轉為 epoch 秒"""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value).timestamp()
+
+
+def gateway_prefix(gateway_id: int) -> str:
+    """Gateway 主題前綴，例如 4192540344 (0xF9E516B8) -> GW16B8"""
+    return f"GW{gateway_id & 0xFFFF:04X}"
+
+
+class GatewayRewriter:
+    """
+    把訊息改寫為第 k 個虛擬 Gateway 的訊息
+
+    虛擬 Gateway 的 ID 為原 ID + k，主題前綴與字串欄位中的 Gateway 標識一併替換；
+    serial no 加上循環偏移，保證多次循環時序列號持續遞增
+    """
+
+    def __init__(self):
+        self._cache: Dict[tuple, tuple] = {}
+
+    def _replacements(self, gateway_id: int, k: int) -> tuple:
+        key = (gateway_id, k)
+        cached = self._cache.get(key)
+        if cached is None:
+            new_id = gateway_id + k
+            cached = (
+                new_id,
+                ((gateway_prefix(gateway_id), gateway_prefix(new_id)),
+                 (f"{gateway_id:08X}", f"{new_id:08X}"))
+            )
+            self._cache[key] = cached
+        return cached
+
+    @staticmethod
+    def _replace(value, pairs):
+        if isinstance(value, str):
+            for old, new in pairs:
+                if old in value:
+                    value = value.replace(old, new)
+            return value
+        if isinstance(value, dict):
+            return {key: GatewayRewriter._replace(item, pairs) for key, item in value.items()}
+        return value
+
+    def rewrite(self, topic: str, message: Dict, k: int, serial_offset: int) -> tuple:
+        """返回改寫後的 (topic, message)，k=0 且無偏移時原樣返回"""
+        gateway_id = message.get("gateway id")
+        if (k == 0 and serial_offset == 0) or not isinstance(gateway_id, int):
+            return topic, message
+
+        new_id, pairs = self._replacements(gateway_id, k)
+        rewritten = {}
+        for key, value in message.items():
+            if key == "gateway id":
+                value = new_id
+            elif key == "serial no" and isinstance(value, int):
+                value += serial_offset
+            elif k and isinstance(value, (str, dict)):
+                value = self._replace(value, pairs)
+            rewritten[key] = value
+        if k:
+            topic = self._replace(topic, pairs)
+        return topic, rewritten
+
+
+def replay(path: str,
+           publish,
+           speed: float = 1.0,
+           loops: int = 1,
+           gateways: int = 1,
+           loop_gap: float = 1.0,
+           report_interval: float = 5.0) -> Dict:
+    """
+    重放抓包
+
+    Args:
+        path: 抓包文件路徑
+        publish: publish(topic, payload) 回調
+        speed: 時間縮放倍率，0 表示盡可能快
+        loops: 循環次數，0 表示無限循環
+        gateways: 虛擬 Gateway 數量
+        loop_gap: 兩次循環之間的間隔（原始時間秒）
+        report_interval: 進度輸出間隔（秒）
+
+    Returns:
+        重放統計
+    """
+    rewriter = GatewayRewriter()
+    stats = {"published": 0, "records": 0, "max_lag": 0.0, "loops": 0}
+    start = time.monotonic()
+    last_report = start
+    window_count = 0
+
+    # 兩次循環之間的時間與序列號偏移，在第一輪中累計
+    capture_offset = 0.0
+    serial_offset = 0
+    serial_min: Optional[int] = None
+    serial_max: Optional[int] = None
+    first_ts: Optional[float] = None
+
+    loop_index = 0
+    while loops == 0 or loop_index < loops:
+        last_ts = None
+        for record in iter_capture(path):
+            topic = record.get("topic")
+            message = record.get("message")
+            if not topic or message is None:
+                continue
+
+            ts = parse_timestamp(record["timestamp"]) if "timestamp" in record else last_ts
+            if ts is None:
+                ts = 0.0
+            if first_ts is None:
+                first_ts = ts
+            # 抓包時間戳亂序時不倒退
+            if last_ts is not None and ts < last_ts:
+                ts = last_ts
+            last_ts = ts
+
+            serial = message.get("serial no")
+            if loop_index == 0 and isinstance(serial, int):
+                serial_min = serial if serial_min is None else min(serial_min, serial)
+                serial_max = serial if serial_max is None else max(serial_max, serial)
+
+            if speed > 0:
+                target = start + (capture_offset + ts - first_ts) / speed
+                delay = target - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif -delay > stats["max_lag"]:
+                    stats["max_lag"] = -delay
+
+            for k in range(gateways):
+                out_topic, out_message = rewriter.rewrite(topic, message, k, serial_offset)
+                publish(out_topic, json.dumps(out_message, ensure_ascii=False))
+            stats["records"] += 1
+            stats["published"] += gateways
+            window_count += gateways
+
+            now = time.monotonic()
+            if report_interval and now - last_report >= report_interval:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 第 {loop_index + 1} 輪, "
+                      f"已發布 {stats['published']} 條 ({window_count / (now - last_report):.1f} msg/s), "
+                      f"最大延遲 {stats['max_lag'] * 1000:.1f} ms")
+                last_report = now
+                window_count = 0
+
+        if first_ts is None:
+            break
+        loop_index += 1
+        stats["loops"] = loop_index
+        capture_offset += (last_ts - first_ts) + loop_gap
+        if serial_min is not None:
+            serial_offset += serial_max - serial_min + 1
+
+    stats["elapsed"] = time.monotonic() - start
+    return stats
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="MQTT 抓包重放工具")
+    parser.add_argument("capture", nargs="?", default=DEFAULT_CAPTURE, help="抓包文件路徑")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="時間縮放倍率，例如 10 表示 10 倍速，0 表示盡可能快")
+    parser.add_argument("--loops", type=int, default=1, help="循環次數，0 表示無限循環")
+    parser.add_argument("--gateways", type=int, default=1,
+                        help="虛擬 Gateway 數量，每條訊息按 Gateway 改寫後各發布一次")
+    parser.add_argument("--loop-gap", type=float, default=1.0, help="循環之間的間隔（原始時間秒）")
+    parser.add_argument("--broker", default="localhost", help="MQTT 代理地址")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT 代理端口")
+    parser.add_argument("--tls", action="store_true", help="使用 SSL/TLS 連接")
+    parser.add_argument("--username", default=None, help="MQTT 用戶名")
+    parser.add_argument("--password", default=None, help="MQTT 密碼")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2), help="發布 QoS")
+    parser.add_argument("--dry-run", action="store_true", help="只解析與計時，不連接代理")
+    return parser.parse_args()
+
+
+def main():
+    """主程式"""
+    args = parse_args()
+    speed_text = "盡可能快" if args.speed <= 0 else f"{args.speed}x"
+    print("MQTT 抓包重放工具")
+    print(f"抓包文件: {args.capture}")
+    print(f"速度: {speed_text}, 循環: {args.loops or '無限'}, 虛擬 Gateway: {args.gateways}")
+
+    client = None
+    if args.dry_run:
+        def publish(topic, payload):
+            pass
+    else:
+        client = mqtt.Client()
+        if args.tls:
+            client.tls_set(ca_certs=None, certfile=None, keyfile=None,
+                           cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS,
+                           ciphers=None)
+        if args.username:
+            client.username_pw_set(args.username, args.password)
+        client.max_queued_messages_set(0)
+        client.connect(args.broker, args.port, 60)
+        client.loop_start()
+        print(f"已連接 MQTT Broker: {args.broker}:{args.port}")
+
+        def publish(topic, payload):
+            client.publish(topic, payload, args.qos)
+
+    try:
+        stats = replay(args.capture, publish, args.speed, args.loops, args.gateways, args.loop_gap)
+        elapsed = stats["elapsed"]
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 重放完成: {stats['loops']} 輪, "
+              f"{stats['records']} 條記錄, 發布 {stats['published']} 條, 耗時 {elapsed:.2f} 秒 "
+              f"({stats['published'] / elapsed if elapsed else 0:.1f} msg/s)")
+    except KeyboardInterrupt:
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 程式被用戶中斷")
+    finally:
+        if client:
+            client.loop_stop()
+            client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
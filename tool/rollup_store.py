@@ -0,0 +1,705 @@
+"""
+多解析度時間序列彙總
+消費健康（hr / SpO2 / bp syst / bp diast / skin temp / temp / battery level）與位置（x / y / z / quality）讀數，
+以 1 秒 -> 1 分鐘 -> 1 小時三級桶增量維護 count / min / max / sum / last，
+查詢時直接讀彙總，不需要掃描原始訊息
+
+儲存結構（每個解析度一個目錄 r<秒>/）：
+  - 開啟中的桶：按 設備 × 欄位 排列的預分配陣列，每條讀數 O(1) 更新三級桶
+  - 已關閉的桶：追加到列式尾部緩衝（series / start / count / min / max / sum / last）
+  - flush() 把尾部緩衝按 (series, start) 排序後寫成段文件（state_file 格式，恢復時 np.memmap 映射），
+    查詢以二分查找定位，只觸及相關的頁
+  - 進行中的時間跨度內按大小分層合併（同層段數達到 MERGE_FANIN 時合併為一段，每行約重寫 log8(段數) 次）；
+    已結束的跨度合併為一段（1 秒級按小時、1 分鐘級按天、1 小時級按 30 天）；
+    超過保留時間的段直接刪除（1 秒級默認保留 2 天，1 分鐘級 60 天，1 小時級不限）
+
+時間一律為讀數時間（epoch 秒），保留與合併以已見過的最新讀數時間為準，重放歷史數據時同樣適用；
+晚到的讀數併入該單元當前開啟的桶
+
+查詢介面：query(device, field, start, end, resolution) 與本地 HTTP
+GET /query?device=...&field=hr&start=-1d&end=&resolution=60 （start / end 可寫 epoch 秒或 -1h 等相對時間），
+GET /devices 返回已登記的設備
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from health_anomaly import resident_key
+from scenario import parse_seconds
+from state_file import load_state, save_state
+
+# 彙總的欄位（series = 設備列 * 欄位數 + 欄位序號）
+FIELDS = ("hr", "SpO2", "bp syst", "bp diast", "skin temp", "temp", "battery level",
+          "x", "y", "z", "quality")
+# 其他來源的欄位名 -> 欄位
+FIELD_ALIASES = {"heart_rate": "hr", "temperature": "skin temp"}
+POSITION_FIELDS = ("x", "y", "z", "quality")
+
+# 解析度（秒）、保留時間（秒，0 表示不限）與段合併跨度（秒）
+RESOLUTIONS = (1, 60, 3600)
+RETENTION = {1: 2 * 86400, 60: 60 * 86400, 3600: 0}
+COMPACT_SPAN = {1: 3600, 60: 86400, 3600: 30 * 86400}
+
+# 尾部緩衝行數上限，寫滿時立即寫段
+SEGMENT_ROWS = 65536
+# 進行中跨度內同一大小層的段數達到此值時合併
+MERGE_FANIN = 8
+# 自動選擇解析度時單次查詢的最多點數
+DEFAULT_MAX_POINTS = 2000
+DEFAULT_FLUSH_INTERVAL = 10.0
+
+# 段文件每行 36 字節：min / max / last 以 float32 保存（生理讀數與米級坐標的精度足夠），sum 保留 float64
+ROW_COLUMNS = (("series", np.int32), ("start", np.int64), ("count", np.int32),
+               ("min", np.float32), ("max", np.float32), ("sum", np.float64), ("last", np.float32))
+
+_FIELDS = {name: index for index, name in enumerate(FIELDS)}
+_FIELDS.update({alias: _FIELDS[name] for alias, name in FIELD_ALIASES.items()})
+
+
+def message_values(message: Dict) -> Optional[List[float]]:
+    """按 FIELDS 順序取出讀數（location 訊息取 position），缺少的欄位為 NaN；不含任何欄位時返回 None"""
+    values = [np.nan] * len(FIELDS)
+    found = False
+    sources = (message, message.get("position")) if isinstance(message.get("position"), dict) else (message,)
+    for source in sources:
+        for field, value in source.items():
+            column = _FIELDS.get(field)
+            if column is None or value is None:
+                continue
+            try:
+                values[column] = float(value)
+                found = True
+            except (TypeError, ValueError):
+                continue
+    return values if found else None
+
+
+class Segment:
+    """已寫入磁碟的一段彙總行，按 (series, start) 排序"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.arrays, meta = load_state(path)
+        self.start = int(meta["start"])
+        self.end = int(meta["end"])
+        self.rows = int(meta["rows"])
+        # 合併段記錄被其取代的成員段文件名
+        self.replaces = meta.get("replaces", [])
+
+    def select(self, series: int, start: int, end: int) -> Optional[Dict[str, np.ndarray]]:
+        """二分查找 series 在 [start, end) 內的行"""
+        column = self.arrays["series"]
+        # 以列的 dtype 查找，否則 numpy 會先把整列轉型複製
+        key = column.dtype.type(series)
+        low = int(np.searchsorted(column, key, "left"))
+        high = int(np.searchsorted(column, key, "right"))
+        if low == high:
+            return None
+        starts = self.arrays["start"][low:high]
+        first = low + int(np.searchsorted(starts, start, "left"))
+        last = low + int(np.searchsorted(starts, end, "left"))
+        if first == last:
+            return None
+        return {name: np.asarray(self.arrays[name][first:last]) for name, _ in ROW_COLUMNS}
+
+
+class RollupLevel:
+    """單個解析度：開啟中的桶、列式尾部緩衝與段文件"""
+
+    def __init__(self, directory: str, resolution: int, cells: int):
+        self.directory = directory
+        self.resolution = resolution
+        self.retention = RETENTION.get(resolution, 0)
+        self.compact_span = COMPACT_SPAN.get(resolution, resolution * 3600)
+        os.makedirs(directory, exist_ok=True)
+
+        self.bucket = np.full(cells, -1, dtype=np.int64)
+        self.count = np.zeros(cells, dtype=np.int64)
+        self.min = np.full(cells, np.inf)
+        self.max = np.full(cells, -np.inf)
+        self.sum = np.zeros(cells)
+        self.last = np.full(cells, np.nan)
+
+        self.tail = {name: np.empty(SEGMENT_ROWS, dtype=dtype) for name, dtype in ROW_COLUMNS}
+        self.tail_rows = 0
+        self.segments: List[Segment] = []
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+        for name in names:
+            try:
+                self.segments.append(Segment(os.path.join(directory, name)))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 略過損壞的段 {name}: {e}")
+        # 合併段寫入後、成員刪除前崩潰時兩者並存，刪除已被合併段取代的成員，避免重複計算
+        replaced = {name for segment in self.segments for name in segment.replaces}
+        for segment in [segment for segment in self.segments if os.path.basename(segment.path) in replaced]:
+            self._remove(segment)
+        # 序號取已有文件的最大值之後，新段不會與被取代的成員同名
+        self._sequence = max((int(name[:-4].rsplit("-", 1)[-1]) for name in names
+                              if name[:-4].rsplit("-", 1)[-1].isdigit()), default=-1) + 1
+
+    def grow(self, cells: int):
+        extra = cells - len(self.bucket)
+        if extra <= 0:
+            return
+        self.bucket = np.concatenate((self.bucket, np.full(extra, -1, dtype=np.int64)))
+        self.count = np.concatenate((self.count, np.zeros(extra, dtype=np.int64)))
+        self.min = np.concatenate((self.min, np.full(extra, np.inf)))
+        self.max = np.concatenate((self.max, np.full(extra, -np.inf)))
+        self.sum = np.concatenate((self.sum, np.zeros(extra)))
+        self.last = np.concatenate((self.last, np.full(extra, np.nan)))
+
+    # ---- 更新 ----
+
+    def update(self, cells: np.ndarray, values: np.ndarray, stamps: np.ndarray):
+        """更新一批互不重複的單元"""
+        buckets = np.floor(stamps / self.resolution).astype(np.int64)
+        opened = self.bucket[cells]
+        # 晚到的讀數併入當前開啟的桶
+        buckets = np.maximum(buckets, opened)
+        changed = buckets != opened
+        closing = cells[changed & (opened >= 0)]
+        if len(closing):
+            self._close(closing)
+        fresh = cells[changed]
+        if len(fresh):
+            self.bucket[fresh] = buckets[changed]
+        self.count[cells] += 1
+        self.min[cells] = np.minimum(self.min[cells], values)
+        self.max[cells] = np.maximum(self.max[cells], values)
+        self.sum[cells] += values
+        self.last[cells] = values
+
+    def _close(self, cells: np.ndarray):
+        """把單元的開啟桶寫入尾部緩衝並重置"""
+        offset = 0
+        while offset < len(cells):
+            if self.tail_rows == SEGMENT_ROWS:
+                self.write_segment()
+            take = cells[offset:offset + SEGMENT_ROWS - self.tail_rows]
+            end = self.tail_rows + len(take)
+            tail = self.tail
+            tail["series"][self.tail_rows:end] = take
+            tail["start"][self.tail_rows:end] = self.bucket[take] * self.resolution
+            tail["count"][self.tail_rows:end] = self.count[take]
+            tail["min"][self.tail_rows:end] = self.min[take]
+            tail["max"][self.tail_rows:end] = self.max[take]
+            tail["sum"][self.tail_rows:end] = self.sum[take]
+            tail["last"][self.tail_rows:end] = self.last[take]
+            self.tail_rows = end
+            offset += len(take)
+        self.bucket[cells] = -1
+        self.count[cells] = 0
+        self.min[cells] = np.inf
+        self.max[cells] = -np.inf
+        self.sum[cells] = 0.0
+
+    def close_before(self, now: float):
+        """關閉 now 所在桶之前的所有開啟桶"""
+        current = int(now // self.resolution)
+        cells = np.flatnonzero((self.bucket >= 0) & (self.bucket < current))
+        if len(cells):
+            self._close(cells)
+
+    def close_all(self):
+        cells = np.flatnonzero(self.bucket >= 0)
+        if len(cells):
+            self._close(cells)
+
+    # ---- 段文件 ----
+
+    def _save(self, arrays: Dict[str, np.ndarray], replaces: Sequence[str] = ()) -> Segment:
+        order = np.lexsort((arrays["start"], arrays["series"]))
+        arrays = {name: np.ascontiguousarray(arrays[name][order]) for name, _ in ROW_COLUMNS}
+        start = int(arrays["start"].min())
+        end = int(arrays["start"].max()) + self.resolution
+        path = os.path.join(self.directory, f"{start:012d}-{end:012d}-{self._sequence:06d}.seg")
+        self._sequence += 1
+        save_state(path, arrays, {"resolution": self.resolution, "start": start, "end": end,
+                                  "rows": len(arrays["series"]), "replaces": list(replaces)})
+        return Segment(path)
+
+    def write_segment(self):
+        """把尾部緩衝寫成段，跨越合併跨度邊界時按跨度拆開，保證每段都能參與合併"""
+        if not self.tail_rows:
+            return
+        rows = self.tail_rows
+        tail = {name: self.tail[name][:rows] for name, _ in ROW_COLUMNS}
+        spans = tail["start"] // self.compact_span
+        for span in np.unique(spans).tolist():
+            mask = spans == span
+            self.segments.append(self._save({name: column[mask] for name, column in tail.items()}))
+        self.tail_rows = 0
+
+    def maintain(self, now: float):
+        """刪除超過保留時間的段，合併已結束跨度內的多個小段"""
+        if self.retention:
+            expired = [segment for segment in self.segments if segment.end <= now - self.retention]
+            for segment in expired:
+                self._remove(segment)
+
+        closed_before = int(now // self.compact_span) * self.compact_span
+        groups: Dict[tuple, List[Segment]] = {}
+        for segment in self.segments:
+            span = segment.start // self.compact_span
+            if (segment.end - 1) // self.compact_span != span:
+                continue
+            if segment.end <= closed_before:
+                groups.setdefault((span, -1), []).append(segment)
+            else:
+                tier = int(np.log(max(segment.rows, 1)) / np.log(MERGE_FANIN))
+                groups.setdefault((span, tier), []).append(segment)
+        for (_, tier), members in groups.items():
+            if len(members) >= (2 if tier < 0 else MERGE_FANIN):
+                self._merge(members)
+        self.segments.sort(key=lambda segment: (segment.start, segment.path))
+
+    def _merge(self, members: List[Segment]):
+        # 合併段記下成員文件名後才刪除成員，中途崩潰時重新開啟會丟棄成員
+        merged = self._save({name: np.concatenate([np.asarray(m.arrays[name]) for m in members])
+                             for name, _ in ROW_COLUMNS},
+                            [os.path.basename(m.path) for m in members])
+        for segment in members:
+            self._remove(segment)
+        self.segments.append(merged)
+
+    def _remove(self, segment: Segment):
+        self.segments.remove(segment)
+        segment.arrays = None
+        try:
+            os.remove(segment.path)
+        except OSError as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 刪除段 {segment.path} 失敗: {e}")
+
+    # ---- 查詢 ----
+
+    def select(self, series: int, start: int, end: int) -> List[Dict[str, np.ndarray]]:
+        parts = []
+        for segment in self.segments:
+            if segment.end > start and segment.start < end:
+                part = segment.select(series, start, end)
+                if part is not None:
+                    parts.append(part)
+        if self.tail_rows:
+            rows = self.tail_rows
+            starts = self.tail["start"][:rows]
+            mask = (self.tail["series"][:rows] == series) & (starts >= start) & (starts < end)
+            if mask.any():
+                parts.append({name: self.tail[name][:rows][mask] for name, _ in ROW_COLUMNS})
+        if series < len(self.bucket) and self.bucket[series] >= 0:
+            bucket_start = int(self.bucket[series]) * self.resolution
+            if start <= bucket_start < end:
+                parts.append({"series": np.array([series]), "start": np.array([bucket_start]),
+                              "count": self.count[series:series + 1].copy(),
+                              "min": self.min[series:series + 1].copy(),
+                              "max": self.max[series:series + 1].copy(),
+                              "sum": self.sum[series:series + 1].copy(),
+                              "last": self.last[series:series + 1].copy()})
+        return parts
+
+
+class RollupStore:
+    """
+    多設備多解析度彙總
+
+    設備按登記順序佔一列，設備表保存在 catalog.json；
+    更新與查詢共用一把鎖，佇列模式下多個工作執行緒可共用同一實例
+    """
+
+    def __init__(self, directory: str, resolutions: Sequence[int] = RESOLUTIONS, initial_devices: int = 0):
+        """
+        Args:
+            directory: 數據目錄
+            resolutions: 解析度（秒），由細到粗
+            initial_devices: 預先分配的設備列數
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.catalog_path = os.path.join(directory, "catalog.json")
+        self.device_ids: List = []
+        self._index: Dict = {}
+        self.latest = 0.0
+        if os.path.exists(self.catalog_path):
+            with open(self.catalog_path, "r", encoding="utf-8") as f:
+                catalog = json.load(f)
+            if list(catalog.get("fields", FIELDS)) != list(FIELDS):
+                raise ValueError(f"{directory} 的欄位定義與當前版本不同")
+            self.device_ids = catalog.get("devices", [])
+            self._index = {key: row for row, key in enumerate(self.device_ids)}
+            self.latest = float(catalog.get("latest", 0.0))
+        self._catalog_size = len(self.device_ids)
+        self._catalog_latest = self.latest
+
+        self._rows = max(initial_devices, len(self.device_ids), 1)
+        cells = self._rows * len(FIELDS)
+        self.resolutions = tuple(sorted(resolutions))
+        self.levels = [RollupLevel(os.path.join(directory, f"r{resolution}"), resolution, cells)
+                       for resolution in self.resolutions]
+        self.readings = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.device_ids)
+
+    # ---- 設備 ----
+
+    def _add_devices(self, keys: Sequence) -> np.ndarray:
+        start = len(self.device_ids)
+        end = start + len(keys)
+        if end > self._rows:
+            rows = self._rows
+            while rows < end:
+                rows *= 2
+            for level in self.levels:
+                level.grow(rows * len(FIELDS))
+            self._rows = rows
+        for offset, key in enumerate(keys):
+            self._index[key] = start + offset
+        self.device_ids.extend(keys)
+        return np.arange(start, end, dtype=np.int64)
+
+    def rows_for(self, keys: Sequence) -> np.ndarray:
+        """返回設備所在列，未登記的設備自動登記"""
+        index = self._index
+        with self._lock:
+            missing = [key for key in dict.fromkeys(keys) if key not in index]
+            if missing:
+                self._add_devices(missing)
+            return np.fromiter((index[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    # ---- 更新 ----
+
+    def update(self, rows, values, timestamp=None, fields: Sequence[str] = FIELDS):
+        """
+        寫入一批讀數
+
+        Args:
+            rows: 設備列索引，長度 n
+            values: (n, len(fields)) 讀數，NaN 表示該條讀數不含此欄位
+            timestamp: 讀數時間（epoch 秒），標量或長度 n 的陣列，默認為當前時間
+            fields: values 各列對應的欄位名（可用 FIELD_ALIASES 中的別名）
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(rows), len(fields))
+        if timestamp is None:
+            timestamp = time.time()
+        timestamps = np.broadcast_to(np.asarray(timestamp, dtype=np.float64), rows.shape)
+        columns = np.array([_FIELDS[field] for field in fields], dtype=np.int64)
+
+        present_row, column = np.nonzero(~np.isnan(values))
+        cells = rows[present_row] * len(FIELDS) + columns[column]
+        readings = values[present_row, column]
+        stamps = timestamps[present_row]
+        if not len(cells):
+            return
+
+        with self._lock:
+            self.readings += len(cells)
+            self.latest = max(self.latest, float(stamps.max()))
+            # 同一單元在一批中出現多次時分輪處理，保持讀數順序
+            while len(cells):
+                unique, first = np.unique(cells, return_index=True)
+                if len(unique) == len(cells):
+                    for level in self.levels:
+                        level.update(cells, readings, stamps)
+                    break
+                first.sort()
+                for level in self.levels:
+                    level.update(cells[first], readings[first], stamps[first])
+                rest = np.ones(len(cells), dtype=bool)
+                rest[first] = False
+                cells, readings, stamps = cells[rest], readings[rest], stamps[rest]
+
+    def process(self, message: Dict, recv_ts: Optional[float] = None):
+        """寫入單條健康或 location 訊息，不含彙總欄位的訊息略過"""
+        values = message_values(message)
+        key = resident_key(message)
+        if values is None or key is None:
+            return
+        self.update(self.rows_for([key]), [values], recv_ts)
+
+    def process_batch(self, messages: Sequence[Dict], recv_ts: Optional[float] = None):
+        keys = []
+        values = []
+        for message in messages:
+            readings = message_values(message)
+            key = resident_key(message)
+            if readings is not None and key is not None:
+                keys.append(key)
+                values.append(readings)
+        if keys:
+            self.update(self.rows_for(keys), values, recv_ts)
+
+    # ---- 持久化 ----
+
+    def flush(self, now: Optional[float] = None, close_open: bool = False):
+        """
+        關閉已結束的桶並把尾部緩衝寫成段，然後按保留與合併規則整理段文件
+
+        Args:
+            now: 讀數時間基準，默認為已見過的最新讀數時間
+            close_open: 同時關閉仍在進行中的桶（停止前呼叫）
+        """
+        with self._lock:
+            now = self.latest if now is None else now
+            # 段文件只在此寫入：先寫設備表，崩潰後段中引用的每一列都能在 catalog.json 中找到
+            if len(self.device_ids) != self._catalog_size or self.latest != self._catalog_latest:
+                self._write_catalog()
+            for level in self.levels:
+                if close_open:
+                    level.close_all()
+                else:
+                    level.close_before(now)
+                level.write_segment()
+                level.maintain(now)
+
+    def _write_catalog(self):
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fields": list(FIELDS), "devices": self.device_ids, "latest": self.latest},
+                      f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.catalog_path)
+        self._catalog_size = len(self.device_ids)
+        self._catalog_latest = self.latest
+
+    def close(self):
+        self.flush(close_open=True)
+
+    # ---- 查詢 ----
+
+    def choose_resolution(self, start: float, end: float, max_points: int = DEFAULT_MAX_POINTS) -> int:
+        """點數不超過 max_points 且仍在保留時間內的最細解析度"""
+        for level in self.levels:
+            if (end - start) / level.resolution > max_points:
+                continue
+            if level.retention and start < self.latest - level.retention:
+                continue
+            return level.resolution
+        return self.levels[-1].resolution
+
+    def query(self, device, field: str, start: float, end: float,
+              resolution: Optional[int] = None, max_points: int = DEFAULT_MAX_POINTS) -> Optional[Dict]:
+        """
+        查詢設備某欄位在 [start, end) 內的彙總
+
+        Returns:
+            {"resolution", "start", "count", "min", "max", "mean", "last"}（陣列按時間排序），設備未登記時返回 None
+        """
+        if field not in _FIELDS:
+            raise ValueError(f"未知欄位 {field}，可用: {', '.join(FIELDS)}")
+        row = self._index.get(device)
+        if row is None and isinstance(device, str) and device.isdigit():
+            row = self._index.get(int(device))
+        if row is None:
+            return None
+        if resolution is None:
+            resolution = self.choose_resolution(start, end, max_points)
+        level = next((level for level in self.levels if level.resolution == resolution), None)
+        if level is None:
+            raise ValueError(f"沒有 {resolution} 秒解析度，可用: {self.resolutions}")
+        series = row * len(FIELDS) + _FIELDS[field]
+        first = int(start // resolution) * resolution
+
+        with self._lock:
+            parts = level.select(series, first, int(np.ceil(end)))
+        result = {"device": device, "field": field, "resolution": resolution}
+        if not parts:
+            result.update({"start": np.empty(0, dtype=np.int64), "count": np.empty(0, dtype=np.int64),
+                           "min": np.empty(0), "max": np.empty(0), "mean": np.empty(0), "last": np.empty(0)})
+            return result
+
+        merged = {name: np.concatenate([part[name] for part in parts]) for name, _ in ROW_COLUMNS}
+        order = np.argsort(merged["start"], kind="stable")
+        merged = {name: column[order] for name, column in merged.items()}
+        # 重啟前後寫出的同一桶合併為一行
+        heads = np.flatnonzero(np.concatenate(([True], np.diff(merged["start"]) != 0)))
+        tails = np.append(heads[1:], len(order)) - 1
+        count = np.add.reduceat(merged["count"], heads)
+        # float32 欄位保留 4 位小數，避免輸出 36.599998 之類的值
+        result.update({
+            "start": merged["start"][heads],
+            "count": count,
+            "min": np.round(np.minimum.reduceat(merged["min"], heads).astype(np.float64), 4),
+            "max": np.round(np.maximum.reduceat(merged["max"], heads).astype(np.float64), 4),
+            "mean": np.add.reduceat(merged["sum"], heads) / np.maximum(count, 1),
+            "last": np.round(merged["last"][tails].astype(np.float64), 4),
+        })
+        return result
+
+    def last_position(self, device, start: float, end: float, resolution: Optional[int] = None) -> Optional[Dict]:
+        """每個桶的最後位置 {"resolution", "start", "x", "y", "z", "quality"}"""
+        results = {field: self.query(device, field, start, end, resolution) for field in POSITION_FIELDS}
+        if results["x"] is None:
+            return None
+        position = {"device": device, "resolution": results["x"]["resolution"], "start": results["x"]["start"]}
+        for field, result in results.items():
+            lookup = dict(zip(result["start"].tolist(), result["last"].tolist()))
+            position[field] = np.array([lookup.get(start, np.nan) for start in position["start"].tolist()])
+        return position
+
+    def stats(self) -> Dict:
+        return {
+            "devices": len(self.device_ids),
+            "readings": self.readings,
+            "segments": {level.resolution: len(level.segments) for level in self.levels},
+            "segment_rows": {level.resolution: sum(s.rows for s in level.segments) for level in self.levels},
+        }
+
+
+def parse_time(value: Optional[str], now: float, default: float) -> float:
+    """epoch 秒，或以 - 開頭的相對時間（-90s / -5m / -1d 相對於 now）"""
+    if value is None or value == "":
+        return default
+    if value.startswith("-"):
+        return now - parse_seconds(value[1:])
+    return float(value)
+
+
+def _json_ready(result: Dict) -> Dict:
+    return {key: (value.tolist() if isinstance(value, np.ndarray) else value) for key, value in result.items()}
+
+
+def start_query_server(store: RollupStore, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """在後台執行緒啟動本地查詢服務（GET /query、GET /devices）"""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                if url.path == "/devices":
+                    body = {"devices": store.device_ids, "fields": list(FIELDS)}
+                elif url.path == "/query":
+                    now = store.latest or time.time()
+                    end = parse_time(params.get("end"), now, now + 1)
+                    start = parse_time(params.get("start"), now, end - 3600)
+                    resolution = int(params["resolution"]) if params.get("resolution") else None
+                    field = params.get("field", "hr")
+                    if field == "position":
+                        result = store.last_position(params.get("device"), start, end, resolution)
+                    else:
+                        result = store.query(params.get("device"), field, start, end, resolution)
+                    if result is None:
+                        self.send_error(404, "device not found")
+                        return
+                    body = _json_ready(result)
+                else:
+                    self.send_error(404)
+                    return
+            except (KeyError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+            data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="rollup-http", daemon=True).start()
+    return server
+
+
+def run_flusher(store: RollupStore, interval: float, stop_event: threading.Event):
+    """每 interval 秒 flush 一次；停止後由呼叫方 close() 關閉仍開啟的桶"""
+    while not stop_event.wait(interval):
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 彙總寫入失敗: {e}")
+
+
+def start_flusher(store: RollupStore, interval: float, stop_event: threading.Event) -> threading.Thread:
+    thread = threading.Thread(target=run_flusher, args=(store, interval, stop_event),
+                              name="rollup-flush", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_benchmark(directory: str, devices: int, days: float, interval: float, seed: Optional[int] = None):
+    """
+    以合成的 300B 讀數（hr / SpO2 / skin temp）與 Tag 位置測量寫入速率，
+    再以儀表板常見範圍（1 小時 / 1 天 / 1 週 / 全部）測量查詢延遲
+    """
+    rng = np.random.default_rng(seed)
+    store = RollupStore(directory, initial_devices=devices)
+    keys = [f"E0:0E:08:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}" for i in range(devices)]
+    rows = store.rows_for(keys)
+    fields = ("hr", "SpO2", "skin temp", "x", "y")
+    steps = int(days * 86400 / interval)
+    start_time = float(int(time.time() // 86400 - days) * 86400)
+    means = np.array([75, 97, 36.6, 5.0, 5.0])
+    spreads = np.array([6, 1.2, 0.3, 2.0, 2.0])
+
+    print(f"基準測試: {devices} 個設備 x {len(fields)} 欄位, 每 {interval:g} 秒一條, {days:g} 天 ({steps} 個週期)")
+    written = 0
+    flush_every = max(1, int(60 / interval))
+    started = time.perf_counter()
+    for step in range(steps):
+        values = np.round(rng.normal(means, spreads, (devices, len(fields))), 2)
+        store.update(rows, values, start_time + step * interval, fields)
+        written += values.size
+        if step % flush_every == flush_every - 1:
+            store.flush()
+    store.close()
+    elapsed = time.perf_counter() - started
+    stats = store.stats()
+    print(f"  寫入: {written / elapsed:,.0f} readings/s ({written} 條, {elapsed:.1f} s), "
+          f"段 {stats['segments']}, 段行數 {stats['segment_rows']}")
+
+    store = RollupStore(directory)
+    end = store.latest + 1
+    for label, span in (("1 小時", 3600), ("1 天", 86400), ("1 週", 7 * 86400), ("全部", days * 86400)):
+        latencies = []
+        points = 0
+        for device in rng.choice(keys, 50):
+            query_started = time.perf_counter()
+            result = store.query(str(device), "hr", end - span, end)
+            latencies.append(time.perf_counter() - query_started)
+            points = len(result["start"])
+        latencies.sort()
+        print(f"  查詢 {label}: 解析度 {result['resolution']} 秒, {points} 點, "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, 最大 {latencies[-1] * 1000:.2f} ms")
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="多解析度彙總：基準測試或啟動本地查詢服務")
+    parser.add_argument("directory", help="數據目錄")
+    parser.add_argument("--serve", type=int, default=0, metavar="PORT", help="只啟動查詢服務（不寫入）")
+    parser.add_argument("--devices", type=int, default=500, help="基準測試的設備數量")
+    parser.add_argument("--days", type=float, default=7, help="基準測試的數據天數")
+    parser.add_argument("--interval", type=float, default=30, help="基準測試每台設備的上報間隔（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serve:
+        store = RollupStore(args.directory)
+        start_query_server(store, args.serve)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 查詢服務: http://127.0.0.1:{args.serve}/query "
+              f"({len(store)} 個設備)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 開始基準測試")
+        run_benchmark(args.directory, args.devices, args.days, args.interval, args.seed)
@@ -0,0 +1,525 @@
+"""
+場景文件載入器
+以 YAML / JSON 描述 Gateway、住民群體（數量、設備類型、上報頻率分佈）、
+按群組（cohort）區分的健康參數與定時事件（跌倒、SOS、發燒潮、Gateway 斷線），
+取代模擬器中寫死的 USERS / HEART_RATE_RANGES / 主題與代理設置。
+
+場景在啟動時一次性編譯為按住民排列的扁平陣列（基礎心率、上報頻率、體溫範圍、
+異常概率、所屬 Gateway）與按時間排序的事件表，運行中每個週期只做陣列索引，
+事件的開始 / 結束以指針推進，單次成本與場景中的群組、事件數量無關。
+
+場景格式（YAML 需要安裝 PyYAML，JSON 無額外依賴）：
+
+    name: 陽光養老院日間
+    seed: 7
+    broker: {host: localhost, port: 1883, topic: health/data, qos: 1}
+    gateways:
+      - import: ../test-data              # 匯入 homes.json / gateways.json / anchors.json
+      - {id: 4192540345, anchors: 4}      # anchors 為數量時自動產生
+      - {count: 2, anchors: 2}            # 批量產生
+    cohorts:
+      normal:  {hr: [65, 85], temp: [36.0, 37.5], anomaly: 0.05}
+      cardiac: {hr: [80, 100], temp: [36.2, 37.5], anomaly: 0.15}
+    populations:
+      - {cohort: normal, device: 300B, count_per_gateway: 20, udr: 0.0333}
+      - {cohort: cardiac, device: 300B, count: 10, udr: {uniform: [0.05, 0.2]}, gateways: [4192540344]}
+      - {device: diaper DV1, count: 10}
+      - {device: tag, count: 30, udr: {choice: [0.1, 0.2, 1.0]}}
+    events:
+      - {type: fever, at: 5m, duration: 30m, cohort: normal, fraction: 0.2, spread: 10m}
+      - {type: fall, at: 90s, count: 1}
+      - {type: sos, at: 2m, count: 2, duration: 30s, every: 10m, repeat: 3}
+      - {type: outage, at: 4m, duration: 1m, gateway: 4022156756}
+
+時間可寫秒數或帶單位的字串（90s / 5m / 1h），均相對場景開始；
+事件默認只選擇有健康讀數的設備（300B），可用 device 指定其他類型；
+spread 把選中的住民分成 steps 組（默認 10）依次開始，形成一波擴散；
+every / repeat 把事件按間隔重複展開。場景路徑為目錄時視為 test-data 目錄，
+匯入其中的 Gateway 並為每個 Gateway 建立 DEFAULT_RESIDENTS_PER_GATEWAY 名住民
+"""
+
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from replay_capture import gateway_prefix
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# 未指定 Gateway 時的默認 Gateway 與 Anchor（與 anchor_trasmitt.py 一致）
+DEFAULT_GATEWAY_ID = 4192540344
+DEFAULT_ANCHOR = {"name": "0x8E97", "id": 36503}
+# 自動產生的 Anchor / Tag ID 起點
+FIRST_ANCHOR_ID = 16912
+FIRST_TAG_ID = 11143
+
+# 以目錄作為場景時每個 Gateway 的住民數量（與模擬器內建 USERS 人數一致）
+DEFAULT_RESIDENTS_PER_GATEWAY = 5
+
+# 設備類型（見 device_uid_topics_detail.md）、別名與 device_uid 前綴
+DEVICE_TYPES = ("300B", "diaper DV1", "pedo", "tag")
+DEVICE_ALIASES = {"300b": "300B", "watch": "300B", "diaper": "diaper DV1", "diaper dv1": "diaper DV1",
+                  "pedo": "pedo", "tag": "tag", "uwb tag": "tag"}
+DEVICE_UID_PREFIX = {"300B": "300B", "diaper DV1": "DIAPER", "pedo": "PEDO", "tag": "TAG"}
+# 有心率與皮膚溫度讀數的設備
+HEALTH_DEVICES = ("300B",)
+
+# 默認健康參數，與 HEART_RATE_RANGES / 前端 healthStore 一致
+DEFAULT_COHORT = {"hr": (65, 85), "temp": (36.0, 37.5), "anomaly": 0.05, "udr": 1 / 30}
+
+# 事件類型與默認持續時間（秒）、心率 / 體溫偏移
+EVENT_TYPES = ("fall", "sos", "fever", "outage")
+EVENT_DEFAULTS = {
+    "fall": {"duration": 10.0, "hr": 20.0, "temp": 0.0},
+    "sos": {"duration": 30.0, "hr": 10.0, "temp": 0.0},
+    "fever": {"duration": 1800.0, "hr": 15.0, "temp": 1.5},
+    "outage": {"duration": 60.0, "hr": 0.0, "temp": 0.0},
+}
+DEFAULT_WAVE_STEPS = 10
+
+_DURATION_PATTERN = re.compile(r"^\s*([0-9.]+)\s*(ms|s|m|h)?\s*$")
+_DURATION_UNITS = {None: 1.0, "ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_seconds(value) -> float:
+    """把 90 / "90s" / "5m" / "1h" 轉為秒數"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"無法解析時間: {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def load_scenario(path: str) -> Dict:
+    """
+    讀取場景文件（.yaml / .yml 以 PyYAML 解析，其餘按 JSON）
+
+    路徑為目錄時返回匯入該 test-data 目錄的默認場景
+    """
+    if os.path.isdir(path):
+        return {"name": os.path.basename(os.path.abspath(path)),
+                "gateways": [{"import": os.path.abspath(path)}],
+                "populations": [{"count_per_gateway": DEFAULT_RESIDENTS_PER_GATEWAY}]}
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("讀取 YAML 場景需要安裝 PyYAML (pip install pyyaml)，或改用 JSON 場景")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise ValueError(f"{path} 不是有效的場景文件")
+    return spec
+
+
+def import_test_data(data_dir: str) -> List[Dict]:
+    """
+    從 test-data 目錄的 homes.json / floors.json / gateways.json / anchors.json 匯入 Gateway
+
+    Anchor 按 gatewayId 歸入 Gateway，使用其 UWB 坐標（cloud_position_x/y/z）
+    """
+    def read(name):
+        file_path = os.path.join(data_dir, name)
+        if not os.path.exists(file_path):
+            return []
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    homes = {home.get("id"): home.get("name") for home in read("homes.json")}
+    floors = {floor.get("id"): floor for floor in read("floors.json")}
+    anchors: Dict[str, List[Dict]] = {}
+    for anchor in read("anchors.json"):
+        if anchor.get("cloud_anchor_id") is None:
+            continue
+        anchors.setdefault(anchor.get("gatewayId"), []).append({
+            "id": int(anchor["cloud_anchor_id"]),
+            "name": anchor.get("name") or f"DW{int(anchor['cloud_anchor_id']):04X}",
+            "position": {"x": anchor.get("cloud_position_x", 0.0),
+                         "y": anchor.get("cloud_position_y", 0.0),
+                         "z": anchor.get("cloud_position_z", 2.0)},
+        })
+
+    gateways = []
+    for gateway in read("gateways.json"):
+        if gateway.get("cloud_gateway_id") is None:
+            continue
+        floor = floors.get(gateway.get("floorId"), {})
+        gateways.append({
+            "gateway_id": int(gateway["cloud_gateway_id"]),
+            "name": gateway.get("name") or f"Gw{int(gateway['cloud_gateway_id']):08X}",
+            "home": homes.get(floor.get("homeId")),
+            "floor_id": gateway.get("floorId"),
+            "anchors": anchors.get(gateway.get("id"), []),
+        })
+    return gateways
+
+
+class EventTimeline:
+    """
+    編譯後的事件表
+
+    每個事件為一行：開始 / 結束時間、類型、心率與體溫偏移、目標住民（CSR 形式）與目標 Gateway；
+    advance(elapsed) 以兩個指針分別推進開始與結束，只處理本次跨越的事件，
+    並把效果累加到按住民排列的 hr_offset / temp_offset / sos / fall 與按 Gateway 排列的 gateway_down
+    """
+
+    def __init__(self, events: List[Dict], resident_count: int, gateway_count: int):
+        events = sorted(events, key=lambda event: event["start"])
+        self.events = events
+        self.start = np.array([event["start"] for event in events], dtype=np.float64)
+        self.end = np.array([event["end"] for event in events], dtype=np.float64)
+        self.kind = np.array([EVENT_TYPES.index(event["type"]) for event in events], dtype=np.int8)
+        self.hr_delta = np.array([event["hr"] for event in events], dtype=np.float64)
+        self.temp_delta = np.array([event["temp"] for event in events], dtype=np.float64)
+        self.gateway = np.array([event["gateway"] for event in events], dtype=np.int32)
+        sizes = [len(event["rows"]) for event in events]
+        self.target_offsets = np.zeros(len(events) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.target_offsets[1:])
+        self.target_rows = (np.concatenate([event["rows"] for event in events]).astype(np.int64)
+                            if events else np.zeros(0, dtype=np.int64))
+        self._end_order = np.argsort(self.end, kind="stable")
+
+        self.hr_offset = np.zeros(resident_count, dtype=np.float64)
+        self.temp_offset = np.zeros(resident_count, dtype=np.float64)
+        self.sos = np.zeros(resident_count, dtype=np.int16)
+        self.fall = np.zeros(resident_count, dtype=np.int16)
+        self.gateway_down = np.zeros(gateway_count, dtype=np.int16)
+        self._next_start = 0
+        self._next_end = 0
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def rows(self, index: int) -> np.ndarray:
+        return self.target_rows[self.target_offsets[index]:self.target_offsets[index + 1]]
+
+    def _apply(self, index: int, sign: int):
+        rows = self.rows(index)
+        kind = EVENT_TYPES[self.kind[index]]
+        if kind == "outage":
+            self.gateway_down[self.gateway[index]] += sign
+            return
+        if self.hr_delta[index]:
+            self.hr_offset[rows] += sign * self.hr_delta[index]
+        if self.temp_delta[index]:
+            self.temp_offset[rows] += sign * self.temp_delta[index]
+        if kind == "sos":
+            self.sos[rows] += sign
+        elif kind == "fall":
+            self.fall[rows] += sign
+
+    def advance(self, elapsed: float) -> List[Tuple[int, bool]]:
+        """
+        推進到場景開始後 elapsed 秒
+
+        Returns:
+            本次發生的 (事件索引, 是否為開始) 列表，結束的事件 is_start 為 False
+        """
+        transitions = []
+        count = len(self.events)
+        while self._next_start < count and self.start[self._next_start] <= elapsed:
+            self._apply(self._next_start, 1)
+            transitions.append((self._next_start, True))
+            self._next_start += 1
+        while self._next_end < count:
+            index = int(self._end_order[self._next_end])
+            if self.end[index] > elapsed or index >= self._next_start:
+                break
+            self._apply(index, -1)
+            transitions.append((index, False))
+            self._next_end += 1
+        return transitions
+
+    @property
+    def finished(self) -> bool:
+        return self._next_end >= len(self.events)
+
+    def describe(self, index: int) -> str:
+        event = self.events[index]
+        target = (f"Gateway {event['gateway_name']}" if event["type"] == "outage"
+                  else f"{len(self.rows(index))} 名住民")
+        return (f"{event['type']} @{event['start']:.0f}s~{event['end']:.0f}s {target}"
+                + (f" ({event['label']})" if event.get("label") else ""))
+
+
+class Scenario:
+    """
+    編譯後的場景
+
+    住民按行排列：resident_ids / names / device_uids 為列表，
+    device、cohort、gateway、base_heart_rate、udr、anomaly_probability、temp_low / temp_high 為 NumPy 陣列
+    """
+
+    def __init__(self, spec: Dict, base_dir: str = "."):
+        # 未指定 seed 時隨機選取並寫回 spec，發送池各進程以同一 spec 重新編譯得到相同的場景
+        self.seed = spec.get("seed")
+        if self.seed is None:
+            self.seed = int(np.random.SeedSequence().entropy % (1 << 32))
+        self.spec = dict(spec, seed=self.seed)
+        self.base_dir = os.path.abspath(base_dir)
+        self.name = spec.get("name", "scenario")
+        self.broker = dict(spec.get("broker") or {})
+        rng = np.random.default_rng(self.seed)
+
+        self.gateways = self._compile_gateways(spec.get("gateways") or [], self.base_dir)
+        self.cohort_names, cohorts = self._compile_cohorts(spec.get("cohorts") or {})
+        self._compile_populations(spec.get("populations") or [], cohorts, rng)
+        self.timeline = EventTimeline(self._compile_events(spec.get("events") or [], rng),
+                                      len(self.resident_ids), len(self.gateways))
+
+    # ---- Gateway ----
+
+    def _compile_gateways(self, entries: List[Dict], base_dir: str) -> List[Dict]:
+        gateways: List[Dict] = []
+        for entry in entries:
+            if "import" in entry:
+                gateways.extend(import_test_data(os.path.join(base_dir, entry["import"])))
+            elif "count" in entry:
+                for _ in range(int(entry["count"])):
+                    gateways.append({"gateway_id": self._next_gateway_id(gateways),
+                                     "anchors": entry.get("anchors", 1)})
+            else:
+                gateway = dict(entry)
+                gateway["gateway_id"] = int(gateway.pop("id", None) or self._next_gateway_id(gateways))
+                gateways.append(gateway)
+        if not gateways:
+            gateways.append({"gateway_id": DEFAULT_GATEWAY_ID, "anchors": [dict(DEFAULT_ANCHOR)]})
+
+        used_anchor_ids = {anchor["id"] for gateway in gateways
+                           if isinstance(gateway.get("anchors"), list) for anchor in gateway["anchors"]}
+        next_anchor_id = FIRST_ANCHOR_ID
+        for gateway in gateways:
+            gateway.setdefault("name", f"Gw{gateway['gateway_id']:08X}")
+            gateway["prefix"] = gateway_prefix(gateway["gateway_id"])
+            anchors = gateway.get("anchors", 1)
+            if isinstance(anchors, int):
+                generated = []
+                for _ in range(anchors):
+                    while next_anchor_id in used_anchor_ids:
+                        next_anchor_id = (next_anchor_id + 1) & 0xFFFF
+                    used_anchor_ids.add(next_anchor_id)
+                    generated.append({"id": next_anchor_id, "name": f"DW{next_anchor_id:04X}"})
+                anchors = generated
+            gateway["anchors"] = [dict(anchor, id=int(anchor["id"]),
+                                       name=anchor.get("name") or f"DW{int(anchor['id']):04X}")
+                                  for anchor in anchors]
+        return gateways
+
+    @staticmethod
+    def _next_gateway_id(gateways: List[Dict]) -> int:
+        return max([DEFAULT_GATEWAY_ID - 1] + [gateway["gateway_id"] for gateway in gateways]) + 1
+
+    def gateway_index(self, key) -> int:
+        """按 Gateway ID、名稱或主題前綴查找 Gateway 索引"""
+        for index, gateway in enumerate(self.gateways):
+            if key in (gateway["gateway_id"], gateway["name"], gateway["prefix"]) or \
+                    str(key) == str(gateway["gateway_id"]):
+                return index
+        raise ValueError(f"場景中沒有 Gateway {key!r}")
+
+    # ---- 群組與群體 ----
+
+    @staticmethod
+    def _compile_cohorts(entries: Dict) -> Tuple[List[str], List[Dict]]:
+        names = ["default"]
+        cohorts = [dict(DEFAULT_COHORT)]
+        for name, profile in entries.items():
+            cohort = dict(DEFAULT_COHORT, **(profile or {}))
+            if name == "default":
+                cohorts[0] = cohort
+            else:
+                names.append(name)
+                cohorts.append(cohort)
+        return names, cohorts
+
+    @staticmethod
+    def _sample_udr(spec, count: int, rng) -> np.ndarray:
+        """上報頻率分佈：數值、{uniform: [a, b]}、{normal: [mean, sd]}、{choice: [...], weights: [...]}"""
+        if isinstance(spec, (int, float)):
+            return np.full(count, float(spec))
+        if "uniform" in spec:
+            low, high = spec["uniform"]
+            return rng.uniform(low, high, size=count)
+        if "normal" in spec:
+            mean, sd = spec["normal"]
+            return np.maximum(rng.normal(mean, sd, size=count), spec.get("min", mean / 10))
+        if "choice" in spec:
+            weights = spec.get("weights")
+            if weights is not None:
+                weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+            return rng.choice(np.asarray(spec["choice"], dtype=np.float64), size=count, p=weights)
+        raise ValueError(f"無法解析上報頻率: {spec!r}")
+
+    def _compile_populations(self, entries: List[Dict], cohorts: List[Dict], rng):
+        ids: List[str] = []
+        names: List[str] = []
+        device_uids: List[str] = []
+        columns = {"device": [], "cohort": [], "gateway": [], "base_heart_rate": [], "udr": [],
+                   "anomaly_probability": [], "temp_low": [], "temp_high": []}
+        device_counts = {device: 0 for device in DEVICE_TYPES}
+        total = sum(int(entry.get("count", 0)) or
+                    int(entry.get("count_per_gateway", 0)) * len(entry.get("gateways") or self.gateways)
+                    for entry in entries)
+        width = max(3, len(str(total)))
+
+        for entry in entries:
+            device = DEVICE_ALIASES.get(str(entry.get("device", "300B")).lower())
+            if device is None:
+                raise ValueError(f"未知設備類型 {entry.get('device')!r}，可用: {', '.join(DEVICE_TYPES)}")
+            cohort_name = entry.get("cohort", "default")
+            if cohort_name not in self.cohort_names:
+                raise ValueError(f"場景中沒有群組 {cohort_name!r}")
+            cohort_index = self.cohort_names.index(cohort_name)
+            cohort = cohorts[cohort_index]
+            gateway_rows = [self.gateway_index(key) for key in entry.get("gateways") or []] or \
+                list(range(len(self.gateways)))
+            count = int(entry.get("count", 0)) or int(entry.get("count_per_gateway", 0)) * len(gateway_rows)
+            if count <= 0:
+                continue
+
+            # 住民按順序輪流分配到 Gateway，與 build_population 一致
+            gateway = np.asarray(gateway_rows, dtype=np.int32)[np.arange(count) % len(gateway_rows)]
+            hr_low, hr_high = cohort["hr"]
+            temp_low, temp_high = cohort["temp"]
+            columns["device"].append(np.full(count, DEVICE_TYPES.index(device), dtype=np.int8))
+            columns["cohort"].append(np.full(count, cohort_index, dtype=np.int16))
+            columns["gateway"].append(gateway)
+            columns["base_heart_rate"].append(rng.integers(hr_low, hr_high + 1, size=count))
+            columns["udr"].append(self._sample_udr(entry.get("udr", cohort["udr"]), count, rng))
+            columns["anomaly_probability"].append(np.full(count, float(cohort["anomaly"])))
+            columns["temp_low"].append(np.full(count, float(temp_low)))
+            columns["temp_high"].append(np.full(count, float(temp_high)))
+
+            prefix = entry.get("id_prefix", "user")
+            name_prefix = entry.get("name_prefix", "住民")
+            for _ in range(count):
+                serial = len(ids) + 1
+                ids.append(f"{prefix}{serial:0{width}d}")
+                names.append(f"{name_prefix}{serial:0{width}d}")
+                device_uids.append(self._device_uid(device, device_counts[device]))
+                device_counts[device] += 1
+
+        self.resident_ids = ids
+        self.resident_names = names
+        self.device_uids = device_uids
+        dtypes = {"device": np.int8, "cohort": np.int16, "gateway": np.int32, "base_heart_rate": np.int64,
+                  "udr": np.float64, "anomaly_probability": np.float64,
+                  "temp_low": np.float64, "temp_high": np.float64}
+        for name, parts in columns.items():
+            setattr(self, name, np.concatenate(parts).astype(dtypes[name]) if parts
+                    else np.zeros(0, dtype=dtypes[name]))
+        if np.any(self.udr <= 0):
+            raise ValueError("上報頻率必須大於 0")
+
+    @staticmethod
+    def _device_uid(device: str, index: int) -> str:
+        """按 device_uid 規則產生設備識別：300B / DIAPER 以 MAC，PEDO / TAG 以 16 位 ID"""
+        if device in ("300B", "diaper DV1"):
+            oui = "E0:0E:08" if device == "300B" else "C5:C6:E3"
+            mac = f"{oui}:{index >> 16 & 0xFF:02X}:{index >> 8 & 0xFF:02X}:{index & 0xFF:02X}"
+            return f"{DEVICE_UID_PREFIX[device]}:{mac}"
+        return f"{DEVICE_UID_PREFIX[device]}:{(FIRST_TAG_ID + index) & 0xFFFF}"
+
+    # ---- 事件 ----
+
+    def _select_rows(self, entry: Dict, rng) -> np.ndarray:
+        mask = np.ones(len(self.resident_ids), dtype=bool)
+        if "cohort" in entry:
+            cohorts = entry["cohort"] if isinstance(entry["cohort"], list) else [entry["cohort"]]
+            mask &= np.isin(self.cohort, [self.cohort_names.index(name) for name in cohorts])
+        if "gateway" in entry:
+            gateways = entry["gateway"] if isinstance(entry["gateway"], list) else [entry["gateway"]]
+            mask &= np.isin(self.gateway, [self.gateway_index(key) for key in gateways])
+        if "device" in entry:
+            mask &= self.device == DEVICE_TYPES.index(DEVICE_ALIASES[str(entry["device"]).lower()])
+        else:
+            mask &= np.isin(self.device, [DEVICE_TYPES.index(device) for device in HEALTH_DEVICES])
+        if "residents" in entry:
+            wanted = set(entry["residents"])
+            mask &= np.array([resident in wanted for resident in self.resident_ids], dtype=bool)
+        candidates = np.flatnonzero(mask)
+
+        if "count" in entry:
+            size = min(int(entry["count"]), len(candidates))
+        elif "fraction" in entry:
+            size = int(round(float(entry["fraction"]) * len(candidates)))
+        elif entry["type"] in ("fall", "sos"):
+            size = min(1, len(candidates))
+        else:
+            size = len(candidates)
+        if size < len(candidates):
+            candidates = np.sort(rng.choice(candidates, size=size, replace=False))
+        return candidates
+
+    def _compile_events(self, entries: List[Dict], rng) -> List[Dict]:
+        events = []
+        for entry in entries:
+            kind = entry.get("type")
+            if kind not in EVENT_TYPES:
+                raise ValueError(f"未知事件類型 {kind!r}，可用: {', '.join(EVENT_TYPES)}")
+            defaults = EVENT_DEFAULTS[kind]
+            start = parse_seconds(entry.get("at", 0))
+            duration = parse_seconds(entry.get("duration", defaults["duration"]))
+            every = parse_seconds(entry.get("every", 0))
+            repeat = int(entry.get("repeat", 1)) if every else 1
+            spread = parse_seconds(entry.get("spread", 0))
+            steps = max(1, int(entry.get("steps", DEFAULT_WAVE_STEPS))) if spread else 1
+
+            for occurrence in range(repeat):
+                base = {"type": kind, "hr": float(entry.get("hr", defaults["hr"])),
+                        "temp": float(entry.get("temp", defaults["temp"])),
+                        "label": entry.get("label", ""), "gateway": -1, "gateway_name": ""}
+                offset = start + occurrence * every
+                if kind == "outage":
+                    key = entry.get("gateway")
+                    gateway = (self.gateway_index(key) if key is not None
+                               else int(rng.integers(len(self.gateways))))
+                    events.append(dict(base, start=offset, end=offset + duration, gateway=gateway,
+                                       gateway_name=self.gateways[gateway]["name"],
+                                       rows=np.zeros(0, dtype=np.int64)))
+                    continue
+                rows = self._select_rows(entry, rng)
+                for step, group in enumerate(np.array_split(rows, steps)):
+                    if not len(group):
+                        continue
+                    begin = offset + spread * step / steps
+                    events.append(dict(base, start=begin, end=begin + duration, rows=group))
+        return events
+
+    # ---- 查詢 ----
+
+    def rows_for_device(self, *devices: str) -> np.ndarray:
+        """指定設備類型的住民行"""
+        codes = [DEVICE_TYPES.index(device) for device in devices]
+        return np.flatnonzero(np.isin(self.device, codes))
+
+    def gateway_device_counts(self, g: int) -> Dict[str, int]:
+        """某個 Gateway 下各類設備的數量"""
+        devices = self.device[self.gateway == g]
+        return {device: int(np.count_nonzero(devices == code)) for code, device in enumerate(DEVICE_TYPES)}
+
+    def summary(self) -> str:
+        devices = ", ".join(f"{device} {int(np.count_nonzero(self.device == code))}"
+                            for code, device in enumerate(DEVICE_TYPES)
+                            if np.any(self.device == code))
+        return (f"場景 {self.name}: {len(self.gateways)} 個 Gateway, "
+                f"{sum(len(gateway['anchors']) for gateway in self.gateways)} 個 Anchor, "
+                f"{len(self.resident_ids)} 名住民 ({devices or '無設備'}), "
+                f"{len(self.cohort_names)} 個群組, {len(self.timeline)} 個事件")
+
+
+def compile_scenario(path: str) -> Scenario:
+    """讀取並編譯場景文件，相對路徑（如 import）以場景文件所在目錄為基準"""
+    spec = load_scenario(path)
+    base_dir = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+    return Scenario(spec, base_dir)
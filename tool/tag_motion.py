@@ -0,0 +1,248 @@
+"""
+向量化 Tag 運動模型
+從 test-data 的 floors.json / anchors.json / gateways.json 一次性載入樓層幾何，
+以 NumPy 陣列保存所有 Tag 的位置、目標點、速度與移動/靜止狀態，
+每次 step() 以一次向量化運算推進全部 Tag（朝目標點行走並加入隨機擾動、
+在樓層邊界內反彈、按停留時間切換移動/靜止），
+定位品質 quality 由預先計算的網格索引（到最近幾個 Anchor 的距離）查表得到
+
+floors.json 只有 realWidth / realHeight 與地圖校正資料，沒有牆體多邊形，
+因此樓層以矩形邊界表示：有 Anchor 的樓層取 Anchor 外接矩形加邊距（UWB 坐標系），
+沒有 Anchor 的樓層取 0~realWidth × 0~realHeight 並在其上按固定間距補設 Anchor
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-data")
+
+# 有 Anchor 的樓層在 Anchor 外接矩形之外的活動邊距（米）
+FLOOR_MARGIN = 1.0
+# 沒有 Anchor 的樓層補設 Anchor 的間距與高度（米）
+SYNTHETIC_ANCHOR_SPACING = 8.0
+SYNTHETIC_ANCHOR_HEIGHT = 2.5
+
+# 品質網格的單元大小（米）與參與計算的最近 Anchor 數量
+QUALITY_CELL_SIZE = 0.25
+QUALITY_NEAREST = 3
+# 超出此距離的 Anchor 視為不可見（米）
+ANCHOR_RANGE = 20.0
+
+# 行走速度範圍（米/秒）、配戴高度（米）
+WALK_SPEED_RANGE = (0.3, 1.2)
+TAG_HEIGHT_RANGE = (0.9, 1.4)
+# 移動 / 靜止時段的平均長度（秒）
+MEAN_MOVING_TIME = 60.0
+MEAN_STATIONARY_TIME = 300.0
+# 行走時的隨機擾動（米/秒）
+WALK_NOISE = 0.15
+# 品質查表後的隨機擾動範圍
+QUALITY_NOISE = 3
+
+
+class FloorGeometry:
+    """
+    單個樓層的幾何資料
+
+    bounds 為 (xmin, ymin, xmax, ymax)，anchors 為 (N, 3) 的 Anchor 坐標，floor_id 為 floors.json 中的 id；
+    建立時預先計算品質網格，運行時按 Tag 所在單元 O(1) 查表
+    """
+
+    def __init__(self, name: str, bounds: Sequence[float], anchors, cell_size: float = QUALITY_CELL_SIZE,
+                 floor_id: Optional[str] = None):
+        self.name = name
+        self.floor_id = floor_id
+        self.bounds = np.asarray(bounds, dtype=np.float64)
+        self.anchors = np.asarray(anchors, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = cell_size
+        xmin, ymin, xmax, ymax = self.bounds
+        self.nx = max(1, int(np.ceil((xmax - xmin) / cell_size)))
+        self.ny = max(1, int(np.ceil((ymax - ymin) / cell_size)))
+        self.quality_grid = self._build_quality_grid()
+
+    def _build_quality_grid(self) -> np.ndarray:
+        """按單元中心到最近幾個 Anchor 的平均距離與可見 Anchor 數量計算品質"""
+        xmin, ymin, _, _ = self.bounds
+        xs = xmin + (np.arange(self.nx) + 0.5) * self.cell_size
+        ys = ymin + (np.arange(self.ny) + 0.5) * self.cell_size
+        grid = np.empty((self.ny, self.nx), dtype=np.uint8)
+        if not len(self.anchors):
+            grid.fill(0)
+            return grid
+
+        nearest = min(QUALITY_NEAREST, len(self.anchors))
+        # 按列分塊，避免 單元數 × Anchor 數 的距離矩陣過大
+        for row, y in enumerate(ys):
+            dx = xs[:, None] - self.anchors[None, :, 0]
+            dy = y - self.anchors[None, :, 1]
+            dz = TAG_HEIGHT_RANGE[0] - self.anchors[None, :, 2]
+            distance = np.sqrt(dx * dx + dy * dy + dz * dz)
+            closest = np.partition(distance, nearest - 1, axis=1)[:, :nearest]
+            visible = (distance <= ANCHOR_RANGE).sum(axis=1)
+            quality = 90.0 - 2.5 * closest.mean(axis=1)
+            quality -= np.where(visible < QUALITY_NEAREST, 25.0, 0.0)
+            grid[row] = np.clip(quality, 10, 99).astype(np.uint8)
+        return grid
+
+
+def default_floor(anchors, name: str = "default", margin: float = FLOOR_MARGIN,
+                  floor_id: Optional[str] = None) -> FloorGeometry:
+    """以 Anchor 外接矩形加邊距作為樓層邊界"""
+    anchors = np.asarray(anchors, dtype=np.float64).reshape(-1, 3)
+    low = anchors[:, :2].min(axis=0) - margin
+    high = anchors[:, :2].max(axis=0) + margin
+    return FloorGeometry(name, (low[0], low[1], high[0], high[1]), anchors, floor_id=floor_id)
+
+
+def synthetic_floor(name: str, width: float, height: float, floor_id: Optional[str] = None) -> FloorGeometry:
+    """沒有 Anchor 的樓層：0~width × 0~height 並按固定間距補設 Anchor"""
+    xs = np.arange(SYNTHETIC_ANCHOR_SPACING / 2, max(width, 1.0), SYNTHETIC_ANCHOR_SPACING)
+    ys = np.arange(SYNTHETIC_ANCHOR_SPACING / 2, max(height, 1.0), SYNTHETIC_ANCHOR_SPACING)
+    gx, gy = np.meshgrid(xs, ys)
+    anchors = np.column_stack((gx.ravel(), gy.ravel(), np.full(gx.size, SYNTHETIC_ANCHOR_HEIGHT)))
+    return FloorGeometry(name, (0.0, 0.0, width, height), anchors, floor_id=floor_id)
+
+
+def load_floors(data_dir: str = DEFAULT_DATA_DIR) -> List[FloorGeometry]:
+    """
+    從 floors.json / anchors.json / gateways.json 載入所有樓層
+
+    Anchor 按所屬 Gateway 的 floorId 歸入樓層，使用其 UWB 坐標（cloud_position_x/y/z）
+    """
+    def read(name):
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    floors = read("floors.json")
+    gateway_floor = {gw.get("id"): gw.get("floorId") for gw in read("gateways.json")}
+    floor_anchors: Dict[str, List] = {}
+    for anchor in read("anchors.json"):
+        floor_id = gateway_floor.get(anchor.get("gatewayId"))
+        if floor_id is None or anchor.get("cloud_position_x") is None:
+            continue
+        floor_anchors.setdefault(floor_id, []).append(
+            (anchor["cloud_position_x"], anchor["cloud_position_y"], anchor.get("cloud_position_z", 2.0)))
+
+    geometries = []
+    for floor in floors:
+        name = f"{floor.get('name', '')}({floor.get('id')})"
+        anchors = floor_anchors.get(floor.get("id"))
+        if anchors:
+            geometries.append(default_floor(anchors, name, floor_id=floor.get("id")))
+        else:
+            geometries.append(synthetic_floor(name, float(floor.get("realWidth", 20)),
+                                              float(floor.get("realHeight", 20)), floor.get("id")))
+    return geometries
+
+
+class TagMotionModel:
+    """
+    所有 Tag 的向量化運動狀態
+
+    step(now) 一次推進全部 Tag，返回本次切換了移動/靜止狀態的 Tag 索引，
+    呼叫方據此切換 nominal / stationary udr
+    """
+
+    def __init__(self, floors: Sequence[FloorGeometry], floor_index, seed: Optional[int] = None,
+                 now: float = 0.0):
+        """
+        Args:
+            floors: 樓層幾何
+            floor_index: 每個 Tag 所在樓層的索引
+            seed: 隨機種子
+            now: 起始時間（秒）
+        """
+        self.floors = list(floors)
+        self.rng = np.random.default_rng(seed)
+        self.floor_index = np.asarray(floor_index, dtype=np.int32)
+        count = len(self.floor_index)
+        self.count = count
+
+        self.bounds = np.stack([floor.bounds for floor in self.floors])[self.floor_index]
+        # 各樓層品質網格展平拼接，Tag 以 offset + iy * nx + ix 查表
+        sizes = [floor.quality_grid.size for floor in self.floors]
+        self._quality = np.concatenate([floor.quality_grid.ravel() for floor in self.floors])
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        self._offset = offsets[self.floor_index]
+        self._nx = np.array([floor.nx for floor in self.floors])[self.floor_index]
+        self._ny = np.array([floor.ny for floor in self.floors])[self.floor_index]
+        self._cell = np.array([floor.cell_size for floor in self.floors])[self.floor_index]
+
+        self.position = np.empty((count, 3))
+        self.position[:, :2] = self._random_points(np.arange(count))
+        self.position[:, 2] = self.rng.uniform(*TAG_HEIGHT_RANGE, count)
+        self.target = self._random_points(np.arange(count))
+        self.speed = self.rng.uniform(*WALK_SPEED_RANGE, count)
+        self.moving = self.rng.random(count) < MEAN_MOVING_TIME / (MEAN_MOVING_TIME + MEAN_STATIONARY_TIME)
+        self.state_until = now + self._durations(self.moving)
+        self.distance = np.zeros(count)
+        self.last_step = now
+
+    def _random_points(self, indices: np.ndarray) -> np.ndarray:
+        bounds = self.bounds[indices]
+        u = self.rng.random((len(indices), 2))
+        return bounds[:, :2] + u * (bounds[:, 2:] - bounds[:, :2])
+
+    def _durations(self, moving: np.ndarray) -> np.ndarray:
+        mean = np.where(moving, MEAN_MOVING_TIME, MEAN_STATIONARY_TIME)
+        return self.rng.exponential(mean)
+
+    def step(self, now: float) -> np.ndarray:
+        """推進到 now，返回切換了狀態的 Tag 索引"""
+        dt = now - self.last_step
+        if dt <= 0:
+            return np.empty(0, dtype=np.int64)
+        self.last_step = now
+
+        # 移動/靜止切換
+        switched = np.flatnonzero(now >= self.state_until)
+        if len(switched):
+            self.moving[switched] = ~self.moving[switched]
+            self.state_until[switched] = now + self._durations(self.moving[switched])
+            self.target[switched] = self._random_points(switched)
+
+        moving = np.flatnonzero(self.moving)
+        if len(moving):
+            xy = self.position[moving, :2]
+            delta = self.target[moving] - xy
+            remaining = np.hypot(delta[:, 0], delta[:, 1])
+            travel = np.minimum(self.speed[moving] * dt, remaining)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                direction = np.where(remaining[:, None] > 0, delta / remaining[:, None], 0.0)
+            new_xy = xy + direction * travel[:, None]
+            new_xy += self.rng.normal(0.0, WALK_NOISE * np.sqrt(dt), (len(moving), 2))
+
+            # 牆體邊界：超出時反射回樓層內
+            low = self.bounds[moving, :2]
+            high = self.bounds[moving, 2:]
+            new_xy = np.where(new_xy < low, 2 * low - new_xy, new_xy)
+            new_xy = np.where(new_xy > high, 2 * high - new_xy, new_xy)
+            np.clip(new_xy, low, high, out=new_xy)
+
+            self.distance[moving] += np.hypot(*(new_xy - xy).T)
+            self.position[moving, :2] = new_xy
+
+            # 到達目標點的 Tag 選取新目標
+            arrived = moving[remaining <= travel + 1e-9]
+            if len(arrived):
+                self.target[arrived] = self._random_points(arrived)
+        return switched
+
+    def quality(self, indices=None) -> np.ndarray:
+        """查表得到定位品質（加隨機擾動）"""
+        if indices is None:
+            indices = np.arange(self.count)
+        xy = self.position[indices, :2]
+        bounds = self.bounds[indices]
+        cell = self._cell[indices]
+        ix = np.clip(((xy[:, 0] - bounds[:, 0]) / cell).astype(np.int64), 0, self._nx[indices] - 1)
+        iy = np.clip(((xy[:, 1] - bounds[:, 1]) / cell).astype(np.int64), 0, self._ny[indices] - 1)
+        base = self._quality[self._offset[indices] + iy * self._nx[indices] + ix].astype(np.int64)
+        noise = self.rng.integers(-QUALITY_NOISE, QUALITY_NOISE + 1, len(base))
+        return np.clip(base + noise, 0, 100)
@@ -0,0 +1,13 @@
+"""
+pytest 設定：工具模組位於 tool/，心率模擬器位於專案根目錄
+"""
+
+import os
+import sys
+
+TOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROOT_DIR = os.path.join(TOOL_DIR, "..")
+
+for path in (TOOL_DIR, ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
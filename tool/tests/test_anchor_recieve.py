@@ -0,0 +1,52 @@
+"""
+anchor_recieve 測試：佇列模式整批取出時的健康異常偵測與逐條處理一致
+"""
+import io
+import json
+
+import anchor_recieve
+from anchor_recieve import CompactRecordWriter, handle_fast, handle_fast_batch
+from health_anomaly import HealthAnomalyDetector
+
+TOPIC = "UWB/GW16B8_Health"
+
+
+def health_items(count):
+    items = []
+    for i in range(count):
+        # 兩位住民交替，第二位在後段持續心率過高
+        resident = f"E0:0E:08:36:93:F{i % 2}"
+        hr = 150 if i % 2 and i > count // 2 else 70 + i % 3
+        payload = json.dumps({"content": "300B", "MAC": resident, "hr": hr, "SpO2": 97}).encode("utf-8")
+        items.append((TOPIC, payload, 1000.0 + i))
+    return items
+
+
+def run(items, batched):
+    stream = io.StringIO()
+    userdata = {"writer": CompactRecordWriter(stream), "detector": HealthAnomalyDetector()}
+    if batched:
+        for start in range(0, len(items), 16):
+            handle_fast_batch(userdata, items[start:start + 16])
+    else:
+        for item in items:
+            handle_fast(userdata, *item)
+    lines = stream.getvalue().splitlines()
+    return [line for line in lines if "\tALERT\t" in line], len(lines)
+
+
+def test_batch_drain_emits_same_alerts():
+    items = health_items(200)
+    single_alerts, single_lines = run(items, batched=False)
+    batch_alerts, batch_lines = run(items, batched=True)
+    assert single_alerts
+    assert sorted(batch_alerts) == sorted(single_alerts)
+    assert batch_lines == single_lines
+
+
+def test_work_queue_uses_batch_handler_with_detector():
+    args = type("Args", (), {"workers": 1, "queue_size": 100, "policy": "block"})()
+    userdata = {"writer": CompactRecordWriter(io.StringIO()), "detector": HealthAnomalyDetector()}
+    assert anchor_recieve.create_work_queue(args, userdata).batch_handler is not None
+    userdata["detector"] = None
+    assert anchor_recieve.create_work_queue(args, userdata).batch_handler is None
@@ -0,0 +1,105 @@
+"""anchor_trasmitt：發送池模式的連接配置、序列號快照恢復與 asyncio 模式的確認追蹤"""
+
+import asyncio
+import os
+import sys
+
+import anchor_trasmitt
+from state_file import PeriodicSnapshot
+
+SCENARIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scenarios", "nursing_home.yaml")
+
+
+def parse(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["anchor_trasmitt.py", *argv])
+    return anchor_trasmitt.parse_args()
+
+
+def test_pool_mode_uses_scenario_broker(monkeypatch):
+    captured = {}
+
+    class FakePool:
+        def __init__(self, shards, target, config, report_interval=0):
+            captured["config"] = config
+            captured["shards"] = shards
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr(anchor_trasmitt, "PublisherPool", FakePool)
+    args = parse(monkeypatch, "--workers", "2", "--scenario", SCENARIO)
+    anchor_trasmitt.run_publisher_pool(args)
+
+    config = captured["config"]
+    assert config["broker"] == "localhost"
+    assert config["port"] == 1883
+    assert not config["tls"]
+    assert config["username"] is None
+    assert captured["shards"]
+
+
+def test_pool_mode_without_scenario_uses_cloud_broker(monkeypatch):
+    captured = {}
+
+    class FakePool:
+        def __init__(self, shards, target, config, report_interval=0):
+            captured["config"] = config
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr(anchor_trasmitt, "PublisherPool", FakePool)
+    anchor_trasmitt.run_publisher_pool(parse(monkeypatch, "--workers", "1"))
+    assert captured["config"]["broker"] == anchor_trasmitt.MQTT_BROKER
+    assert captured["config"]["tls"]
+
+
+def save_serials(path, gateway_serials, final):
+    snapshot = PeriodicSnapshot(str(path), lambda: anchor_trasmitt.transmitter_state(gateway_serials=gateway_serials))
+    snapshot.save(final=final)
+
+
+def test_restore_skips_ahead_after_crash(monkeypatch, tmp_path):
+    monkeypatch.setattr(anchor_trasmitt, "serial_counter", 100)
+    path = tmp_path / "tx.state"
+    save_serials(path, {1: 500, 2: 700}, final=False)
+
+    gateway_serials = {1: 0, 2: 0, 3: 0}
+    ahead = {1: 10, 2: 20, 3: 30}
+    assert anchor_trasmitt.restore_serials(str(path), gateway_serials=gateway_serials, ahead=ahead)
+    # 快照之後可能已發出的序列號不再重用；快照中沒有的 Gateway 從全域序列號開始
+    assert gateway_serials == {1: 510, 2: 720, 3: 130}
+
+
+def test_restore_after_clean_shutdown_continues_exactly(monkeypatch, tmp_path):
+    monkeypatch.setattr(anchor_trasmitt, "serial_counter", 100)
+    path = tmp_path / "tx.state"
+    save_serials(path, {1: 500}, final=True)
+
+    gateway_serials = {1: 0}
+    anchor_trasmitt.restore_serials(str(path), gateway_serials=gateway_serials, ahead={1: 10})
+    assert gateway_serials == {1: 500}
+    assert anchor_trasmitt.serial_counter == 100
+
+
+def test_serials_ahead_covers_one_extra_cycle():
+    # 每 2 秒 3 條，快照間隔 10 秒：5 個週期 + 1 個週期
+    assert anchor_trasmitt.serials_ahead(10.0, 2.0, 3) == 18
+    assert anchor_trasmitt.serials_ahead(30.0, 1.0) == 31
+
+
+def test_confirmation_tracker_prunes_and_reports_failures(capsys):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        pending, track = anchor_trasmitt.confirmation_tracker()
+        ok, failed = loop.create_future(), loop.create_future()
+        track(ok)
+        track(failed)
+        assert len(pending) == 2
+        ok.set_result(1.0)
+        failed.set_exception(ConnectionError("發送失敗，錯誤碼: 4"))
+        await asyncio.sleep(0)
+        return pending
+
+    assert asyncio.run(scenario()) == set()
+    assert "確認失敗: 發送失敗，錯誤碼: 4" in capsys.readouterr().out
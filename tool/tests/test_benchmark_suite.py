@@ -0,0 +1,25 @@
+"""
+benchmark_suite.compare 測試：基準中缺失的項目不再被忽略
+"""
+from benchmark_suite import compare
+
+
+def test_missing_baseline_entry_is_a_regression():
+    baseline = {"json.decode[health]": {"rate": 1000.0}, "rollup.update": {"rate": 500.0}}
+    results = {"json.decode[health]": {"rate": 990.0}}
+    regressions, skipped = compare(results, baseline, 0.15)
+    assert len(regressions) == 1 and regressions[0].startswith("rollup.update")
+    assert skipped == []
+    assert results["json.decode[health]"]["ratio"] == 0.99
+
+
+def test_entries_of_groups_not_run_are_listed_as_skipped():
+    baseline = {"e2e.publish_receive[qos1]": {"rate": 100.0}, "template.msgpack.encode[health]": {"rate": 10.0}}
+    regressions, skipped = compare({}, baseline, 0.15, not_run=["e2e", "codec"])
+    assert regressions == []
+    assert [line.split(":")[0] for line in skipped] == list(baseline)
+
+
+def test_slow_entry_is_a_regression():
+    regressions, _ = compare({"capture.merge": {"rate": 80.0}}, {"capture.merge": {"rate": 100.0}}, 0.15)
+    assert regressions and "-20.0%" in regressions[0]
@@ -0,0 +1,104 @@
+"""
+capture_analyzer 測試：序號摘要與分塊 / 合併順序無關，MomentStats 合併與單次累加一致
+"""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from capture_analyzer import MomentStats, SequenceStats
+
+MAX_GAP = 50
+
+
+def serial_stream():
+    """兩段計數器生命週期（中間重啟），含丟包、重複、亂序與一次大幅前跳"""
+    first = [value for value in range(1, 301) if value not in (100, 101, 102, 250)]
+    first.insert(first.index(200), 200)
+    index = first.index(150)
+    first[index], first[index + 1] = first[index + 1], first[index]
+    second = [value for value in range(1, 121) if value != 60]
+    values = first + second + list(range(1000, 1011))
+    return [(value, 1000.0 + i * 0.1) for i, value in enumerate(values)]
+
+
+def sequence_of(items):
+    stats = SequenceStats(MAX_GAP)
+    for value, received in items:
+        stats.add(value, received)
+    return stats
+
+
+def test_sequence_summary():
+    summary = sequence_of(serial_stream()).summary()
+    assert summary == {
+        "first": 1, "last": 1010, "unique": 426, "duplicates": 1, "missing": 5,
+        "loss": 5 / 431, "gaps": 3, "max_gap": 3, "resets": 2
+    }
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 50, 137])
+def test_sequence_chunk_merge_invariance(chunk):
+    items = serial_stream()
+    expected = sequence_of(items).summary()
+    parts = [sequence_of(items[start:start + chunk]) for start in range(0, len(items), chunk)]
+
+    for order in (parts, parts[::-1], random.Random(chunk).sample(parts, len(parts))):
+        total = SequenceStats(MAX_GAP)
+        for part in order:
+            total.merge(part)
+        assert total.summary() == expected
+
+
+def test_sequence_merge_of_merged_parts():
+    items = serial_stream()
+    expected = sequence_of(items).summary()
+    left, right = SequenceStats(MAX_GAP), SequenceStats(MAX_GAP)
+    for start in range(0, len(items), 40):
+        (left if start // 40 % 2 else right).merge(sequence_of(items[start:start + 40]))
+    right.merge(left)
+    assert right.summary() == expected
+
+
+def moments_of(values):
+    stats = MomentStats()
+    for value in values:
+        stats.add(float(value))
+    return stats
+
+
+@pytest.mark.parametrize("split", [0, 1, 333, 999, 1000])
+def test_moment_merge_matches_single_pass(split):
+    # 大偏移量（epoch 秒）下的小幅波動，直接累加平方和會失去精度
+    values = 1.77e9 + np.random.default_rng(split).normal(0.0, 0.5, 1000)
+    # 減去偏移量是精確的，作為參考值
+    shifted = values - 1.77e9
+    merged = moments_of(values[:split])
+    merged.merge(moments_of(values[split:]))
+
+    assert merged.count == len(values)
+    assert merged.mean - 1.77e9 == pytest.approx(shifted.mean(), abs=1e-5)
+    assert math.sqrt(merged.m2 / merged.count) == pytest.approx(shifted.std(), rel=1e-5)
+    assert (merged.minimum, merged.maximum) == (values.min(), values.max())
+    assert merged.summary(1.77e9) == moments_of(values).summary(1.77e9)
+
+
+def test_moment_merge_many_parts_in_any_order():
+    values = np.random.default_rng(7).uniform(-3.0, 3.0, 600)
+    parts = [moments_of(values[start:start + 45]) for start in range(0, len(values), 45)]
+    for order in (parts, parts[::-1]):
+        total = MomentStats()
+        for part in order:
+            total.merge(part)
+        assert total.count == len(values)
+        assert total.mean == pytest.approx(values.mean(), abs=1e-12)
+        assert total.m2 / total.count == pytest.approx(values.var(), rel=1e-9)
+
+
+def test_moment_merge_empty():
+    stats = moments_of([1.0, 2.0, 4.0])
+    before = stats.summary()
+    stats.merge(MomentStats())
+    assert stats.summary() == before
+    assert MomentStats().summary() is None
@@ -0,0 +1,36 @@
+"""
+gateway_emulator 測試：configChange 命令的頻率校驗
+"""
+import pytest
+
+from gateway_emulator import GatewayEmulator, build_gateways
+from tick_scheduler import TickScheduler
+
+
+def emulator_with_scheduler():
+    emulator = GatewayEmulator(build_gateways(1, 2, 1, seed=1), seed=1)
+    emulator.scheduler = TickScheduler(len(emulator.streams), udr_hz=emulator.rates, seed=1)
+    return emulator
+
+
+def tag_command(emulator, **fields):
+    tag = emulator.gateways[0]["tags"][0]
+    return dict({"content": "configChange", "gateway id": emulator.gateways[0]["gateway_id"],
+                 "node": "TAG", "id": tag["id"], "serial no": 1}, **fields)
+
+
+@pytest.mark.parametrize("udr", [0, -1.0, float("nan"), "2", True])
+def test_invalid_udr_is_rejected(udr):
+    emulator = emulator_with_scheduler()
+    tag = emulator.gateways[0]["tags"][0]
+    before = dict(tag)
+    replies = emulator.handle_command(tag_command(emulator, led=False, **{"nominal udr(hz)": udr}))
+    assert [message["content"] for _, message in replies] == ["fail from gateway"]
+    assert tag == before
+
+
+def test_valid_udr_updates_rate():
+    emulator = emulator_with_scheduler()
+    replies = emulator.handle_command(tag_command(emulator, **{"nominal udr(hz)": 2.0}))
+    assert replies[0][1]["content"] == "ack from gateway"
+    assert emulator.gateways[0]["tags"][0]["nominal udr(hz)"] == 2.0
@@ -0,0 +1,69 @@
+"""
+message_sink.BatchingSink 測試：後端寫入失敗時的計數與重試
+"""
+from message_sink import BatchingSink
+
+TOPIC = "UWB/GW16B8_Health"
+
+
+class FlakyBackend:
+    name = "flaky"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.written = []
+
+    def write(self, batches):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.written.append(sum(len(rows) for rows in batches.values()))
+
+    def close(self):
+        pass
+
+
+def add(sink, count):
+    for i in range(count):
+        sink.add(TOPIC, {"content": "300B", "id": i, "hr": 70}, 1.0)
+
+
+def test_failed_batch_is_not_counted_and_is_retried():
+    backend = FlakyBackend(failures=1)
+    sink = BatchingSink([backend], max_rows=100, max_delay=3600.0)
+    add(sink, 3)
+    sink.flush()
+    stats = sink.stats()
+    assert (stats["rows"], stats["batches"], stats["errors"], stats["pending"]) == (0, 0, 1, 3)
+
+    add(sink, 2)
+    sink.flush()
+    # 失敗的批次先於新批次重試
+    assert backend.written == [3, 2]
+    stats = sink.stats()
+    assert (stats["rows"], stats["batches"], stats["pending"], stats["failed"]) == (5, 2, 0, 0)
+
+
+def test_only_failed_backend_is_retried():
+    healthy = FlakyBackend()
+    flaky = FlakyBackend(failures=1)
+    sink = BatchingSink([healthy, flaky], max_rows=100, max_delay=3600.0)
+    add(sink, 4)
+    sink.flush()
+    assert sink.stats()["rows"] == 0
+    sink.flush()
+    assert healthy.written == [4]
+    assert flaky.written == [4]
+    assert sink.stats()["rows"] == 4
+
+
+def test_pending_rows_are_bounded():
+    backend = FlakyBackend(failures=10)
+    sink = BatchingSink([backend], max_rows=100, max_delay=3600.0, max_pending_rows=5)
+    for _ in range(3):
+        add(sink, 3)
+        sink.flush()
+    stats = sink.stats()
+    assert stats["pending"] == 3
+    assert stats["failed"] == 6
+    assert stats["rows"] == 0
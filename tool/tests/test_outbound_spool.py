@@ -0,0 +1,81 @@
+"""
+outbound_spool 測試：追加 / 補發確認 / 重啟恢復，以及 QoS ≥ 1 斷線時不重複補發
+"""
+from types import SimpleNamespace
+
+from outbound_spool import MQTT_ERR_NO_CONN, OutboundSpool, SpoolDrainer, queued_by_client
+
+
+def fill(spool, count, qos=0):
+    for i in range(count):
+        spool.append("topic", f"m{i}", qos)
+
+
+def test_commit_advances_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "out.spool")
+    spool = OutboundSpool(path)
+    fill(spool, 5)
+
+    batch = spool.read_batch(3)
+    assert [payload for _, payload, _ in batch] == [b"m0", b"m1", b"m2"]
+    spool.commit(2)
+    assert len(spool) == 3
+    spool.close()
+
+    reopened = OutboundSpool(path)
+    assert reopened.recovered == 3
+    assert [payload for _, payload, _ in reopened.read_batch(10)] == [b"m2", b"m3", b"m4"]
+    reopened.commit(3)
+    assert len(reopened) == 0
+    reopened.close()
+
+
+def test_truncated_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "out.spool")
+    spool = OutboundSpool(path)
+    fill(spool, 3)
+    spool.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    reopened = OutboundSpool(path)
+    assert reopened.recovered == 3
+    assert len(reopened.read_batch(10)) == 3
+    reopened.close()
+
+
+def test_drain_stops_on_failure_and_keeps_rest(tmp_path):
+    spool = OutboundSpool(str(tmp_path / "out.spool"))
+    fill(spool, 4)
+    results = iter([0, 0, MQTT_ERR_NO_CONN])
+    sent = []
+
+    def publish(topic, payload, qos):
+        sent.append(payload)
+        return SimpleNamespace(rc=next(results))
+
+    drainer = SpoolDrainer(spool, publish, lambda: True, batch=10)
+    assert drainer.drain_once() == 2
+    # QoS 0 的失敗記錄留在 spool，下次補發
+    assert len(spool) == 2
+    assert spool.read_batch(10)[0][1] == b"m2"
+    spool.close()
+
+
+def test_drain_commits_records_queued_by_client(tmp_path):
+    spool = OutboundSpool(str(tmp_path / "out.spool"))
+    fill(spool, 3, qos=1)
+    results = iter([0, MQTT_ERR_NO_CONN])
+
+    drainer = SpoolDrainer(spool, lambda *args: SimpleNamespace(rc=next(results)), lambda: True, batch=10)
+    # 第二條已由 paho 排隊重發，不能留在 spool 再補發一次
+    assert drainer.drain_once() == 2
+    assert len(spool) == 1
+    spool.close()
+
+
+def test_queued_by_client():
+    assert queued_by_client(MQTT_ERR_NO_CONN, 1)
+    assert queued_by_client(MQTT_ERR_NO_CONN, 2)
+    assert not queued_by_client(MQTT_ERR_NO_CONN, 0)
+    assert not queued_by_client(15, 1)
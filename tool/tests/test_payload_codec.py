@@ -0,0 +1,42 @@
+"""
+payload_codec 測試：各編碼的模板輸出解碼後與原訊息一致，NumPy 標量可直接填入槽位
+"""
+import numpy as np
+import pytest
+
+from payload_codec import CODEC_JSON, PayloadTemplate, available_codecs, decode_payload, sample_shapes
+
+SHAPES = sample_shapes()
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+@pytest.mark.parametrize("shape", sorted(SHAPES))
+def test_template_round_trip(codec, shape):
+    template, values = SHAPES[shape]
+    compiled = PayloadTemplate(template, codec)
+    assert decode_payload(compiled.encode(*values)) == compiled.fill(*values)
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_numpy_scalars(codec):
+    template, _ = SHAPES["location"]
+    compiled = PayloadTemplate(template, codec)
+    values = (np.float64(3.41), np.float32(7.0), np.int64(1), np.int32(87), "2026-289 23:59:58.80",
+              np.int64(1234), np.uint16(5678))
+    decoded = decode_payload(compiled.encode(*values))
+    assert decoded["position"] == {"x": 3.41, "y": 7.0, "z": 1, "quality": 87}
+    assert decoded["serial no"] == 5678
+    assert type(decoded["sf number"]) is int
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_slot_count_is_checked(codec):
+    template, values = SHAPES["health"]
+    with pytest.raises(TypeError):
+        PayloadTemplate(template, codec).encode(*values[:-1])
+
+
+def test_json_rejects_nan():
+    template, values = SHAPES["health"]
+    with pytest.raises(ValueError):
+        PayloadTemplate(template, CODEC_JSON).encode(values[0], float("nan"), *values[2:])
@@ -0,0 +1,75 @@
+"""
+rollup_store 測試：崩潰後重新開啟時的段與設備表一致性
+"""
+import json
+import os
+
+import numpy as np
+
+import rollup_store
+from rollup_store import ROW_COLUMNS, RollupStore
+
+
+def hr_total(store, device):
+    result = store.query(device, "hr", 0, 10_000, resolution=1)
+    return int(result["count"].sum())
+
+
+def test_merge_interrupted_before_member_removal(tmp_path):
+    directory = str(tmp_path / "rollup")
+    store = RollupStore(directory, resolutions=(1,))
+    rows = store.rows_for(["A"])
+    store.update(rows, [[72.0]], 1000.5, ("hr",))
+    store.flush(now=1002)
+    store.update(rows, [[75.0]], 1003.5, ("hr",))
+    store.flush(now=1005)
+
+    level = store.levels[0]
+    members = list(level.segments)
+    assert len(members) == 2
+    # 合併段已寫入、成員尚未刪除時崩潰
+    level._save({name: np.concatenate([np.asarray(m.arrays[name]) for m in members]) for name, _ in ROW_COLUMNS},
+                [os.path.basename(m.path) for m in members])
+
+    reopened = RollupStore(directory, resolutions=(1,))
+    assert len(reopened.levels[0].segments) == 1
+    assert hr_total(reopened, "A") == 2
+
+
+def test_catalog_is_written_before_segments(tmp_path, monkeypatch):
+    directory = str(tmp_path / "rollup")
+    catalog_path = os.path.join(directory, "catalog.json")
+    store = RollupStore(directory, resolutions=(1,))
+    store.update(store.rows_for(["A", "B"]), [[72.0], [80.0]], 1000.5, ("hr",))
+
+    seen = []
+    save_state = rollup_store.save_state
+
+    def crash_after_recording(path, arrays, meta=None):
+        with open(catalog_path, "r", encoding="utf-8") as f:
+            seen.append(json.load(f)["devices"])
+        raise OSError("crash while writing segment")
+
+    monkeypatch.setattr(rollup_store, "save_state", crash_after_recording)
+    try:
+        store.flush(now=1002)
+    except OSError:
+        pass
+    monkeypatch.setattr(rollup_store, "save_state", save_state)
+
+    assert seen == [["A", "B"]]
+    reopened = RollupStore(directory, resolutions=(1,))
+    assert reopened.device_ids == ["A", "B"]
+
+
+def test_flush_persists_latest(tmp_path):
+    directory = str(tmp_path / "rollup")
+    store = RollupStore(directory, resolutions=(1,))
+    rows = store.rows_for(["A"])
+    store.update(rows, [[72.0]], 1000.5, ("hr",))
+    store.flush()
+    store.update(rows, [[73.0]], 2000.5, ("hr",))
+    store.flush()
+
+    # 未呼叫 close() 也能恢復最新讀數時間
+    assert RollupStore(directory, resolutions=(1,)).latest == 2000.5
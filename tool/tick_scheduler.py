@@ -0,0 +1,204 @@
+"""
+速率控制的發送排程器
+按每個設備的上報頻率（nominal udr(hz)）排程發送，
+以單調時鐘的絕對時間格點修正累積漂移，並定期回報實際達到的速率
+"""
+
+import heapq
+import logging
+import random
+import time
+from typing import Iterator, List, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    """
+    多設備發送排程器
+
+    每個設備按自己的週期 (1 / udr) 排在一條絕對時間格點上，
+    初始相位在週期內均勻分層並加入抖動，避免所有設備同時發送。
+    ticks() 每次產出一批已到期的設備索引，由呼叫者負責實際發送。
+    """
+
+    def __init__(self,
+                 device_count: int,
+                 udr_hz: Union[float, Sequence[float], None] = None,
+                 target_rate: Optional[float] = None,
+                 jitter: float = 0.0,
+                 max_lag: Optional[float] = None,
+                 report_interval: float = 10.0,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            device_count: 設備數量
+            udr_hz: 每個設備的上報頻率，可為單一值或按設備排列的序列
+            target_rate: 目標總速率 (msg/s)，設備頻率總和超出時按比例降低
+            jitter: 每次發送相對格點的隨機偏移，以週期比例表示 (0~1)
+            max_lag: 落後超過此秒數的設備直接跳到下一個格點，None 表示一個週期
+            report_interval: 速率回報間隔（秒），0 表示不回報
+            seed: 隨機種子
+        """
+        if device_count <= 0:
+            raise ValueError("device_count 必須大於 0")
+        if udr_hz is None and target_rate is None:
+            raise ValueError("udr_hz 與 target_rate 至少需要提供一個")
+
+        if udr_hz is None:
+            rates = [target_rate / device_count] * device_count
+        elif isinstance(udr_hz, (int, float)):
+            rates = [float(udr_hz)] * device_count
+        else:
+            rates = [float(r) for r in udr_hz]
+            if len(rates) != device_count:
+                raise ValueError("udr_hz 長度必須與 device_count 一致")
+        if min(rates) <= 0:
+            raise ValueError("udr_hz 必須大於 0")
+
+        total_rate = sum(rates)
+        if target_rate is not None and total_rate > target_rate:
+            scale = target_rate / total_rate
+            logger.warning(f"設備上報頻率總和 {total_rate:.1f} msg/s 超過目標 "
+                           f"{target_rate:.1f} msg/s，按比例 {scale:.3f} 降低")
+            rates = [r * scale for r in rates]
+            total_rate = target_rate
+        elif target_rate is not None and total_rate < target_rate:
+            logger.warning(f"設備上報頻率總和只有 {total_rate:.1f} msg/s，"
+                           f"無法達到目標 {target_rate:.1f} msg/s")
+
+        self.device_count = device_count
+        self.periods = [1.0 / r for r in rates]
+        self.expected_rate = total_rate
+        self.jitter = max(0.0, min(1.0, jitter))
+        self.max_lag = max_lag
+        self.report_interval = report_interval
+        self.running = False
+
+        self._random = random.Random(seed)
+        self._heap: List[tuple] = []
+
+        # 統計
+        self.dispatched = 0
+        self.skipped = 0
+        self._window_start = 0.0
+        self._window_dispatched = 0
+        self._window_max_lag = 0.0
+        self.last_report = {}
+
+    def _offset(self, period: float) -> float:
+        """計算單次發送相對格點的抖動偏移"""
+        if not self.jitter:
+            return 0.0
+        return (self._random.random() - 0.5) * self.jitter * period
+
+    def _reset(self, start: float):
+        """以 start 為起點重建排程堆"""
+        count = self.device_count
+        heap = []
+        for index, period in enumerate(self.periods):
+            # 分層相位：第 i 個設備落在週期的第 i/N 段內
+            grid = start + period * (index + self._random.random()) / count
+            heap.append((max(start, grid + self._offset(period)), grid, index))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._window_start = start
+        self._window_dispatched = 0
+        self._window_max_lag = 0.0
+
+    def stop(self):
+        """停止排程"""
+        self.running = False
+
+    def set_rate(self, index: int, udr_hz: float):
+        """
+        修改單個設備的上報頻率
+
+        已排入的下一次發送不變，從其後的格點開始使用新週期；可在其他執行緒呼叫
+        """
+        if udr_hz <= 0:
+            raise ValueError("udr_hz 必須大於 0")
+        period = 1.0 / udr_hz
+        self.expected_rate += udr_hz - 1.0 / self.periods[index]
+        self.periods[index] = period
+
+    def ticks(self, max_batch: Optional[int] = None,
+              max_sleep: float = 0.5) -> Iterator[List[int]]:
+        """
+        產出已到期的設備索引批次
+
+        Args:
+            max_batch: 每批最多設備數，None 表示不限
+            max_sleep: 單次休眠上限（秒），保證能及時響應 stop()
+
+        Yields:
+            到期設備索引列表
+        """
+        self.running = True
+        self._reset(time.monotonic())
+        heap = self._heap
+        periods = self.periods
+
+        while self.running:
+            now = time.monotonic()
+            due = []
+            while heap and heap[0][0] <= now:
+                if max_batch is not None and len(due) >= max_batch:
+                    break
+                due_time, grid, index = heap[0]
+                period = periods[index]
+                lag = now - due_time
+                if lag > self._window_max_lag:
+                    self._window_max_lag = lag
+
+                limit = period if self.max_lag is None else self.max_lag
+                next_grid = grid + period
+                if lag > limit:
+                    # 落後太多：跳過錯過的格點，而不是突發補發
+                    missed = int(lag // period)
+                    next_grid += missed * period
+                    self.skipped += missed
+                heapq.heapreplace(heap, (next_grid + self._offset(period), next_grid, index))
+                due.append(index)
+
+            if due:
+                self.dispatched += len(due)
+                self._window_dispatched += len(due)
+                yield due
+
+            now = time.monotonic()
+            if self.report_interval and now - self._window_start >= self.report_interval:
+                self._report(now)
+
+            if heap:
+                delay = heap[0][0] - time.monotonic()
+                if delay > 0:
+                    time.sleep(min(delay, max_sleep))
+
+    def _report(self, now: float):
+        """回報本統計窗口的實際速率"""
+        elapsed = now - self._window_start
+        achieved = self._window_dispatched / elapsed if elapsed > 0 else 0.0
+        max_lag = self._window_max_lag
+        behind = (achieved < self.expected_rate * 0.95 or
+                  max_lag > min(self.periods))
+
+        self.last_report = {
+            "achieved_rate": achieved,
+            "expected_rate": self.expected_rate,
+            "max_lag": max_lag,
+            "skipped": self.skipped,
+            "behind": behind
+        }
+
+        if behind:
+            logger.warning(f"發送落後: 實際 {achieved:.1f} msg/s / 目標 "
+                           f"{self.expected_rate:.1f} msg/s, 最大延遲 {max_lag * 1000:.1f} ms, "
+                           f"累計跳過 {self.skipped}")
+        else:
+            logger.info(f"發送達標: 實際 {achieved:.1f} msg/s / 目標 "
+                        f"{self.expected_rate:.1f} msg/s, 最大延遲 {max_lag * 1000:.1f} ms")
+
+        self._window_start = now
+        self._window_dispatched = 0
+        self._window_max_lag = 0.0
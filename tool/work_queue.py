@@ -0,0 +1,205 @@
+"""
+有界工作佇列與工作執行緒池
+MQTT 網路回調只負責把 (topic, payload, recv_ts) 放入佇列，由工作執行緒解析與輸出；
+同一主題下同一設備 id 的訊息固定分派到同一個工作執行緒，以保持處理順序
+"""
+
+import collections
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional
+
+# 佇列已滿時的背壓策略
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop-oldest"
+POLICY_DROP_NEWEST = "drop-newest"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST)
+# 批量處理時工作執行緒一次最多取出的項目數
+DEFAULT_BATCH_SIZE = 256
+
+
+def device_key(topic: str, payload: bytes) -> bytes:
+    """
+    不解析 JSON，直接從 payload 取出設備標識（"id" 或 "MAC"）與主題組成分派鍵
+    找不到標識時退回以主題分派
+    """
+    for marker in (b'"id":', b'"MAC":'):
+        start = payload.find(marker)
+        if start >= 0:
+            start += len(marker)
+            end = payload.find(b',', start)
+            if end < 0:
+                end = payload.find(b'}', start)
+            return topic.encode('utf-8') + payload[start:end].strip()
+    return topic.encode('utf-8')
+
+
+class _Lane:
+    """單個工作執行緒的有界佇列"""
+
+    def __init__(self, capacity: int):
+        self.items = collections.deque()
+        self.capacity = capacity
+        self.condition = threading.Condition()
+
+
+class BoundedWorkQueue:
+    """
+    分片有界工作佇列
+
+    總容量平均分配給各工作執行緒；佇列已滿時按策略處理：
+    block 阻塞生產者（網路執行緒），drop-oldest 丟棄最舊項目，drop-newest 丟棄新項目
+    """
+
+    def __init__(self, handler: Callable, workers: int = 1, maxsize: int = 10000,
+                 policy: str = POLICY_BLOCK, batch_handler: Optional[Callable] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            handler: handler(topic, payload, recv_ts)，在工作執行緒內呼叫
+            workers: 工作執行緒數量
+            maxsize: 佇列總容量
+            policy: 背壓策略，見 POLICIES
+            batch_handler: batch_handler([(topic, payload, recv_ts), ...])，指定時工作執行緒
+                           一次取出最多 batch_size 條交給它處理，不再逐條呼叫 handler
+            batch_size: 批量處理時一次取出的最多條數
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"未知的背壓策略: {policy}")
+        if workers <= 0:
+            raise ValueError("workers 必須大於 0")
+
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_size = max(1, batch_size)
+        self.policy = policy
+        capacity = max(1, maxsize // workers)
+        self.lanes: List[_Lane] = [_Lane(capacity) for _ in range(workers)]
+        self.threads: List[threading.Thread] = []
+        self.running = False
+
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        """啟動工作執行緒"""
+        self.running = True
+        for index, lane in enumerate(self.lanes):
+            target = self._worker if self.batch_handler is None else self._batch_worker
+            thread = threading.Thread(target=target, args=(lane,),
+                                      name=f"mqtt-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, drain: bool = True, timeout: float = 5.0):
+        """停止工作執行緒，drain 為 True 時先處理完佇列中剩餘項目"""
+        self.running = False
+        for lane in self.lanes:
+            with lane.condition:
+                if not drain:
+                    lane.items.clear()
+                lane.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def put(self, topic: str, payload: bytes, recv_ts: float) -> bool:
+        """
+        放入一條訊息
+
+        Returns:
+            是否成功入隊（drop-newest 策略下佇列滿時返回 False）
+        """
+        lanes = self.lanes
+        if len(lanes) == 1:
+            lane = lanes[0]
+        else:
+            lane = lanes[zlib.crc32(device_key(topic, payload)) % len(lanes)]
+
+        dropped = False
+        with lane.condition:
+            items = lane.items
+            if len(items) >= lane.capacity:
+                if self.policy == POLICY_BLOCK:
+                    while len(items) >= lane.capacity and self.running:
+                        lane.condition.wait()
+                elif self.policy == POLICY_DROP_OLDEST:
+                    items.popleft()
+                    dropped = True
+                else:
+                    with self._stats_lock:
+                        self.dropped += 1
+                    return False
+            items.append((topic, payload, recv_ts))
+            depth = len(items)
+            lane.condition.notify()
+
+        with self._stats_lock:
+            self.enqueued += 1
+            if dropped:
+                self.dropped += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def _worker(self, lane: _Lane):
+        handler = self.handler
+        items = lane.items
+        while True:
+            with lane.condition:
+                while not items and self.running:
+                    lane.condition.wait()
+                if not items:
+                    return
+                topic, payload, recv_ts = items.popleft()
+                # 通知被 block 策略阻塞的生產者
+                lane.condition.notify()
+
+            try:
+                handler(topic, payload, recv_ts)
+            except Exception:
+                with self._stats_lock:
+                    self.errors += 1
+            with self._stats_lock:
+                self.processed += 1
+
+    def _batch_worker(self, lane: _Lane):
+        handler = self.batch_handler
+        items = lane.items
+        while True:
+            with lane.condition:
+                while not items and self.running:
+                    lane.condition.wait()
+                if not items:
+                    return
+                batch = [items.popleft() for _ in range(min(len(items), self.batch_size))]
+                lane.condition.notify_all()
+
+            try:
+                handler(batch)
+            except Exception:
+                with self._stats_lock:
+                    self.errors += 1
+            with self._stats_lock:
+                self.processed += len(batch)
+
+    def depth(self) -> int:
+        """當前佇列總深度"""
+        return sum(len(lane.items) for lane in self.lanes)
+
+    def stats(self) -> Dict:
+        """佇列統計快照"""
+        with self._stats_lock:
+            return {
+                "depth": self.depth(),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "policy": self.policy,
+                "workers": len(self.lanes)
+            }